@@ -1,19 +1,203 @@
 from __future__ import annotations
 
+import hashlib
+import hmac
+import json
+import logging
+import os
 import sqlite3
+import time
+from functools import wraps
 from itertools import groupby
 import math
 from datetime import date, datetime, timezone
 from zoneinfo import ZoneInfo
-from flask import Flask, redirect, render_template, request, url_for, flash, abort
+from flask import (
+    Flask,
+    Response,
+    abort,
+    current_app,
+    flash,
+    g,
+    make_response,
+    redirect,
+    render_template,
+    request,
+    session,
+)
+
+from data_version import data_versions
+from db import (
+    APP_DIR,
+    catalog_scope,
+    close_db,
+    get_catalog_db,
+    get_db,
+    query_stats,
+    set_store_resolver,
+    transaction,
+)
+from fragment_cache import FragmentCache
+from idempotency import (
+    ensure_idempotency_schema,
+    find_submission,
+    normalize_key,
+    remember_submission,
+)
+from ledger_archive import ensure_archive_schema
+from metrics import cache_hit, cache_miss
+from metrics import registry as metrics
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+from outbox import ensure_outbox_schema
+from projections import bring_up_to_date, ensure_projection_schema
+from stores import (
+    DEFAULT_STORE_ID,
+    STORE_TABLES,
+    StoreMigrationError,
+    migrate_store_schema,
+    needs_store_migration,
+    store_catalog,
+)
+from transfers import migrate_transfer_ledger, needs_transfer_ledger_migration
+
+# flash・管理ログインのセッション用。未設定なら開発用の固定値（管理ログインは使えない）
+SECRET_KEY = os.getenv("SECRET_KEY", "")
+
+# コンパイル済みテンプレートをファイルに残し、新しいワーカーはそれを読むだけにする（空なら無効）
+JINJA_BYTECODE_CACHE_DIR = os.getenv("JINJA_BYTECODE_CACHE_DIR", os.path.join(APP_DIR, "jinja_cache"))
+
+
+# SQL計測の結果をページ下部に出す（db.py の QueryTrace）
+SQL_TRACE_PANEL = os.getenv("SQL_TRACE_PANEL", "0") == "1"
+
+# 管理用エンドポイント（未設定なら無効＝404）
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+def _admin_session_digest() -> str:
+    # トークンを替えたら以前のログインは無効になる
+    return hashlib.sha256(f"admin:{ADMIN_TOKEN}".encode("utf-8")).hexdigest()
+
+
+def is_admin_request() -> bool:
+    """
+    X-Admin-Token ヘッダか、/admin/login 済みのセッション。
+    URL（?token=）では受け付けない（アクセスログ・履歴・Referer に残るため）。
+    """
+    if not ADMIN_TOKEN:
+        return False
+    token = request.headers.get("X-Admin-Token")
+    if token is not None:
+        return hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8"))
+    digest = session.get("admin") if SECRET_KEY else None
+    return isinstance(digest, str) and hmac.compare_digest(digest, _admin_session_digest())
+
+
+# -----------------------------
+# HTTP キャッシュ（ETag / Last-Modified）
+# -----------------------------
+# 画面ごとに読むテーブル（ETag と断片キャッシュのキー）
+INVENTORY_TABLES = ("items", "suppliers", "inventory_tx")
+SHOPPING_LIST_TABLES = INVENTORY_TABLES + ("item_price_index",)
+MONTHLY_FOOD_COST_TABLES = (
+    "stocktakes",
+    "stocktake_lines",
+    "purchases",
+    "purchase_lines",
+    "items",
+    "item_price_index",
+    "daily_reports",
+)
+
+FRAGMENT_CACHE_BYTES = int(os.getenv("FRAGMENT_CACHE_BYTES", str(32 * 1024 * 1024)))
+fragment_cache = FragmentCache(FRAGMENT_CACHE_BYTES)
+
+
+def _code_version() -> str:
+    """app.py・テンプレート・静的ファイルの最終更新。デプロイしたら ETag も変わる。"""
+    paths = [os.path.abspath(__file__)]
+    for folder in ("templates", "static"):
+        for dirpath, _dirnames, filenames in os.walk(os.path.join(APP_DIR, folder)):
+            paths.extend(os.path.join(dirpath, name) for name in filenames)
+    return str(max(int(os.path.getmtime(p)) for p in paths))
+
+
+CODE_VERSION = _code_version()
+
+
+def data_version_etag(tables, store_id: int | None = None) -> tuple[str, float | None]:
+    """
+    テーブルの版数から ETag を作る（本体DBには触らない）。
+    今日の日付（JST）も混ぜる（既定の月・日付が日付けで変わる画面があるため）。
+    店舗ごとに中身が違う画面は store_id も混ぜる。
+    2つ目の値は Last-Modified に使える時刻。最後の書き込みと同じ秒のうちは None（秒単位では区別できない）。
+    """
+    versions, updated_at = data_versions.read(tables)
+    today = datetime.now(ZoneInfo("Asia/Tokyo")).date().isoformat()
+    key = json.dumps([CODE_VERSION, today, store_id, sorted(versions.items())])
+    etag = hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+    last_modified = math.floor(updated_at) + 1 if updated_at else None
+    if last_modified is not None and time.time() < last_modified:
+        last_modified = None
+    return etag, last_modified
+
 
-from db import close_db, commit_and_sync, get_db
+def _not_modified(etag: str, last_modified: float | None) -> bool:
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    ims = request.if_modified_since
+    return last_modified is not None and ims is not None and ims.timestamp() >= last_modified
 
-app = Flask(__name__)
-app.secret_key = "dev-secret-key-change-me"  # flash用（あとで環境変数にするのが理想）
 
+def conditional_by_data_version(*tables: str):
+    """
+    GET を ETag / Last-Modified で条件付きにする。tables は画面が読むテーブル。
+    変わっていなければビューを呼ばずに 304 を返すので、SQL は1本も走らない。
+    flash が残っている回（と SQL デバッグパネル表示中）は毎回描き、キャッシュさせない。
+    ナビの店舗切替があるので stores / locations と今の店舗も ETag に入れる。
+    """
+    tables = tables + STORE_TABLES
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if session.get("_flashes") or SQL_TRACE_PANEL or current_app.debug:
+                return view(*args, **kwargs)
+            etag, last_modified = data_version_etag(tables, current_store_id())
+            if _not_modified(etag, last_modified):
+                cache_hit("http_etag")
+                response = Response(status=304)
+            else:
+                cache_miss("http_etag")
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or session.get("_flashes"):
+                    return response
+            response.set_etag(etag)
+            if last_modified is not None:
+                response.last_modified = last_modified
+            response.headers["Cache-Control"] = "private, no-cache"
+            response.vary.add("Cookie")
+            return response
+
+        return wrapper
 
-app.teardown_appcontext(close_db)
+    return decorator
+
+
+def render_cached_fragment(template_name: str, tables, params: dict, build_context) -> Markup:
+    """
+    行の多い部分テンプレートを描画済み HTML でキャッシュする。
+    キーはテンプレート名＋今の店舗＋params、版は tables のデータ版数。外れたときだけ build_context()（SQL）と描画を行う。
+    """
+    store_id = current_store_id()
+    version, _last_modified = data_version_etag(tables, store_id)
+    key = (template_name, store_id, tuple(sorted(params.items())))
+    html = fragment_cache.get(key, version)
+    if html is None:
+        html = render_template(template_name, **build_context())
+        fragment_cache.put(key, version, html)
+    return Markup(html)
 
 
 _items_note_column_ready = False
@@ -30,6 +214,7 @@ def ensure_purchase_inventory_tx_integrity() -> None:
             """
             SELECT
               p.purchase_id,
+              p.store_id,
               p.purchased_at,
               p.note,
               COUNT(DISTINCT pl.purchase_line_id) AS line_count,
@@ -37,7 +222,7 @@ def ensure_purchase_inventory_tx_integrity() -> None:
               COALESCE(MIN(tx.location), 'STORE') AS location
             FROM purchases p
             LEFT JOIN purchase_lines pl ON pl.purchase_id = p.purchase_id
-            LEFT JOIN inventory_tx tx
+            LEFT JOIN inventory_tx_history tx
               ON tx.ref_type = 'PURCHASE'
              AND tx.ref_id = p.purchase_id
             GROUP BY p.purchase_id
@@ -47,383 +232,397 @@ def ensure_purchase_inventory_tx_integrity() -> None:
         if not broken_rows:
             return
 
-        db.execute("BEGIN")
-        for row in broken_rows:
-            purchase_id = int(row["purchase_id"])
-            purchased_at = row["purchased_at"]
-            note = row["note"]
-            location = normalize_inventory_location(row["location"], "STORE")
+        with transaction(db, serialize=True):
+            for row in broken_rows:
+                purchase_id = int(row["purchase_id"])
+                store_id = int(row["store_id"])
+                purchased_at = row["purchased_at"]
+                note = row["note"]
+                location = normalize_inventory_location(row["location"], "STORE", store_id)
 
-            db.execute(
-                "DELETE FROM inventory_tx WHERE ref_type = 'PURCHASE' AND ref_id = ?",
-                (purchase_id,),
-            )
-            lines = db.execute(
-                """
-                SELECT item_id, qty
-                FROM purchase_lines
-                WHERE purchase_id = ?
-                ORDER BY purchase_line_id ASC
-                """,
-                (purchase_id,),
-            ).fetchall()
-            for line in lines:
                 db.execute(
+                    "DELETE FROM inventory_tx WHERE ref_type = 'PURCHASE' AND ref_id = ?",
+                    (purchase_id,),
+                )
+                lines = db.execute(
                     """
-                    INSERT INTO inventory_tx (
-                      happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note
-                    )
-                    VALUES (
-                      COALESCE(?, datetime('now')),
-                      ?, ?, 'PURCHASE', ?, 'PURCHASE', ?, ?
-                    )
+                    SELECT item_id, qty
+                    FROM purchase_lines
+                    WHERE purchase_id = ?
+                    ORDER BY purchase_line_id ASC
                     """,
-                    (
-                        purchased_at,
-                        int(line["item_id"]),
-                        float(line["qty"] or 0),
-                        location,
-                        purchase_id,
-                        note,
-                    ),
-                )
-        commit_and_sync()
+                    (purchase_id,),
+                ).fetchall()
+                for line in lines:
+                    db.execute(
+                        """
+                        INSERT INTO inventory_tx (
+                          store_id, happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note
+                        )
+                        VALUES (
+                          ?, COALESCE(?, datetime('now')),
+                          ?, ?, 'PURCHASE', ?, 'PURCHASE', ?, ?
+                        )
+                        """,
+                        (
+                            store_id,
+                            purchased_at,
+                            int(line["item_id"]),
+                            float(line["qty"] or 0),
+                            location,
+                            purchase_id,
+                            note,
+                        ),
+                    )
     except Exception:
-        db.rollback()
+        pass
 
 
 def ensure_items_note_column() -> None:
     db = get_db()
     try:
-        cols = db.execute("PRAGMA table_info(items)").fetchall()
-        col_names = {row["name"] for row in cols}
-        if "note" not in col_names:
-            db.execute("ALTER TABLE items ADD COLUMN note TEXT")
-            commit_and_sync()
+        with transaction(db):
+            cols = db.execute("PRAGMA table_info(items)").fetchall()
+            col_names = {row["name"] for row in cols}
+            if "note" not in col_names:
+                db.execute("ALTER TABLE items ADD COLUMN note TEXT")
     except Exception:
-        db.rollback()
+        pass
 
 
 def ensure_stocktake_lines_cost_columns() -> None:
     db = get_db()
     try:
-        cols = db.execute("PRAGMA table_info(stocktake_lines)").fetchall()
-        col_names = {row["name"] for row in cols}
-        if "unit_cost" not in col_names:
-            db.execute("ALTER TABLE stocktake_lines ADD COLUMN unit_cost REAL")
-        if "line_amount" not in col_names:
-            db.execute("ALTER TABLE stocktake_lines ADD COLUMN line_amount REAL")
-        commit_and_sync()
+        with transaction(db):
+            cols = db.execute("PRAGMA table_info(stocktake_lines)").fetchall()
+            col_names = {row["name"] for row in cols}
+            if "unit_cost" not in col_names:
+                db.execute("ALTER TABLE stocktake_lines ADD COLUMN unit_cost REAL")
+            if "line_amount" not in col_names:
+                db.execute("ALTER TABLE stocktake_lines ADD COLUMN line_amount REAL")
     except Exception:
-        db.rollback()
+        pass
 
 
-@app.before_request
-def _ensure_schema():
-    global _items_note_column_ready
-    if _items_note_column_ready:
-        return
-    ensure_items_note_column()
-    ensure_stocktake_lines_cost_columns()
-    ensure_purchase_inventory_tx_integrity()
-    _items_note_column_ready = True
+def ensure_stocktakes_all_locations_column() -> None:
+    """棚卸が店舗全体（全保管場所の合計）を数えたものか。既存の棚卸は店舗全体とみなす。"""
+    db = get_db()
+    try:
+        with transaction(db):
+            cols = db.execute("PRAGMA table_info(stocktakes)").fetchall()
+            col_names = {row["name"] for row in cols}
+            if "all_locations" not in col_names:
+                db.execute(
+                    "ALTER TABLE stocktakes ADD COLUMN all_locations INTEGER NOT NULL DEFAULT 1"
+                )
+    except Exception:
+        pass
 
 
-def _to_float(value: str, default: float = 0.0) -> float:
-    value = (value or "").strip()
-    if value == "":
-        return default
-    return float(value)
+def ensure_items_order_columns() -> None:
+    """発注案用：入数（pack_qty）と最小発注数（min_order_qty）を items に追加する。"""
+    db = get_db()
+    try:
+        with transaction(db):
+            cols = db.execute("PRAGMA table_info(items)").fetchall()
+            col_names = {row["name"] for row in cols}
+            if "pack_qty" not in col_names:
+                db.execute("ALTER TABLE items ADD COLUMN pack_qty REAL NOT NULL DEFAULT 0")
+            if "min_order_qty" not in col_names:
+                db.execute("ALTER TABLE items ADD COLUMN min_order_qty REAL NOT NULL DEFAULT 0")
+    except Exception:
+        pass
 
 
-def normalize_inventory_location(raw: str | None, default: str = "STORE") -> str:
-    location = (raw or "").strip().upper()
-    if location == "WAREHOUSE" or location == "STORE":
-        return location
-    if (raw or "").strip() == "Warehouse":
-        return "WAREHOUSE"
-    return default
+def ensure_purchase_orders_tables() -> None:
+    """発注案（下書き）テーブル。確定するまで inventory_tx には影響させない。"""
+    db = get_db()
+    try:
+        with transaction(db):
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS purchase_orders (
+                  purchase_order_id  INTEGER PRIMARY KEY AUTOINCREMENT,
+                  supplier_id        INTEGER,
+                  created_at         TEXT    NOT NULL DEFAULT (datetime('now')),
+                  status             TEXT    NOT NULL DEFAULT 'DRAFT'
+                                     CHECK (status IN ('DRAFT','RECEIVED','CANCELLED')),
+                  est_amount         REAL,
+                  note               TEXT,
+                  purchase_id        INTEGER,
+                  FOREIGN KEY (supplier_id) REFERENCES suppliers(supplier_id)
+                    ON UPDATE CASCADE
+                    ON DELETE SET NULL
+                )
+                """
+            )
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS purchase_order_lines (
+                  purchase_order_line_id  INTEGER PRIMARY KEY AUTOINCREMENT,
+                  purchase_order_id       INTEGER NOT NULL,
+                  item_id                 INTEGER NOT NULL,
+                  qty                     REAL    NOT NULL,
+                  unit_price              REAL,
+                  price_source            TEXT,
+                  line_amount             REAL,
+                  FOREIGN KEY (purchase_order_id) REFERENCES purchase_orders(purchase_order_id)
+                    ON UPDATE CASCADE
+                    ON DELETE CASCADE,
+                  FOREIGN KEY (item_id) REFERENCES items(item_id)
+                    ON UPDATE CASCADE
+                    ON DELETE CASCADE
+                )
+                """
+            )
+            db.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_purchase_order_lines_order_id
+                ON purchase_order_lines(purchase_order_id)
+                """
+            )
+    except Exception:
+        pass
 
 
-def fetch_suppliers() -> list[sqlite3.Row]:
+def ensure_item_price_index_table() -> None:
+    """
+    実績単価インデックス（材料×仕入れ先ごとの最終単価）。
+    supplier_id = 0 は仕入れ先未設定の入庫。空なら purchase_lines から作り直す。
+    """
     db = get_db()
-    return db.execute(
-        "SELECT supplier_id, name FROM suppliers ORDER BY name ASC"
-    ).fetchall()
+    try:
+        with transaction(db):
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS item_price_index (
+                  item_id            INTEGER NOT NULL,
+                  supplier_id        INTEGER NOT NULL DEFAULT 0,
+                  last_unit_price    REAL    NOT NULL,
+                  last_purchased_at  TEXT    NOT NULL,
+                  last_purchase_id   INTEGER,
+                  prev_unit_price    REAL,
+                  rolling_avg_30d    REAL,
+                  updated_at         TEXT    NOT NULL DEFAULT (datetime('now')),
+                  PRIMARY KEY (item_id, supplier_id)
+                )
+                """
+            )
+            empty = db.execute("SELECT 1 FROM item_price_index LIMIT 1").fetchone() is None
+            if empty:
+                refresh_item_price_index(db)
+    except Exception:
+        pass
 
 
-def fetch_item(item_id: int) -> sqlite3.Row | None:
+def ensure_ledger_archive_tables() -> None:
+    """締め済み月の inventory_tx 退避先（ledger_archive.py）。"""
     db = get_db()
-    return db.execute(
-        """
-        SELECT
-          i.item_id,
-          i.cost_group,
-          i.supplier_id,
-          i.name,
-          i.unit_base,
-          i.reorder_point,
-          i.ref_unit_price,
-          i.note,
-          i.is_fixed,
-          i.is_active,
-          s.name AS supplier_name
-        FROM items i
-        LEFT JOIN suppliers s ON s.supplier_id = i.supplier_id
-        WHERE i.item_id = ?
-        """,
-        (item_id,),
-    ).fetchone()
+    try:
+        with transaction(db):
+            ensure_archive_schema(db)
+    except Exception:
+        pass
 
 
-# -----------------------------
-# Routes
-# -----------------------------
-@app.get("/")
-def home():
-    return render_template("home.html")
+def ensure_store_tables() -> None:
+    """店舗・保管場所（stores.py）。旧スキーマなら台帳・伝票の表を店舗対応に作り直す。"""
+    db = get_db()
+    migrating = needs_store_migration(db)
+    if migrating:
+        # 作り直しの DROP で子の行（棚卸明細など）を消さない。トランザクションの外でしか切り替えられない
+        db.execute("PRAGMA foreign_keys = OFF")
+    try:
+        with transaction(db, serialize=True):
+            migrated = migrate_store_schema(db)
+        if migrated:
+            current_app.logger.warning("店舗対応のスキーマに移行しました: %s", migrated)
+    except (StoreMigrationError, sqlite3.Error):
+        current_app.logger.exception("店舗対応のスキーマへの移行に失敗しました")
+    finally:
+        if migrating:
+            db.execute("PRAGMA foreign_keys = ON")
+    store_catalog.invalidate()
+
+
+def ensure_transfer_ledger() -> None:
+    """移動を台帳に載せる（transfers.py）。inventory_tx の CHECK が古ければ作り直す。"""
+    db = get_db()
+    migrating = needs_transfer_ledger_migration(db)
+    if migrating:
+        db.execute("PRAGMA foreign_keys = OFF")
+    try:
+        with transaction(db, serialize=True):
+            migrated = migrate_transfer_ledger(db)
+        if migrated:
+            current_app.logger.warning("移動を台帳に載せるスキーマに移行しました: %s", migrated)
+    except sqlite3.Error:
+        current_app.logger.exception("移動の台帳スキーマへの移行に失敗しました")
+    finally:
+        if migrating:
+            db.execute("PRAGMA foreign_keys = ON")
+
+
+def ensure_idempotency_table() -> None:
+    """フォーム送信の冪等キー（idempotency.py）。"""
+    db = get_db()
+    try:
+        with transaction(db):
+            ensure_idempotency_schema(db)
+    except Exception:
+        pass
 
 
-@app.get("/items")
-def items_list():
+def ensure_projection_tables() -> None:
+    """
+    台帳からの射影（projections.py）。新しく登録した射影は台帳から作り、遅れていれば追いつかせる。
+    以降は台帳への書き込みと同じトランザクションでトリガーが更新する。
+    """
     db = get_db()
-    rows = db.execute(
-        """
-        SELECT
-          i.item_id,
-          i.name,
-          i.unit_base,
-          i.reorder_point,
-          i.ref_unit_price,
-          i.note,
-          i.is_fixed,
-          i.cost_group,
-          i.is_active,
-          s.name AS supplier_name
-        FROM items i
-        LEFT JOIN suppliers s ON s.supplier_id = i.supplier_id
-        ORDER BY i.item_id DESC
-        """
-    ).fetchall()
-    return render_template("items_list.html", items=rows)
-
-
-@app.get("/items/new")
-def item_new_form():
-    suppliers = fetch_suppliers()
-    return render_template("item_new.html", suppliers=suppliers)
-
-
-@app.post("/items")
-def item_create():
-    supplier_id_raw = request.form.get("supplier_id", "").strip()
-    supplier_id = int(supplier_id_raw) if supplier_id_raw else None
-
-    name = (request.form.get("name") or "").strip()
-    unit_base = (request.form.get("unit_base") or "").strip()
-    reorder_point = _to_float(request.form.get("reorder_point", ""), 0.0)
-    ref_unit_price = _to_float(request.form.get("ref_unit_price", ""), 0.0)
-    note = (request.form.get("note") or "").strip() or None
-    is_fixed = 1 if request.form.get("is_fixed") == "1" else 0
-    cost_group = (request.form.get("cost_group") or "SUPPLIES").strip()
-    if cost_group not in ("FOOD", "SUPPLIES"):
-        cost_group = "SUPPLIES"
-    is_active = 1 if request.form.get("is_active") == "1" else 0
-
-    # バリデーション（最低限）
-    errors: list[str] = []
-    if not name:
-        errors.append("材料名（name）は必須です。")
-    if not unit_base:
-        errors.append("単位（unit_base）は必須です。（例: g / ml / pcs）")
-    if reorder_point < 0:
-        errors.append("発注目安（reorder_point）は0以上にしてください。")
-    if ref_unit_price < 0:
-        errors.append("参考価格（ref_unit_price）は0以上にしてください。")
-
-    if errors:
-        for e in errors:
-            flash(e, "error")
-        return redirect(url_for("item_new_form"))
+    try:
+        with transaction(db, serialize=True):
+            ensure_projection_schema(db)
+            for name, rows in bring_up_to_date(db).items():
+                current_app.logger.warning("射影 %s に台帳の %d行を反映しました", name, rows)
+    except sqlite3.Error:
+        current_app.logger.exception("射影の準備に失敗しました")
+
 
+def ensure_outbox_table() -> None:
+    """台帳・伝票の変更フィード（outbox.py）。表の列が変わったらトリガーを作り直す。"""
     db = get_db()
     try:
-        # category は使わないので NULL で入れる（列が存在してもOK）
-        db.execute(
-            """
-            INSERT INTO items (
-              supplier_id, name, category, unit_base,
-              reorder_point, ref_unit_price, note, is_fixed, cost_group, is_active
-            )
-            VALUES (?, ?, NULL, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (supplier_id, name, unit_base, reorder_point, ref_unit_price, note, is_fixed, cost_group, is_active),
-        )
-        commit_and_sync()
-    except sqlite3.IntegrityError as e:
-        db.rollback()
-        flash(f"登録に失敗しました（整合性エラー）: {e}", "error")
-        return redirect(url_for("item_new_form"))
-    except Exception as e:
-        db.rollback()
-        flash(f"登録に失敗しました: {e}", "error")
-        return redirect(url_for("item_new_form"))
+        with transaction(db):
+            ensure_outbox_schema(db)
+    except sqlite3.Error:
+        current_app.logger.exception("変更フィードの準備に失敗しました")
 
-    flash("材料を登録しました。", "success")
-    return redirect(url_for("items_list"))
 
+def ensure_schema():
+    global _items_note_column_ready
+    if _items_note_column_ready:
+        return
+    # 各補正は transaction() の中で行う。失敗してもロールバック済みなので起動は続ける
+    # 店舗ごとのファイルに分けているときも補正はカタログに行い、店舗ファイルは開くときにそれに合わせる
+    with catalog_scope():
+        ensure_items_note_column()
+        ensure_stocktake_lines_cost_columns()
+        ensure_items_order_columns()
+        ensure_purchase_orders_tables()
+        ensure_item_price_index_table()
+        ensure_store_tables()
+        ensure_ledger_archive_tables()
+        ensure_transfer_ledger()
+        ensure_stocktakes_all_locations_column()  # 店舗対応の移行で stocktakes を作り直した後に足す
+        ensure_idempotency_table()
+        ensure_purchase_inventory_tx_integrity()
+        ensure_projection_tables()
+        ensure_outbox_table()
+    _items_note_column_ready = True
 
-# =============================
-# Suppliers（登録・編集）
-# =============================
-def fetch_supplier(supplier_id: int) -> sqlite3.Row | None:
-    db = get_db()
-    return db.execute(
-        """
-        SELECT supplier_id, name, phone, note, created_at
-        FROM suppliers
-        WHERE supplier_id = ?
-        """,
-        (supplier_id,),
-    ).fetchone()
 
+def current_store_id() -> int:
+    """
+    今の店舗。?store= → X-Store-Id ヘッダ（API・端末）→ セッション（ナビの店舗切替）→ 既定店舗の順。
+    明示された店舗が無い・休止中なら 404。
+    """
+    if "store_id" in g:
+        return g.store_id
+    active = {s["store_id"] for s in store_catalog.active_stores(get_catalog_db)}
+    explicit = request.args.get("store") or request.headers.get("X-Store-Id")
+    if explicit:
+        try:
+            store_id = int(explicit)
+        except ValueError:
+            abort(404)
+        if store_id not in active:
+            abort(404)
+    else:
+        store_id = session.get("store_id", DEFAULT_STORE_ID)
+        if store_id not in active:
+            store_id = DEFAULT_STORE_ID
+    g.store_id = store_id
+    return store_id
 
-@app.get("/suppliers")
-def suppliers_list():
-    db = get_db()
-    rows = db.execute(
-        """
-        SELECT supplier_id, name, phone, note, created_at
-        FROM suppliers
-        ORDER BY supplier_id DESC
-        """
-    ).fetchall()
-    return render_template("suppliers_list.html", suppliers=rows)
 
+set_store_resolver(current_store_id)  # get_db() はこの店舗のDBファイルに振り分ける（SHARD_DIR のとき）
 
-@app.get("/suppliers/new")
-def supplier_new_form():
-    return render_template("supplier_new.html")
 
+def idempotent_submission(view):
+    """
+    登録フォームの POST を冪等にする（idempotency.py）。同じキーの2回目は書き込まずに最初の結果へ戻す。
+    ビューは書き込みのトランザクションの最後で remember_submission_result(db, リダイレクト先) を呼び、
+    DuplicateSubmission を duplicate_submission_response() で返すこと。
+    """
 
-@app.post("/suppliers")
-def supplier_create():
-    name = (request.form.get("name") or "").strip()
-    phone = (request.form.get("phone") or "").strip() or None
-    location = "WAREHOUSE"
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = normalize_key(request.form.get("idempotency_key"))
+        if key is not None:
+            location = find_submission(get_db(), current_store_id(), key)
+            if location is not None:
+                return duplicate_submission_response(location)
+        g.idempotency_key = key
+        return view(*args, **kwargs)
 
-    note = (request.form.get("note") or "").strip() or None
+    return wrapper
 
-    errors: list[str] = []
-    if not name:
-        errors.append("仕入れ先名（name）は必須です。")
 
-    if errors:
-        for e in errors:
-            flash(e, "error")
-        return redirect(url_for("supplier_new_form"))
+def remember_submission_result(db, location: str) -> None:
+    key = g.get("idempotency_key")
+    if key is not None:
+        remember_submission(db, current_store_id(), key, request.endpoint, location)
 
-    db = get_db()
-    try:
-        db.execute(
-            """
-            INSERT INTO suppliers (name, phone, note)
-            VALUES (?, ?, ?)
-            """,
-            (name, phone, note),
-        )
-        commit_and_sync()
-    except sqlite3.IntegrityError as e:
-        db.rollback()
-        flash(f"登録に失敗しました（整合性エラー）: {e}", "error")
-        return redirect(url_for("supplier_new_form"))
-    except Exception as e:
-        db.rollback()
-        flash(f"登録に失敗しました: {e}", "error")
-        return redirect(url_for("supplier_new_form"))
-
-    flash("仕入れ先を登録しました。", "success")
-    return redirect(url_for("suppliers_list"))
-
-
-@app.get("/suppliers/<int:supplier_id>/edit")
-def supplier_edit_form(supplier_id: int):
-    supplier = fetch_supplier(supplier_id)
-    if supplier is None:
-        abort(404)
-    return render_template("supplier_edit.html", supplier=supplier)
-
-
-@app.post("/suppliers/<int:supplier_id>/update")
-def supplier_update(supplier_id: int):
-    supplier = fetch_supplier(supplier_id)
-    if supplier is None:
-        abort(404)
-
-    name = (request.form.get("name") or "").strip()
-    phone = (request.form.get("phone") or "").strip() or None
-    note = (request.form.get("note") or "").strip() or None
-
-    errors: list[str] = []
-    if not name:
-        errors.append("仕入れ先名（name）は必須です。")
-
-    if errors:
-        for e in errors:
-            flash(e, "error")
-        return redirect(url_for("supplier_edit_form", supplier_id=supplier_id))
 
-    db = get_db()
-    try:
-        db.execute(
-            """
-            UPDATE suppliers
-            SET name = ?, phone = ?, note = ?
-            WHERE supplier_id = ?
-            """,
-            (name, phone, note, supplier_id),
-        )
-        commit_and_sync()
-    except sqlite3.IntegrityError as e:
-        db.rollback()
-        flash(f"更新に失敗しました（整合性エラー）: {e}", "error")
-        return redirect(url_for("supplier_edit_form", supplier_id=supplier_id))
-    except Exception as e:
-        db.rollback()
-        flash(f"更新に失敗しました: {e}", "error")
-        return redirect(url_for("supplier_edit_form", supplier_id=supplier_id))
-
-    flash("仕入れ先を更新しました。", "success")
-    return redirect(url_for("suppliers_list"))
-
-
-@app.post("/suppliers/<int:supplier_id>/delete")
-def supplier_delete(supplier_id: int):
-    db = get_db()
+def duplicate_submission_response(location: str):
+    flash("この内容は登録済みです（再送信は反映していません）。", "success")
+    return redirect(location)
 
-    supplier = db.execute(
-        "SELECT supplier_id, name FROM suppliers WHERE supplier_id = ?",
-        (supplier_id,),
-    ).fetchone()
-    if supplier is None:
-        abort(404)
 
-    try:
-        db.execute("DELETE FROM suppliers WHERE supplier_id = ?", (supplier_id,))
-        commit_and_sync()
-        flash(f"仕入れ先を削除しました: {supplier['name']}", "success")
-    except sqlite3.IntegrityError as e:
-        db.rollback()
-        flash(f"削除できませんでした（関連データあり）: {e}", "error")
-    except Exception as e:
-        db.rollback()
-        flash(f"削除に失敗しました: {e}", "error")
+def normalize_inventory_location(
+    raw: str | None, default: str = "STORE", store_id: int | None = None
+) -> str:
+    """保管場所コード（大文字）。店舗の locations に無いもの・文字列でないものは default。"""
+    location = raw.strip().upper() if isinstance(raw, str) else ""
+    if store_id is None:
+        store_id = current_store_id()
+    if location in store_catalog.location_codes(get_catalog_db, store_id):
+        return location
+    return default
+
+
+# 店舗全体の棚卸の差分（ADJUST）を載せる保管場所
+STOCKTAKE_ADJUST_LOCATION = "WAREHOUSE"
+
+
+def parse_stocktake_location(raw, store_id: int | None = None) -> str | None:
+    """
+    棚卸する保管場所。空・ALL は店舗全体（None、全保管場所の合計と比べる）。
+    店舗の locations に無いコード・文字列でない値は ValueError。
+    """
+    if raw is None:
+        return None
+    if not isinstance(raw, str):
+        raise ValueError(raw)
+    code = raw.strip().upper()
+    if code in ("", "ALL"):
+        return None
+    if store_id is None:
+        store_id = current_store_id()
+    if code not in store_catalog.location_codes(get_catalog_db, store_id):
+        raise ValueError(raw)
+    return code
 
-    return redirect(url_for("suppliers_list"))
+
+def fetch_suppliers() -> list[sqlite3.Row]:
+    db = get_db()
+    return db.execute(
+        "SELECT supplier_id, name FROM suppliers ORDER BY name ASC"
+    ).fetchall()
 
 
 # =============================
-# Purchases（入庫）: 一覧 / 新規 / 登録 / 詳細
+# Purchases（入庫）
 # =============================
 def fetch_active_items() -> list[sqlite3.Row]:
     db = get_db()
@@ -437,595 +636,183 @@ def fetch_active_items() -> list[sqlite3.Row]:
     ).fetchall()
 
 
-@app.get("/purchases")
-def purchases_list():
-    db = get_db()
-    rows = db.execute(
-        """
-        SELECT
-          p.purchase_id,
-          p.purchased_at,
-          COALESCE(s.name,'（未設定）') AS supplier_name,
-          p.note,
-          p.total_amount,
-          COALESCE(itx.location, 'STORE') AS location
-        FROM purchases p
-        LEFT JOIN suppliers s ON s.supplier_id = p.supplier_id
-        LEFT JOIN (
-          SELECT ref_id, MIN(location) AS location
-          FROM inventory_tx
-          WHERE ref_type = 'PURCHASE'
-          GROUP BY ref_id
-        ) itx ON itx.ref_id = p.purchase_id
-        ORDER BY p.purchased_at DESC, p.purchase_id DESC
-        """
-    ).fetchall()
-    created = request.args.get("created")
-    try:
-        created_purchase_id = int(created) if created else None
-    except ValueError:
-        created_purchase_id = None
-    return render_template(
-        "purchases_list.html",
-        purchases=rows,
-        created_purchase_id=created_purchase_id,
-    )
-
-
-@app.get("/purchases/new")
-def purchase_new_form():
-    suppliers = fetch_suppliers()
-    items = fetch_active_items()
-    return render_template(
-        "purchase_new.html",
-        suppliers=suppliers,
-        items=items,
-        default_location="STORE",
-    )
+# -----------------------------
+# Item price index（実績単価インデックス）
+# -----------------------------
+PRICE_ALERT_RATIO = 0.10  # 前回単価から10%以上動いたら通知
 
 
-@app.post("/purchases")
-def purchase_create():
-    db = get_db()
+def _price_index_select_sql(item_filter: str = "") -> str:
+    """
+    item_price_index に入れる行を purchase_lines から計算するSELECT。
+    rolling_avg_30d は「最終仕入日から遡って30日」の加重平均単価。
+    """
+    return f"""
+        WITH lines AS (
+          SELECT
+            pl.item_id,
+            COALESCE(p.supplier_id, 0) AS supplier_id,
+            pl.purchase_id,
+            pl.qty,
+            pl.unit_price,
+            COALESCE(pl.line_amount, pl.qty * pl.unit_price) AS amount,
+            p.purchased_at,
+            ROW_NUMBER() OVER (
+              PARTITION BY pl.item_id, COALESCE(p.supplier_id, 0)
+              ORDER BY p.purchased_at DESC, pl.purchase_line_id DESC
+            ) AS rn
+          FROM purchase_lines pl
+          JOIN purchases p ON p.purchase_id = pl.purchase_id
+          WHERE pl.unit_price IS NOT NULL
+            {item_filter}
+        )
+        SELECT
+          l.item_id,
+          l.supplier_id,
+          l.unit_price AS last_unit_price,
+          l.purchased_at AS last_purchased_at,
+          l.purchase_id AS last_purchase_id,
+          (
+            SELECT l2.unit_price
+            FROM lines l2
+            WHERE l2.item_id = l.item_id
+              AND l2.supplier_id = l.supplier_id
+              AND l2.rn = 2
+          ) AS prev_unit_price,
+          (
+            SELECT SUM(l3.amount) / NULLIF(SUM(l3.qty), 0)
+            FROM lines l3
+            WHERE l3.item_id = l.item_id
+              AND l3.supplier_id = l.supplier_id
+              AND datetime(l3.purchased_at) >= datetime(l.purchased_at, '-30 days')
+          ) AS rolling_avg_30d
+        FROM lines l
+        WHERE l.rn = 1
+    """
 
-    supplier_id_raw = (request.form.get("supplier_id") or "").strip()
-    supplier_id = int(supplier_id_raw) if supplier_id_raw else None
 
-    purchased_date = (request.form.get("purchased_date") or "").strip()
-    if purchased_date:
-        purchased_at = f"{purchased_date} 09:00:00"
-    else:
-        # 空ならDB側のDEFAULTに任せる
-        purchased_at = None
+def refresh_item_price_index(db, item_ids: list[int] | None = None) -> None:
+    """
+    入庫の登録・更新・削除のトランザクション内で呼び、対象材料の行だけ作り直す。
+    item_ids=None なら全件再構築（初回のバックフィル用）。
+    """
+    insert_sql = """
+        INSERT INTO item_price_index (
+          item_id, supplier_id, last_unit_price, last_purchased_at,
+          last_purchase_id, prev_unit_price, rolling_avg_30d
+        )
+    """
+    if item_ids is None:
+        db.execute("DELETE FROM item_price_index")
+        db.execute(insert_sql + _price_index_select_sql())
+        return
 
-    location = normalize_inventory_location(request.form.get("location"), "STORE")
+    for chunk in _iter_chunks(sorted(set(int(x) for x in item_ids))):
+        placeholders = ",".join("?" for _ in chunk)
+        db.execute(
+            f"DELETE FROM item_price_index WHERE item_id IN ({placeholders})",
+            chunk,
+        )
+        db.execute(
+            insert_sql
+            + _price_index_select_sql(f"AND pl.item_id IN ({placeholders})"),
+            chunk,
+        )
 
-    note = (request.form.get("note") or "").strip() or None
 
-    # 明細（最大10行想定）
-    item_ids = request.form.getlist("item_id")
-    qty_list = request.form.getlist("qty")
-    unit_price_list = request.form.getlist("unit_price")
+def fetch_price_index_map(db, item_ids: list[int]) -> dict[int, list[sqlite3.Row]]:
+    """材料ごとの実績単価（仕入れ先別、新しい順）。主キー検索のみで履歴は走査しない。"""
+    price_map: dict[int, list[sqlite3.Row]] = {}
+    for chunk in _iter_chunks(item_ids):
+        placeholders = ",".join("?" for _ in chunk)
+        rows = db.execute(
+            f"""
+            SELECT
+              item_id, supplier_id, last_unit_price, last_purchased_at,
+              prev_unit_price, rolling_avg_30d
+            FROM item_price_index
+            WHERE item_id IN ({placeholders})
+            ORDER BY item_id, last_purchased_at DESC
+            """,
+            chunk,
+        ).fetchall()
+        for r in rows:
+            price_map.setdefault(int(r["item_id"]), []).append(r)
+    return price_map
 
-    lines: list[tuple[int, float, float | None]] = []
-    errors: list[str] = []
 
-    for idx, (item_id_raw, qty_raw, unit_price_raw) in enumerate(
-        zip(item_ids, qty_list, unit_price_list), start=1
-    ):
-        item_id_raw = (item_id_raw or "").strip()
-        qty_raw = (qty_raw or "").strip()
-        unit_price_raw = (unit_price_raw or "").strip()
+def build_estimate_price_map(db, items) -> dict[int, float]:
+    """
+    見積り用単価：材料マスターの仕入れ先の最終単価 → 全仕入れ先で最新の単価 → ref_unit_price。
+    items には item_id / ref_unit_price（あれば supplier_id）が必要。
+    """
+    item_ids = [int(it["item_id"]) for it in items]
+    price_map = fetch_price_index_map(db, item_ids)
 
-        if item_id_raw == "" and qty_raw == "" and unit_price_raw == "":
-            continue  # 完全空行はスキップ
+    estimate_map: dict[int, float] = {}
+    for it in items:
+        item_id = int(it["item_id"])
+        rows = price_map.get(item_id, [])
+        supplier_id = it["supplier_id"] if "supplier_id" in it.keys() else None
+        price = None
+        for r in rows:
+            if supplier_id is not None and r["supplier_id"] == supplier_id:
+                price = float(r["last_unit_price"])
+                break
+        if price is None and rows:
+            price = float(rows[0]["last_unit_price"])
+        if price is None:
+            price = float(it["ref_unit_price"] or 0)
+        estimate_map[item_id] = price
+    return estimate_map
+
+
+def insert_purchase(
+    db,
+    store_id: int,
+    supplier_id: int | None,
+    purchased_at: str | None,
+    location: str,
+    note: str | None,
+    lines: list[tuple[int, float, float | None]],
+) -> int:
+    """
+    入庫ヘッダ＋明細＋在庫履歴（PURCHASE）を登録して purchase_id を返す。
+    トランザクションと実績単価インデックスの更新は呼び出し側で行う。
+    """
+    # 合計金額（単価が全部空なら 0）
+    total = sum(qty * unit_price for (_item_id, qty, unit_price) in lines if unit_price is not None)
+    cur = db.execute(
+        """
+        INSERT INTO purchases (store_id, supplier_id, purchased_at, note, total_amount)
+        VALUES (?, ?, COALESCE(?, datetime('now')), ?, ?)
+        """,
+        (store_id, supplier_id, purchased_at, note, total),
+    )
+    purchase_id = cur.lastrowid
 
-        if item_id_raw == "":
-            errors.append(f"{idx}行目：材料を選択してください。")
-            continue
-
-        if qty_raw == "":
-            errors.append(f"{idx}行目：数量(qty)を入力してください。")
-            continue
-
-        try:
-            item_id = int(item_id_raw)
-        except ValueError:
-            errors.append(f"{idx}行目：材料IDが不正です。")
-            continue
-
-        try:
-            qty = float(qty_raw)
-        except ValueError:
-            errors.append(f"{idx}行目：数量(qty)が数値ではありません。")
-            continue
-
-        if qty <= 0:
-            errors.append(f"{idx}行目：数量(qty)は0より大きくしてください。")
-            continue
-        item_row = db.execute(
-            "SELECT name, unit_base FROM items WHERE item_id = ?",
-            (item_id,),
-        ).fetchone()
-        if item_row is None:
-            errors.append(f"{idx}行目：材料IDが存在しません。")
-            continue
-
-        if unit_price_raw == "":
-            errors.append(f"{idx}行目：単価(unit_price)を入力してください。")
-            continue
-
-        try:
-            unit_price = float(unit_price_raw)
-            if unit_price < 0:
-                errors.append(f"{idx}行目：単価(unit_price)は0以上にしてください。")
-                continue
-        except ValueError:
-            errors.append(f"{idx}行目：単価(unit_price)が数値ではありません。")
-            continue
-
-        lines.append((item_id, qty, unit_price))
-
-    if not lines:
-        errors.append("明細が1行もありません。材料と数量を入力してください。")
-
-    if errors:
-        for e in errors:
-            flash(e, "error")
-        return redirect(url_for("purchase_new_form"))
-
-    try:
-        # トランザクション（ヘッダ＋明細＋在庫履歴をまとめて登録）
-        db.execute("BEGIN;")
-
-        # purchases（ヘッダ）
-        if purchased_at is None:
-            cur = db.execute(
-                """
-                INSERT INTO purchases (supplier_id, note, total_amount)
-                VALUES (?, ?, NULL)
-                """,
-                (supplier_id, note),
-            )
-        else:
-            purchased_at_db = purchased_at
-            cur = db.execute(
-                """
-                INSERT INTO purchases (supplier_id, purchased_at, note, total_amount)
-                VALUES (?, ?, ?, NULL)
-                """,
-                (supplier_id, purchased_at_db, note),
-            )
-
-        purchase_id = cur.lastrowid
-
-        # 明細＆在庫履歴
-        total = 0.0
-        for (item_id, qty, unit_price) in lines:
-            line_amount = None
-            if unit_price is not None:
-                line_amount = qty * unit_price
-                total += line_amount
-
-            # purchase_lines
-            db.execute(
-                """
-                INSERT INTO purchase_lines (purchase_id, item_id, qty, unit_price, line_amount)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (purchase_id, item_id, qty, unit_price, line_amount),
-            )
-
-            # inventory_tx（在庫増加）
-            db.execute(
-                """
-                INSERT INTO inventory_tx (
-                  happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note
-                )
-                VALUES (
-                  COALESCE(?, datetime('now')),
-                  ?, ?, 'PURCHASE', ?, 'PURCHASE', ?, ?
-                )
-                """,
-                (
-                    purchased_at,
-                    item_id,
-                    qty,
-                    location,
-                    purchase_id,
-                    note,
-                ),
-            )
-
-        # 合計金額を保存（単価が全部空なら 0 のままになる）
-        db.execute(
-            "UPDATE purchases SET total_amount = ? WHERE purchase_id = ?",
-            (total, purchase_id),
-        )
-
-        commit_and_sync()
-    except Exception as e:
-        db.rollback()
-        flash(f"入庫登録に失敗しました: {e}", "error")
-        return redirect(url_for("purchase_new_form"))
-
-    flash("入庫（仕入れ）を登録しました。", "success")
-    return redirect(url_for("purchases_list", created=purchase_id))
-
-
-@app.post("/purchases/new-from-list")
-def purchase_new_from_list():
-    db = get_db()
-
-    supplier_id_raw = (request.form.get("supplier_id") or "").strip()
-    supplier_id = int(supplier_id_raw) if supplier_id_raw else None
-
-    # チェックされた材料
-    selected_item_ids_raw = request.form.getlist("selected_item_ids")
-    selected_item_ids = []
-    for x in selected_item_ids_raw:
-        try:
-            selected_item_ids.append(int(x))
-        except ValueError:
-            pass
-
-    if not selected_item_ids:
-        flash("チェックされた材料がありません。", "error")
-        return redirect(url_for("shopping_list"))
-
-    prefill_lines = []
-    for item_id in selected_item_ids[:10]:  # purchase_new.html が10行固定なので最大10件
-        qty_raw = (request.form.get(f"qty_{item_id}") or "").strip()
-        unit_price_raw = (request.form.get(f"unit_price_{item_id}") or "").strip()
-
-        try:
-            qty = float(qty_raw) if qty_raw else 0.0
-        except ValueError:
-            qty = 0.0
-
-        # 単価は任意
-        unit_price = None
-        if unit_price_raw != "":
-            try:
-                unit_price = float(unit_price_raw)
-            except ValueError:
-                unit_price = None
-
-        prefill_lines.append(
-            {
-                "item_id": item_id,
-                "qty": qty,
-                "unit_price": unit_price,
-            }
-        )
-
-    suppliers = fetch_suppliers()
-    items = fetch_active_items()
-
-    # ちょい親切：メモに「買い物リストから」入れとく
-    default_note = "買い物リストから作成"
-
-    return render_template(
-        "purchase_new.html",
-        suppliers=suppliers,
-        items=items,
-        prefill_lines=prefill_lines,
-        default_supplier_id=supplier_id,
-        default_location="STORE",
-        default_note=default_note,
-    )
-
-
-@app.get("/purchases/<int:purchase_id>")
-def purchase_detail(purchase_id: int):
-    db = get_db()
-
-    header = db.execute(
-        """
-        SELECT
-          p.purchase_id,
-          p.purchased_at,
-          p.total_amount,
-          p.note,
-          s.name AS supplier_name
-        FROM purchases p
-        LEFT JOIN suppliers s ON s.supplier_id = p.supplier_id
-        WHERE p.purchase_id = ?
-        """,
-        (purchase_id,),
-    ).fetchone()
-
-    if header is None:
-        abort(404)
-
-    lines = db.execute(
-        """
-        SELECT
-          pl.purchase_line_id,
-          pl.qty,
-          pl.unit_price,
-          pl.line_amount,
-          i.name AS item_name,
-          i.unit_base
-        FROM purchase_lines pl
-        JOIN items i ON i.item_id = pl.item_id
-        WHERE pl.purchase_id = ?
-        ORDER BY pl.purchase_line_id ASC
-        """,
-        (purchase_id,),
-    ).fetchall()
-
-    return render_template("purchase_detail.html", header=header, lines=lines)
-
-
-@app.get("/purchases/<int:purchase_id>/edit")
-def purchase_edit_form(purchase_id: int):
-    db = get_db()
-
-    header = db.execute(
-        """
-        SELECT
-          p.purchase_id,
-          p.purchased_at,
-          p.note,
-          p.supplier_id,
-          s.name AS supplier_name,
-          COALESCE((
-            SELECT MIN(tx.location)
-            FROM inventory_tx tx
-            WHERE tx.ref_type = 'PURCHASE' AND tx.ref_id = p.purchase_id
-          ), 'STORE') AS location
-        FROM purchases p
-        LEFT JOIN suppliers s ON s.supplier_id = p.supplier_id
-        WHERE p.purchase_id = ?
-        """,
-        (purchase_id,),
-    ).fetchone()
-    if header is None:
-        abort(404)
-
-    lines = db.execute(
-        """
-        SELECT item_id, qty, unit_price
-        FROM purchase_lines
-        WHERE purchase_id = ?
-        ORDER BY purchase_line_id ASC
-        """,
-        (purchase_id,),
-    ).fetchall()
-
-    line_rows: list[dict[str, object]] = []
-    for l in lines:
-        line_rows.append(
-            {
-                "item_id": l["item_id"],
-                "qty": l["qty"],
-                "unit_price": l["unit_price"],
-            }
-        )
-    while len(line_rows) < 10:
-        line_rows.append({"item_id": "", "qty": "", "unit_price": ""})
-    line_rows = line_rows[:10]
-
-    default_purchased_date = ""
-    if header["purchased_at"]:
-        default_purchased_date = str(header["purchased_at"])[:10]
-
-    suppliers = fetch_suppliers()
-    items = fetch_active_items()
-    return render_template(
-        "purchase_edit.html",
-        header=header,
-        line_rows=line_rows,
-        suppliers=suppliers,
-        items=items,
-        default_purchased_date=default_purchased_date,
-        default_location=normalize_inventory_location(header["location"], "STORE"),
-    )
-
-
-@app.post("/purchases/<int:purchase_id>/update")
-def purchase_update(purchase_id: int):
-    db = get_db()
-
-    header = db.execute(
-        """
-        SELECT
-          p.purchase_id,
-          p.purchased_at,
-          COALESCE((
-            SELECT MIN(tx.location)
-            FROM inventory_tx tx
-            WHERE tx.ref_type = 'PURCHASE' AND tx.ref_id = p.purchase_id
-          ), 'STORE') AS location
-        FROM purchases p
-        WHERE p.purchase_id = ?
-        """,
-        (purchase_id,),
-    ).fetchone()
-    if header is None:
-        abort(404)
-
-    supplier_id_raw = (request.form.get("supplier_id") or "").strip()
-    supplier_id = int(supplier_id_raw) if supplier_id_raw else None
-
-    purchased_date = (request.form.get("purchased_date") or "").strip()
-    if purchased_date:
-        purchased_at_db = f"{purchased_date} 09:00:00"
-    else:
-        purchased_at_db = header["purchased_at"]
-
-    location = normalize_inventory_location(
-        request.form.get("location"), header["location"] or "STORE"
-    )
-
-    note = (request.form.get("note") or "").strip() or None
-
-    item_ids = request.form.getlist("item_id")
-    qty_list = request.form.getlist("qty")
-    unit_price_list = request.form.getlist("unit_price")
-
-    lines: list[tuple[int, float, float | None]] = []
-    errors: list[str] = []
-
-    for idx, (item_id_raw, qty_raw, unit_price_raw) in enumerate(
-        zip(item_ids, qty_list, unit_price_list), start=1
-    ):
-        item_id_raw = (item_id_raw or "").strip()
-        qty_raw = (qty_raw or "").strip()
-        unit_price_raw = (unit_price_raw or "").strip()
-
-        if item_id_raw == "" and qty_raw == "" and unit_price_raw == "":
-            continue
-
-        if item_id_raw == "":
-            errors.append(f"{idx}行目：材料を選択してください。")
-            continue
-
-        if qty_raw == "":
-            errors.append(f"{idx}行目：数量(qty)を入力してください。")
-            continue
-
-        try:
-            item_id = int(item_id_raw)
-        except ValueError:
-            errors.append(f"{idx}行目：材料IDが不正です。")
-            continue
-
-        try:
-            qty = float(qty_raw)
-        except ValueError:
-            errors.append(f"{idx}行目：数量(qty)が数値ではありません。")
-            continue
-
-        if qty <= 0:
-            errors.append(f"{idx}行目：数量(qty)は0より大きくしてください。")
-            continue
-        item_row = db.execute(
-            "SELECT name, unit_base FROM items WHERE item_id = ?",
-            (item_id,),
-        ).fetchone()
-        if item_row is None:
-            errors.append(f"{idx}行目：材料IDが存在しません。")
-            continue
-
-        if unit_price_raw == "":
-            errors.append(f"{idx}行目：単価(unit_price)を入力してください。")
-            continue
-
-        try:
-            unit_price = float(unit_price_raw)
-            if unit_price < 0:
-                errors.append(f"{idx}行目：単価(unit_price)は0以上にしてください。")
-                continue
-        except ValueError:
-            errors.append(f"{idx}行目：単価(unit_price)が数値ではありません。")
-            continue
-
-        lines.append((item_id, qty, unit_price))
-
-    if not lines:
-        errors.append("明細が1行もありません。材料と数量を入力してください。")
-
-    if errors:
-        for e in errors:
-            flash(e, "error")
-        return redirect(url_for("purchase_edit_form", purchase_id=purchase_id))
-
-    try:
-        db.execute("BEGIN;")
-
-        db.execute(
-            """
-            UPDATE purchases
-            SET supplier_id = ?, purchased_at = ?, note = ?, total_amount = NULL
-            WHERE purchase_id = ?
-            """,
-            (supplier_id, purchased_at_db, note, purchase_id),
-        )
-
-        db.execute(
-            "DELETE FROM inventory_tx WHERE ref_type = 'PURCHASE' AND ref_id = ?",
-            (purchase_id,),
-        )
-        db.execute("DELETE FROM purchase_lines WHERE purchase_id = ?", (purchase_id,))
-
-        total = 0.0
-        for (item_id, qty, unit_price) in lines:
-            line_amount = None
-            if unit_price is not None:
-                line_amount = qty * unit_price
-                total += line_amount
-
-            db.execute(
-                """
-                INSERT INTO purchase_lines (purchase_id, item_id, qty, unit_price, line_amount)
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (purchase_id, item_id, qty, unit_price, line_amount),
-            )
-
-            db.execute(
-                """
-                INSERT INTO inventory_tx (
-                  happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note
-                )
-                VALUES (
-                  COALESCE(?, datetime('now')),
-                  ?, ?, 'PURCHASE', ?, 'PURCHASE', ?, ?
-                )
-                """,
-                (
-                    purchased_at_db,
-                    item_id,
-                    qty,
-                    location,
-                    purchase_id,
-                    note,
-                ),
-            )
-
-        db.execute(
-            "UPDATE purchases SET total_amount = ? WHERE purchase_id = ?",
-            (total, purchase_id),
-        )
-
-        commit_and_sync()
-    except Exception as e:
-        db.rollback()
-        flash(f"更新に失敗しました: {e}", "error")
-        return redirect(url_for("purchase_edit_form", purchase_id=purchase_id))
-
-    flash("入庫を更新しました。", "success")
-    return redirect(url_for("purchase_detail", purchase_id=purchase_id))
-
-
-@app.post("/purchases/<int:purchase_id>/delete")
-def purchase_delete(purchase_id: int):
-    db = get_db()
-
-    header = db.execute(
-        "SELECT purchase_id FROM purchases WHERE purchase_id = ?",
-        (purchase_id,),
-    ).fetchone()
-    if header is None:
-        abort(404)
-
-    try:
-        db.execute("BEGIN;")
-        db.execute(
-            "DELETE FROM inventory_tx WHERE ref_type = 'PURCHASE' AND ref_id = ?",
-            (purchase_id,),
-        )
-        db.execute("DELETE FROM purchases WHERE purchase_id = ?", (purchase_id,))
-        commit_and_sync()
-    except Exception as e:
-        db.rollback()
-        flash(f"削除に失敗しました: {e}", "error")
-        return redirect(url_for("purchase_detail", purchase_id=purchase_id))
-
-    flash("入庫を削除しました。", "success")
-    return redirect(url_for("purchases_list"))
+    db.executemany(
+        """
+        INSERT INTO purchase_lines (purchase_id, item_id, qty, unit_price, line_amount)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        [
+            (purchase_id, item_id, qty, unit_price, None if unit_price is None else qty * unit_price)
+            for (item_id, qty, unit_price) in lines
+        ],
+    )
+    db.executemany(
+        """
+        INSERT INTO inventory_tx (
+          store_id, happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note
+        )
+        SELECT store_id, purchased_at, ?, ?, 'PURCHASE', ?, 'PURCHASE', purchase_id, note
+        FROM purchases
+        WHERE purchase_id = ?
+        """,
+        [(item_id, qty, location, purchase_id) for (item_id, qty, _unit_price) in lines],
+    )
+    return purchase_id
 
 
 # -----------------------------
@@ -1068,54 +855,14 @@ def _iter_chunks(values: list[int], chunk_size: int = 400):
         yield values[i : i + chunk_size]
 
 
-def normalize_stocktake_mode(raw: str | None, default: str) -> str:
-    mode = (raw or "").strip().lower()
-    if mode not in ("weekly", "monthly"):
-        return default
-    return mode
-
-
-def normalize_stocktake_group(raw: str | None) -> str:
-    group = (raw or "").strip().upper()
-    if group not in ("ALL", "FOOD", "SUPPLIES"):
-        return "ALL"
-    return group
-
-
-def fetch_items_for_stocktake_group(group: str) -> list[sqlite3.Row]:
-    db = get_db()
-    if group == "FOOD":
-        return db.execute(
-            """
-            SELECT item_id, name, unit_base, reorder_point, ref_unit_price, cost_group
-            FROM items
-            WHERE is_active = 1 AND cost_group = 'FOOD'
-            ORDER BY name ASC
-            """
-        ).fetchall()
-    if group == "SUPPLIES":
-        return db.execute(
-            """
-            SELECT item_id, name, unit_base, reorder_point, ref_unit_price, cost_group
-            FROM items
-            WHERE is_active = 1 AND cost_group = 'SUPPLIES'
-            ORDER BY name ASC
-            """
-        ).fetchall()
-    return db.execute(
-        """
-        SELECT item_id, name, unit_base, reorder_point, ref_unit_price, cost_group
-        FROM items
-        WHERE is_active = 1
-        ORDER BY name ASC
-        """
-    ).fetchall()
-
-
-def get_inventory_qty_map_for_items(db, item_ids: list[int]) -> dict[int, float]:
+def get_inventory_qty_map_for_items(
+    db, store_id: int, item_ids: list[int], location: str | None = None
+) -> dict[int, float]:
+    """材料ごとの残量。location を渡すとその保管場所の残量（移動は保管場所ごとに台帳に載るため）。"""
     if not item_ids:
         return {}
 
+    location_filter = "" if location is None else "AND location = ?"
     qty_map: dict[int, float] = {}
     for chunk in _iter_chunks(item_ids):
         placeholders = ",".join("?" for _ in chunk)
@@ -1123,10 +870,10 @@ def get_inventory_qty_map_for_items(db, item_ids: list[int]) -> dict[int, float]
             f"""
             SELECT item_id, COALESCE(SUM(qty_delta), 0) AS qty
             FROM inventory_tx
-            WHERE item_id IN ({placeholders})
+            WHERE store_id = ? AND item_id IN ({placeholders}) {location_filter}
             GROUP BY item_id
             """,
-            chunk,
+            (store_id, *chunk) if location is None else (store_id, *chunk, location),
         ).fetchall()
         for row in rows:
             qty_map[int(row["item_id"])] = float(row["qty"] or 0)
@@ -1192,37 +939,46 @@ def month_range_for_datetime(dt_str: str):
     return start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")
 
 
-def get_opening_monthly_stocktake_id(db, month_start: str, location: str | None = None):
+def get_opening_monthly_stocktake_id(
+    db, store_id: int, month_start: str, location: str | None = None
+):
     if location:
         row = db.execute(
             """
             SELECT stocktake_id, taken_at
             FROM stocktakes
-            WHERE scope = 'MONTHLY'
+            WHERE store_id = ?
+              AND scope = 'MONTHLY'
               AND location = ?
               AND taken_at < ?
             ORDER BY taken_at DESC
             LIMIT 1
             """,
-            (location, month_start),
+            (store_id, location, month_start),
         ).fetchone()
         return row
     row = db.execute(
         """
         SELECT stocktake_id, taken_at
         FROM stocktakes
-        WHERE scope = 'MONTHLY'
+        WHERE store_id = ?
+          AND scope = 'MONTHLY'
           AND taken_at < ?
         ORDER BY taken_at DESC
         LIMIT 1
         """,
-        (month_start,),
+        (store_id, month_start),
     ).fetchone()
     return row
 
 
 def calc_monthly_weighted_unit_cost(
-    db, item_id: int, month_start: str, month_end: str, location: str | None = None
+    db,
+    store_id: int,
+    item_id: int,
+    month_start: str,
+    month_end: str,
+    location: str | None = None,
 ):
     """
     月次総平均（加重平均）単価を計算。
@@ -1235,7 +991,7 @@ def calc_monthly_weighted_unit_cost(
     ref = float(item["ref_unit_price"] or 0)
 
     # 期首（月初の前の月次棚卸）
-    opening = get_opening_monthly_stocktake_id(db, month_start, location=location)
+    opening = get_opening_monthly_stocktake_id(db, store_id, month_start, location=location)
 
     opening_qty = 0.0
     opening_amount = 0.0
@@ -1274,10 +1030,11 @@ def calc_monthly_weighted_unit_cost(
         JOIN purchases p ON p.purchase_id = pl.purchase_id
         JOIN items i ON i.item_id = pl.item_id
         WHERE pl.item_id=?
+          AND p.store_id = ?
           AND p.purchased_at >= ?
           AND p.purchased_at < ?
         """,
-        (item_id, month_start, month_end),
+        (item_id, store_id, month_start, month_end),
     ).fetchall()
 
     purchased_qty = 0.0
@@ -1311,7 +1068,12 @@ def calc_monthly_weighted_unit_cost(
 
 
 def build_monthly_weighted_unit_cost_map(
-    db, items: list[sqlite3.Row], month_start: str, month_end: str, location: str | None = None
+    db,
+    store_id: int,
+    items: list[sqlite3.Row],
+    month_start: str,
+    month_end: str,
+    location: str | None = None,
 ) -> dict[int, tuple[float, bool, bool]]:
     if not items:
         return {}
@@ -1323,7 +1085,7 @@ def build_monthly_weighted_unit_cost_map(
     opening_amount_map: dict[int, float] = {}
     used_ref_opening_map: dict[int, bool] = {}
 
-    opening = get_opening_monthly_stocktake_id(db, month_start, location=location)
+    opening = get_opening_monthly_stocktake_id(db, store_id, month_start, location=location)
     if opening:
         rows = db.execute(
             """
@@ -1358,10 +1120,11 @@ def build_monthly_weighted_unit_cost_map(
             FROM purchase_lines pl
             JOIN purchases p ON p.purchase_id = pl.purchase_id
             WHERE pl.item_id IN ({placeholders})
+              AND p.store_id = ?
               AND p.purchased_at >= ?
               AND p.purchased_at < ?
             """,
-            (*chunk, month_start, month_end),
+            (*chunk, store_id, month_start, month_end),
         ).fetchall()
         purchase_rows.extend(rows)
 
@@ -1394,1913 +1157,299 @@ def build_monthly_weighted_unit_cost_map(
                 unit_price
             )
 
-    cost_map: dict[int, tuple[float, bool, bool]] = {}
-    for item_id in item_ids:
-        opening_qty = opening_qty_map.get(item_id, 0.0)
-        opening_amount = opening_amount_map.get(item_id, 0.0)
-        purchased_qty = purchased_qty_map.get(item_id, 0.0)
-        purchased_amount = purchased_amount_map.get(item_id, 0.0)
-
-        denom = opening_qty + purchased_qty
-        used_ref = used_ref_opening_map.get(item_id, False) or used_ref_purchase_map.get(
-            item_id, False
-        )
-        if denom <= 0:
-            cost_map[item_id] = (ref_map.get(item_id, 0.0), True, used_ref)
-        else:
-            avg_unit_cost = (opening_amount + purchased_amount) / denom
-            cost_map[item_id] = (avg_unit_cost, False, used_ref)
-
-    return cost_map
-
-
-def calc_initial_stocktake_unit_cost(db, item_id: int, taken_at: str) -> float:
-    """
-    初回棚卸用: 棚卸日までの仕入実績平均単価を計算。
-    unit_price未入力はref_unit_priceで代用、数量0ならref_unit_price。
-    """
-    item = db.execute(
-        "SELECT ref_unit_price FROM items WHERE item_id=?", (item_id,)
-    ).fetchone()
-    ref = float(item["ref_unit_price"] or 0)
-
-    row = db.execute(
-        """
-        SELECT
-          COALESCE(SUM(
-            CASE
-              WHEN pl.line_amount IS NOT NULL THEN pl.line_amount
-              WHEN pl.unit_price IS NOT NULL THEN pl.qty * pl.unit_price
-              ELSE pl.qty * COALESCE(i.ref_unit_price, 0)
-            END
-          ), 0) AS amount_sum,
-          COALESCE(SUM(pl.qty), 0) AS qty_sum
-        FROM purchase_lines pl
-        JOIN purchases p ON p.purchase_id = pl.purchase_id
-        JOIN items i ON i.item_id = pl.item_id
-        WHERE pl.item_id = ?
-          AND datetime(p.purchased_at) <= datetime(?)
-        """,
-        (item_id, taken_at),
-    ).fetchone()
-
-    qty_sum = float(row["qty_sum"] or 0)
-    if qty_sum <= 0:
-        return ref
-    amount_sum = float(row["amount_sum"] or 0)
-    return amount_sum / qty_sum
-
-
-def build_initial_stocktake_unit_cost_map(
-    db, items: list[sqlite3.Row], taken_at: str
-) -> dict[int, float]:
-    """
-    初回棚卸用: 棚卸日時までの実績平均単価を品目ごとに一括計算する。
-    実績数量が0の品目は ref_unit_price を使用。
-    """
-    if not items:
-        return {}
-
-    item_ids = [int(it["item_id"]) for it in items]
-    ref_map = {int(it["item_id"]): float(it["ref_unit_price"] or 0) for it in items}
-
-    unit_cost_map: dict[int, float] = {}
-    for chunk in _iter_chunks(item_ids):
-        placeholders = ",".join(["?"] * len(chunk))
-        rows = db.execute(
-            f"""
-            SELECT
-              pl.item_id AS item_id,
-              COALESCE(SUM(
-                CASE
-                  WHEN pl.line_amount IS NOT NULL THEN pl.line_amount
-                  WHEN pl.unit_price IS NOT NULL THEN pl.qty * pl.unit_price
-                  ELSE pl.qty * COALESCE(i.ref_unit_price, 0)
-                END
-              ), 0) AS amount_sum,
-              COALESCE(SUM(pl.qty), 0) AS qty_sum
-            FROM purchase_lines pl
-            JOIN purchases p ON p.purchase_id = pl.purchase_id
-            JOIN items i ON i.item_id = pl.item_id
-            WHERE pl.item_id IN ({placeholders})
-              AND datetime(p.purchased_at) <= datetime(?)
-            GROUP BY pl.item_id
-            """,
-            (*chunk, taken_at),
-        ).fetchall()
-
-        for r in rows:
-            item_id = int(r["item_id"])
-            qty_sum = float(r["qty_sum"] or 0)
-            if qty_sum <= 0:
-                unit_cost_map[item_id] = ref_map.get(item_id, 0.0)
-                continue
-            amount_sum = float(r["amount_sum"] or 0)
-            unit_cost_map[item_id] = amount_sum / qty_sum
-
-    for item_id in item_ids:
-        if item_id not in unit_cost_map:
-            unit_cost_map[item_id] = ref_map.get(item_id, 0.0)
-
-    return unit_cost_map
-
-
-def format_daily_report_for_line(rep) -> str:
-    """
-    LINEへコピペする用の本文を作る
-    形式:
-    【日報】
-    売れたバッチ
-    生産時間(入力値・時間)
-
-    売上(カンマ区切り)
-
-    所感
-    """
-    sold = rep["sold_batches"]
-    sold_str = str(sold if sold is not None else 0)
-
-    prod = rep["production_minutes"]
-    prod_str = f"{float(prod or 0):.1f}"
-
-    sales = rep["sales_amount"]
-    sales_int = int(round(float(sales or 0)))
-    sales_str = f"{sales_int:,}"
-
-    impression = (rep["impression"] or "").strip()
-
-    return (
-        "【日報】\n"
-        f"{sold_str}\n"
-        f"{prod_str}\n\n"
-        f"{sales_str}\n\n"
-        f"{impression}"
-    )
-
-
-def get_active_batch_config(db):
-    row = db.execute(
-        """
-        SELECT batch_config_id, name, pieces_per_batch
-        FROM batch_config
-        WHERE is_active = 1
-        ORDER BY batch_config_id DESC
-        LIMIT 1
-        """
-    ).fetchone()
-    return row
-
-
-def regenerate_inventory_tx_for_daily_report(db, daily_report_id: int) -> int:
-    """
-    日報IDに紐づく inventory_tx（CONSUME）を作り直す。
-    return: 作成したtx件数
-    """
-    rep = db.execute(
-        """
-        SELECT daily_report_id, report_date, sold_batches
-        FROM daily_reports
-        WHERE daily_report_id = ?
-        """,
-        (daily_report_id,),
-    ).fetchone()
-
-    if rep is None:
-        return 0
-
-    report_date = rep["report_date"]  # 'YYYY-MM-DD'
-    sold_batches = float(rep["sold_batches"] or 0)
-
-    happened_at = f"{report_date} 09:00:00"
-    location = "STORE"
-
-    # まず既存の自動生成分を削除（編集時に二重計上させない）
-    db.execute(
-        """
-        DELETE FROM inventory_tx
-        WHERE ref_type = 'DAILY_REPORT'
-          AND ref_id = ?
-          AND tx_type IN ('CONSUME', 'WASTE')
-        """,
-        (daily_report_id,),
-    )
-
-    # auto_consume=1 だけ対象（週次で数えるものは0にしておけばOK）
-    recipe_rows = db.execute(
-        """
-        SELECT rb.item_id, rb.qty_per_batch, i.unit_base
-        FROM recipe_batch rb
-        JOIN batch_config bc ON bc.batch_config_id = rb.batch_config_id
-        JOIN items i ON i.item_id = rb.item_id
-        WHERE rb.auto_consume = 1
-          AND bc.is_active = 1
-        """
-    ).fetchall()
-
-    created = 0
-
-    for r in recipe_rows:
-        item_id = r["item_id"]
-        qty_per_batch = float(r["qty_per_batch"] or 0)
-
-        # 通常消費（売れたバッチ数分）
-        consume_qty = qty_per_batch * sold_batches
-
-        # マイナスで在庫を減らす
-        if abs(consume_qty) > 1e-9:
-            db.execute(
-                """
-                INSERT INTO inventory_tx
-                  (happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note)
-                VALUES
-                  (?, ?, ?, 'CONSUME', ?, 'DAILY_REPORT', ?, ?)
-                """,
-                (
-                    happened_at,
-                    item_id,
-                    -consume_qty,
-                    location,
-                    daily_report_id,
-                    f"日報自動消費：sold_batches={sold_batches}",
-                ),
-            )
-            created += 1
-
-    return created
-
-
-@app.get("/daily-reports")
-def daily_reports_list():
-    db = get_db()
-    rows = db.execute(
-        """
-        SELECT daily_report_id, report_date, sold_batches, production_minutes, sales_amount
-        FROM daily_reports
-        ORDER BY report_date DESC, daily_report_id DESC
-        """
-    ).fetchall()
-    return render_template("daily_reports_list.html", reports=rows)
-
-
-@app.get("/daily-reports/new")
-def daily_report_new():
-    today = date.today().isoformat()
-    return render_template("daily_report_new.html", default_date=today)
-
-
-@app.post("/daily-reports")
-def daily_report_create():
-    db = get_db()
-
-    report_date = (request.form.get("report_date") or "").strip()
-    if not report_date:
-        flash("日付（report_date）は必須です", "error")
-        return redirect(url_for("daily_report_new"))
-
-    sold_batches = float((request.form.get("sold_batches") or "0").strip() or 0)
-    waste_pieces = 0
-    production_minutes = float(
-        (request.form.get("production_minutes") or "0").strip() or 0
-    )
-    sales_amount = float((request.form.get("sales_amount") or "0").strip() or 0)
-    impression = (request.form.get("impression") or "").strip()
-
-    # 1日1回運用：同じ日付があるなら編集へ誘導（好みで）
-    exists = db.execute(
-        """
-        SELECT daily_report_id FROM daily_reports WHERE report_date = ?
-        LIMIT 1
-        """,
-        (report_date,),
-    ).fetchone()
-    if exists:
-        flash("この日付の日報は既にあります。編集してください。", "error")
-        return redirect(
-            url_for("daily_report_edit", daily_report_id=exists["daily_report_id"])
-        )
-
-    try:
-        db.execute("BEGIN")
-
-        db.execute(
-            """
-            INSERT INTO daily_reports
-              (report_date, sold_batches, waste_pieces, production_minutes, sales_amount, impression, created_at)
-            VALUES
-              (?, ?, ?, ?, ?, ?, datetime('now'))
-            """,
-            (
-                report_date,
-                sold_batches,
-                waste_pieces,
-                production_minutes,
-                sales_amount,
-                impression,
-            ),
-        )
-
-        daily_report_id = db.execute("SELECT last_insert_rowid() AS id").fetchone()[
-            "id"
-        ]
-
-        created_tx = regenerate_inventory_tx_for_daily_report(db, daily_report_id)
-
-        db.execute("COMMIT")
-        flash(f"日報を登録しました（inventory_tx自動生成: {created_tx}件）", "success")
-        return redirect(url_for("daily_report_detail", daily_report_id=daily_report_id))
-
-    except Exception as e:
-        db.execute("ROLLBACK")
-        flash(f"日報登録に失敗しました: {e}", "error")
-        return redirect(url_for("daily_report_new"))
-
-
-@app.get("/daily-reports/<int:daily_report_id>/edit")
-def daily_report_edit(daily_report_id: int):
-    db = get_db()
-    rep = db.execute(
-        """
-        SELECT * FROM daily_reports WHERE daily_report_id = ?
-        """,
-        (daily_report_id,),
-    ).fetchone()
-    if rep is None:
-        abort(404)
-    return render_template("daily_report_edit.html", rep=rep)
-
-
-@app.post("/daily-reports/<int:daily_report_id>/edit")
-def daily_report_update(daily_report_id: int):
-    db = get_db()
-
-    report_date = (request.form.get("report_date") or "").strip()
-    sold_batches = float((request.form.get("sold_batches") or "0").strip() or 0)
-    waste_pieces = 0
-    production_minutes = float(
-        (request.form.get("production_minutes") or "0").strip() or 0
-    )
-    sales_amount = float((request.form.get("sales_amount") or "0").strip() or 0)
-    impression = (request.form.get("impression") or "").strip()
-
-    try:
-        db.execute("BEGIN")
-
-        db.execute(
-            """
-            UPDATE daily_reports
-            SET report_date = ?,
-                sold_batches = ?,
-                waste_pieces = ?,
-                production_minutes = ?,
-                sales_amount = ?,
-                impression = ?
-            WHERE daily_report_id = ?
-            """,
-            (
-                report_date,
-                sold_batches,
-                waste_pieces,
-                production_minutes,
-                sales_amount,
-                impression,
-                daily_report_id,
-            ),
-        )
-
-        created_tx = regenerate_inventory_tx_for_daily_report(db, daily_report_id)
-
-        db.execute("COMMIT")
-        flash(f"日報を更新しました（inventory_tx再生成: {created_tx}件）", "success")
-        return redirect(url_for("daily_report_detail", daily_report_id=daily_report_id))
-
-    except Exception as e:
-        db.execute("ROLLBACK")
-        flash(f"日報更新に失敗しました: {e}", "error")
-        return redirect(url_for("daily_report_edit", daily_report_id=daily_report_id))
-
-
-@app.get("/daily-reports/<int:daily_report_id>")
-def daily_report_detail(daily_report_id: int):
-    db = get_db()
-    rep = db.execute(
-        """
-        SELECT *
-        FROM daily_reports
-        WHERE daily_report_id = ?
-        """,
-        (daily_report_id,),
-    ).fetchone()
-
-    if rep is None:
-        abort(404)
-
-    line_text = format_daily_report_for_line(rep)
-    return render_template("daily_report_detail.html", rep=rep, line_text=line_text)
-
-
-@app.get("/recipe-batch")
-def recipe_batch_edit():
-    db = get_db()
-
-    bc = get_active_batch_config(db)
-    if bc is None:
-        flash("アクティブなBATCH_CONFIGがありません。先に batch_config を作成してください。", "error")
-        return redirect(url_for("items_list"))
-
-    batch_config_id = bc["batch_config_id"]
-
-    # items と recipe_batch を紐付けて表示
-    rows = db.execute(
-        """
-        SELECT
-          i.item_id,
-          i.name,
-          i.unit_base,
-          COALESCE(i.cost_group, 'SUPPLIES') AS cost_group,
-          COALESCE(rb.qty_per_batch, 0) AS qty_per_batch,
-          COALESCE(rb.auto_consume, 0) AS auto_consume
-        FROM items i
-        LEFT JOIN recipe_batch rb
-          ON rb.item_id = i.item_id
-         AND rb.batch_config_id = ?
-        WHERE i.is_active = 1
-        ORDER BY
-          CASE COALESCE(i.cost_group,'SUPPLIES') WHEN 'FOOD' THEN 0 ELSE 1 END,
-          i.name ASC
-        """,
-        (batch_config_id,),
-    ).fetchall()
-
-    return render_template(
-        "recipe_batch_edit.html",
-        bc=bc,
-        rows=rows,
-    )
-
-
-@app.post("/recipe-batch")
-def recipe_batch_update():
-    db = get_db()
-
-    batch_config_id = request.form.get("batch_config_id")
-    if not batch_config_id:
-        abort(400)
-    batch_config_id = int(batch_config_id)
-
-    # 対象items（アクティブ）
-    items = db.execute(
-        """
-        SELECT item_id, unit_base
-        FROM items
-        WHERE is_active = 1
-        ORDER BY item_id
-        """
-    ).fetchall()
-
-    # 既存レシピ（qtyを保持するため qty_per_batch も取る）
-    existing = db.execute(
-        """
-        SELECT recipe_id, item_id, qty_per_batch, auto_consume
-        FROM recipe_batch
-        WHERE batch_config_id = ?
-        """,
-        (batch_config_id,),
-    ).fetchall()
-
-    existing_by_item = {
-        r["item_id"]: {
-            "recipe_id": r["recipe_id"],
-            "qty_per_batch": float(r["qty_per_batch"] or 0),
-            "auto_consume": int(r["auto_consume"] or 0),
-        }
-        for r in existing
-    }
-
-    updated = 0
-    inserted = 0
-
-    try:
-        db.execute("BEGIN")
-
-        for it in items:
-            item_id = it["item_id"]
-            unit_base = it["unit_base"]
-
-            # ✅ auto_consume はチェックのON/OFFだけで設定できる
-            auto_consume = 1 if request.form.get(f"auto_{item_id}") == "1" else 0
-
-            # qty_per_batch：空欄なら「既存値を保持」する
-            raw_qty = (request.form.get(f"qty_{item_id}") or "").strip()
-
-            if item_id in existing_by_item:
-                # 既存がある場合：空欄なら保持、入力があれば更新
-                qty = existing_by_item[item_id]["qty_per_batch"]
-                if raw_qty != "":
-                    try:
-                        qty = float(raw_qty)
-                    except ValueError:
-                        pass  # 変な入力は無視して保持
-            else:
-                # 既存がない場合：空欄なら0（ただしauto_consume=1なら「設定行」を作る）
-                if raw_qty == "":
-                    qty = 0.0
-                else:
-                    try:
-                        qty = float(raw_qty)
-                    except ValueError:
-                        qty = 0.0
-
-            # pcsも小数を許可（小数第3位まで想定）
-
-            if item_id in existing_by_item:
-                # 既存行：auto_consume だけの変更もOK、qtyは空欄なら保持
-                recipe_id = existing_by_item[item_id]["recipe_id"]
-                db.execute(
-                    """
-                    UPDATE recipe_batch
-                    SET qty_per_batch = ?, auto_consume = ?
-                    WHERE recipe_id = ?
-                    """,
-                    (qty, auto_consume, recipe_id),
-                )
-                updated += 1
-            else:
-                # 新規：qty>0 もしくは auto_consume=1 のときだけ行を作る
-                # （auto_consume=1 で qty=0 の「設定だけ」もOK）
-                if qty > 0 or auto_consume == 1:
-                    db.execute(
-                        """
-                        INSERT INTO recipe_batch (batch_config_id, item_id, qty_per_batch, auto_consume)
-                        VALUES (?, ?, ?, ?)
-                        """,
-                        (batch_config_id, item_id, qty, auto_consume),
-                    )
-                    inserted += 1
-
-        db.execute("COMMIT")
-        flash(f"保存しました（追加:{inserted} 更新:{updated}）", "success")
-        return redirect(url_for("recipe_batch_edit"))
-
-    except Exception as e:
-        db.execute("ROLLBACK")
-        flash(f"保存に失敗しました: {e}", "error")
-        return redirect(url_for("recipe_batch_edit"))
-@app.get("/stocktakes")
-def stocktakes_list():
-    db = get_db()
-    rows = db.execute(
-        """
-        SELECT
-          st.stocktake_id,
-          st.taken_at,
-          datetime(substr(replace(st.taken_at, 'T', ' '), 1, 19), '+9 hours') AS taken_at_display,
-          st.scope,
-          st.location,
-          st.note,
-          COUNT(sl.stocktake_line_id) AS line_count
-        FROM stocktakes st
-        LEFT JOIN stocktake_lines sl ON sl.stocktake_id = st.stocktake_id
-        GROUP BY st.stocktake_id
-        ORDER BY st.taken_at DESC, st.stocktake_id DESC
-        """
-    ).fetchall()
-    return render_template("stocktakes_list.html", stocktakes=rows)
-
-
-@app.get("/stocktakes/new")
-def stocktake_new_form():
-    # デフォルトはFOODのみ
-    only_food = request.args.get("only_food", "1") != "0"
-    group = "FOOD" if only_food else "ALL"
-    return redirect(url_for("stocktake_weekly_new", group=group))
-
-
-@app.post("/stocktakes")
-def stocktake_create():
-    db = get_db()
-
-    taken_at_local = (request.form.get("taken_at") or "").strip()
-    taken_at = _to_datetime_seconds(taken_at_local)  # UTC 'YYYY-MM-DD HH:MM:00' or None
-    if not taken_at:
-        taken_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
-    scope = "MONTHLY"  # 今回は月次固定（必要ならフォーム化できます）
-    # 月次棚卸は倉庫での実測を前提
-    location = "WAREHOUSE"
-    note = (request.form.get("note") or "").strip() or None
-
-    only_food = (request.form.get("only_food") or "1") != "0"
-
-    # 明細
-    item_ids = request.form.getlist("item_id")
-    counted_list = request.form.getlist("counted_qty")
-
-    lines: list[tuple[int, float]] = []
-    errors: list[str] = []
-
-    for idx, (item_id_raw, counted_raw) in enumerate(
-        zip(item_ids, counted_list), start=1
-    ):
-        item_id_raw = (item_id_raw or "").strip()
-        counted_raw = (counted_raw or "").strip()
-
-        if counted_raw == "":
-            continue  # 未入力は「今回は数えてない」とみなしてスキップ
-
-        try:
-            item_id = int(item_id_raw)
-        except ValueError:
-            errors.append(f"{idx}行目：材料IDが不正です。")
-            continue
-
-        try:
-            counted = float(counted_raw)
-        except ValueError:
-            errors.append(f"{idx}行目：棚卸数量が数値ではありません。")
-            continue
-
-        if counted < 0:
-            errors.append(f"{idx}行目：棚卸数量は0以上にしてください。")
-            continue
-
-        lines.append((item_id, counted))
-
-    if not lines:
-        errors.append("棚卸数量が1つも入力されていません。少なくとも1つ入力してください。")
-
-    if errors:
-        for e in errors:
-            flash(e, "error")
-        return redirect(url_for("stocktake_new_form", only_food=("1" if only_food else "0")))
-
-    # ここ重要：棚卸時点の「理論在庫」を計算（taken_atがあればその時点まで）
-    if taken_at:
-        inv_rows = db.execute(
-            """
-            SELECT item_id, SUM(qty_delta) AS qty
-            FROM inventory_tx
-            WHERE location = ? AND happened_at <= ?
-            GROUP BY item_id
-            """,
-            (location, taken_at),
-        ).fetchall()
-    else:
-        inv_rows = db.execute(
-            """
-            SELECT item_id, SUM(qty_delta) AS qty
-            FROM inventory_tx
-            WHERE location = ?
-            GROUP BY item_id
-            """,
-            (location,),
-        ).fetchall()
-
-    theoretical_map = {row["item_id"]: float(row["qty"] or 0) for row in inv_rows}
-
-    try:
-        # 明示BEGINは使わず、まとめてcommit/rollback
-        # stocktakes（ヘッダ）
-        cur = db.execute(
-            """
-            INSERT INTO stocktakes (taken_at, scope, location, note)
-            VALUES (?, ?, ?, ?)
-            """,
-            (taken_at, scope, location, note),
-        )
-
-        stocktake_id = cur.lastrowid
-
-        # lines と adjust tx
-        for (item_id, counted) in lines:
-            # 保存（棚卸の実測）
-            db.execute(
-                """
-                INSERT INTO stocktake_lines (stocktake_id, item_id, counted_qty)
-                VALUES (?, ?, ?)
-                """,
-                (stocktake_id, item_id, counted),
-            )
-
-            theoretical = theoretical_map.get(item_id, 0.0)
-            delta = counted - theoretical
-
-            # 差分が0なら tx を作らない（履歴が汚れない）
-            if abs(delta) < 1e-9:
-                continue
-
-            # inventory_tx（差分調整）
-            db.execute(
-                """
-                INSERT INTO inventory_tx (
-                  happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note
-                )
-                VALUES (
-                  COALESCE(?, datetime('now')),
-                  ?, ?, 'ADJUST', ?, 'STOCKTAKE', ?, ?
-                )
-                """,
-                (taken_at, item_id, delta, location, stocktake_id, note),
-            )
-
-        commit_and_sync()
-    except Exception as e:
-        db.rollback()
-        flash(f"月次棚卸の登録に失敗しました: {e}", "error")
-        return redirect(url_for("stocktake_new_form", only_food=("1" if only_food else "0")))
-
-    flash("月次棚卸を登録し、差分を ADJUST で反映しました。", "success")
-    return redirect(url_for("stocktake_detail", stocktake_id=stocktake_id))
-
-
-@app.get("/stocktakes/<int:stocktake_id>")
-def stocktake_detail(stocktake_id: int):
-    db = get_db()
-
-    header = db.execute(
-        """
-        SELECT
-          stocktake_id,
-          taken_at,
-          datetime(substr(replace(taken_at, 'T', ' '), 1, 19), '+9 hours') AS taken_at_display,
-          scope,
-          location,
-          note
-        FROM stocktakes
-        WHERE stocktake_id = ?
-        """,
-        (stocktake_id,),
-    ).fetchone()
-    if header is None:
-        abort(404)
-
-    lines = db.execute(
-        """
-        SELECT
-          sl.stocktake_line_id,
-          i.name AS item_name,
-          i.unit_base,
-          i.cost_group,
-          sl.counted_qty
-        FROM stocktake_lines sl
-        JOIN items i ON i.item_id = sl.item_id
-        WHERE sl.stocktake_id = ?
-        ORDER BY i.name ASC
-        """,
-        (stocktake_id,),
-    ).fetchall()
-
-    adjusts = db.execute(
-        """
-        SELECT
-          itx.tx_id,
-          i.name AS item_name,
-          i.unit_base,
-          itx.qty_delta
-        FROM inventory_tx itx
-        JOIN items i ON i.item_id = itx.item_id
-        WHERE itx.ref_type = 'STOCKTAKE'
-          AND itx.ref_id = ?
-          AND itx.tx_type = 'ADJUST'
-        ORDER BY i.name ASC
-        """,
-        (stocktake_id,),
-    ).fetchall()
-
-    return render_template(
-        "stocktake_detail.html",
-        header=header,
-        st=header,
-        lines=lines,
-        adjusts=adjusts,
-    )
-
-
-def _get_active_batch_config_id(db):
-    row = db.execute(
-        """
-        SELECT batch_config_id
-        FROM batch_config
-        WHERE is_active = 1
-        ORDER BY batch_config_id DESC
-        LIMIT 1
-        """
-    ).fetchone()
-    if not row:
-        return None
-    return row["batch_config_id"]
-
-
-def _get_qty_per_batch_map_for_items(db, item_ids: list[int]) -> dict[int, float]:
-    batch_config_id = _get_active_batch_config_id(db)
-    if not batch_config_id or not item_ids:
-        return {}
-
-    qty_per_batch_map: dict[int, float] = {}
-    for chunk in _iter_chunks(item_ids):
-        placeholders = ",".join("?" for _ in chunk)
-        params = [batch_config_id, *chunk]
-        rows = db.execute(
-            f"""
-            SELECT item_id, COALESCE(qty_per_batch, 0) AS qty_per_batch
-            FROM recipe_batch
-            WHERE batch_config_id = ?
-              AND item_id IN ({placeholders})
-            """,
-            params,
-        ).fetchall()
-        for r in rows:
-            qty_per_batch_map[int(r["item_id"])] = float(r["qty_per_batch"] or 0)
-    return qty_per_batch_map
-
-
-def _apply_weekly_batches_to_reorder_point(
-    db, items: list[sqlite3.Row], weekly_batches: float
-) -> int:
-    if weekly_batches < 0:
-        return 0
-    item_ids = [int(it["item_id"]) for it in items]
-    qty_per_batch_map = _get_qty_per_batch_map_for_items(db, item_ids)
-    if not qty_per_batch_map:
-        return 0
-
-    update_params = []
-    for it in items:
-        item_id = int(it["item_id"])
-        qty_per_batch = qty_per_batch_map.get(item_id)
-        if qty_per_batch is None:
-            continue
-        reorder_point = max(qty_per_batch * weekly_batches, 0.0)
-        update_params.append((reorder_point, item_id))
-    if not update_params:
-        return 0
-
-    db.executemany(
-        """
-        UPDATE items
-        SET reorder_point = ?
-        WHERE item_id = ?
-        """,
-        update_params,
-    )
-    return len(update_params)
-
-
-def _get_manual_items_for_weekly(db, batch_config_id: int):
-    # 手動管理＝auto_consume=0（NULLも0扱いにして手動に寄せる）
-    # 理論在庫＝inventory_tx合計
-    # 前回週次棚卸値（あれば）も取る
-    return db.execute(
-        """
-        SELECT
-            i.item_id,
-            i.name,
-            i.unit_base,
-            i.reorder_point,
-            COALESCE(rb.auto_consume, 0) AS auto_consume,
-            COALESCE((
-                SELECT SUM(tx.qty_delta)
-                FROM inventory_tx tx
-                WHERE tx.item_id = i.item_id
-            ), 0) AS theoretical_qty,
-            (
-                SELECT sl.counted_qty
-                FROM stocktake_lines sl
-                JOIN stocktakes st ON st.stocktake_id = sl.stocktake_id
-                WHERE st.scope = 'WEEKLY' AND sl.item_id = i.item_id
-                ORDER BY st.taken_at DESC
-                LIMIT 1
-            ) AS last_weekly_qty
-        FROM items i
-        LEFT JOIN recipe_batch rb
-          ON rb.item_id = i.item_id
-         AND rb.batch_config_id = ?
-        WHERE i.is_active = 1
-          AND COALESCE(rb.auto_consume, 0) = 0
-        ORDER BY i.name COLLATE NOCASE
-        """,
-        (batch_config_id,),
-    ).fetchall()
-
-
-@app.route("/stocktakes/weekly/new", methods=["GET", "POST"])
-def stocktake_weekly_new():
-    if request.method == "POST":
-        return stocktake_create_unified()
-
-    db = get_db()
-
-    mode = normalize_stocktake_mode(request.args.get("mode"), "weekly")
-    if request.method == "POST":
-        mode = normalize_stocktake_mode(request.form.get("mode"), "weekly")
-    group = "ALL"
-    if request.method == "POST":
-        group = normalize_stocktake_group(request.form.get("group"))
-
-    location = "WAREHOUSE"
-    items = fetch_items_for_stocktake_group(group)
-
-    item_ids = [int(it["item_id"]) for it in items]
-    current_map = get_inventory_qty_map_for_items(db, item_ids)
-
-    if request.method == "POST":
-        taken_at = (request.form.get("taken_at") or "").strip()
-        if not taken_at:
-            taken_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        note = (request.form.get("note") or "").strip()
-        month_start, month_end = month_range_for_datetime(taken_at)
-
-        prev_monthly = db.execute(
-            """
-            SELECT stocktake_id
-            FROM stocktakes
-            WHERE scope = 'MONTHLY'
-              AND location = ?
-              AND datetime(taken_at) < datetime(?)
-            ORDER BY datetime(taken_at) DESC, stocktake_id DESC
-            LIMIT 1
-            """,
-            (location, taken_at),
-        ).fetchone()
-        is_initial_stocktake = prev_monthly is None
-        cost_map = {}
-        if not is_initial_stocktake:
-            cost_map = build_monthly_weighted_unit_cost_map(
-                db, items, month_start, month_end, location=location
-            )
-        cost_map = {}
-        if not is_initial_stocktake:
-            cost_map = build_monthly_weighted_unit_cost_map(
-                db, items, month_start, month_end, location=location
-            )
-        cost_map = {}
-        if not is_initial_stocktake:
-            cost_map = build_monthly_weighted_unit_cost_map(
-                db, items, month_start, month_end, location=location
-            )
-
-        try:
-            db.execute("BEGIN")
-
-            cur = db.execute(
-                """
-                INSERT INTO stocktakes (taken_at, scope, location, note)
-                VALUES (?, 'WEEKLY', ?, ?)
-                """,
-                (taken_at, location, note),
-            )
-            stocktake_id = cur.lastrowid
-
-            adjust_count = 0
-
-            for it in items:
-                item_id = it["item_id"]
-                unit_base = it["unit_base"]
-                raw = (request.form.get(f"counted_{item_id}") or "").strip()
-                if raw == "":
-                    counted = current_map.get(item_id, 0.0)
-                else:
-                    try:
-                        counted = float(raw)
-                    except ValueError:
-                        counted = current_map.get(item_id, 0.0)
-
-                if is_initial_stocktake:
-                    unit_cost = calc_initial_stocktake_unit_cost(db, item_id, taken_at)
-                else:
-                    unit_cost, _no_qty, _used_ref = cost_map.get(
-                        item_id, (float(it["ref_unit_price"] or 0), True, False)
-                    )
-                line_amount = counted * unit_cost
-                db.execute(
-                    """
-                    INSERT INTO stocktake_lines (
-                      stocktake_id, item_id, counted_qty, unit_cost, line_amount
-                    )
-                    VALUES (?, ?, ?, ?, ?)
-                    """,
-                    (stocktake_id, item_id, counted, unit_cost, line_amount),
-                )
-
-                current = current_map.get(item_id, 0.0)
-                delta = counted - current
-                if abs(delta) < 1e-9:
-                    continue
-
-                db.execute(
-                    """
-                    INSERT INTO inventory_tx
-                      (happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note)
-                    VALUES
-                      (?, ?, ?, 'ADJUST', ?, 'STOCKTAKE', ?, ?)
-                    """,
-                    (
-                        taken_at,
-                        item_id,
-                        delta,
-                        location,
-                        stocktake_id,
-                        "WEEKLY棚卸差分（ADJUST）",
-                    ),
-                )
-                adjust_count += 1
-
-            db.execute("COMMIT")
-            flash(f"週次棚卸を登録しました（ADJUST反映: {adjust_count}件）", "success")
-            return redirect(url_for("stocktake_detail", stocktake_id=stocktake_id))
-
-        except Exception as e:
-            db.execute("ROLLBACK")
-            flash(f"週次棚卸の保存に失敗しました: {e}", "error")
-            return redirect(
-                url_for("stocktake_weekly_new", group=group, mode=mode)
-            )
-
-    rows = []
-    qty_per_batch_map = _get_qty_per_batch_map_for_items(db, item_ids)
-    has_active_batch_config = _get_active_batch_config_id(db) is not None
-    for it in items:
-        cur = current_map.get(it["item_id"], 0.0)
-        rows.append(
-            {
-                "item_id": it["item_id"],
-                "name": it["name"],
-                "unit_base": it["unit_base"],
-                "ref_unit_price": float(it["ref_unit_price"] or 0),
-                "cost_group": it["cost_group"],
-                "reorder_point": float(it["reorder_point"] or 0),
-                "qty_per_batch": float(qty_per_batch_map.get(int(it["item_id"]), 0)),
-                "current_qty": cur,
-                "counted_default": cur,
-            }
-        )
-
-    default_taken_at = datetime.now(ZoneInfo("Asia/Tokyo")).strftime(
-        "%Y-%m-%d %H:%M:%S"
-    )
-    return render_template(
-        "stocktake_new.html",
-        mode=mode,
-        group=group,
-        rows=rows,
-        default_taken_at=default_taken_at,
-        has_active_batch_config=has_active_batch_config,
-        default_weekly_batches=1.0,
-    )
-
-
-# -----------------------------
-# Stocktakes (月次: 新フォーム)
-# -----------------------------
-@app.get("/stocktakes/monthly/new")
-def stocktake_monthly_new():
-    db = get_db()
-
-    mode = normalize_stocktake_mode(request.args.get("mode"), "weekly")
-    group = normalize_stocktake_group(request.args.get("group"))
-
-    location = "WAREHOUSE"
-    items = fetch_items_for_stocktake_group(group)
-
-    item_ids = [int(it["item_id"]) for it in items]
-    current_map = get_inventory_qty_map_for_items(db, item_ids)
-
-    rows = []
-    item_ids = [int(it["item_id"]) for it in items]
-    qty_per_batch_map = _get_qty_per_batch_map_for_items(db, item_ids)
-    has_active_batch_config = _get_active_batch_config_id(db) is not None
-    for it in items:
-        cur = current_map.get(it["item_id"], 0.0)
-        rows.append(
-            {
-                "item_id": it["item_id"],
-                "name": it["name"],
-                "unit_base": it["unit_base"],
-                "ref_unit_price": float(it["ref_unit_price"] or 0),
-                "cost_group": it["cost_group"],
-                "reorder_point": float(it["reorder_point"] or 0),
-                "qty_per_batch": float(qty_per_batch_map.get(int(it["item_id"]), 0)),
-                "current_qty": cur,
-                "counted_default": cur,
-            }
-        )
-
-    default_taken_at = datetime.now(ZoneInfo("Asia/Tokyo")).strftime(
-        "%Y-%m-%d %H:%M:%S"
-    )
-    return render_template(
-        "stocktake_new.html",
-        mode=mode,
-        group=group,
-        rows=rows,
-        default_taken_at=default_taken_at,
-        has_active_batch_config=has_active_batch_config,
-        default_weekly_batches=1.0,
-    )
-
-
-@app.post("/stocktakes/monthly")
-def stocktake_monthly_create():
-    return stocktake_create_unified()
-
-
-@app.get("/stocktakes/<int:stocktake_id>/edit")
-def stocktake_edit_form(stocktake_id: int):
-    db = get_db()
-
-    header = db.execute(
-        """
-        SELECT
-          stocktake_id,
-          taken_at,
-          datetime(substr(replace(taken_at, 'T', ' '), 1, 19), '+9 hours') AS taken_at_display,
-          scope,
-          location,
-          note
-        FROM stocktakes
-        WHERE stocktake_id = ?
-        """,
-        (stocktake_id,),
-    ).fetchone()
-    if header is None:
-        abort(404)
-
-    mode = normalize_stocktake_mode((header["scope"] or "").lower(), "monthly")
-    group = normalize_stocktake_group(request.args.get("group"))
-
-    items = fetch_items_for_stocktake_group(group)
-
-    item_ids = [int(it["item_id"]) for it in items]
-    current_map = get_inventory_qty_map_for_items(db, item_ids)
-
-    line_rows = db.execute(
-        """
-        SELECT item_id, counted_qty
-        FROM stocktake_lines
-        WHERE stocktake_id = ?
-        """,
-        (stocktake_id,),
-    ).fetchall()
-    line_map = {r["item_id"]: float(r["counted_qty"] or 0) for r in line_rows}
-
-    rows = []
-    item_ids = [int(it["item_id"]) for it in items]
-    qty_per_batch_map = _get_qty_per_batch_map_for_items(db, item_ids)
-    has_active_batch_config = _get_active_batch_config_id(db) is not None
-    for it in items:
-        cur = current_map.get(it["item_id"], 0.0)
-        counted = line_map.get(it["item_id"], cur)
-        rows.append(
-            {
-                "item_id": it["item_id"],
-                "name": it["name"],
-                "unit_base": it["unit_base"],
-                "ref_unit_price": float(it["ref_unit_price"] or 0),
-                "cost_group": it["cost_group"],
-                "reorder_point": float(it["reorder_point"] or 0),
-                "qty_per_batch": float(qty_per_batch_map.get(int(it["item_id"]), 0)),
-                "current_qty": cur,
-                "counted_default": counted,
-            }
-        )
-
-    return render_template(
-        "stocktake_new.html",
-        mode=mode,
-        group=group,
-        rows=rows,
-        default_taken_at=header["taken_at_display"] or header["taken_at"],
-        form_action=url_for("stocktake_update", stocktake_id=stocktake_id),
-        is_edit=True,
-        stocktake_id=stocktake_id,
-        has_active_batch_config=has_active_batch_config,
-        default_weekly_batches=1.0,
-    )
-
-
-@app.post("/stocktakes/create")
-def stocktake_create_unified():
-    db = get_db()
-
-    location = "WAREHOUSE"
-    mode = normalize_stocktake_mode(request.form.get("mode"), "monthly")
-    group = normalize_stocktake_group(request.form.get("group"))
-
-    taken_at = _to_datetime_seconds(request.form.get("taken_at"))
-    if not taken_at:
-        taken_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
-    note = (request.form.get("note") or "").strip()
-    apply_weekly_batches = "1" in request.form.getlist("apply_weekly_batches")
-    weekly_batches_raw = (request.form.get("weekly_batches") or "").strip()
-    weekly_batches = None
-    if mode == "weekly" and apply_weekly_batches and weekly_batches_raw:
-        try:
-            weekly_batches = float(weekly_batches_raw)
-        except ValueError:
-            flash("1週間のバッチ数は数値で入力してください。", "error")
-            return redirect(url_for("stocktake_weekly_new", group=group, mode=mode))
-        if weekly_batches < 0:
-            flash("1週間のバッチ数は0以上にしてください。", "error")
-            return redirect(url_for("stocktake_weekly_new", group=group, mode=mode))
-
-    items = fetch_items_for_stocktake_group(group)
-
-    item_ids = [int(it["item_id"]) for it in items]
-    current_map = get_inventory_qty_map_for_items(db, item_ids)
-
-    month_start, month_end = month_range_for_datetime(taken_at)
-
-    if mode == "weekly":
-        prev_monthly = db.execute(
-            """
-            SELECT stocktake_id
-            FROM stocktakes
-            WHERE scope = 'MONTHLY'
-              AND location = ?
-              AND datetime(taken_at) < datetime(?)
-            ORDER BY datetime(taken_at) DESC, stocktake_id DESC
-            LIMIT 1
-            """,
-            (location, taken_at),
-        ).fetchone()
-        is_initial_stocktake = prev_monthly is None
-        cost_map = {}
-        if not is_initial_stocktake:
-            cost_map = build_monthly_weighted_unit_cost_map(
-                db, items, month_start, month_end, location=location
-            )
-
-        try:
-            db.execute("BEGIN")
-
-            cur = db.execute(
-                """
-                INSERT INTO stocktakes (taken_at, scope, location, note)
-                VALUES (?, 'WEEKLY', ?, ?)
-                """,
-                (taken_at, location, note),
-            )
-            stocktake_id = cur.lastrowid
-
-            adjust_count = 0
-
-            for it in items:
-                item_id = it["item_id"]
-                unit_base = it["unit_base"]
-
-                raw = (request.form.get(f"counted_{item_id}") or "").strip()
-                if raw == "":
-                    counted = current_map.get(item_id, 0.0)
-                else:
-                    try:
-                        counted = float(raw)
-                    except ValueError:
-                        counted = current_map.get(item_id, 0.0)
-
-                if is_initial_stocktake:
-                    unit_cost = calc_initial_stocktake_unit_cost(db, item_id, taken_at)
-                else:
-                    unit_cost, _no_qty, _used_ref = cost_map.get(
-                        item_id, (float(it["ref_unit_price"] or 0), True, False)
-                    )
-                line_amount = counted * unit_cost
-                db.execute(
-                    """
-                    INSERT INTO stocktake_lines (
-                      stocktake_id, item_id, counted_qty, unit_cost, line_amount
-                    )
-                    VALUES (?, ?, ?, ?, ?)
-                    """,
-                    (stocktake_id, item_id, counted, unit_cost, line_amount),
-                )
-
-                current = current_map.get(item_id, 0.0)
-                delta = counted - current
-                if abs(delta) < 1e-9:
-                    continue
-
-                db.execute(
-                    """
-                    INSERT INTO inventory_tx
-                      (happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note)
-                    VALUES
-                      (?, ?, ?, 'ADJUST', ?, 'STOCKTAKE', ?, ?)
-                    """,
-                    (
-                        taken_at,
-                        item_id,
-                        delta,
-                        location,
-                        stocktake_id,
-                        "WEEKLY棚卸差分（ADJUST）",
-                    ),
-                )
-                adjust_count += 1
-
-            updated_reorder_count = 0
-            if weekly_batches is not None:
-                updated_reorder_count = _apply_weekly_batches_to_reorder_point(
-                    db, items, weekly_batches
-                )
-
-            db.execute("COMMIT")
-            if weekly_batches is not None:
-                flash(
-                    f"週次棚卸を登録しました（ADJUST反映: {adjust_count}件 / 発注目安更新: {updated_reorder_count}件）",
-                    "success",
-                )
-            else:
-                flash(f"週次棚卸を登録しました（ADJUST反映: {adjust_count}件）", "success")
-            return redirect(url_for("stocktake_detail", stocktake_id=stocktake_id))
-
-        except Exception as e:
-            db.execute("ROLLBACK")
-            flash(f"週次棚卸の保存に失敗しました: {e}", "error")
-            return redirect(url_for("stocktake_weekly_new", group=group, mode=mode))
-
-    # monthly
-    prev_monthly = db.execute(
-        """
-        SELECT stocktake_id
-        FROM stocktakes
-        WHERE scope = 'MONTHLY'
-          AND location = ?
-          AND datetime(taken_at) < datetime(?)
-        ORDER BY datetime(taken_at) DESC, stocktake_id DESC
-        LIMIT 1
-        """,
-        (location, taken_at),
-    ).fetchone()
-    is_initial_stocktake = prev_monthly is None
-    cost_map = {}
-    if not is_initial_stocktake:
-        cost_map = build_monthly_weighted_unit_cost_map(
-            db, items, month_start, month_end, location=location
-        )
-
-    try:
-        db.execute("BEGIN")
-
-        db.execute(
-            """
-            INSERT INTO stocktakes (taken_at, scope, location, note)
-            VALUES (?, 'MONTHLY', ?, ?)
-            """,
-            (taken_at, location, note),
-        )
-        stocktake_id = db.execute("SELECT last_insert_rowid() AS id").fetchone()[
-            "id"
-        ]
-
-        adjust_count = 0
-
-        for it in items:
-            item_id = it["item_id"]
-            unit_base = it["unit_base"]
-
-            raw = (request.form.get(f"counted_{item_id}") or "").strip()
-            if raw == "":
-                counted = current_map.get(item_id, 0.0)
-            else:
-                try:
-                    counted = float(raw)
-                except ValueError:
-                    counted = current_map.get(item_id, 0.0)
-
-            if is_initial_stocktake:
-                unit_cost = calc_initial_stocktake_unit_cost(db, item_id, taken_at)
-            else:
-                unit_cost, _no_qty, _used_ref = cost_map.get(
-                    item_id, (float(it["ref_unit_price"] or 0), True, False)
-                )
-            line_amount = counted * unit_cost
-            db.execute(
-                """
-                INSERT INTO stocktake_lines (
-                  stocktake_id, item_id, counted_qty, unit_cost, line_amount
-                )
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                (stocktake_id, item_id, counted, unit_cost, line_amount),
-            )
-
-            current = current_map.get(item_id, 0.0)
-            delta = counted - current
-            if abs(delta) < 1e-9:
-                continue
-
-            db.execute(
-                """
-                INSERT INTO inventory_tx
-                  (happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note)
-                VALUES
-                  (?, ?, ?, 'ADJUST', ?, 'STOCKTAKE', ?, ?)
-                """,
-                (
-                    taken_at,
-                    item_id,
-                    delta,
-                    location,
-                    stocktake_id,
-                    "MONTHLY棚卸差分（ADJUST）",
-                ),
-            )
-            adjust_count += 1
-
-        db.execute("COMMIT")
-        flash(f"月次棚卸を登録しました（ADJUST反映: {adjust_count}件）", "success")
-        return redirect(url_for("stocktake_detail", stocktake_id=stocktake_id))
-
-    except Exception as e:
-        db.execute("ROLLBACK")
-        flash(f"棚卸登録に失敗しました: {e}", "error")
-        return redirect(url_for("stocktake_monthly_new", group=group, mode=mode))
-
-
-@app.post("/stocktakes/<int:stocktake_id>/update")
-def stocktake_update(stocktake_id: int):
-    db = get_db()
-
-    header = db.execute(
-        "SELECT stocktake_id FROM stocktakes WHERE stocktake_id = ?",
-        (stocktake_id,),
-    ).fetchone()
-    if header is None:
-        abort(404)
-
-    location = "WAREHOUSE"
-    mode = normalize_stocktake_mode(request.form.get("mode"), "monthly")
-    scope = "WEEKLY" if mode == "weekly" else "MONTHLY"
-    group = normalize_stocktake_group(request.form.get("group"))
-
-    taken_at = _to_datetime_seconds(request.form.get("taken_at"))
-    if not taken_at:
-        taken_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
-    if not taken_at:
-        taken_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    note = (request.form.get("note") or "").strip()
-    apply_weekly_batches = "1" in request.form.getlist("apply_weekly_batches")
-    weekly_batches_raw = (request.form.get("weekly_batches") or "").strip()
-    weekly_batches = None
-    if scope == "WEEKLY" and apply_weekly_batches and weekly_batches_raw:
-        try:
-            weekly_batches = float(weekly_batches_raw)
-        except ValueError:
-            flash("1週間のバッチ数は数値で入力してください。", "error")
-            return redirect(
-                url_for("stocktake_edit_form", stocktake_id=stocktake_id, group=group)
-            )
-        if weekly_batches < 0:
-            flash("1週間のバッチ数は0以上にしてください。", "error")
-            return redirect(
-                url_for("stocktake_edit_form", stocktake_id=stocktake_id, group=group)
-            )
-
-    items = fetch_items_for_stocktake_group(group)
-    month_start, month_end = month_range_for_datetime(taken_at)
-
-    try:
-        db.execute("BEGIN")
-
-        db.execute(
-            """
-            UPDATE stocktakes
-            SET taken_at = ?, scope = ?, location = ?, note = ?
-            WHERE stocktake_id = ?
-            """,
-            (taken_at, scope, location, note, stocktake_id),
-        )
-
-        db.execute(
-            "DELETE FROM inventory_tx WHERE ref_type = 'STOCKTAKE' AND ref_id = ?",
-            (stocktake_id,),
-        )
-        db.execute("DELETE FROM stocktake_lines WHERE stocktake_id = ?", (stocktake_id,))
-
-        item_ids = [int(it["item_id"]) for it in items]
-        baseline_map = get_inventory_qty_map_for_items(db, item_ids)
-
-        prev_monthly = db.execute(
-            """
-            SELECT stocktake_id
-            FROM stocktakes
-            WHERE scope = 'MONTHLY'
-              AND location = ?
-              AND datetime(taken_at) < datetime(?)
-              AND stocktake_id != ?
-            ORDER BY datetime(taken_at) DESC, stocktake_id DESC
-            LIMIT 1
-            """,
-            (location, taken_at, stocktake_id),
-        ).fetchone()
-        is_initial_stocktake = prev_monthly is None
-
-        cost_map = {}
-        if not is_initial_stocktake:
-            cost_map = build_monthly_weighted_unit_cost_map(
-                db, items, month_start, month_end, location=location
-            )
-        initial_cost_map = {}
-        if is_initial_stocktake:
-            initial_cost_map = build_initial_stocktake_unit_cost_map(db, items, taken_at)
-
-        adjust_count = 0
-        stocktake_line_params = []
-        inventory_tx_params = []
-        for it in items:
-            item_id = it["item_id"]
-            unit_base = it["unit_base"]
-
-            raw = (request.form.get(f"counted_{item_id}") or "").strip()
-            if raw == "":
-                counted = baseline_map.get(item_id, 0.0)
-            else:
-                try:
-                    counted = float(raw)
-                except ValueError:
-                    counted = baseline_map.get(item_id, 0.0)
-
-            if is_initial_stocktake:
-                unit_cost = initial_cost_map.get(int(item_id), float(it["ref_unit_price"] or 0))
-            else:
-                unit_cost, _no_qty, _used_ref = cost_map.get(
-                    item_id, (float(it["ref_unit_price"] or 0), True, False)
-                )
-            line_amount = counted * unit_cost
-            stocktake_line_params.append(
-                (stocktake_id, item_id, counted, unit_cost, line_amount)
-            )
-
-            baseline = baseline_map.get(item_id, 0.0)
-            delta = counted - baseline
-            if abs(delta) < 1e-9:
-                continue
-
-            note_label = "WEEKLY棚卸差分（ADJUST）" if scope == "WEEKLY" else "MONTHLY棚卸差分（ADJUST）"
-            inventory_tx_params.append(
-                (taken_at, item_id, delta, location, stocktake_id, note_label)
-            )
-            adjust_count += 1
-
-        if stocktake_line_params:
-            db.executemany(
-                """
-                INSERT INTO stocktake_lines (
-                  stocktake_id, item_id, counted_qty, unit_cost, line_amount
-                )
-                VALUES (?, ?, ?, ?, ?)
-                """,
-                stocktake_line_params,
-            )
-        if inventory_tx_params:
-            db.executemany(
-                """
-                INSERT INTO inventory_tx
-                  (happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note)
-                VALUES
-                  (?, ?, ?, 'ADJUST', ?, 'STOCKTAKE', ?, ?)
-                """,
-                inventory_tx_params,
-            )
-
-        updated_reorder_count = 0
-        if scope == "WEEKLY" and weekly_batches is not None:
-            updated_reorder_count = _apply_weekly_batches_to_reorder_point(
-                db, items, weekly_batches
-            )
-
-        db.execute("COMMIT")
-        if scope == "WEEKLY" and weekly_batches is not None:
-            flash(
-                f"棚卸を更新しました（ADJUST反映: {adjust_count}件 / 発注目安更新: {updated_reorder_count}件）",
-                "success",
-            )
-        else:
-            flash(f"棚卸を更新しました（ADJUST反映: {adjust_count}件）", "success")
-        return redirect(url_for("stocktake_detail", stocktake_id=stocktake_id))
-
-    except Exception as e:
-        db.execute("ROLLBACK")
-        flash(f"棚卸更新に失敗しました: {e}", "error")
-        return redirect(
-            url_for("stocktake_edit_form", stocktake_id=stocktake_id, group=group)
-        )
-
-
-@app.post("/stocktakes/<int:stocktake_id>/delete")
-def stocktake_delete(stocktake_id: int):
-    db = get_db()
-
-    try:
-        db.execute("BEGIN")
-        db.execute(
-            "DELETE FROM inventory_tx WHERE ref_type = 'STOCKTAKE' AND ref_id = ?",
-            (stocktake_id,),
-        )
-        db.execute("DELETE FROM stocktake_lines WHERE stocktake_id = ?", (stocktake_id,))
-        db.execute("DELETE FROM stocktakes WHERE stocktake_id = ?", (stocktake_id,))
-        db.execute("COMMIT")
-        flash("棚卸を削除しました。", "success")
-    except Exception as e:
-        db.execute("ROLLBACK")
-        flash(f"棚卸の削除に失敗しました: {e}", "error")
-
-    return redirect(url_for("stocktakes_list"))
-
-
-# -----------------------------
-# Transfers (移動)
-# -----------------------------
-@app.get("/transfers")
-def transfers_list():
-    db = get_db()
-    rows = db.execute(
-        """
-        SELECT
-          t.transfer_id,
-          t.moved_at,
-          t.from_location,
-          t.to_location,
-          t.note,
-          COUNT(tl.transfer_line_id) AS line_count
-        FROM transfers t
-        LEFT JOIN transfer_lines tl ON tl.transfer_id = t.transfer_id
-        GROUP BY t.transfer_id
-        ORDER BY t.moved_at DESC, t.transfer_id DESC
-        """
-    ).fetchall()
-    return render_template("transfers_list.html", transfers=rows)
-
-
-@app.get("/transfers/new")
-def transfer_new_form():
-    items = fetch_active_items()
-    return render_template("transfer_new.html", items=items)
-
-
-@app.post("/transfers")
-def transfer_create():
-    db = get_db()
-
-    moved_date = (request.form.get("moved_date") or "").strip()
-    if moved_date:
-        moved_at = f"{moved_date} 09:00:00"
-    else:
-        moved_at = None
-
-    from_location = (request.form.get("from_location") or "WAREHOUSE").strip()
-    to_location = (request.form.get("to_location") or "STORE").strip()
-    note = (request.form.get("note") or "").strip() or None
-
-    if from_location not in ("STORE", "WAREHOUSE"):
-        from_location = "WAREHOUSE"
-    if to_location not in ("STORE", "WAREHOUSE"):
-        to_location = "STORE"
-
-    errors = []
-    if from_location == to_location:
-        errors.append("移動元と移動先が同じです。")
+    cost_map: dict[int, tuple[float, bool, bool]] = {}
+    for item_id in item_ids:
+        opening_qty = opening_qty_map.get(item_id, 0.0)
+        opening_amount = opening_amount_map.get(item_id, 0.0)
+        purchased_qty = purchased_qty_map.get(item_id, 0.0)
+        purchased_amount = purchased_amount_map.get(item_id, 0.0)
 
-    item_ids = request.form.getlist("item_id")
-    qty_list = request.form.getlist("qty")
+        denom = opening_qty + purchased_qty
+        used_ref = used_ref_opening_map.get(item_id, False) or used_ref_purchase_map.get(
+            item_id, False
+        )
+        if denom <= 0:
+            cost_map[item_id] = (ref_map.get(item_id, 0.0), True, used_ref)
+        else:
+            avg_unit_cost = (opening_amount + purchased_amount) / denom
+            cost_map[item_id] = (avg_unit_cost, False, used_ref)
 
-    lines = []
-    for idx, (item_id_raw, qty_raw) in enumerate(
-        zip(item_ids, qty_list), start=1
-    ):
-        item_id_raw = (item_id_raw or "").strip()
-        qty_raw = (qty_raw or "").strip()
+    return cost_map
 
-        if item_id_raw == "" and qty_raw == "":
-            continue
 
-        if item_id_raw == "":
-            errors.append(f"{idx}行目：材料を選択してください。")
-            continue
+def calc_initial_stocktake_unit_cost(db, store_id: int, item_id: int, taken_at: str) -> float:
+    """
+    初回棚卸用: 棚卸日までの仕入実績平均単価を計算。
+    unit_price未入力・数量0は見積り単価（実績単価インデックス → ref_unit_price）で代用。
+    """
+    item = db.execute(
+        "SELECT item_id, supplier_id, ref_unit_price FROM items WHERE item_id=?", (item_id,)
+    ).fetchone()
+    ref = build_estimate_price_map(db, [item]).get(item_id, 0.0)
 
-        if qty_raw == "":
-            errors.append(f"{idx}行目：数量(qty)を入力してください。")
-            continue
+    row = db.execute(
+        """
+        SELECT
+          COALESCE(SUM(
+            CASE
+              WHEN pl.line_amount IS NOT NULL THEN pl.line_amount
+              WHEN pl.unit_price IS NOT NULL THEN pl.qty * pl.unit_price
+              ELSE pl.qty * ?
+            END
+          ), 0) AS amount_sum,
+          COALESCE(SUM(pl.qty), 0) AS qty_sum
+        FROM purchase_lines pl
+        JOIN purchases p ON p.purchase_id = pl.purchase_id
+        WHERE pl.item_id = ?
+          AND p.store_id = ?
+          AND datetime(p.purchased_at) <= datetime(?)
+        """,
+        (ref, item_id, store_id, taken_at),
+    ).fetchone()
 
-        try:
-            item_id = int(item_id_raw)
-        except ValueError:
-            errors.append(f"{idx}行目：材料IDが不正です。")
-            continue
+    qty_sum = float(row["qty_sum"] or 0)
+    if qty_sum <= 0:
+        return ref
+    amount_sum = float(row["amount_sum"] or 0)
+    return amount_sum / qty_sum
 
-        try:
-            qty = float(qty_raw)
-        except ValueError:
-            errors.append(f"{idx}行目：数量(qty)が数値ではありません。")
-            continue
 
-        if qty <= 0:
-            errors.append(f"{idx}行目：数量(qty)は0より大きくしてください。")
-            continue
+def regenerate_inventory_tx_for_daily_report(db, daily_report_id: int) -> int:
+    """
+    日報IDに紐づく inventory_tx（CONSUME）を作り直す。
+    return: 作成したtx件数
+    """
+    rep = db.execute(
+        """
+        SELECT daily_report_id, store_id, report_date, sold_batches
+        FROM daily_reports
+        WHERE daily_report_id = ?
+        """,
+        (daily_report_id,),
+    ).fetchone()
 
-        lines.append((item_id, qty))
+    if rep is None:
+        return 0
 
-    if not lines:
-        errors.append("明細が1行もありません。材料と数量を入力してください。")
+    store_id = int(rep["store_id"])
+    report_date = rep["report_date"]  # 'YYYY-MM-DD'
+    sold_batches = float(rep["sold_batches"] or 0)
 
-    if errors:
-        for e in errors:
-            flash(e, "error")
-        return redirect(url_for("transfer_new_form"))
+    happened_at = f"{report_date} 09:00:00"
+    location = "STORE"
 
-    try:
-        # transfers（ヘッダ）
-        if moved_at:
-            cur = db.execute(
-                """
-                INSERT INTO transfers (moved_at, from_location, to_location, note)
-                VALUES (?, ?, ?, ?)
-                """,
-                (moved_at, from_location, to_location, note),
-            )
-        else:
-            cur = db.execute(
-                """
-                INSERT INTO transfers (from_location, to_location, note)
-                VALUES (?, ?, ?)
-                """,
-                (from_location, to_location, note),
-            )
+    # まず既存の自動生成分を削除（編集時に二重計上させない）
+    db.execute(
+        """
+        DELETE FROM inventory_tx
+        WHERE ref_type = 'DAILY_REPORT'
+          AND ref_id = ?
+          AND tx_type IN ('CONSUME', 'WASTE')
+        """,
+        (daily_report_id,),
+    )
 
-        transfer_id = cur.lastrowid
+    # auto_consume=1 だけ対象（週次で数えるものは0にしておけばOK）
+    recipe_rows = db.execute(
+        """
+        SELECT rb.item_id, rb.qty_per_batch, i.unit_base
+        FROM recipe_batch rb
+        JOIN batch_config bc ON bc.batch_config_id = rb.batch_config_id
+        JOIN items i ON i.item_id = rb.item_id
+        WHERE rb.auto_consume = 1
+          AND bc.is_active = 1
+        """
+    ).fetchall()
 
-        for (item_id, qty) in lines:
-            # transfer_lines
-            db.execute(
-                """
-                INSERT INTO transfer_lines (transfer_id, item_id, qty)
-                VALUES (?, ?, ?)
-                """,
-                (transfer_id, item_id, qty),
-            )
+    created = 0
 
-            happened_at = moved_at if moved_at else None
+    for r in recipe_rows:
+        item_id = r["item_id"]
+        qty_per_batch = float(r["qty_per_batch"] or 0)
 
-            # inventory_tx：移動元 -qty
-            db.execute(
-                """
-                INSERT INTO inventory_tx
-                  (happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note)
-                VALUES
-                  (COALESCE(?, datetime('now')), ?, ?, 'TRANSFER', ?, 'TRANSFER', ?, ?)
-                """,
-                (happened_at, item_id, -qty, from_location, transfer_id, note),
-            )
+        # 通常消費（売れたバッチ数分）
+        consume_qty = qty_per_batch * sold_batches
 
-            # inventory_tx：移動先 +qty
+        # マイナスで在庫を減らす
+        if abs(consume_qty) > 1e-9:
             db.execute(
                 """
                 INSERT INTO inventory_tx
-                  (happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note)
+                  (store_id, happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note)
                 VALUES
-                  (COALESCE(?, datetime('now')), ?, ?, 'TRANSFER', ?, 'TRANSFER', ?, ?)
+                  (?, ?, ?, ?, 'CONSUME', ?, 'DAILY_REPORT', ?, ?)
                 """,
-                (happened_at, item_id, qty, to_location, transfer_id, note),
+                (
+                    store_id,
+                    happened_at,
+                    item_id,
+                    -consume_qty,
+                    location,
+                    daily_report_id,
+                    f"日報自動消費：sold_batches={sold_batches}",
+                ),
             )
+            created += 1
 
-        commit_and_sync()
-    except Exception as e:
-        db.rollback()
-        flash(f"移動の登録に失敗しました: {e}", "error")
-        return redirect(url_for("transfer_new_form"))
-
-    flash("移動を登録しました（在庫履歴にも反映済み）。", "success")
-    return redirect(url_for("transfer_detail", transfer_id=transfer_id))
-
-
-@app.get("/transfers/<int:transfer_id>")
-def transfer_detail(transfer_id: int):
-    db = get_db()
+    return created
 
-    header = db.execute(
-        """
-        SELECT transfer_id, moved_at, from_location, to_location, note
-        FROM transfers
-        WHERE transfer_id = ?
-        """,
-        (transfer_id,),
-    ).fetchone()
-    if header is None:
-        abort(404)
 
-    lines = db.execute(
+def _get_manual_items_for_weekly(db, store_id: int, batch_config_id: int):
+    # 手動管理＝auto_consume=0（NULLも0扱いにして手動に寄せる）
+    # 理論在庫＝inventory_tx合計
+    # 前回週次棚卸値（あれば）も取る
+    return db.execute(
         """
         SELECT
-          tl.transfer_line_id,
-          i.name AS item_name,
-          i.unit_base,
-          tl.qty
-        FROM transfer_lines tl
-        JOIN items i ON i.item_id = tl.item_id
-        WHERE tl.transfer_id = ?
-        ORDER BY i.name ASC
+            i.item_id,
+            i.name,
+            i.unit_base,
+            i.reorder_point,
+            COALESCE(rb.auto_consume, 0) AS auto_consume,
+            COALESCE((
+                SELECT SUM(tx.qty_delta)
+                FROM inventory_tx tx
+                WHERE tx.store_id = ? AND tx.item_id = i.item_id
+            ), 0) AS theoretical_qty,
+            (
+                SELECT sl.counted_qty
+                FROM stocktake_lines sl
+                JOIN stocktakes st ON st.stocktake_id = sl.stocktake_id
+                WHERE st.store_id = ? AND st.scope = 'WEEKLY' AND sl.item_id = i.item_id
+                ORDER BY st.taken_at DESC
+                LIMIT 1
+            ) AS last_weekly_qty
+        FROM items i
+        LEFT JOIN recipe_batch rb
+          ON rb.item_id = i.item_id
+         AND rb.batch_config_id = ?
+        WHERE i.is_active = 1
+          AND COALESCE(rb.auto_consume, 0) = 0
+        ORDER BY i.name COLLATE NOCASE
         """,
-        (transfer_id,),
+        (store_id, store_id, batch_config_id),
     ).fetchall()
 
-    return render_template("transfer_detail.html", header=header, lines=lines)
-
 
-@app.get("/transfers/new-from-purchase/<int:purchase_id>")
-def transfer_new_from_purchase(purchase_id: int):
-    db = get_db()
+# -----------------------------
+# Stocktakes (月次: 新フォーム)
+# -----------------------------
+def insert_stocktake(
+    db,
+    store_id: int,
+    taken_at: str,
+    scope: str,
+    counted_location: str | None,
+    note: str | None,
+    items: list[sqlite3.Row],
+    counted_map: dict[int, float],
+) -> tuple[int, int]:
+    """
+    棚卸ヘッダ＋明細（単価・金額つき）と、理論在庫との差分 ADJUST を登録する。
+    counted_location は数えた保管場所。None は店舗全体で、全保管場所の合計と比べて差分を
+    STOCKTAKE_ADJUST_LOCATION に載せる。
+    counted_map にない材料は理論在庫のまま数えたものとする。トランザクションは呼び出し側。
+    returns: (stocktake_id, ADJUST件数)
+    """
+    location = counted_location or STOCKTAKE_ADJUST_LOCATION
+    item_ids = [int(it["item_id"]) for it in items]
+    current_map = get_inventory_qty_map_for_items(db, store_id, item_ids, counted_location)
+    month_start, month_end = month_range_for_datetime(taken_at)
 
-    # 仕入れヘッダ
-    p = db.execute(
+    prev_monthly = db.execute(
         """
-        SELECT purchase_id, supplier_id, purchased_at, note
-        FROM purchases
-        WHERE purchase_id = ?
+        SELECT stocktake_id
+        FROM stocktakes
+        WHERE store_id = ?
+          AND scope = 'MONTHLY'
+          AND location = ?
+          AND datetime(taken_at) < datetime(?)
+        ORDER BY datetime(taken_at) DESC, stocktake_id DESC
+        LIMIT 1
         """,
-        (purchase_id,),
+        (store_id, location, taken_at),
     ).fetchone()
-    if p is None:
-        abort(404)
-
-    # 仕入れ明細
-    lines = db.execute(
-        """
-        SELECT pl.item_id, pl.qty, i.name, i.unit_base
-        FROM purchase_lines pl
-        JOIN items i ON i.item_id = pl.item_id
-        WHERE pl.purchase_id = ?
-        ORDER BY pl.purchase_line_id ASC
-        """,
-        (purchase_id,),
-    ).fetchall()
-
-    if not lines:
-        flash("この仕入れには明細がありません。", "error")
-        return redirect(url_for("purchases_list"))
+    is_initial_stocktake = prev_monthly is None
+    cost_map = {}
+    if not is_initial_stocktake:
+        cost_map = build_monthly_weighted_unit_cost_map(
+            db, store_id, items, month_start, month_end, location=location
+        )
 
-    # この仕入れがどこに入庫されたか（inventory_txから推定）
-    tx_loc = db.execute(
+    cur = db.execute(
         """
-        SELECT location
-        FROM inventory_tx
-        WHERE ref_type = 'PURCHASE' AND ref_id = ?
-        LIMIT 1
+        INSERT INTO stocktakes (store_id, taken_at, scope, location, all_locations, note)
+        VALUES (?, ?, ?, ?, ?, ?)
         """,
-        (purchase_id,),
-    ).fetchone()
-
-    from_location = (tx_loc["location"] if tx_loc else "WAREHOUSE")
-    if from_location not in ("STORE", "WAREHOUSE"):
-        from_location = "WAREHOUSE"
-
-    # 移動先（倉庫→店舗が基本）
-    to_location = "STORE" if from_location == "WAREHOUSE" else "WAREHOUSE"
-
-    # transfer_new.html が10行固定なら最大10件まで
-    prefill_lines = []
-    for r in lines[:10]:
-        prefill_lines.append(
-            {
-                "item_id": r["item_id"],
-                "qty": float(r["qty"] or 0),
-            }
-        )
+        (store_id, taken_at, scope, location, 1 if counted_location is None else 0, note),
+    )
+    stocktake_id = cur.lastrowid
 
-    if len(lines) > 10:
-        flash("明細が10件を超えています。移動フォームには先頭10件のみ反映しました。", "error")
+    line_params = []
+    adjust_params = []
+    for it in items:
+        item_id = it["item_id"]
+        current = current_map.get(item_id, 0.0)
+        counted = counted_map.get(item_id, current)
 
-    suppliers = fetch_suppliers()
-    items = fetch_active_items()
+        if is_initial_stocktake:
+            unit_cost = calc_initial_stocktake_unit_cost(db, store_id, item_id, taken_at)
+        else:
+            unit_cost, _no_qty, _used_ref = cost_map.get(
+                item_id, (float(it["ref_unit_price"] or 0), True, False)
+            )
+        line_params.append((stocktake_id, item_id, counted, unit_cost, counted * unit_cost))
 
-    default_note = f"仕入れID {purchase_id} から店舗へ補充"
-    default_moved_date = str(p["purchased_at"])[:10] if p["purchased_at"] else ""
+        delta = counted - current
+        if abs(delta) >= 1e-9:
+            adjust_params.append(
+                (
+                    store_id,
+                    taken_at,
+                    item_id,
+                    delta,
+                    location,
+                    stocktake_id,
+                    f"{scope}棚卸差分（ADJUST）",
+                )
+            )
 
-    return render_template(
-        "transfer_new.html",
-        suppliers=suppliers,
-        items=items,
-        prefill_lines=prefill_lines,
-        default_from_location=from_location,
-        default_to_location=to_location,
-        default_moved_date=default_moved_date,
-        default_note=default_note,
+    db.executemany(
+        """
+        INSERT INTO stocktake_lines (
+          stocktake_id, item_id, counted_qty, unit_cost, line_amount
+        )
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        line_params,
+    )
+    db.executemany(
+        """
+        INSERT INTO inventory_tx
+          (store_id, happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note)
+        VALUES
+          (?, ?, ?, ?, 'ADJUST', ?, 'STOCKTAKE', ?, ?)
+        """,
+        adjust_params,
     )
+    return stocktake_id, len(adjust_params)
 
 
 # -----------------------------
 # Shopping list (買い物リスト)
 # -----------------------------
-@app.get("/shopping-list")
-def shopping_list():
-    db = get_db()
-
-    # 在庫集計CTE（常に合算）
+def build_shopping_list(db, store_id: int) -> list[dict[str, object]]:
+    """店舗の在庫が発注目安を下回った材料を仕入れ先ごとにまとめる（画面と /api/read で共用）。"""
+    # 在庫集計CTE（店舗内の保管場所は合算）
     inv_cte = """
     WITH inv AS (
       SELECT item_id, SUM(qty_delta) AS qty
       FROM inventory_tx
+      WHERE store_id = ?
       GROUP BY item_id
     )
     """
-    inv_params = ()
+    inv_params = (store_id,)
 
     # フィルタ条件
     cond = ["i.is_active = 1"]
@@ -3332,6 +1481,9 @@ def shopping_list():
         inv_params,
     ).fetchall()
 
+    # 見積り単価は実績単価インデックス優先（無ければ参考価格）
+    est_price_map = build_estimate_price_map(db, rows)
+
     # 仕入れ先ごとにまとめる（推奨発注量も計算）
     grouped = []
     for supplier_name, group in groupby(rows, key=lambda r: r["supplier_name"]):
@@ -3346,7 +1498,8 @@ def shopping_list():
             if order_qty <= 1e-9:
                 continue
             ref_price = float(r["ref_unit_price"] or 0)
-            est_amount = order_qty * ref_price
+            est_price = est_price_map.get(int(r["item_id"]), ref_price)
+            est_amount = order_qty * est_price
             est_sum += est_amount
 
             items.append(
@@ -3359,6 +1512,7 @@ def shopping_list():
                     "reorder_point": reorder_point,
                     "order_qty": order_qty,
                     "ref_unit_price": ref_price,
+                    "est_unit_price": est_price,
                     "est_amount": est_amount,
                     "cost_group": r["cost_group"],
                     "is_fixed": r["is_fixed"],
@@ -3366,42 +1520,37 @@ def shopping_list():
             )
         if items:
             grouped.append({"supplier_name": supplier_name, "items": items, "est_sum": est_sum})
-
-    return render_template(
-        "shopping_list.html",
-        grouped=grouped,
-    )
+    return grouped
 
 
 # -----------------------------
 # Reports (月次原価)
 # -----------------------------
-@app.get("/reports/monthly-food-cost")
-def monthly_food_cost():
-    # 月選択：?ym=2026-01（なければ今月）
-    ym = (request.args.get("ym") or date.today().strftime("%Y-%m")).strip()
+IDEAL_FOOD_COST_RATIO = 0.38  # 理想38%
+
 
+def build_monthly_food_cost(db, store_id: int, ym: str) -> dict[str, object]:
+    """店舗ごとの月次原価（期首＋仕入−期末）の集計。画面と /api/read・店舗横断集計で共用。"""
     # 月次棚卸は倉庫に寄せる運用
     location = "WAREHOUSE"
 
-    ideal_ratio = 0.38  # 理想38%
+    ideal_ratio = IDEAL_FOOD_COST_RATIO
 
     month_start, month_end = month_range(ym)
 
-    db = get_db()
-
     # 期首：通常は月初より前の最新MONTHLY棚卸
     begin_st = db.execute(
         """
         SELECT stocktake_id, taken_at
         FROM stocktakes
-        WHERE scope = 'MONTHLY'
+        WHERE store_id = ?
+          AND scope = 'MONTHLY'
           AND location = ?
           AND datetime(taken_at) < datetime(?)
         ORDER BY datetime(taken_at) DESC, stocktake_id DESC
         LIMIT 1
         """,
-        (location, month_start),
+        (store_id, location, month_start),
     ).fetchone()
 
     is_cutover_month = False
@@ -3411,14 +1560,15 @@ def monthly_food_cost():
             """
             SELECT stocktake_id, taken_at
             FROM stocktakes
-            WHERE scope = 'MONTHLY'
+            WHERE store_id = ?
+              AND scope = 'MONTHLY'
               AND location = ?
               AND datetime(taken_at) >= datetime(?)
               AND datetime(taken_at) < datetime(?)
             ORDER BY datetime(taken_at) ASC, stocktake_id ASC
             LIMIT 1
             """,
-            (location, month_start, month_end),
+            (store_id, location, month_start, month_end),
         ).fetchone()
         if begin_st:
             is_cutover_month = True
@@ -3446,14 +1596,15 @@ def monthly_food_cost():
         """
         SELECT stocktake_id, taken_at
         FROM stocktakes
-        WHERE scope = 'MONTHLY'
+        WHERE store_id = ?
+          AND scope = 'MONTHLY'
           AND location = ?
           AND datetime(taken_at) >= datetime(?)
           AND datetime(taken_at) < datetime(?)
         ORDER BY datetime(taken_at) DESC, stocktake_id DESC
         LIMIT 1
         """,
-        (location, month_start, month_end),
+        (store_id, location, month_start, month_end),
     ).fetchone()
 
     end_value = 0.0
@@ -3511,19 +1662,23 @@ def monthly_food_cost():
             CASE
               WHEN pl.line_amount IS NOT NULL THEN pl.line_amount
               WHEN pl.unit_price IS NOT NULL THEN pl.qty * pl.unit_price
-              ELSE pl.qty * i.ref_unit_price
+              ELSE pl.qty * COALESCE(ipx.last_unit_price, i.ref_unit_price)
             END
           ), 0) AS purchase_amount,
           SUM(CASE WHEN pl.unit_price IS NULL AND pl.line_amount IS NULL THEN 1 ELSE 0 END) AS used_ref_count
         FROM purchase_lines pl
         JOIN purchases p ON p.purchase_id = pl.purchase_id
         JOIN items i ON i.item_id = pl.item_id
-        WHERE i.cost_group = 'FOOD'
+        LEFT JOIN item_price_index ipx
+          ON ipx.item_id = pl.item_id
+         AND ipx.supplier_id = COALESCE(p.supplier_id, 0)
+        WHERE p.store_id = ?
+          AND i.cost_group = 'FOOD'
           AND (p.note IS NULL OR p.note NOT LIKE '%初回棚卸%')
           AND datetime(p.purchased_at) >= datetime(?)
           AND datetime(p.purchased_at) < datetime(?)
         """,
-        (effective_start, effective_end),
+        (store_id, effective_start, effective_end),
     ).fetchone()
     purchases_cost = purchases_row["purchase_amount"]
     used_ref_count = int(purchases_row["used_ref_count"] or 0)
@@ -3534,10 +1689,11 @@ def monthly_food_cost():
         """
         SELECT COALESCE(SUM(sales_amount), 0) AS v
         FROM daily_reports
-        WHERE date(report_date) >= date(?)
+        WHERE store_id = ?
+          AND date(report_date) >= date(?)
           AND date(report_date) < date(?)
         """,
-        (month_start, month_end),
+        (store_id, month_start, month_end),
     ).fetchone()["v"]
 
     # 当月仕入の内訳（表示用）
@@ -3547,18 +1703,22 @@ def monthly_food_cost():
           i.name,
           i.unit_base,
           SUM(pl.qty) AS qty_sum,
-          SUM(pl.qty * COALESCE(pl.unit_price, i.ref_unit_price)) AS amount
+          SUM(pl.qty * COALESCE(pl.unit_price, ipx.last_unit_price, i.ref_unit_price)) AS amount
         FROM purchase_lines pl
         JOIN purchases p ON p.purchase_id = pl.purchase_id
         JOIN items i ON i.item_id = pl.item_id
-        WHERE i.cost_group = 'FOOD'
+        LEFT JOIN item_price_index ipx
+          ON ipx.item_id = pl.item_id
+         AND ipx.supplier_id = COALESCE(p.supplier_id, 0)
+        WHERE p.store_id = ?
+          AND i.cost_group = 'FOOD'
           AND (p.note IS NULL OR p.note NOT LIKE '%初回棚卸%')
           AND datetime(p.purchased_at) >= datetime(?)
           AND datetime(p.purchased_at) < datetime(?)
         GROUP BY i.item_id
         ORDER BY amount DESC, i.name ASC
         """,
-        (effective_start, effective_end),
+        (store_id, effective_start, effective_end),
     ).fetchall()
 
     # 原価計算
@@ -3572,46 +1732,47 @@ def monthly_food_cost():
     diff_yen = cogs - ideal_cogs
     diff_pp = None if ratio is None else (ratio - ideal_ratio) * 100  # percentage points
 
-    return render_template(
-        "monthly_food_cost.html",
-        ym=ym,
-        start_date=month_start,
-        next_date=month_end,
-        location=location,
-        ideal_ratio=ideal_ratio,
-        sales=float(sales),
-        purchases_cost=float(purchases_cost),
-        used_ref_count=used_ref_count,
-        begin_value=float(begin_value),
-        end_value=float(end_value),
-        cogs=float(cogs),
-        ratio=ratio,  # None or 0.xx
-        diff_yen=float(diff_yen),
-        diff_pp=diff_pp,
-        begin_taken_at=begin_taken_at,
-        end_taken_at=end_taken_at,
-        begin_missing=begin_missing,
-        end_missing=end_missing,
-        purchase_breakdown=purchase_breakdown,
-        end_lines=end_lines,
-    )
+    return {
+        "ym": ym,
+        "store_id": store_id,
+        "start_date": month_start,
+        "next_date": month_end,
+        "location": location,
+        "ideal_ratio": ideal_ratio,
+        "sales": float(sales),
+        "purchases_cost": float(purchases_cost),
+        "used_ref_count": used_ref_count,
+        "begin_value": float(begin_value),
+        "end_value": float(end_value),
+        "cogs": float(cogs),
+        "ratio": ratio,  # None or 0.xx
+        "diff_yen": float(diff_yen),
+        "diff_pp": diff_pp,
+        "begin_taken_at": begin_taken_at,
+        "end_taken_at": end_taken_at,
+        "begin_missing": begin_missing,
+        "end_missing": end_missing,
+        "purchase_breakdown": purchase_breakdown,
+        "end_lines": end_lines,
+    }
 
 
 # -----------------------------
 # Inventory (在庫一覧)
 # -----------------------------
-@app.get("/inventory")
-def inventory_list():
-    db = get_db()
-
-    # 在庫残量 = inventory_tx の qty_delta を全体合算
-    rows = db.execute(
+def fetch_inventory_rows(db, store_id: int) -> list[sqlite3.Row]:
+    """
+    在庫残量 = 店舗の inventory_tx の qty_delta の合計（発注目安割れを先頭に）。
+    台帳を毎回合算せず、保管場所ごとの残量の射影（inventory_balances。書き込み時にトリガーで更新）を足す。
+    """
+    return db.execute(
         """
         WITH inv AS (
           SELECT
             item_id,
-            SUM(qty_delta) AS qty_total
-          FROM inventory_tx
+            SUM(qty) AS qty_total
+          FROM inventory_balances
+          WHERE store_id = ?
           GROUP BY item_id
         )
         SELECT
@@ -3631,125 +1792,85 @@ def inventory_list():
         ORDER BY
           (COALESCE(inv.qty_total, 0) <= i.reorder_point) DESC,
           i.name ASC
-        """
+        """,
+        (store_id,),
     ).fetchall()
 
-    return render_template("inventory_list.html", rows=rows)
-
 
 # -----------------------------
-# Edit (更新)
+# 起動（ウォームアップ）
 # -----------------------------
-@app.get("/items/<int:item_id>/edit")
-def item_edit_form(item_id: int):
-    item = fetch_item(item_id)
-    if item is None:
-        abort(404)
-    suppliers = fetch_suppliers()
-    return render_template("item_edit.html", item=item, suppliers=suppliers)
-
-
-@app.post("/items/<int:item_id>/update")
-def item_update(item_id: int):
-    item = fetch_item(item_id)
-    if item is None:
-        abort(404)
-
-    supplier_id_raw = request.form.get("supplier_id", "").strip()
-    supplier_id = int(supplier_id_raw) if supplier_id_raw else None
-
-    name = (request.form.get("name") or "").strip()
-    unit_base = (request.form.get("unit_base") or "").strip()
-    reorder_point = _to_float(request.form.get("reorder_point", ""), 0.0)
-    ref_unit_price = _to_float(request.form.get("ref_unit_price", ""), 0.0)
-    note = (request.form.get("note") or "").strip() or None
-    is_fixed = 1 if request.form.get("is_fixed") == "1" else 0
-    cost_group = (request.form.get("cost_group") or "SUPPLIES").strip()
-    if cost_group not in ("FOOD", "SUPPLIES"):
-        cost_group = "SUPPLIES"
-    is_active = 1 if request.form.get("is_active") == "1" else 0
-
-    errors: list[str] = []
-    if not name:
-        errors.append("材料名（name）は必須です。")
-    if not unit_base:
-        errors.append("単位（unit_base）は必須です。（例: g / ml / pcs）")
-    if reorder_point < 0:
-        errors.append("発注目安（reorder_point）は0以上にしてください。")
-    if ref_unit_price < 0:
-        errors.append("参考価格（ref_unit_price）は0以上にしてください。")
-
-    if errors:
-        for e in errors:
-            flash(e, "error")
-        return redirect(url_for("item_edit_form", item_id=item_id))
+WARMUP_ON_START = os.getenv("WARMUP_ON_START", "1") != "0"
+startup_logger = logging.getLogger("takoyaki.startup")
 
-    db = get_db()
-    try:
-        # category は使わないので NULL で上書きしてOK
-        db.execute(
-            """
-            UPDATE items
-            SET
-              supplier_id = ?,
-              name = ?,
-              category = NULL,
-              unit_base = ?,
-              reorder_point = ?,
-              ref_unit_price = ?,
-              note = ?,
-              is_fixed = ?,
-              cost_group = ?,
-              is_active = ?
-            WHERE item_id = ?
-            """,
-            (supplier_id, name, unit_base, reorder_point, ref_unit_price, note, is_fixed, cost_group, is_active, item_id),
-        )
-        commit_and_sync()
-    except sqlite3.IntegrityError as e:
-        db.rollback()
-        flash(f"更新に失敗しました（整合性エラー）: {e}", "error")
-        return redirect(url_for("item_edit_form", item_id=item_id))
-    except Exception as e:
-        db.rollback()
-        flash(f"更新に失敗しました: {e}", "error")
-        return redirect(url_for("item_edit_form", item_id=item_id))
-
-    flash("材料を更新しました。", "success")
-    return redirect(url_for("items_list"))
-
-
-@app.post("/items/<int:item_id>/delete")
-def item_delete(item_id: int):
-    db = get_db()
 
-    # 存在確認
-    item = db.execute(
-        "SELECT item_id, name FROM items WHERE item_id = ?", (item_id,)
-    ).fetchone()
-    if item is None:
-        abort(404)
+def precompile_templates(app: Flask) -> int:
+    """全テンプレートを先にコンパイルしておく（初回描画でのパース・コンパイルをなくす）。"""
+    env = app.jinja_env
+    names = [name for name in env.list_templates() if name.endswith(".html")]
+    for name in names:
+        env.get_template(name)
+    return len(names)
 
-    try:
-        # まず物理削除を試す
-        db.execute("DELETE FROM items WHERE item_id = ?", (item_id,))
-        commit_and_sync()
-        flash(f"材料を削除しました: {item['name']}", "success")
-    except sqlite3.IntegrityError:
-        # 関連データがあると削除できないので、無効化へ
-        db.rollback()
-        db.execute("UPDATE items SET is_active = 0 WHERE item_id = ?", (item_id,))
-        commit_and_sync()
-        flash(
-            f"関連データがあるため物理削除できませんでした。無効化（is_active=0）しました: {item['name']}",
-            "error",
-        )
-    except Exception as e:
-        db.rollback()
-        flash(f"削除に失敗しました: {e}", "error")
 
-    return redirect(url_for("items_list"))
+def warmup(app: Flask) -> dict[str, float]:
+    """
+    最初のリクエストより前に済ませておく下ごしらえ。
+    テンプレートのコンパイル、スキーマ補正（ensure_schema）、DB接続（libsql なら接続時の sync）、
+    トップ画面への空リクエスト1回。
+    """
+    timings: dict[str, float] = {}
+    started = time.perf_counter()
+    timings["templates"] = precompile_templates(app)
+    timings["templates_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    started = time.perf_counter()
+    with app.app_context():
+        ensure_schema()
+        get_db().execute("SELECT 1").fetchone()
+    timings["db_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    # ルーティング・セッション・before/after_request の初回読み込みを1回通しておく（SQL は走らない画面）
+    started = time.perf_counter()
+    app.test_client().get("/")
+    timings["request_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    # preload したマスターの未送信分をワーカーに引き継がない（fork 先で二重に足されるため）
+    for flush in (metrics.flush, query_stats.flush):
+        try:
+            flush(force=True)
+        except sqlite3.Error:
+            pass
+    return timings
+
+
+def create_app(config: dict | None = None, warm: bool | None = None) -> Flask:
+    """
+    アプリを組み立てる（views/ の Blueprint・DB の後始末・テンプレートのバイトコードキャッシュ）。
+    config は app.config に重ねる。呼ぶたびに新しいアプリを返す。
+    WSGI サーバの入口で、flask --app app もこれを呼ぶ。
+      gunicorn -c gunicorn.conf.py   （wsgi_app = "app:create_app()"、preload_app = True）
+    preload ならマスターで1回ウォームアップし、fork したワーカーは最初から温まった状態で始まる。
+    """
+    app = Flask(__name__)
+    app.secret_key = SECRET_KEY or "dev-secret-key-change-me"
+    if config:
+        app.config.update(config)
+    if JINJA_BYTECODE_CACHE_DIR:
+        os.makedirs(JINJA_BYTECODE_CACHE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(JINJA_BYTECODE_CACHE_DIR)
+    app.teardown_appcontext(close_db)
+    # ビューはこのモジュールの関数を使うので、組み立てるときに読み込む（import 時にはアプリを作らない）
+    from views import BLUEPRINTS
+
+    for blueprint in BLUEPRINTS:
+        app.register_blueprint(blueprint)
+
+    if WARMUP_ON_START if warm is None else warm:
+        timings = warmup(app)
+        startup_logger.info(json.dumps({"event": "warmup", "pid": os.getpid(), **timings}))
+    return app
 
 
 if __name__ == "__main__":
-    app.run(debug=True, host="127.0.0.1", port=5000)
+    create_app().run(debug=True, host="127.0.0.1", port=5000)
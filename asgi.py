@@ -0,0 +1,396 @@
+"""
+読み取り専用の JSON API（ASGI）。Flask（WSGI）とは別プロセスで横に並べて動かす。
+
+  uvicorn asgi:application --host 0.0.0.0 --port 8001
+
+- GET /api/read/inventory
+  GET /api/read/shopping-list
+  GET /api/read/reports/monthly-food-cost?ym=YYYY-MM
+- GET /api/read/changes?since=<seq>&wait=<秒>（ロングポーリング）
+  GET /api/read/changes/stream?since=<seq>（SSE。再接続時は Last-Event-ID から続ける）
+  台帳・伝票の変更フィード（outbox.py）。since より後の変更が無ければ、書き込みがあるまで待って返す。
+  待つ間はスレッドもDB接続も持たない（データ版数を見て、変わったらプールで読む）。
+- 集計は app.py の関数（画面と同じもの）を ASGI_READ_THREADS 本のスレッドプールで実行する。
+  DB接続は呼び出しごとに app_context を張って開き、終わったら閉じる。
+- イベントループは接続を抱えて待つだけなので、1プロセスで多数のタブレット・スマホをさばける。
+  プールの順番待ちが ASGI_READ_MAX_PENDING を超えたら 503（Retry-After: 1）を返す。
+- 画面と同じくデータ版数の ETag を付け、If-None-Match が一致すればプールに回さず 304 を返す。
+- 店舗は ?store= か X-Store-Id ヘッダで選ぶ（既定は本店）。無い・休止中の店舗は 404。
+- リバースプロキシで /api/read/ だけをこのプロセスへ振り分ける。書き込みは従来どおり WSGI 側。
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from urllib.parse import parse_qs
+
+from app import (
+    INVENTORY_TABLES,
+    MONTHLY_FOOD_COST_TABLES,
+    SHOPPING_LIST_TABLES,
+    build_monthly_food_cost,
+    build_shopping_list,
+    create_app,
+    data_version_etag,
+    ensure_schema,
+    fetch_inventory_rows,
+)
+from data_version import data_versions
+from db import get_catalog_db, get_store_db
+from stores import DEFAULT_STORE_ID, STORE_TABLES, store_catalog
+from metrics import cache_hit, cache_miss
+from metrics import registry as metrics
+from outbox import OUTBOX_BATCH_ROWS, OUTBOX_POLL_INTERVAL_SEC, OUTBOX_TABLES, fetch_changes
+
+ASGI_READ_THREADS = int(os.getenv("ASGI_READ_THREADS", "8"))
+ASGI_READ_MAX_PENDING = int(os.getenv("ASGI_READ_MAX_PENDING", "64"))
+CHANGES_MAX_WAIT_SEC = float(os.getenv("CHANGES_MAX_WAIT_SEC", "25"))  # ロングポーリングで待つ上限
+CHANGES_STREAM_MAX_SEC = float(os.getenv("CHANGES_STREAM_MAX_SEC", "300"))  # SSE を1回で流す上限（切れたら再接続）
+CHANGES_HEARTBEAT_SEC = 15.0  # SSE のコメント行（プロキシに切られないように）。このときは版数に関係なく読み直す
+
+logger = logging.getLogger("takoyaki.asgi")
+
+# 集計関数が使う app コンテキスト用（ルートは使わないのでウォームアップはしない）
+flask_app = create_app(warm=False)
+_executor = ThreadPoolExecutor(max_workers=ASGI_READ_THREADS, thread_name_prefix="read-api")
+_pending = 0  # イベントループのスレッドからだけ触る
+
+
+def _rows(rows) -> list[dict]:
+    return [dict(r) for r in rows]
+
+
+def _inventory(db, store_id: int, params: dict[str, str]) -> dict[str, object]:
+    return {"items": _rows(fetch_inventory_rows(db, store_id))}
+
+
+def _shopping_list(db, store_id: int, params: dict[str, str]) -> dict[str, object]:
+    return {"suppliers": build_shopping_list(db, store_id)}
+
+
+def _monthly_food_cost(db, store_id: int, params: dict[str, str]) -> dict[str, object]:
+    ym = (params.get("ym") or date.today().strftime("%Y-%m")).strip()
+    try:
+        datetime.strptime(ym, "%Y-%m")
+    except ValueError:
+        raise ValueError("ym は YYYY-MM で指定してください") from None
+    report = build_monthly_food_cost(db, store_id, ym)
+    report["purchase_breakdown"] = _rows(report["purchase_breakdown"])
+    report["end_lines"] = _rows(report["end_lines"])
+    return report
+
+
+# path -> (集計関数, 読むテーブル)
+ROUTES = {
+    "/api/read/inventory": (_inventory, INVENTORY_TABLES),
+    "/api/read/shopping-list": (_shopping_list, SHOPPING_LIST_TABLES),
+    "/api/read/reports/monthly-food-cost": (_monthly_food_cost, MONTHLY_FOOD_COST_TABLES),
+}
+
+
+def _run_view(view, store_id: int, params: dict[str, str]) -> bytes:
+    """スレッドプール側で実行する。JSON 化とメトリクスの書き出しまでここで済ませてループを空ける。"""
+    with flask_app.app_context():
+        ensure_schema()  # WSGI 側の before_request と同じ（2回目以降は何もしない）
+        if store_id not in {s["store_id"] for s in store_catalog.active_stores(get_catalog_db)}:
+            raise LookupError(f"store not found: {store_id}")
+        body = view(get_store_db(store_id), store_id, params)
+    try:
+        metrics.flush()
+    except sqlite3.Error:
+        pass
+    return json.dumps(body, ensure_ascii=False, default=str).encode("utf-8")
+
+
+def _run_changes(store_id: int, since: int, limit: int) -> dict[str, object]:
+    """スレッドプール側で実行する。"""
+    with flask_app.app_context():
+        ensure_schema()
+        if store_id not in {s["store_id"] for s in store_catalog.active_stores(get_catalog_db)}:
+            raise LookupError(f"store not found: {store_id}")
+        return fetch_changes(get_store_db(store_id), store_id, since, limit)
+
+
+def _changes_params(scope, params: dict[str, str]) -> tuple[int, int, float]:
+    """(since, limit, wait)。SSE の再接続は Last-Event-ID を since より優先する。"""
+    raw = params.get("since")
+    for name, value in scope.get("headers", []):
+        if name == b"last-event-id":
+            raw = value.decode("latin-1")
+    try:
+        since = int(raw or 0)
+        limit = min(max(int(params.get("limit") or OUTBOX_BATCH_ROWS), 1), OUTBOX_BATCH_ROWS)
+        wait = min(max(float(params.get("wait") or 0), 0.0), CHANGES_MAX_WAIT_SEC)
+    except ValueError:
+        raise ValueError("since・limit・wait は数値で指定してください") from None
+    return since, limit, wait
+
+
+def _outbox_version() -> tuple:
+    versions, _updated_at = data_versions.read(OUTBOX_TABLES)
+    return tuple(sorted(versions.items()))
+
+
+class _Busy(Exception):
+    pass
+
+
+async def _read_changes(store_id: int, since: int, limit: int) -> dict[str, object]:
+    global _pending
+    if _pending >= ASGI_READ_MAX_PENDING:
+        raise _Busy()
+    _pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, _run_changes, store_id, since, limit)
+    finally:
+        _pending -= 1
+
+
+async def _wait_for_write(version: tuple, timeout: float, stop: asyncio.Event | None = None) -> tuple:
+    """
+    データ版数が変わるか timeout まで（stop が立ったらそこで）待つ。その時点の版数を返す。
+    版数ファイルの1表を引くだけなので、ループのスレッドで済ませる。
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        current = _outbox_version()
+        if current != version or time.monotonic() >= deadline or (stop is not None and stop.is_set()):
+            return current
+        await asyncio.sleep(min(OUTBOX_POLL_INTERVAL_SEC, max(deadline - time.monotonic(), 0)))
+
+
+async def _changes(scope, receive, send, store_id: int, params: dict[str, str]) -> int:
+    since, limit, wait = _changes_params(scope, params)
+    # 版数は読む前に取る（読んだ後・待ち始める前の書き込みを取りこぼさない）
+    version = _outbox_version()
+    batch = await _read_changes(store_id, since, limit)
+    deadline = time.monotonic() + wait
+    while not batch["changes"] and time.monotonic() < deadline:
+        version = await _wait_for_write(version, deadline - time.monotonic())
+        batch = await _read_changes(store_id, since, limit)
+    await _send(send, 200, json.dumps(batch, ensure_ascii=False, default=str).encode("utf-8"))
+    return 200
+
+
+async def _changes_stream(scope, receive, send, store_id: int, params: dict[str, str]) -> int:
+    since, limit, _wait = _changes_params(scope, params)
+    version = _outbox_version()
+    batch = await _read_changes(store_id, since, limit)  # 無い店舗・混雑はここで（ヘッダを送る前に）返す
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-store"),
+                (b"x-accel-buffering", b"no"),  # nginx にためさせない
+            ],
+        }
+    )
+
+    async def body(chunk: bytes) -> None:
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+    disconnected = asyncio.Event()
+
+    async def watch_disconnect():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    deadline = time.monotonic() + CHANGES_STREAM_MAX_SEC
+    try:
+        await body(b"retry: 3000\n\n")
+        if batch["truncated"]:
+            await body(b"event: truncated\ndata: {}\n\n")
+        while True:
+            for change in batch["changes"]:
+                data = json.dumps(change, ensure_ascii=False, default=str)
+                await body(f"id: {change['seq']}\nevent: change\ndata: {data}\n\n".encode("utf-8"))
+            since = batch["next"]
+            if disconnected.is_set() or time.monotonic() >= deadline:
+                break
+            if batch["more"]:
+                version = _outbox_version()
+            else:
+                current = await _wait_for_write(
+                    version, min(CHANGES_HEARTBEAT_SEC, deadline - time.monotonic()), disconnected
+                )
+                if disconnected.is_set():
+                    break
+                if current == version:
+                    await body(b": keep-alive\n\n")
+                version = current
+            batch = await _read_changes(store_id, since, limit)
+    except OSError:
+        pass  # 途中で切れた
+    except Exception:
+        # ヘッダは送ってあるので、ここで切る（クライアントは Last-Event-ID で続きから再接続する）
+        logger.exception("change stream failed: store %s", store_id)
+    finally:
+        watcher.cancel()
+    if not disconnected.is_set():
+        try:
+            await send({"type": "http.response.body", "body": b""})
+        except OSError:
+            pass
+    return 200
+
+
+# path -> ハンドラ（送信まで自前で行い、ステータスを返す）
+STREAM_ROUTES = {
+    "/api/read/changes": _changes,
+    "/api/read/changes/stream": _changes_stream,
+}
+
+
+async def _send(send, status: int, body: bytes, headers=None, head_only: bool = False) -> None:
+    headers = headers or []
+    if not any(name == b"etag" for name, _value in headers):
+        headers = headers + [(b"cache-control", b"no-store")]
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+            ]
+            + headers,
+        }
+    )
+    await send({"type": "http.response.body", "body": b"" if head_only else body})
+
+
+def _store_id(scope, params: dict[str, str]) -> int | None:
+    """?store= → X-Store-Id → 既定店舗。数字でなければ None（404）。"""
+    raw = params.get("store")
+    if raw is None:
+        for name, value in scope.get("headers", []):
+            if name == b"x-store-id":
+                raw = value.decode("latin-1")
+                break
+    if raw is None or not raw.strip():
+        return DEFAULT_STORE_ID
+    try:
+        return int(raw)
+    except ValueError:
+        return None
+
+
+def _etag_matches(scope, etag: str) -> bool:
+    for name, value in scope.get("headers", []):
+        if name == b"if-none-match":
+            candidates = [v.strip().removeprefix("W/").strip('"') for v in value.decode("latin-1").split(",")]
+            return etag in candidates or "*" in candidates
+    return False
+
+
+def _error(message: str) -> bytes:
+    return json.dumps({"error": message}, ensure_ascii=False).encode("utf-8")
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send) -> None:
+    global _pending
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    started = time.perf_counter()
+    route = scope["path"]
+    view, tables = ROUTES.get(route, (None, ()))
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    params = {k: v[-1] for k, v in query.items()}
+    store_id = _store_id(scope, params)
+    if route in STREAM_ROUTES:
+        try:
+            if store_id is None:
+                raise LookupError("store not found")
+            if scope["method"] != "GET":
+                status = 405
+                await _send(send, status, _error("method not allowed"), [(b"allow", b"GET")])
+            else:
+                status = await STREAM_ROUTES[route](scope, receive, send, store_id, params)
+        except LookupError as e:
+            status = 404
+            await _send(send, status, _error(str(e)))
+        except ValueError as e:
+            status = 400
+            await _send(send, status, _error(str(e)))
+        except _Busy:
+            status = 503
+            await _send(send, status, _error("busy"), [(b"retry-after", b"1")])
+        except Exception:
+            logger.exception("read api failed: %s", route)
+            status = 500
+            await _send(send, status, _error("internal error"))
+        _observe(route, scope["method"], status, started)
+        return
+    etag = None
+    if view is not None and store_id is not None and scope["method"] in ("GET", "HEAD"):
+        # 版数ファイルの小さな1表を引くだけなので、ループのスレッドで済ませる
+        etag, _last_modified = data_version_etag((*tables, *STORE_TABLES), store_id)
+    if view is None:
+        route = "<unmatched>"
+        status, body, headers = 404, _error("not found"), None
+    elif store_id is None:
+        status, body, headers = 404, _error("store not found"), None
+    elif scope["method"] not in ("GET", "HEAD"):
+        status, body, headers = 405, _error("method not allowed"), [(b"allow", b"GET, HEAD")]
+    elif _etag_matches(scope, etag):
+        cache_hit("http_etag")
+        status, body, headers = 304, b"", None
+    elif _pending >= ASGI_READ_MAX_PENDING:
+        status, body, headers = 503, _error("busy"), [(b"retry-after", b"1")]
+    else:
+        cache_miss("http_etag")
+        headers = None
+        _pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            status, body = 200, await loop.run_in_executor(_executor, _run_view, view, store_id, params)
+        except LookupError as e:
+            status, body = 404, _error(str(e))
+        except ValueError as e:
+            status, body = 400, _error(str(e))
+        except Exception:
+            logger.exception("read api failed: %s", route)
+            status, body = 500, _error("internal error")
+        finally:
+            _pending -= 1
+
+    if etag is not None and status in (200, 304):
+        headers = (headers or []) + [
+            (b"etag", f'"{etag}"'.encode()),
+            (b"cache-control", b"private, no-cache"),
+        ]
+    await _send(send, status, body, headers, head_only=scope["method"] == "HEAD")
+
+    _observe(route, scope["method"], status, started)
+
+
+def _observe(route: str, method: str, status: int, started: float) -> None:
+    labels = {"route": route, "method": method}
+    metrics.observe("takoyaki_http_request_duration_seconds", time.perf_counter() - started, labels)
+    metrics.inc("takoyaki_http_requests_total", dict(labels, status=str(status)))
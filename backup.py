@@ -0,0 +1,602 @@
+"""
+takoyaki_inventory.db のオンラインバックアップ／リストア。
+
+  python backup.py snapshot [--db PATH] [--dir backups] [--keep 14]
+  python backup.py list     [--dir backups]
+  python backup.py restore  [--snapshot FILE | --until "YYYY-MM-DD HH:MM:SS"] [--source PATH] -o OUT
+  python backup.py bench    [--sizes 10000,100000,1000000]
+
+- snapshot: sqlite3 のオンラインバックアップAPIで BACKUP_PAGES_PER_STEP ページずつコピーする。
+  ステップの合間はロックを離すので、アプリ（gunicorn）の書き込みを止めない。
+  コピー後に gzip 圧縮し、古いスナップショットは --keep 件を残して削除する。
+- restore: スナップショットを展開して quick_check し、--until 指定時は
+  --source（現行DB）の変更フィード（outbox.py）から、スナップショットより後・書いた時刻が until 以前の
+  変更を書いた順に再適用する。追加だけでなく伝票の編集・削除、日報の作り直し、台帳のアーカイブも戻る。
+  対象は変更フィードに載る表（台帳・入庫・棚卸・移動・日報・アーカイブ）。材料・仕入れ先はスナップショットに
+  無いものだけ現行DBから足す。射影（inventory_balances）は最後に台帳から作り直す。
+  結果は -o に書き出して確認してから差し替える。
+- verify: 一時DBで スナップショット → 入庫の削除・棚卸の編集など → 時点復元 を行い、
+  復元した台帳の残量が現行DB（と until 時点）と一致するかを確かめる（食い違えば終了コード 1）。
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from db import APP_DIR, DB_FILE
+from outbox import OUTBOX_TABLES
+from projections import PROJECTIONS, rebuild
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(APP_DIR, "backups"))
+BACKUP_KEEP = 14
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.005  # 秒。ステップ間で書き込み側にロックを譲る
+
+SNAPSHOT_PREFIX = "takoyaki_inventory-"
+SNAPSHOT_SUFFIX = ".db.gz"
+SNAPSHOT_TS_FORMAT = "%Y%m%dT%H%M%SZ"
+
+
+# -----------------------------
+# Snapshot
+# -----------------------------
+def snapshot_path(backup_dir: str, taken_at: datetime) -> str:
+    name = f"{SNAPSHOT_PREFIX}{taken_at.strftime(SNAPSHOT_TS_FORMAT)}{SNAPSHOT_SUFFIX}"
+    return os.path.join(backup_dir, name)
+
+
+def parse_snapshot_time(path: str) -> datetime | None:
+    name = os.path.basename(path)
+    if not (name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)):
+        return None
+    ts = name[len(SNAPSHOT_PREFIX) : -len(SNAPSHOT_SUFFIX)]
+    try:
+        return datetime.strptime(ts, SNAPSHOT_TS_FORMAT).replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+
+def list_snapshots(backup_dir: str = BACKUP_DIR) -> list[tuple[datetime, str]]:
+    """(取得時刻UTC, パス) を古い順に返す。"""
+    if not os.path.isdir(backup_dir):
+        return []
+    snapshots = []
+    for name in os.listdir(backup_dir):
+        path = os.path.join(backup_dir, name)
+        taken_at = parse_snapshot_time(path)
+        if taken_at is not None:
+            snapshots.append((taken_at, path))
+    snapshots.sort()
+    return snapshots
+
+
+def online_backup(src_path: str, dst_path: str, pages: int = BACKUP_PAGES_PER_STEP) -> None:
+    """オンラインバックアップAPIで src を dst に段階コピーする。"""
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(dst_path)
+    try:
+        src.backup(dst, pages=pages, sleep=BACKUP_STEP_SLEEP)
+    finally:
+        dst.close()
+        src.close()
+
+
+def create_snapshot(
+    db_path: str = DB_FILE,
+    backup_dir: str = BACKUP_DIR,
+    keep: int = BACKUP_KEEP,
+) -> str:
+    os.makedirs(backup_dir, exist_ok=True)
+    taken_at = datetime.now(timezone.utc).replace(microsecond=0)
+    out_path = snapshot_path(backup_dir, taken_at)
+
+    fd, tmp_db = tempfile.mkstemp(suffix=".db", dir=backup_dir)
+    os.close(fd)
+    try:
+        online_backup(db_path, tmp_db)
+        tmp_gz = out_path + ".part"
+        with open(tmp_db, "rb") as f_in, gzip.open(tmp_gz, "wb", compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out, length=1024 * 1024)
+        os.replace(tmp_gz, out_path)
+    finally:
+        if os.path.exists(tmp_db):
+            os.remove(tmp_db)
+
+    rotate_snapshots(backup_dir, keep)
+    return out_path
+
+
+def rotate_snapshots(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> list[str]:
+    snapshots = list_snapshots(backup_dir)
+    removed = []
+    if keep <= 0:
+        return removed
+    for _taken_at, path in snapshots[:-keep]:
+        os.remove(path)
+        removed.append(path)
+    return removed
+
+
+# -----------------------------
+# Restore
+# -----------------------------
+def find_snapshot_before(until: datetime, backup_dir: str = BACKUP_DIR) -> str | None:
+    candidates = [path for taken_at, path in list_snapshots(backup_dir) if taken_at <= until]
+    return candidates[-1] if candidates else None
+
+
+class RestoreError(Exception):
+    pass
+
+
+REPLAY_CHUNK_ROWS = 5000
+# スナップショットに無ければ現行DBから足すマスタ（伝票から参照される）
+REPLAY_MASTER_TABLES = (("suppliers", "supplier_id"), ("items", "item_id"))
+
+
+def _table_columns(conn: sqlite3.Connection, schema: str, table: str) -> list[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table})").fetchall()]
+
+
+def _has_table(conn: sqlite3.Connection, schema: str, table: str) -> bool:
+    return conn.execute(
+        f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone() is not None
+
+
+def _outbox_seq(conn: sqlite3.Connection, schema: str) -> int:
+    """これまでに振った最大の seq（消した行も含む）。"""
+    row = conn.execute(f"SELECT seq FROM {schema}.sqlite_sequence WHERE name = 'outbox'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def _add_missing_masters(conn: sqlite3.Connection) -> dict[str, int]:
+    added = {}
+    for table, key in REPLAY_MASTER_TABLES:
+        main_cols = set(_table_columns(conn, "main", table))
+        cols = ", ".join(c for c in _table_columns(conn, "src", table) if c in main_cols)
+        cur = conn.execute(
+            f"""
+            INSERT INTO main.{table} ({cols})
+            SELECT {cols} FROM src.{table}
+            WHERE {key} NOT IN (SELECT {key} FROM main.{table})
+            """
+        )
+        added[table] = cur.rowcount
+    return added
+
+
+def _apply_change(conn: sqlite3.Connection, columns: dict[str, set[str]], table: str, op: str, row_id: int, payload: str) -> bool:
+    pk = OUTBOX_TABLES[table][0]
+    if op == "DELETE":
+        conn.execute(f"DELETE FROM main.{table} WHERE {pk} = ?", (row_id,))
+        return True
+    row = {k: v for k, v in json.loads(payload).items() if k in columns[table]}
+    if pk not in row:
+        return False
+    cols = list(row)
+    updates = ", ".join(f"{c} = excluded.{c}" for c in cols if c != pk)
+    conn.execute(
+        f"""
+        INSERT INTO main.{table} ({", ".join(cols)}) VALUES ({", ".join("?" for _ in cols)})
+        ON CONFLICT ({pk}) DO {"UPDATE SET " + updates if updates else "NOTHING"}
+        """,
+        [row[c] for c in cols],
+    )
+    return True
+
+
+def replay_changes(conn: sqlite3.Connection, source_path: str, until_utc: str) -> dict[str, object]:
+    """
+    スナップショット（conn）より後に source で書かれた変更を、source の変更フィードから書いた順
+    （seq の順）に再適用する。until_utc は書いた時刻（outbox.created_at、UTC）で比べる。
+    外部キーは切って適用する（CASCADE で消えた明細も、フィードに1行ずつ載っている）。
+    """
+    conn.execute("ATTACH DATABASE ? AS src", (f"file:{source_path}?mode=ro",))
+    try:
+        if not _has_table(conn, "src", "outbox"):
+            raise RestoreError("現行DBに変更フィード（outbox）がありません。")
+        if not _has_table(conn, "main", "outbox"):
+            raise RestoreError("このスナップショットは変更フィード（outbox）より前のものなので、時点復元できません。")
+        after_seq = _outbox_seq(conn, "main")
+        first = conn.execute("SELECT MIN(seq) FROM src.outbox").fetchone()[0]
+        pruned = (int(first) - 1) if first is not None else _outbox_seq(conn, "src")
+        if after_seq < pruned:
+            raise RestoreError(
+                f"スナップショットの後の変更（seq {after_seq} より後）の一部が、現行DBの outbox-prune で消えています。"
+            )
+
+        columns = {
+            table: set(_table_columns(conn, "main", table))
+            for table in OUTBOX_TABLES
+            if _has_table(conn, "main", table)
+        }
+        conn.execute("PRAGMA foreign_keys = OFF")
+        conn.execute("BEGIN")
+        added = _add_missing_masters(conn)
+        applied = skipped = 0
+        last_seq = after_seq
+        while True:
+            rows = conn.execute(
+                """
+                SELECT seq, table_name, op, row_id, payload
+                FROM src.outbox
+                WHERE seq > ? AND created_at <= ?
+                ORDER BY seq
+                LIMIT ?
+                """,
+                (last_seq, until_utc, REPLAY_CHUNK_ROWS),
+            ).fetchall()
+            if not rows:
+                break
+            for seq, table, op, row_id, payload in rows:
+                if table in columns and _apply_change(conn, columns, table, op, row_id, payload):
+                    applied += 1
+                else:
+                    skipped += 1
+                last_seq = seq
+
+        # 再適用でスナップショット側のトリガーが積んだ行を、現行DBのフィードの同じ範囲に置き換える
+        conn.execute("DELETE FROM main.outbox WHERE seq > ?", (after_seq,))
+        out_cols = ", ".join(_table_columns(conn, "main", "outbox"))
+        conn.execute(
+            f"INSERT INTO main.outbox ({out_cols}) SELECT {out_cols} FROM src.outbox WHERE seq > ? AND seq <= ?",
+            (after_seq, last_seq),
+        )
+        conn.execute("UPDATE main.sqlite_sequence SET seq = ? WHERE name = 'outbox'", (last_seq,))
+
+        if _has_table(conn, "main", "projection_cursors"):
+            conn.row_factory = sqlite3.Row
+            for projection in PROJECTIONS.values():
+                rebuild(conn, projection)
+        conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("DETACH DATABASE src")
+    return {"replayed_changes": applied, "skipped_changes": skipped, "last_seq": last_seq, "added_masters": added}
+
+
+def restore_snapshot(
+    snapshot: str,
+    output_path: str,
+    until: datetime | None = None,
+    source_path: str | None = None,
+) -> dict[str, object]:
+    out_dir = os.path.dirname(os.path.abspath(output_path))
+    fd, tmp_db = tempfile.mkstemp(suffix=".db", dir=out_dir)
+    os.close(fd)
+    try:
+        with gzip.open(snapshot, "rb") as f_in, open(tmp_db, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out, length=1024 * 1024)
+
+        conn = sqlite3.connect(tmp_db, uri=True, isolation_level=None)
+        try:
+            ok = conn.execute("PRAGMA quick_check").fetchone()[0]
+            if ok != "ok":
+                raise RuntimeError(f"スナップショットが壊れています: {ok}")
+            replayed: dict[str, object] = {}
+            if until is not None and source_path:
+                until_utc = until.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+                replayed = replay_changes(conn, source_path, until_utc)
+        finally:
+            conn.close()
+        os.replace(tmp_db, output_path)
+    finally:
+        if os.path.exists(tmp_db):
+            os.remove(tmp_db)
+
+    return {"snapshot": snapshot, "output": output_path, **replayed}
+
+
+# -----------------------------
+# Benchmark
+# -----------------------------
+def _build_bench_db(path: str, template_db: str, tx_rows: int) -> None:
+    """template_db のスキーマと材料をコピーし、inventory_tx を tx_rows 行まで水増しする。"""
+    online_backup(template_db, path)
+    conn = sqlite3.connect(path)
+    try:
+        item_ids = [r[0] for r in conn.execute("SELECT item_id FROM items").fetchall()]
+        if not item_ids:
+            raise RuntimeError("items が空のDBではベンチマークできません")
+        rng = random.Random(0)
+        batch = []
+        for n in range(tx_rows):
+            batch.append(
+                (
+                    f"2024-{(n % 12) + 1:02d}-{(n % 28) + 1:02d} 09:00:00",
+                    rng.choice(item_ids),
+                    rng.uniform(-5, 10),
+                    "STORE" if n % 2 else "WAREHOUSE",
+                )
+            )
+            if len(batch) >= 50_000:
+                conn.executemany(
+                    "INSERT INTO inventory_tx (happened_at, item_id, qty_delta, tx_type, location) VALUES (?, ?, ?, 'ADJUST', ?)",
+                    batch,
+                )
+                batch.clear()
+        if batch:
+            conn.executemany(
+                "INSERT INTO inventory_tx (happened_at, item_id, qty_delta, tx_type, location) VALUES (?, ?, ?, 'ADJUST', ?)",
+                batch,
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def run_benchmark(template_db: str, sizes: list[int]) -> list[dict[str, object]]:
+    results = []
+    with tempfile.TemporaryDirectory() as work:
+        for size in sizes:
+            db_path = os.path.join(work, f"bench_{size}.db")
+            _build_bench_db(db_path, template_db, size)
+            db_bytes = os.path.getsize(db_path)
+
+            snap_dir = os.path.join(work, f"snap_{size}")
+            t0 = time.perf_counter()
+            snap = create_snapshot(db_path, snap_dir, keep=1)
+            backup_sec = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            restore_snapshot(snap, os.path.join(work, f"restored_{size}.db"))
+            restore_sec = time.perf_counter() - t0
+
+            results.append(
+                {
+                    "tx_rows": size,
+                    "db_mb": round(db_bytes / 1024 / 1024, 2),
+                    "snapshot_mb": round(os.path.getsize(snap) / 1024 / 1024, 2),
+                    "backup_sec": round(backup_sec, 3),
+                    "restore_sec": round(restore_sec, 3),
+                }
+            )
+    return results
+
+
+# -----------------------------
+# 時点復元の確認（verify）
+# -----------------------------
+def _ledger_balances(path: str) -> dict[tuple[int, int, str], float]:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            """
+            SELECT store_id, item_id, location, ROUND(SUM(qty_delta), 6)
+            FROM inventory_tx GROUP BY store_id, item_id, location
+            """
+        ).fetchall()
+        return {(r[0], r[1], r[2]): r[3] for r in rows if r[3]}
+    finally:
+        conn.close()
+
+
+def _projection_balances(path: str) -> dict[tuple[int, int, str], float]:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT store_id, item_id, location, ROUND(qty, 6) FROM inventory_balances"
+        ).fetchall()
+        return {(r[0], r[1], r[2]): r[3] for r in rows if r[3]}
+    finally:
+        conn.close()
+
+
+def _utc_now_str() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def verify_run(snap_dir: str) -> dict[str, object]:
+    """
+    verify の子プロセス。環境変数の一時DBにアプリ経由で書き、スナップショットを挟んで時点復元する。
+    スナップショットの後に 入庫の削除・入庫の編集・新しい入庫・移動 を書く。
+    """
+    import app as app_module
+
+    c = app_module.create_app(warm=False).test_client()
+    c.get("/")
+    db_path = DB_FILE
+    conn = sqlite3.connect(db_path)
+    item_a, item_b = [r[0] for r in conn.execute("SELECT item_id FROM items ORDER BY item_id LIMIT 2")]
+    conn.close()
+
+    def purchase(item_id: int, qty: str) -> int:
+        c.post("/purchases", data={"item_id": [str(item_id)], "qty": [qty], "unit_price": ["100"], "location": "STORE"})
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute("SELECT MAX(purchase_id) FROM purchases").fetchone()[0]
+        finally:
+            conn.close()
+
+    deleted = purchase(item_a, "7")
+    edited = purchase(item_b, "3")
+    snapshot = create_snapshot(db_path, snap_dir, keep=1)
+
+    c.post(f"/purchases/{deleted}/delete")
+    c.post(
+        f"/purchases/{edited}/update",
+        data={"item_id": [str(item_b)], "qty": ["5"], "unit_price": ["120"], "location": "STORE"},
+    )
+    purchase(item_a, "2")
+    c.post(
+        "/transfers",
+        data={"from_location": "STORE", "to_location": "WAREHOUSE", "item_id": [str(item_b)], "qty": ["1"]},
+    )
+    until_ledger = _ledger_balances(db_path)
+    until = _utc_now_str()
+    time.sleep(1.1)
+    purchase(item_b, "9")
+    now_ledger = _ledger_balances(db_path)
+
+    checks = {}
+    with tempfile.TemporaryDirectory(prefix="verify-") as work:
+        for name, until_str, expected in (
+            ("until", until, until_ledger),
+            ("latest", "9999-12-31 23:59:59", now_ledger),
+        ):
+            out = os.path.join(work, f"{name}.db")
+            result = restore_snapshot(snapshot, out, until=_parse_until(until_str), source_path=db_path)
+            ledger = _ledger_balances(out)
+            checks[name] = {
+                "replayed_changes": result["replayed_changes"],
+                "ledger_matches": ledger == expected,
+                "projection_matches": _projection_balances(out) == ledger,
+            }
+    return {"until": until, "checks": checks}
+
+
+def run_verify(source: str) -> dict[str, object]:
+    """source の写しを一時ディレクトリに作り、別プロセス（verify-run）で確かめる。"""
+    with tempfile.TemporaryDirectory(prefix="verify-") as tmp:
+        work = os.path.join(tmp, "work.db")
+        online_backup(source, work)
+        env = dict(
+            os.environ,
+            SQLITE_FILE=work,
+            SHARD_DIR="",
+            METRICS_FILE=os.path.join(tmp, "metrics.db"),
+            QUERY_STATS_FILE=os.path.join(tmp, "query_stats.db"),
+            DATA_VERSION_FILE=os.path.join(tmp, "data_version.db"),
+            SYNC_STATE_FILE=os.path.join(tmp, "sync_state.db"),
+            SLOW_SQL_LOG=os.path.join(tmp, "slow_sql.log"),
+        )
+        env.pop("TURSO_DATABASE_URL", None)
+        env.pop("TURSO_AUTH_TOKEN", None)
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "verify-run", "--dir", os.path.join(tmp, "backups")],
+            env=env,
+            cwd=APP_DIR,
+            capture_output=True,
+            text=True,
+        )
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit("確認に失敗しました。")
+    return json.loads(proc.stdout)
+
+
+# -----------------------------
+# CLI
+# -----------------------------
+def _parse_until(raw: str) -> datetime:
+    """'YYYY-MM-DD HH:MM[:SS]'（UTC）を datetime に。"""
+    s = raw.strip().replace("T", " ")
+    if len(s) == 16:
+        s += ":00"
+    return datetime.strptime(s[:19], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="takoyaki_inventory.db のバックアップ／リストア")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_snap = sub.add_parser("snapshot", help="オンラインバックアップを取得して圧縮・ローテーション")
+    p_snap.add_argument("--db", default=DB_FILE)
+    p_snap.add_argument("--dir", default=BACKUP_DIR)
+    p_snap.add_argument("--keep", type=int, default=BACKUP_KEEP)
+
+    p_list = sub.add_parser("list", help="スナップショット一覧")
+    p_list.add_argument("--dir", default=BACKUP_DIR)
+
+    p_restore = sub.add_parser("restore", help="スナップショットから復元（任意で時点まで変更を再適用）")
+    p_restore.add_argument("--dir", default=BACKUP_DIR)
+    p_restore.add_argument("--snapshot", help="使うスナップショット（省略時は --until 以前の最新）")
+    p_restore.add_argument("--until", help="この時刻（UTC）までに書いた変更を再適用")
+    p_restore.add_argument("--source", default=DB_FILE, help="再適用元の現行DB")
+    p_restore.add_argument("-o", "--output", required=True)
+
+    p_bench = sub.add_parser("bench", help="DBサイズ別のバックアップ／リストア時間を計測")
+    p_bench.add_argument("--db", default=DB_FILE, help="スキーマと材料の元にするDB")
+    p_bench.add_argument("--sizes", default="10000,100000,1000000")
+
+    p_verify = sub.add_parser("verify", help="一時DBで時点復元を試し、台帳の残量が一致するか確かめる")
+    p_verify.add_argument("--db", default=DB_FILE, help="写しを作る元のDB")
+
+    p_verify_run = sub.add_parser("verify-run", help=argparse.SUPPRESS)
+    p_verify_run.add_argument("--dir", required=True)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "snapshot":
+        path = create_snapshot(args.db, args.dir, args.keep)
+        print(path)
+        return 0
+
+    if args.command == "list":
+        for taken_at, path in list_snapshots(args.dir):
+            size_mb = os.path.getsize(path) / 1024 / 1024
+            print(f"{taken_at.strftime('%Y-%m-%d %H:%M:%S')}Z  {size_mb:8.2f} MB  {path}")
+        return 0
+
+    if args.command == "restore":
+        until = _parse_until(args.until) if args.until else None
+        snapshot = args.snapshot
+        if snapshot is None:
+            if until is None:
+                latest = list_snapshots(args.dir)
+                snapshot = latest[-1][1] if latest else None
+            else:
+                snapshot = find_snapshot_before(until, args.dir)
+        if snapshot is None:
+            print("使えるスナップショットがありません。", file=sys.stderr)
+            return 1
+        if os.path.abspath(args.output) == os.path.abspath(args.source):
+            print("出力先に現行DBは指定できません。確認後に手動で差し替えてください。", file=sys.stderr)
+            return 1
+        try:
+            result = restore_snapshot(snapshot, args.output, until=until, source_path=args.source)
+        except RestoreError as e:
+            print(str(e), file=sys.stderr)
+            return 1
+        for key, value in result.items():
+            print(f"{key}: {value}")
+        return 0
+
+    if args.command == "verify-run":
+        print(json.dumps(verify_run(args.dir)))
+        return 0
+
+    if args.command == "verify":
+        report = run_verify(args.db)
+        ok = True
+        print(f"until: {report['until']}")
+        for name, check in report["checks"].items():
+            passed = check["ledger_matches"] and check["projection_matches"]
+            ok = ok and passed
+            print(
+                f"{name:>8}  replayed={check['replayed_changes']:<4} "
+                f"ledger={'ok' if check['ledger_matches'] else 'NG'} "
+                f"projection={'ok' if check['projection_matches'] else 'NG'}"
+            )
+        return 0 if ok else 1
+
+    if args.command == "bench":
+        sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+        print(f"{'tx_rows':>10} {'db_mb':>8} {'snap_mb':>8} {'backup_s':>9} {'restore_s':>10}")
+        for r in run_benchmark(args.db, sizes):
+            print(
+                f"{r['tx_rows']:>10} {r['db_mb']:>8} {r['snapshot_mb']:>8} "
+                f"{r['backup_sec']:>9} {r['restore_sec']:>10}"
+            )
+        return 0
+
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1096 @@
+"""
+主要ルートのベンチマーク（Flask test client）。
+
+  python bench.py run     [--sizes small,medium] [--repeat 5] [-o benchmarks/latest.json] [--compare benchmarks/baseline.json]
+  python bench.py compare BASELINE.json CURRENT.json [--latency-threshold 0.25] [--query-threshold 0]
+  python bench.py contention [--size small] [--readers 4] [--writers 2] [--duration 10] [-o benchmarks/contention.json]
+  python bench.py asgi-load  [--size small] [--clients 32] [--threads 1,8] [--io-delay-ms 0] [--duration 10] [-o benchmarks/asgi_load.json]
+  python bench.py startup    [--size small] [--repeat 5] [-o benchmarks/startup.json]
+  python bench.py shards     [--size small] [--stores 8] [--writers 1] [--duration 10] [-o benchmarks/shards.json]
+
+- データは seed_data.py で規模ごとに作って BENCH_DATA_DIR にキャッシュする（seed 固定なので毎回同じ）。
+- 規模ごとに子プロセスで計測する（DBファイルの切り替えとプロセス内キャッシュの影響を避けるため）。
+  POST 系は作業用コピーに対して実行するので、キャッシュ済みのデータは汚れない。
+- 1リクエストあたりの SQL 文数は sqlite3 の trace callback で数える。
+- 各ルートは描画済み断片のキャッシュを毎回空にして計測する。キャッシュを使う画面は、当たったときを
+  「(cached)」付きの別ケースとして計測する。
+- contention は読み取りスレッドと書き込みスレッドを同時に回し、接続設定の before（rollback journal /
+  synchronous=FULL / 書き込みキューなし）と after（WAL / NORMAL / キューあり）でスループット・エラー数・
+  ロック待ち時間（takoyaki_db_lock_wait_seconds）・BUSY 再試行を比べる。
+- asgi-load は asgi.py の読み取り API を同じプロセス内で直接呼び、同時クライアント数を固定して
+  スレッドプールの本数ごとにスループットと待ち時間を比べる（1本 = 同期ワーカー1つ相当）。
+  HTTP の往復は含まない。--io-delay-ms は接続ごとの待ち（Turso の接続時 sync 相当）を足して計測する。
+- startup は新しいプロセスごとに import → create_app() → 主要画面の初回応答までを測り、
+  ウォームアップなし（従来）/ バイトコードキャッシュ / ウォームアップ / preload（fork 後の初回）を比べる。
+- shards は店舗を --stores 個に増やし、店舗ごとに書き込みスレッドを回して週次棚卸（長い台帳書き込み）を
+  登録しつつ店舗横断レポート（/reports/stores）を読む。1ファイル（single）と店舗ごとのファイル
+  （sharded: SHARD_DIR、flask shards-split で移してから計測）で、書き込みのスループット・待ち時間と
+  レポートの応答時間を比べる。
+- compare は p50 が閾値（割合）以上かつ BENCH_MIN_DELTA_MS 以上遅くなった、
+  または SQL 文数が閾値を超えて増えたルートがあれば終了コード 1 を返す。
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from db import APP_DIR
+
+BENCH_DATA_DIR = os.getenv("BENCH_DATA_DIR", os.path.join(APP_DIR, "bench_data"))
+BENCH_RESULT_DIR = os.path.join(APP_DIR, "benchmarks")
+BENCH_SEED = 42
+BENCH_MIN_DELTA_MS = 2.0  # これ未満の差はノイズとして無視
+
+CONTENTION_PROFILES = {
+    "before": {"SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_SYNCHRONOUS": "FULL", "DB_WRITE_QUEUE": "0"},
+    "after": {"SQLITE_JOURNAL_MODE": "WAL", "SQLITE_SYNCHRONOUS": "NORMAL", "DB_WRITE_QUEUE": "1"},
+}
+CONTENTION_READ_PATHS = ("/inventory", "/shopping-list")
+
+# name -> (起動のしかた, Jinja バイトコードキャッシュを使うか)
+STARTUP_PROFILES = {
+    "before": ("lazy", False),
+    "lazy": ("lazy", True),
+    "warm": ("warm", True),
+    "preload": ("preload", True),
+}
+SHARD_PROFILES = ("single", "sharded")
+
+STARTUP_PATHS = ("/inventory", "/stocktakes/weekly/new", "/reports/monthly-food-cost", "/shopping-list")
+
+BENCH_SIZES = {
+    "small": {"years": 1, "items": 40, "suppliers": 6},
+    "medium": {"years": 3, "items": 300, "suppliers": 12},
+    "large": {"years": 5, "items": 1500, "suppliers": 20},
+}
+
+
+# -----------------------------
+# Dataset
+# -----------------------------
+def dataset_path(size: str) -> str:
+    return os.path.join(BENCH_DATA_DIR, f"{size}-seed{BENCH_SEED}.db")
+
+
+def ensure_dataset(size: str) -> str:
+    path = dataset_path(size)
+    if os.path.exists(path):
+        return path
+    import seed_data
+
+    os.makedirs(BENCH_DATA_DIR, exist_ok=True)
+    spec = BENCH_SIZES[size]
+    rc = seed_data.main(
+        [
+            "-o", path,
+            "--seed", str(BENCH_SEED),
+            "--years", str(spec["years"]),
+            "--items", str(spec["items"]),
+            "--suppliers", str(spec["suppliers"]),
+        ]
+    )
+    if rc != 0:
+        raise SystemExit(f"データ生成に失敗しました: {size}")
+    return path
+
+
+# -----------------------------
+# Cases（子プロセス側）
+# -----------------------------
+def _pick_targets(db) -> dict[str, object]:
+    """計測に使うID・日付を作業用DBから拾う。"""
+    last_report = db.execute("SELECT MAX(report_date) AS d FROM daily_reports").fetchone()["d"]
+    last_day = date.fromisoformat(last_report) if last_report else date.today()
+    prev_month = (last_day.replace(day=1) - timedelta(days=1)).strftime("%Y-%m")
+
+    purchase = db.execute(
+        "SELECT purchase_id, supplier_id, purchased_at FROM purchases ORDER BY purchase_id DESC LIMIT 1"
+    ).fetchone()
+    purchase_lines = []
+    if purchase is not None:
+        purchase_lines = db.execute(
+            "SELECT item_id, qty, unit_price FROM purchase_lines WHERE purchase_id = ? ORDER BY purchase_line_id",
+            (purchase["purchase_id"],),
+        ).fetchall()
+
+    weekly = db.execute(
+        "SELECT stocktake_id, taken_at FROM stocktakes WHERE scope = 'WEEKLY' ORDER BY stocktake_id DESC LIMIT 1"
+    ).fetchone()
+    weekly_lines = []
+    if weekly is not None:
+        weekly_lines = db.execute(
+            "SELECT item_id, counted_qty FROM stocktake_lines WHERE stocktake_id = ?",
+            (weekly["stocktake_id"],),
+        ).fetchall()
+
+    return {
+        "last_day": last_day,
+        "prev_month": prev_month,
+        "purchase": purchase,
+        "purchase_lines": purchase_lines,
+        "weekly": weekly,
+        "weekly_lines": weekly_lines,
+    }
+
+
+# render_cached_fragment() を使う画面
+FRAGMENT_CACHED_CASES = ("GET /inventory", "GET /reports/monthly-food-cost", "GET /stocktakes/weekly/new")
+
+
+def _build_cases(t: dict[str, object]) -> list[tuple[str, str, str, object]]:
+    # taken_at は画面と同じく datetime-local（JST）で渡す
+    taken_local = f"{t['last_day'].isoformat()}T20:00"
+    cases: list[tuple[str, str, str, object]] = [
+        ("GET /inventory", "GET", "/inventory", None),
+        ("GET /shopping-list", "GET", "/shopping-list", None),
+        ("GET /reports/monthly-food-cost", "GET", f"/reports/monthly-food-cost?ym={t['prev_month']}", None),
+        ("GET /stocktakes/weekly/new", "GET", "/stocktakes/weekly/new", None),
+        (
+            "POST /stocktakes/weekly/new",
+            "POST",
+            "/stocktakes/weekly/new",
+            {"mode": "weekly", "group": "ALL", "taken_at": taken_local, "note": "bench"},
+        ),
+        ("GET /purchases", "GET", "/purchases", None),
+    ]
+
+    weekly = t["weekly"]
+    if weekly is not None:
+        form: dict[str, object] = {"mode": "weekly", "group": "ALL", "taken_at": taken_local, "note": "bench"}
+        for line in t["weekly_lines"]:
+            form[f"counted_{line['item_id']}"] = str(line["counted_qty"])
+        cases.append(
+            ("POST /stocktakes/<id>/update", "POST", f"/stocktakes/{weekly['stocktake_id']}/update", form)
+        )
+
+    purchase = t["purchase"]
+    if purchase is not None:
+        lines = t["purchase_lines"]
+        form = {
+            "supplier_id": str(purchase["supplier_id"] or ""),
+            "purchased_date": str(purchase["purchased_at"])[:10],
+            "location": "WAREHOUSE",
+            "note": "bench",
+            "item_id": [str(r["item_id"]) for r in lines],
+            "qty": [str(r["qty"]) for r in lines],
+            "unit_price": [str(r["unit_price"] or "") for r in lines],
+        }
+        cases.append(
+            ("POST /purchases/<id>/update", "POST", f"/purchases/{purchase['purchase_id']}/update", form)
+        )
+
+    # 描画済み断片のキャッシュに当たる画面は、キャッシュを空にした計測（上の名前）とは別に
+    # キャッシュに当たったときも計測する
+    cases += [
+        (f"{name} (cached)", method, path, form)
+        for name, method, path, form in cases
+        if name in FRAGMENT_CACHED_CASES
+    ]
+    return cases
+
+
+def run_size(db_path: str, repeat: int) -> dict[str, dict[str, object]]:
+    """子プロセスで呼ばれる。SQLITE_FILE は呼び出し側で db_path に設定済み。"""
+    import sqlite3
+
+    from app import create_app, fragment_cache
+    from db import get_db
+
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        targets = _pick_targets(conn)
+    finally:
+        conn.close()
+    cases = _build_cases(targets)
+
+    app = create_app(warm=False)
+    counter = {"n": 0}
+
+    def _count(_sql):
+        counter["n"] += 1
+
+    @app.before_request
+    def _bench_trace():
+        get_db().set_trace_callback(_count)
+
+    client = app.test_client()
+    client.get("/")  # スキーマ補正などの初回処理を計測から外す
+
+    results: dict[str, dict[str, object]] = {}
+    for name, method, path, form in cases:
+        cached = name.endswith(" (cached)")
+        timings = []
+        queries = []
+        status = None
+        for i in range(repeat + 1):
+            if not cached:
+                fragment_cache.clear()  # ウォームアップで埋まった断片に当たると SQL・描画が計測から消える
+            counter["n"] = 0
+            started = time.perf_counter()
+            if method == "GET":
+                resp = client.get(path)
+            else:
+                resp = client.post(path, data=form)
+            elapsed = (time.perf_counter() - started) * 1000
+            status = resp.status_code
+            if i == 0:
+                continue  # ウォームアップ
+            timings.append(elapsed)
+            queries.append(counter["n"])
+        results[name] = {
+            "status": status,
+            "p50_ms": round(statistics.median(timings), 3),
+            "mean_ms": round(statistics.fmean(timings), 3),
+            "max_ms": round(max(timings), 3),
+            "queries": int(statistics.median(queries)),
+        }
+    return results
+
+
+def _latency_summary(samples: list[tuple[float, bool]], duration: float) -> dict[str, object]:
+    timings = sorted(ms for ms, _ok in samples)
+    if not timings:
+        return {"requests": 0, "errors": 0, "rps": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "max_ms": 0.0}
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _ms, ok in samples if not ok),
+        "rps": round(len(samples) / duration, 2),
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "max_ms": round(timings[-1], 3),
+    }
+
+
+def _read_lock_metrics(metrics_file: str) -> dict[str, object]:
+    import sqlite3
+
+    conn = sqlite3.connect(metrics_file)
+    try:
+        rows = conn.execute(
+            """
+            SELECT metric, labels, series, value FROM metric_samples
+            WHERE metric IN ('takoyaki_db_lock_wait_seconds', 'takoyaki_db_busy_retries_total')
+            """
+        ).fetchall()
+    finally:
+        conn.close()
+    out: dict[str, object] = {"busy_retries": 0}
+    for metric, labels, series, value in rows:
+        if metric == "takoyaki_db_busy_retries_total":
+            out["busy_retries"] += int(value)
+            continue
+        stage = dict(tuple(p) for p in json.loads(labels)).get("stage", "")
+        if series == "sum":
+            out[f"{stage}_wait_ms"] = round(value * 1000, 3)
+        elif series == "count":
+            out[f"{stage}_count"] = int(value)
+    return out
+
+
+def run_contention(db_path: str, readers: int, writers: int, duration: float) -> dict[str, object]:
+    """子プロセスで呼ばれる。接続設定は呼び出し側が環境変数で渡す。"""
+    import re
+    import sqlite3
+    import threading
+
+    from app import create_app
+    from metrics import METRICS_FILE
+    from metrics import registry as metrics
+
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        targets = _pick_targets(conn)
+    finally:
+        conn.close()
+    taken_local = f"{targets['last_day'].isoformat()}T20:00"
+    stocktake_form = {"mode": "weekly", "group": "ALL", "taken_at": taken_local, "note": "bench"}
+    stocktake_ok = re.compile(r"/stocktakes/\d+$")
+
+    app = create_app(warm=False)
+    app.test_client().get("/")  # スキーマ補正などの初回処理を計測から外す
+
+    deadline = time.monotonic() + duration
+    samples: dict[str, list[tuple[float, bool]]] = {"read": [], "write_long": [], "write_short": []}
+    lock = threading.Lock()
+
+    def reader(idx: int) -> None:
+        client = app.test_client()
+        out = []
+        i = idx
+        while time.monotonic() < deadline:
+            path = CONTENTION_READ_PATHS[i % len(CONTENTION_READ_PATHS)]
+            i += 1
+            started = time.perf_counter()
+            resp = client.get(path)
+            out.append(((time.perf_counter() - started) * 1000, resp.status_code == 200))
+        with lock:
+            samples["read"].extend(out)
+
+    def writer(idx: int) -> None:
+        # 長い台帳書き込み（週次棚卸）と短い書き込み（仕入れ先登録）を交互に
+        client = app.test_client()
+        out: dict[str, list] = {"write_long": [], "write_short": []}
+        i = 0
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            if i % 2 == 0:
+                resp = client.post("/stocktakes/weekly/new", data=stocktake_form)
+                ok = bool(stocktake_ok.search(resp.location or ""))
+                kind = "write_long"
+            else:
+                resp = client.post("/suppliers", data={"name": f"bench-{idx}-{i}"})
+                ok = (resp.location or "").endswith("/suppliers")
+                kind = "write_short"
+            out[kind].append(((time.perf_counter() - started) * 1000, ok))
+            i += 1
+        with lock:
+            for kind, rows in out.items():
+                samples[kind].extend(rows)
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    threads += [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    metrics.flush(force=True)
+    result: dict[str, object] = {kind: _latency_summary(rows, elapsed) for kind, rows in samples.items()}
+    result["locks"] = _read_lock_metrics(METRICS_FILE)
+    result["elapsed_sec"] = round(elapsed, 2)
+    return result
+
+
+def run_contention_profiles(size: str, readers: int, writers: int, duration: float) -> dict[str, object]:
+    source = ensure_dataset(size)
+    report: dict[str, object] = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "size": size,
+            "readers": readers,
+            "writers": writers,
+            "duration_sec": duration,
+        },
+        "profiles": {},
+    }
+    for name, settings in CONTENTION_PROFILES.items():
+        with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+            work = os.path.join(tmp, "work.db")
+            shutil.copyfile(source, work)
+            env = dict(
+                os.environ,
+                SQLITE_FILE=work,
+                METRICS_FILE=os.path.join(tmp, "metrics.db"),
+                QUERY_STATS_FILE=os.path.join(tmp, "query_stats.db"),
+                SLOW_SQL_LOG=os.path.join(tmp, "slow_sql.log"),
+                **settings,
+            )
+            env.pop("TURSO_DATABASE_URL", None)
+            env.pop("TURSO_AUTH_TOKEN", None)
+            proc = subprocess.run(
+                [
+                    sys.executable, os.path.abspath(__file__), "contention-run",
+                    "--db", work,
+                    "--readers", str(readers),
+                    "--writers", str(writers),
+                    "--duration", str(duration),
+                ],
+                env=env,
+                cwd=APP_DIR,
+                capture_output=True,
+                text=True,
+            )
+        if proc.returncode != 0:
+            sys.stderr.write(proc.stderr)
+            raise SystemExit(f"計測に失敗しました: {name}")
+        report["profiles"][name] = dict(json.loads(proc.stdout), settings=settings)
+    return report
+
+
+def print_contention_report(report: dict[str, object]) -> None:
+    for name, r in report["profiles"].items():
+        s = r["settings"]
+        print(
+            f"== {name}（journal={s['SQLITE_JOURNAL_MODE']} synchronous={s['SQLITE_SYNCHRONOUS']}"
+            f" queue={'on' if s['DB_WRITE_QUEUE'] == '1' else 'off'}）"
+        )
+        for kind in ("read", "write_long", "write_short"):
+            k = r[kind]
+            print(
+                f"  {kind:12s} {k['requests']:6d} req  {k['rps']:8.1f} req/s  err {k['errors']:4d}"
+                f"  p50 {k['p50_ms']:8.1f}ms  p95 {k['p95_ms']:8.1f}ms  max {k['max_ms']:8.1f}ms"
+            )
+        locks = r["locks"]
+        print(
+            f"  lock wait    begin {locks.get('begin_wait_ms', 0):.1f}ms / {locks.get('begin_count', 0)}回"
+            f"  queue {locks.get('queue_wait_ms', 0):.1f}ms / {locks.get('queue_count', 0)}回"
+            f"  BUSY再試行 {locks['busy_retries']}"
+        )
+
+
+def run_asgi_load(db_path: str, clients: int, duration: float, io_delay_ms: float) -> dict[str, object]:
+    """子プロセスで呼ばれる。ASGI_READ_THREADS は呼び出し側が環境変数で渡す。"""
+    import asyncio
+    import sqlite3
+
+    import asgi
+    from asgi import ASGI_READ_MAX_PENDING, application
+
+    if io_delay_ms > 0:
+        get_db = asgi.get_db
+
+        def get_db_with_io_wait():
+            time.sleep(io_delay_ms / 1000)
+            return get_db()
+
+        asgi.get_db = get_db_with_io_wait
+
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        targets = _pick_targets(conn)
+    finally:
+        conn.close()
+    paths = [
+        ("/api/read/inventory", b""),
+        ("/api/read/shopping-list", b""),
+        ("/api/read/reports/monthly-food-cost", f"ym={targets['prev_month']}".encode()),
+    ]
+
+    async def call(path: str, query: bytes) -> int:
+        status = {}
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+
+        scope = {"type": "http", "method": "GET", "path": path, "query_string": query, "headers": []}
+        await application(scope, receive, send)
+        return status.get("code", 0)
+
+    async def drive() -> tuple[list[tuple[float, bool]], float]:
+        for path, query in paths:
+            await call(path, query)  # ウォームアップ
+        samples: list[tuple[float, bool]] = []
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + duration
+
+        async def client(idx: int) -> None:
+            i = idx
+            while loop.time() < deadline:
+                path, query = paths[i % len(paths)]
+                i += 1
+                started = time.perf_counter()
+                code = await call(path, query)
+                samples.append(((time.perf_counter() - started) * 1000, code == 200))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(n) for n in range(clients)))
+        return samples, time.perf_counter() - started
+
+    samples, elapsed = asyncio.run(drive())
+    result = _latency_summary(samples, elapsed)
+    result["max_pending"] = ASGI_READ_MAX_PENDING
+    result["io_delay_ms"] = io_delay_ms
+    return result
+
+
+def run_asgi_load_profiles(
+    size: str, clients: int, threads: list[int], duration: float, io_delay_ms: float
+) -> dict[str, object]:
+    source = ensure_dataset(size)
+    report: dict[str, object] = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "size": size,
+            "clients": clients,
+            "duration_sec": duration,
+            "io_delay_ms": io_delay_ms,
+        },
+        "threads": {},
+    }
+    for n in threads:
+        with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+            work = os.path.join(tmp, "work.db")
+            shutil.copyfile(source, work)
+            env = dict(
+                os.environ,
+                SQLITE_FILE=work,
+                METRICS_FILE=os.path.join(tmp, "metrics.db"),
+                ASGI_READ_THREADS=str(n),
+                ASGI_READ_MAX_PENDING=str(max(clients, 1)),
+            )
+            env.pop("TURSO_DATABASE_URL", None)
+            env.pop("TURSO_AUTH_TOKEN", None)
+            proc = subprocess.run(
+                [
+                    sys.executable, os.path.abspath(__file__), "asgi-load-run",
+                    "--db", work,
+                    "--clients", str(clients),
+                    "--duration", str(duration),
+                    "--io-delay-ms", str(io_delay_ms),
+                ],
+                env=env,
+                cwd=APP_DIR,
+                capture_output=True,
+                text=True,
+            )
+        if proc.returncode != 0:
+            sys.stderr.write(proc.stderr)
+            raise SystemExit(f"計測に失敗しました: threads={n}")
+        report["threads"][str(n)] = json.loads(proc.stdout)
+    return report
+
+
+def print_asgi_load_report(report: dict[str, object]) -> None:
+    meta = report["meta"]
+    print(
+        f"== asgi read API（clients={meta['clients']} / io-delay {meta['io_delay_ms']}ms"
+        f" / {meta['duration_sec']}秒）"
+    )
+    base = None
+    for n, r in report["threads"].items():
+        gain = f"  x{r['rps'] / base:.2f}" if base else ""
+        base = base or r["rps"] or None
+        print(
+            f"  threads {n:>3s} {r['requests']:6d} req  {r['rps']:8.1f} req/s  err {r['errors']:4d}"
+            f"  p50 {r['p50_ms']:8.1f}ms  p95 {r['p95_ms']:8.1f}ms{gain}"
+        )
+
+
+# 子プロセスで `python -c` として実行する（bench.py 自身の import で flask などを先に読まないため）
+_STARTUP_SCRIPT = r"""
+import json, os, sys, time
+started = time.perf_counter()
+mode, paths = sys.argv[1], sys.argv[2:]
+import app as appmod
+imported = time.perf_counter()
+application = appmod.create_app(warm=mode != "lazy")
+ready = time.perf_counter()
+
+
+def first_responses():
+    client = application.test_client()
+    out = {}
+    for path in paths:
+        t = time.perf_counter()
+        status = client.get(path).status_code
+        out[path] = {"ms": (time.perf_counter() - t) * 1000, "status": status}
+    return out
+
+
+if mode == "preload":
+    # gunicorn の preload_app と同じく、温めたプロセスを fork して子の初回応答を測る
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        forked = time.perf_counter()
+        first = first_responses()
+        done = time.perf_counter()
+        os.write(w, json.dumps({"first": first, "worker_to_first_ms": (done - forked) * 1000}).encode())
+        os._exit(0)
+    os.close(w)
+    chunks = []
+    while True:
+        chunk = os.read(r, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.waitpid(pid, 0)
+    child = json.loads(b"".join(chunks))
+    first, worker_to_first_ms = child["first"], child["worker_to_first_ms"]
+else:
+    first = first_responses()
+    worker_to_first_ms = (time.perf_counter() - started) * 1000
+
+json.dump(
+    {
+        "import_ms": (imported - started) * 1000,
+        "create_app_ms": (ready - imported) * 1000,
+        "first": first,
+        "worker_to_first_ms": worker_to_first_ms,
+    },
+    sys.stdout,
+)
+"""
+
+
+def run_startup_profiles(size: str, repeat: int) -> dict[str, object]:
+    """
+    プロセス起動ごとの import → 初回応答までを測る。
+      before  : ウォームアップなし・バイトコードキャッシュなし（従来どおり）
+      lazy    : ウォームアップなし・バイトコードキャッシュあり
+      warm    : create_app() でウォームアップしてから応答（import からの合計）
+      preload : 温めたプロセスを fork した子の初回応答（gunicorn preload_app 相当）
+    """
+    source = ensure_dataset(size)
+    report: dict[str, object] = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "size": size,
+            "repeat": repeat,
+            "paths": list(STARTUP_PATHS),
+        },
+        "profiles": {},
+    }
+    for name, (mode, use_bytecode_cache) in STARTUP_PROFILES.items():
+        if mode == "preload" and not hasattr(os, "fork"):
+            continue
+        runs = []
+        with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+            work = os.path.join(tmp, "work.db")
+            shutil.copyfile(source, work)
+            env = dict(
+                os.environ,
+                SQLITE_FILE=work,
+                METRICS_FILE=os.path.join(tmp, "metrics.db"),
+                QUERY_STATS_FILE=os.path.join(tmp, "query_stats.db"),
+                DATA_VERSION_FILE=os.path.join(tmp, "data_version.db"),
+                JINJA_BYTECODE_CACHE_DIR=os.path.join(tmp, "jinja_cache") if use_bytecode_cache else "",
+            )
+            env.pop("TURSO_DATABASE_URL", None)
+            env.pop("TURSO_AUTH_TOKEN", None)
+            # 1回目はバイトコードキャッシュ作成・スキーマ補正を済ませるための捨て回
+            for _ in range(repeat + 1):
+                proc = subprocess.run(
+                    [sys.executable, "-c", _STARTUP_SCRIPT, mode, *STARTUP_PATHS],
+                    env=env,
+                    cwd=APP_DIR,
+                    capture_output=True,
+                    text=True,
+                )
+                if proc.returncode != 0:
+                    sys.stderr.write(proc.stderr)
+                    raise SystemExit(f"計測に失敗しました: {name}")
+                runs.append(json.loads(proc.stdout))
+        runs = runs[1:]
+        report["profiles"][name] = {
+            "import_ms": round(statistics.median(r["import_ms"] for r in runs), 2),
+            "create_app_ms": round(statistics.median(r["create_app_ms"] for r in runs), 2),
+            "worker_to_first_ms": round(statistics.median(r["worker_to_first_ms"] for r in runs), 2),
+            "first": {
+                path: round(statistics.median(r["first"][path]["ms"] for r in runs), 2)
+                for path in STARTUP_PATHS
+            },
+        }
+    return report
+
+
+def print_startup_report(report: dict[str, object]) -> None:
+    meta = report["meta"]
+    print(f"== startup（{meta['size']} / 中央値 {meta['repeat']}回）")
+    for name, r in report["profiles"].items():
+        first = "  ".join(f"{path} {ms:.1f}" for path, ms in r["first"].items())
+        print(
+            f"  {name:8s} import {r['import_ms']:7.1f}ms  create_app {r['create_app_ms']:7.1f}ms"
+            f"  -> 初回応答まで {r['worker_to_first_ms']:7.1f}ms"
+        )
+        print(f"           初回 ms: {first}")
+
+
+def run_shards(db_path: str, stores: int, writers: int, duration: float) -> dict[str, object]:
+    """子プロセスで呼ばれる。SHARD_DIR は呼び出し側が環境変数で渡す（なければ1ファイル）。"""
+    import re
+    import sqlite3
+    import threading
+
+    from app import create_app
+    from metrics import METRICS_FILE
+    from metrics import registry as metrics
+    from shards import SHARD_DIR
+
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        targets = _pick_targets(conn)
+    finally:
+        conn.close()
+    taken_local = f"{targets['last_day'].isoformat()}T20:00"
+    stocktake_form = {"mode": "weekly", "group": "ALL", "taken_at": taken_local, "note": "bench"}
+    stocktake_ok = re.compile(r"/stocktakes/\d+$")
+    ym = targets["last_day"].strftime("%Y-%m")
+
+    app = create_app(warm=False)
+    client = app.test_client()
+    client.get("/")  # スキーマ補正などの初回処理を計測から外す
+    for n in range(2, stores + 1):
+        client.post("/stores", data={"code": f"BENCH{n}", "name": f"ベンチ店舗{n}"})
+    if SHARD_DIR:
+        result = app.test_cli_runner().invoke(args=["shards-split"])
+        if result.exit_code != 0:
+            raise SystemExit(result.output)
+    conn = sqlite3.connect(db_path)
+    try:
+        store_ids = [r[0] for r in conn.execute("SELECT store_id FROM stores WHERE is_active = 1 ORDER BY store_id")]
+    finally:
+        conn.close()
+    for store_id in store_ids:
+        client.get(f"/inventory?store={store_id}")  # 店舗ファイルを開く初回（表定義の同期）も外す
+
+    deadline = time.monotonic() + duration
+    samples: dict[str, list[tuple[float, bool]]] = {"write": [], "report": []}
+    lock = threading.Lock()
+
+    def writer(store_id: int) -> None:
+        c = app.test_client()
+        out = []
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            resp = c.post(f"/stocktakes/weekly/new?store={store_id}", data=stocktake_form)
+            out.append(((time.perf_counter() - started) * 1000, bool(stocktake_ok.search(resp.location or ""))))
+        with lock:
+            samples["write"].extend(out)
+
+    def reporter() -> None:
+        c = app.test_client()
+        out = []
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            resp = c.get(f"/reports/stores?ym={ym}")
+            out.append(((time.perf_counter() - started) * 1000, resp.status_code == 200))
+        with lock:
+            samples["report"].extend(out)
+
+    threads = [threading.Thread(target=writer, args=(sid,)) for sid in store_ids for _ in range(writers)]
+    threads.append(threading.Thread(target=reporter))
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    metrics.flush(force=True)
+    result: dict[str, object] = {kind: _latency_summary(rows, elapsed) for kind, rows in samples.items()}
+    result["locks"] = _read_lock_metrics(METRICS_FILE)
+    result["elapsed_sec"] = round(elapsed, 2)
+    result["stores"] = len(store_ids)
+    return result
+
+
+def run_shards_profiles(size: str, stores: int, writers: int, duration: float) -> dict[str, object]:
+    source = ensure_dataset(size)
+    report: dict[str, object] = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "size": size,
+            "stores": stores,
+            "writers_per_store": writers,
+            "duration_sec": duration,
+        },
+        "profiles": {},
+    }
+    for name in SHARD_PROFILES:
+        with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+            work = os.path.join(tmp, "work.db")
+            shutil.copyfile(source, work)
+            env = dict(
+                os.environ,
+                SQLITE_FILE=work,
+                SHARD_DIR=os.path.join(tmp, "shards") if name == "sharded" else "",
+                METRICS_FILE=os.path.join(tmp, "metrics.db"),
+                QUERY_STATS_FILE=os.path.join(tmp, "query_stats.db"),
+                DATA_VERSION_FILE=os.path.join(tmp, "data_version.db"),
+                SLOW_SQL_LOG=os.path.join(tmp, "slow_sql.log"),
+            )
+            env.pop("TURSO_DATABASE_URL", None)
+            env.pop("TURSO_AUTH_TOKEN", None)
+            proc = subprocess.run(
+                [
+                    sys.executable, os.path.abspath(__file__), "shards-run",
+                    "--db", work,
+                    "--stores", str(stores),
+                    "--writers", str(writers),
+                    "--duration", str(duration),
+                ],
+                env=env,
+                cwd=APP_DIR,
+                capture_output=True,
+                text=True,
+            )
+        if proc.returncode != 0:
+            sys.stderr.write(proc.stderr)
+            raise SystemExit(f"計測に失敗しました: {name}")
+        report["profiles"][name] = json.loads(proc.stdout)
+    return report
+
+
+def print_shards_report(report: dict[str, object]) -> None:
+    meta = report["meta"]
+    print(f"== shards（{meta['size']} / {meta['stores']}店舗 × 書き込み {meta['writers_per_store']}本）")
+    for name, r in report["profiles"].items():
+        print(f"  {name}")
+        for kind in ("write", "report"):
+            k = r[kind]
+            print(
+                f"    {kind:8s} {k['requests']:6d} req  {k['rps']:8.1f} req/s  err {k['errors']:4d}"
+                f"  p50 {k['p50_ms']:8.1f}ms  p95 {k['p95_ms']:8.1f}ms  max {k['max_ms']:8.1f}ms"
+            )
+        locks = r["locks"]
+        print(
+            f"    lock wait begin {locks.get('begin_wait_ms', 0):.1f}ms / {locks.get('begin_count', 0)}回"
+            f"  queue {locks.get('queue_wait_ms', 0):.1f}ms / {locks.get('queue_count', 0)}回"
+            f"  BUSY再試行 {locks['busy_retries']}"
+        )
+
+
+# -----------------------------
+# Run / Compare
+# -----------------------------
+def run_benchmarks(sizes: list[str], repeat: int) -> dict[str, object]:
+    report: dict[str, object] = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": repeat,
+            "seed": BENCH_SEED,
+        },
+        "results": {},
+    }
+    for size in sizes:
+        source = ensure_dataset(size)
+        with tempfile.TemporaryDirectory(prefix="bench-") as tmp:
+            work = os.path.join(tmp, "work.db")
+            shutil.copyfile(source, work)
+            env = dict(os.environ, SQLITE_FILE=work)
+            env.pop("TURSO_DATABASE_URL", None)
+            env.pop("TURSO_AUTH_TOKEN", None)
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "run-size", "--db", work, "--repeat", str(repeat)],
+                env=env,
+                cwd=APP_DIR,
+                capture_output=True,
+                text=True,
+            )
+        if proc.returncode != 0:
+            sys.stderr.write(proc.stderr)
+            raise SystemExit(f"計測に失敗しました: {size}")
+        report["results"][size] = json.loads(proc.stdout)
+    return report
+
+
+def compare_reports(
+    baseline: dict[str, object],
+    current: dict[str, object],
+    latency_threshold: float,
+    query_threshold: int,
+) -> list[str]:
+    regressions = []
+    for size, routes in current["results"].items():
+        base_routes = baseline["results"].get(size)
+        if not base_routes:
+            continue
+        for name, cur in routes.items():
+            base = base_routes.get(name)
+            if not base:
+                continue
+            delta = cur["p50_ms"] - base["p50_ms"]
+            if delta > BENCH_MIN_DELTA_MS and cur["p50_ms"] > base["p50_ms"] * (1 + latency_threshold):
+                regressions.append(
+                    f"[{size}] {name}: p50 {base['p50_ms']:.1f}ms -> {cur['p50_ms']:.1f}ms"
+                )
+            if cur["queries"] > base["queries"] + query_threshold:
+                regressions.append(
+                    f"[{size}] {name}: SQL {base['queries']} -> {cur['queries']}"
+                )
+    return regressions
+
+
+def print_report(report: dict[str, object], baseline: dict[str, object] | None = None) -> None:
+    for size, routes in report["results"].items():
+        print(f"== {size}")
+        base_routes = (baseline or {}).get("results", {}).get(size, {})
+        for name, r in routes.items():
+            line = f"  {name:44s} {r['p50_ms']:9.1f}ms  max {r['max_ms']:9.1f}ms  SQL {r['queries']:6d}  ({r['status']})"
+            base = base_routes.get(name)
+            if base:
+                line += f"  base {base['p50_ms']:.1f}ms / {base['queries']}"
+            print(line)
+
+
+def _load(path: str) -> dict[str, object]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="主要ルートのベンチマーク")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="計測してJSONに保存")
+    p_run.add_argument("--sizes", default="small,medium", help=f"カンマ区切り（{','.join(BENCH_SIZES)}）")
+    p_run.add_argument("--repeat", type=int, default=5)
+    p_run.add_argument("-o", "--output", default=os.path.join(BENCH_RESULT_DIR, "latest.json"))
+    p_run.add_argument("--compare", default=None, help="このベースラインと比較する")
+    p_run.add_argument("--latency-threshold", type=float, default=0.25)
+    p_run.add_argument("--query-threshold", type=int, default=0)
+
+    p_cmp = sub.add_parser("compare", help="ベースラインと比較")
+    p_cmp.add_argument("baseline")
+    p_cmp.add_argument("current")
+    p_cmp.add_argument("--latency-threshold", type=float, default=0.25)
+    p_cmp.add_argument("--query-threshold", type=int, default=0)
+
+    p_one = sub.add_parser("run-size", help=argparse.SUPPRESS)
+    p_one.add_argument("--db", required=True)
+    p_one.add_argument("--repeat", type=int, default=5)
+
+    p_con = sub.add_parser("contention", help="読み書きの同時実行で before/after の接続設定を比べる")
+    p_con.add_argument("--size", default="small", choices=list(BENCH_SIZES))
+    p_con.add_argument("--readers", type=int, default=4)
+    p_con.add_argument("--writers", type=int, default=2)
+    p_con.add_argument("--duration", type=float, default=10.0, help="秒")
+    p_con.add_argument("-o", "--output", default=os.path.join(BENCH_RESULT_DIR, "contention.json"))
+
+    p_con_run = sub.add_parser("contention-run", help=argparse.SUPPRESS)
+    p_con_run.add_argument("--db", required=True)
+    p_con_run.add_argument("--readers", type=int, default=4)
+    p_con_run.add_argument("--writers", type=int, default=2)
+    p_con_run.add_argument("--duration", type=float, default=10.0)
+
+    p_asgi = sub.add_parser("asgi-load", help="読み取り API（ASGI）の同時接続での負荷試験")
+    p_asgi.add_argument("--size", default="small", choices=list(BENCH_SIZES))
+    p_asgi.add_argument("--clients", type=int, default=32)
+    p_asgi.add_argument("--threads", default="1,8", help="カンマ区切りのスレッドプール本数")
+    p_asgi.add_argument("--io-delay-ms", type=float, default=0.0, help="接続ごとに足す待ち時間")
+    p_asgi.add_argument("--duration", type=float, default=10.0, help="秒")
+    p_asgi.add_argument("-o", "--output", default=os.path.join(BENCH_RESULT_DIR, "asgi_load.json"))
+
+    p_asgi_run = sub.add_parser("asgi-load-run", help=argparse.SUPPRESS)
+    p_asgi_run.add_argument("--db", required=True)
+    p_asgi_run.add_argument("--clients", type=int, default=32)
+    p_asgi_run.add_argument("--duration", type=float, default=10.0)
+    p_asgi_run.add_argument("--io-delay-ms", type=float, default=0.0)
+
+    p_start = sub.add_parser("startup", help="ワーカー起動から初回応答までの時間を比べる")
+    p_start.add_argument("--size", default="small", choices=list(BENCH_SIZES))
+    p_start.add_argument("--repeat", type=int, default=5)
+    p_start.add_argument("-o", "--output", default=os.path.join(BENCH_RESULT_DIR, "startup.json"))
+
+    p_sh = sub.add_parser("shards", help="店舗ごとのDBファイルと1ファイルで、店舗別の同時書き込みを比べる")
+    p_sh.add_argument("--size", default="small", choices=list(BENCH_SIZES))
+    p_sh.add_argument("--stores", type=int, default=8)
+    p_sh.add_argument("--writers", type=int, default=1, help="店舗あたりの書き込みスレッド数")
+    p_sh.add_argument("--duration", type=float, default=10.0, help="秒")
+    p_sh.add_argument("-o", "--output", default=os.path.join(BENCH_RESULT_DIR, "shards.json"))
+
+    p_sh_run = sub.add_parser("shards-run", help=argparse.SUPPRESS)
+    p_sh_run.add_argument("--db", required=True)
+    p_sh_run.add_argument("--stores", type=int, default=8)
+    p_sh_run.add_argument("--writers", type=int, default=1)
+    p_sh_run.add_argument("--duration", type=float, default=10.0)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "shards-run":
+        json.dump(run_shards(args.db, args.stores, args.writers, args.duration), sys.stdout)
+        return 0
+
+    if args.command == "shards":
+        report = run_shards_profiles(args.size, args.stores, args.writers, args.duration)
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print_shards_report(report)
+        print(f"-> {args.output}")
+        return 0
+
+    if args.command == "startup":
+        report = run_startup_profiles(args.size, args.repeat)
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print_startup_report(report)
+        print(f"-> {args.output}")
+        return 0
+
+    if args.command == "contention-run":
+        json.dump(run_contention(args.db, args.readers, args.writers, args.duration), sys.stdout)
+        return 0
+
+    if args.command == "asgi-load-run":
+        json.dump(run_asgi_load(args.db, args.clients, args.duration, args.io_delay_ms), sys.stdout)
+        return 0
+
+    if args.command == "asgi-load":
+        threads = [int(t) for t in args.threads.split(",") if t.strip()]
+        report = run_asgi_load_profiles(args.size, args.clients, threads, args.duration, args.io_delay_ms)
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print_asgi_load_report(report)
+        print(f"-> {args.output}")
+        return 0
+
+    if args.command == "contention":
+        report = run_contention_profiles(args.size, args.readers, args.writers, args.duration)
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print_contention_report(report)
+        print(f"-> {args.output}")
+        return 0
+
+    if args.command == "run-size":
+        json.dump(run_size(args.db, args.repeat), sys.stdout)
+        return 0
+
+    if args.command == "run":
+        sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+        unknown = [s for s in sizes if s not in BENCH_SIZES]
+        if unknown:
+            print(f"不明なサイズ: {', '.join(unknown)}", file=sys.stderr)
+            return 2
+        report = run_benchmarks(sizes, args.repeat)
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        baseline = _load(args.compare) if args.compare else None
+        print_report(report, baseline)
+        print(f"-> {args.output}")
+        if baseline is None:
+            return 0
+        current = report
+    else:
+        baseline = _load(args.baseline)
+        current = _load(args.current)
+        print_report(current, baseline)
+
+    regressions = compare_reports(baseline, current, args.latency_threshold, args.query_threshold)
+    if regressions:
+        print("退行あり:")
+        for r in regressions:
+            print(f"  {r}")
+        return 1
+    print("退行なし")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""
+テーブル単位のデータ版数（書き込みがあるたびに +1）。画面の ETag / Last-Modified に使う。
+
+- transaction() の COMMIT 後に、その中で書いたテーブルの版数を DATA_VERSION_FILE（SQLite）で +1 する。
+  全ワーカー共通なので、どのワーカーが書いても次の GET から ETag が変わる。
+- 読む側は小さな1表を引くだけで、本体DBには接続しない。
+- 書き先のテーブルが読み取れない SQL は "*"（全体）を進める。本体DBをバックアップから戻したときも
+  `flask data-version-bump` で "*" を進める。
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+APP_DIR = os.path.abspath(os.path.dirname(__file__))
+DATA_VERSION_FILE = os.getenv("DATA_VERSION_FILE", os.path.join(APP_DIR, "data_version.db"))
+
+ALL_TABLES = "*"
+
+logger = logging.getLogger("takoyaki.data_version")
+
+_RE_WRITE_TARGET = re.compile(
+    r"""\s*(?:
+        INSERT(?:\s+OR\s+\w+)?\s+INTO
+      | REPLACE\s+INTO
+      | UPDATE(?:\s+OR\s+\w+)?
+      | DELETE\s+FROM
+      | (?:DROP|ALTER)\s+TABLE(?:\s+IF\s+EXISTS)?
+    )\s+["`\[]?(\w+)""",
+    re.IGNORECASE | re.VERBOSE,
+)
+_RE_NO_DATA_CHANGE = re.compile(
+    r"\s*(?:CREATE\s+(?:TEMP(?:ORARY)?\s+)?(?:TABLE|VIEW|TRIGGER)|DROP\s+TRIGGER|(?:CREATE|DROP)\s+(?:UNIQUE\s+)?INDEX"
+    r"|ANALYZE|VACUUM|REINDEX)\b",
+    re.IGNORECASE,
+)
+
+
+def written_table(sql: str) -> str | None:
+    """書き込み SQL の対象テーブル名。データが変わらない文は None、読み取れなければ "*"。"""
+    m = _RE_WRITE_TARGET.match(sql)
+    if m:
+        return m.group(1).lower()
+    if _RE_NO_DATA_CHANGE.match(sql):
+        return None
+    return ALL_TABLES
+
+
+class DataVersions:
+    def __init__(self, path: str = DATA_VERSION_FILE):
+        self.path = path
+        self._local = threading.local()  # スレッドごとに接続を使い回す（毎回の open を省く）
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS data_versions (
+              table_name  TEXT    PRIMARY KEY,
+              version     INTEGER NOT NULL,
+              updated_at  REAL    NOT NULL
+            )
+            """
+        )
+        # "*" の初期値はファイルを作った時刻。作り直しても以前の ETag と重ならない
+        conn.execute(
+            "INSERT OR IGNORE INTO data_versions (table_name, version, updated_at) VALUES (?, ?, 0)",
+            (ALL_TABLES, int(time.time() * 1000)),
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()  # fork 後（gunicorn の preload）は親の接続を使わない
+        return conn
+
+    def bump(self, tables) -> None:
+        """COMMIT 済みの書き込みを記録する。失敗しても本体の書き込みは戻せないのでログだけ残す。"""
+        names = sorted({t for t in tables if t})
+        if not names:
+            return
+        now = time.time()
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    """
+                    INSERT INTO data_versions (table_name, version, updated_at)
+                    VALUES (?, 1, ?)
+                    ON CONFLICT (table_name) DO UPDATE
+                      SET version = version + 1, updated_at = excluded.updated_at
+                    """,
+                    [(name, now) for name in names],
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            logger.exception("data version bump failed: %s", names)
+
+    def read(self, tables) -> tuple[dict[str, int], float]:
+        """指定テーブルと "*" の版数、およびその中で最後に書かれた時刻（epoch秒、なければ 0）。"""
+        names = sorted(set(tables) | {ALL_TABLES})
+        placeholders = ",".join("?" for _ in names)
+        rows = self._connect().execute(
+            f"SELECT table_name, version, updated_at FROM data_versions WHERE table_name IN ({placeholders})",
+            names,
+        ).fetchall()
+        versions = {name: 0 for name in names}
+        updated_at = 0.0
+        for name, version, ts in rows:
+            versions[name] = int(version)
+            updated_at = max(updated_at, float(ts))
+        return versions, updated_at
+
+
+data_versions = DataVersions()
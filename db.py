@@ -1,13 +1,72 @@
+import atexit
+import json
+import logging
 import os
+import re
 import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from logging.handlers import RotatingFileHandler
+from urllib.parse import quote
 
 import libsql
-from flask import g
+from flask import g, has_app_context, has_request_context
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス内の直列化だけ
+    fcntl = None
+
+from data_version import ALL_TABLES, data_versions, written_table
+from metrics import registry as metrics
+from projections import bring_up_to_date
+from shards import SHARD_DIR, ensure_shard_schema, shard_path
+from stores import DEFAULT_STORE_ID
 
 APP_DIR = os.path.abspath(os.path.dirname(__file__))
 DB_FILE = os.getenv("SQLITE_FILE", os.path.join(APP_DIR, "takoyaki_inventory.db"))
 REPLICA_FILE = os.getenv("TURSO_REPLICA_FILE", os.path.join(APP_DIR, "replica.db"))
 
+# sqlite 直結の接続設定（WAL なら読み取りが書き込みを待たない。journal_mode はファイルに残る）
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL").upper()
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+if SQLITE_JOURNAL_MODE not in ("WAL", "DELETE", "TRUNCATE", "PERSIST", "MEMORY"):
+    raise ValueError(f"SQLITE_JOURNAL_MODE が不正です: {SQLITE_JOURNAL_MODE}")
+if SQLITE_SYNCHRONOUS not in ("OFF", "NORMAL", "FULL", "EXTRA"):
+    raise ValueError(f"SQLITE_SYNCHRONOUS が不正です: {SQLITE_SYNCHRONOUS}")
+if SHARD_DIR and os.getenv("TURSO_DATABASE_URL") and os.getenv("TURSO_AUTH_TOKEN"):
+    raise ValueError("SHARD_DIR（店舗ごとのDBファイル）は sqlite 直結のときだけ使えます")
+
+# transaction(serialize=True) の書き込みキュー（ワーカー間は DB_WRITE_LOCK_FILE の flock）。0 で無効
+DB_WRITE_QUEUE = os.getenv("DB_WRITE_QUEUE", "1") != "0"
+DB_WRITE_LOCK_FILE = os.getenv("DB_WRITE_LOCK_FILE", DB_FILE + ".writelock")
+
+# リクエスト単位のSQL計測（SQL_TRACE=0 で無効）
+SQL_TRACE = os.getenv("SQL_TRACE", "1") != "0"
+
+# libsql の同期: deferred = コミットをまとめて裏スレッドで sync / immediate = 従来どおり毎回 sync
+TURSO_SYNC_MODE = os.getenv("TURSO_SYNC_MODE", "deferred")
+SYNC_COALESCE_MS = float(os.getenv("SYNC_COALESCE_MS", "200"))
+SYNC_RETRY_MAX_SEC = 30.0
+SYNC_STATE_FILE = os.getenv("SYNC_STATE_FILE", os.path.join(APP_DIR, "sync_state.db"))
+
+# transaction(): SQLITE_BUSY のときの再試行回数と初回の待ち時間（倍々に伸ばす）
+TX_BUSY_RETRIES = int(os.getenv("TX_BUSY_RETRIES", "5"))
+TX_BUSY_BACKOFF_SEC = 0.05
+
+# 指紋ごとの集計（ワーカー間は QUERY_STATS_FILE の SQLite に足し込んで共有）
+QUERY_STATS_FILE = os.getenv("QUERY_STATS_FILE", os.path.join(APP_DIR, "query_stats.db"))
+QUERY_STATS_FLUSH_SEC = float(os.getenv("QUERY_STATS_FLUSH_SEC", "30"))
+SLOW_SQL_MS = float(os.getenv("SLOW_SQL_MS", "100"))
+SLOW_SQL_LOG = os.getenv("SLOW_SQL_LOG", os.path.join(APP_DIR, "logs", "slow_sql.log"))
+SLOW_SQL_LOG_BYTES = 5 * 1024 * 1024
+SLOW_SQL_LOG_BACKUPS = 5
+# ヒストグラムの上限（ms）。固定なのでワーカー間でそのまま足し算できる
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float("inf"))
+
 
 def _row_to_dict(row, description):
     if row is None or description is None:
@@ -34,6 +93,13 @@ class _LibsqlCursor:
         rows = self._cursor.fetchall()
         return [_row_to_dict(row, self._cursor.description) for row in rows]
 
+    def fetchmany(self, size=None):
+        if size is None:
+            rows = self._cursor.fetchmany()
+        else:
+            rows = self._cursor.fetchmany(size)
+        return [_row_to_dict(row, self._cursor.description) for row in rows]
+
     def __iter__(self):
         return iter(self.fetchall())
 
@@ -49,10 +115,316 @@ class _LibsqlCursor:
         return getattr(self._cursor, name)
 
 
+# -----------------------------
+# SQL trace（リクエスト単位）
+# -----------------------------
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_IN_LIST = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_RE_SPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """リテラルを ? に、IN (?, ?, ...) を IN (?...) に畳んで1行にする。"""
+    sql = _RE_STRING.sub("?", sql)
+    sql = _RE_NUMBER.sub("?", sql)
+    sql = _RE_SPACE.sub(" ", sql).strip()
+    return _RE_IN_LIST.sub("IN (?...)", sql)
+
+
+class QueryTrace:
+    """1リクエスト中に実行したSQL（正規化SQL・所要時間・行数）の記録。"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements: list[dict] = []
+        self.transactions: list[dict] = []
+
+    def add(self, sql: str, duration: float, rows: int) -> dict:
+        rec = {"sql": normalize_sql(sql), "ms": duration * 1000, "rows": rows}
+        self.statements.append(rec)
+        return rec
+
+    def add_transaction(self, duration: float, outcome: str) -> None:
+        self.transactions.append({"ms": duration * 1000, "outcome": outcome})
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    @property
+    def tx_ms(self) -> float:
+        """書き込みロックを持っていた時間の合計。"""
+        return sum(t["ms"] for t in self.transactions)
+
+    @property
+    def total_ms(self) -> float:
+        return sum(r["ms"] for r in self.statements)
+
+    def top(self, n: int = 10) -> list[dict]:
+        """正規化SQLごとに合計時間の大きい順。"""
+        agg: dict[str, dict] = {}
+        for r in self.statements:
+            a = agg.setdefault(r["sql"], {"sql": r["sql"], "count": 0, "ms": 0.0, "max_ms": 0.0, "rows": 0})
+            a["count"] += 1
+            a["ms"] += r["ms"]
+            a["max_ms"] = max(a["max_ms"], r["ms"])
+            a["rows"] += r["rows"]
+        return sorted(agg.values(), key=lambda a: a["ms"], reverse=True)[:n]
+
+
+def start_query_trace() -> None:
+    if SQL_TRACE:
+        g.query_trace = QueryTrace()
+
+
+def get_query_trace() -> QueryTrace | None:
+    if not has_app_context():
+        return None
+    return g.get("query_trace")
+
+
+# -----------------------------
+# Query stats（指紋ごとのヒストグラム）
+# -----------------------------
+def _bucket_index(ms: float) -> int:
+    return bisect_left(LATENCY_BUCKETS_MS, ms)
+
+
+def histogram_quantile(buckets: list[int], q: float, max_ms: float) -> float:
+    """バケットの上限で近似した分位点（最大値を超えない）。"""
+    total = sum(buckets)
+    if total == 0:
+        return 0.0
+    rank = q * total
+    seen = 0
+    for idx, n in enumerate(buckets):
+        seen += n
+        if seen >= rank:
+            return min(LATENCY_BUCKETS_MS[idx], max_ms)
+    return max_ms
+
+
+class QueryStats:
+    """
+    プロセス内で溜めた差分を QUERY_STATS_FLUSH_SEC ごとに共有ファイルへ足し込む。
+    読むときは共有ファイル側（全ワーカー合算）を見る。
+    """
+
+    def __init__(self, path: str = QUERY_STATS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending: dict[str, dict] = {}
+        self._last_flush = time.monotonic()
+
+    def observe(self, fingerprint: str, ms: float) -> None:
+        with self._lock:
+            st = self._pending.get(fingerprint)
+            if st is None:
+                st = {"buckets": [0] * len(LATENCY_BUCKETS_MS), "count": 0, "sum_ms": 0.0, "max_ms": 0.0}
+                self._pending[fingerprint] = st
+            st["buckets"][_bucket_index(ms)] += 1
+            st["count"] += 1
+            st["sum_ms"] += ms
+            st["max_ms"] = max(st["max_ms"], ms)
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS query_stats (
+              fingerprint TEXT PRIMARY KEY,
+              count       INTEGER NOT NULL,
+              sum_ms      REAL    NOT NULL,
+              max_ms      REAL    NOT NULL,
+              buckets     TEXT    NOT NULL,
+              updated_at  TEXT    NOT NULL DEFAULT (datetime('now'))
+            )
+            """
+        )
+        return conn
+
+    def flush(self, force: bool = False) -> None:
+        if not force and time.monotonic() - self._last_flush < QUERY_STATS_FLUSH_SEC:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+        try:
+            self._write(pending)
+        except sqlite3.Error:
+            # 書けなかった分は戻して次回に回す
+            with self._lock:
+                for fp, st in pending.items():
+                    cur = self._pending.setdefault(fp, st)
+                    if cur is not st:
+                        cur["buckets"] = [a + b for a, b in zip(cur["buckets"], st["buckets"])]
+                        cur["count"] += st["count"]
+                        cur["sum_ms"] += st["sum_ms"]
+                        cur["max_ms"] = max(cur["max_ms"], st["max_ms"])
+            raise
+
+    def _write(self, pending: dict[str, dict]) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fp, st in pending.items():
+                row = conn.execute(
+                    "SELECT count, sum_ms, max_ms, buckets FROM query_stats WHERE fingerprint = ?",
+                    (fp,),
+                ).fetchone()
+                if row is not None:
+                    merged = [a + b for a, b in zip(json.loads(row[3]), st["buckets"])]
+                    st = {
+                        "buckets": merged,
+                        "count": row[0] + st["count"],
+                        "sum_ms": row[1] + st["sum_ms"],
+                        "max_ms": max(row[2], st["max_ms"]),
+                    }
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO query_stats (fingerprint, count, sum_ms, max_ms, buckets, updated_at)
+                    VALUES (?, ?, ?, ?, ?, datetime('now'))
+                    """,
+                    (fp, st["count"], st["sum_ms"], st["max_ms"], json.dumps(st["buckets"])),
+                )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def snapshot(self) -> list[dict]:
+        """全ワーカー合算の集計（合計時間の大きい順）。"""
+        self.flush(force=True)
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT fingerprint, count, sum_ms, max_ms, buckets FROM query_stats ORDER BY sum_ms DESC"
+            ).fetchall()
+        finally:
+            conn.close()
+        out = []
+        for fp, count, sum_ms, max_ms, buckets_json in rows:
+            buckets = json.loads(buckets_json)
+            out.append(
+                {
+                    "fingerprint": fp,
+                    "count": count,
+                    "total_ms": round(sum_ms, 3),
+                    "mean_ms": round(sum_ms / count, 3) if count else 0.0,
+                    "p50_ms": round(histogram_quantile(buckets, 0.50, max_ms), 3),
+                    "p95_ms": round(histogram_quantile(buckets, 0.95, max_ms), 3),
+                    "max_ms": round(max_ms, 3),
+                }
+            )
+        return out
+
+    def reset(self) -> None:
+        with self._lock:
+            self._pending = {}
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM query_stats")
+            conn.commit()
+        finally:
+            conn.close()
+
+
+query_stats = QueryStats()
+
+
+@atexit.register
+def _flush_query_stats_at_exit() -> None:
+    try:
+        query_stats.flush(force=True)
+    except sqlite3.Error:
+        pass
+
+
+slow_sql_logger = logging.getLogger("takoyaki.slowsql")
+
+
+def _ensure_slow_sql_handler() -> None:
+    if slow_sql_logger.handlers:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(SLOW_SQL_LOG)), exist_ok=True)
+    handler = RotatingFileHandler(
+        SLOW_SQL_LOG, maxBytes=SLOW_SQL_LOG_BYTES, backupCount=SLOW_SQL_LOG_BACKUPS, encoding="utf-8"
+    )
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_sql_logger.addHandler(handler)
+    slow_sql_logger.setLevel(logging.WARNING)
+    slow_sql_logger.propagate = False
+
+
+def finish_query_trace(trace: QueryTrace, label: str) -> None:
+    """リクエスト終了時に呼ぶ。指紋の集計に足し、遅いSQLはスローログへ。"""
+    for rec in trace.statements:
+        query_stats.observe(rec["sql"], rec["ms"])
+        if rec["ms"] >= SLOW_SQL_MS:
+            _ensure_slow_sql_handler()
+            slow_sql_logger.warning(
+                json.dumps(
+                    {"path": label, "ms": round(rec["ms"], 2), "rows": rec["rows"], "sql": rec["sql"]},
+                    ensure_ascii=False,
+                )
+            )
+    try:
+        query_stats.flush()
+    except sqlite3.Error:
+        # 集計ファイルが取れなくても本処理は止めない
+        pass
+
+
+class _TracedCursor:
+    """fetch した行数と時間を、execute 時の記録に足し込む。"""
+
+    def __init__(self, cursor, rec):
+        self._cursor = cursor
+        self._rec = rec
+
+    def _fetched(self, started, rows):
+        self._rec["ms"] += (time.perf_counter() - started) * 1000
+        self._rec["rows"] += len(rows)
+        return rows
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched(started, [] if row is None else [row])
+        return row
+
+    def fetchall(self):
+        started = time.perf_counter()
+        return self._fetched(started, self._cursor.fetchall())
+
+    def fetchmany(self, *args):
+        started = time.perf_counter()
+        return self._fetched(started, self._cursor.fetchmany(*args))
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+_RE_READ_ONLY_SQL = re.compile(r"\s*(SELECT|EXPLAIN|PRAGMA\s+\w+\s*(\(|;|$))", re.IGNORECASE)
+
+
 class _DBProxy:
-    def __init__(self, conn, is_libsql):
+    def __init__(self, conn, is_libsql, path=None):
         self._conn = conn
         self._is_libsql = is_libsql
+        self.path = path or DB_FILE  # 書き込みキューのロックファイルをDBファイルごとに分ける
+        # transaction() の状態（入れ子の深さ・書き込みの有無・書いたテーブル・sync を待つか）
+        self._tx_depth = 0
+        self._tx_dirty = False
+        self._tx_tables: set[str] = set()
+        self._tx_wait_sync = False
 
     def cursor(self, *args, **kwargs):
         cur = self._conn.cursor(*args, **kwargs)
@@ -61,53 +433,544 @@ class _DBProxy:
         return cur
 
     def execute(self, *args, **kwargs):
-        cur = self.cursor()
-        cur.execute(*args, **kwargs)
-        return cur
+        return self._run("execute", args, kwargs)
 
     def executemany(self, *args, **kwargs):
+        return self._run("executemany", args, kwargs)
+
+    def _run(self, method, args, kwargs):
+        if self._tx_depth:
+            sql = args[0] if args else kwargs.get("sql", "")
+            if not _RE_READ_ONLY_SQL.match(sql):
+                self._tx_dirty = True
+                self._tx_tables.add(written_table(sql))
         cur = self.cursor()
-        cur.executemany(*args, **kwargs)
-        return cur
+        trace = get_query_trace()
+        if trace is None:
+            getattr(cur, method)(*args, **kwargs)
+            return cur
+        started = time.perf_counter()
+        getattr(cur, method)(*args, **kwargs)
+        duration = time.perf_counter() - started
+        rowcount = cur.rowcount if cur.rowcount and cur.rowcount > 0 else 0
+        rec = trace.add(args[0] if args else kwargs.get("sql", ""), duration, rowcount)
+        return _TracedCursor(cur, rec)
 
     def __getattr__(self, name):
         return getattr(self._conn, name)
 
     def commit(self):
+        if self._tx_depth:
+            raise RuntimeError("transaction() の中では commit() できません")
         self._conn.commit()
-        if hasattr(self._conn, "sync"):
-            self._conn.sync()
+        data_versions.bump([ALL_TABLES])  # transaction() 外の書き込みは対象テーブルを追っていない
+        self._after_commit()
+
+    def _after_commit(self):
+        if not hasattr(self._conn, "sync"):
+            return
+        if TURSO_SYNC_MODE == "immediate":
+            _timed_sync(self._conn, "commit")
+        else:
+            sync_scheduler.notify_commit()
+
+
+def _timed_sync(conn, source: str) -> None:
+    started = time.perf_counter()
+    conn.sync()
+    metrics.observe(
+        "takoyaki_libsql_sync_duration_seconds", time.perf_counter() - started, {"source": source}
+    )
+    metrics.inc("takoyaki_libsql_sync_total", {"source": source})
+
+
+# -----------------------------
+# Deferred sync（コミットをまとめて裏で sync）
+# -----------------------------
+class _SyncState:
+    """
+    未同期コミットの水位（committed_seq / synced_seq）を SYNC_STATE_FILE に持つ。
+    全ワーカー共通。プロセスが落ちても committed > synced なら次の起動で sync し直す。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sync_state (
+              id             INTEGER PRIMARY KEY CHECK (id = 1),
+              committed_seq  INTEGER NOT NULL,
+              synced_seq     INTEGER NOT NULL,
+              updated_at     REAL    NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            "INSERT OR IGNORE INTO sync_state (id, committed_seq, synced_seq, updated_at) VALUES (1, 0, 0, ?)",
+            (time.time(),),
+        )
+        return conn
+
+    def mark_committed(self) -> int:
+        conn = self._connect()
+        try:
+            return conn.execute(
+                "UPDATE sync_state SET committed_seq = committed_seq + 1, updated_at = ? WHERE id = 1 RETURNING committed_seq",
+                (time.time(),),
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def read(self) -> tuple[int, int]:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT committed_seq, synced_seq FROM sync_state WHERE id = 1").fetchone()
+            return int(row[0]), int(row[1])
+        finally:
+            conn.close()
+
+    def mark_synced(self, seq: int) -> None:
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE sync_state SET synced_seq = MAX(synced_seq, ?), updated_at = ? WHERE id = 1",
+                (seq, time.time()),
+            )
+        finally:
+            conn.close()
+
+
+class SyncScheduler:
+    """
+    コミットのたびに notify_commit() し、SYNC_COALESCE_MS の間に来たコミットを1回の sync にまとめる。
+    sync は専用スレッドが専用の libsql 接続で行う（リクエストの接続は teardown で閉じるため）。
+    """
+
+    def __init__(self, connect, state: _SyncState):
+        self._connect = connect
+        self._state = state
+        self._cond = threading.Condition()
+        self._pid = None
+        self._thread = None
+        self._conn = None
+        self._pending = 0
+        self._first_pending_at = None
+        self._urgent = False
+        self._local_seq = 0
+        self._synced_local_seq = 0
+
+    def _ensure_thread(self) -> None:
+        # fork 後（gunicorn の preload）は親のスレッドを引き継がないので作り直す
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._conn = None
+        self._thread = threading.Thread(target=self._run, name="turso-sync", daemon=True)
+        self._thread.start()
+
+    def recover(self) -> None:
+        """前回の未同期コミットが残っていれば、すぐ sync する。"""
+        committed, synced = self._state.read()
+        if committed > synced:
+            with self._cond:
+                self._pending += 1
+                self._first_pending_at = self._first_pending_at or time.monotonic()
+                self._urgent = True
+                self._ensure_thread()
+                self._cond.notify_all()
+
+    def notify_commit(self) -> None:
+        try:
+            self._state.mark_committed()
+        except sqlite3.Error:
+            pass  # 水位が書けなくても sync 自体は行う
+        with self._cond:
+            if self._pending:
+                metrics.inc("takoyaki_sync_coalesced_commits_total")
+            self._pending += 1
+            self._local_seq += 1
+            self._first_pending_at = self._first_pending_at or time.monotonic()
+            metrics.inc_gauge("takoyaki_sync_pending_commits", 1)
+            self._ensure_thread()
+            self._cond.notify_all()
+
+    def flush(self, timeout: float | None = None) -> bool:
+        """ここまでのコミットが sync されるまで待つ（read-your-writes が要る呼び出し側用）。"""
+        with self._cond:
+            target = self._local_seq
+            if self._synced_local_seq >= target:
+                return True
+            self._urgent = True
+            self._ensure_thread()
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._synced_local_seq >= target, timeout)
+
+    def _run(self) -> None:
+        backoff = 0.5
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending > 0)
+                deadline = self._first_pending_at + SYNC_COALESCE_MS / 1000
+                while not self._urgent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                pending = self._pending
+                first_at = self._first_pending_at
+                target_local = self._local_seq
+                self._pending = 0
+                self._first_pending_at = None
+                self._urgent = False
+
+            try:
+                committed, _synced = self._state.read()
+            except sqlite3.Error:
+                committed = None
+            try:
+                if self._conn is None:
+                    self._conn = self._connect()
+                _timed_sync(self._conn, "deferred")
+            except Exception:
+                metrics.inc("takoyaki_sync_errors_total")
+                self._conn = None
+                with self._cond:
+                    # 失敗した分は次回に持ち越す
+                    self._pending += pending
+                    self._first_pending_at = first_at
+                time.sleep(backoff)
+                backoff = min(backoff * 2, SYNC_RETRY_MAX_SEC)
+                continue
+
+            backoff = 0.5
+            if committed is not None:
+                try:
+                    self._state.mark_synced(committed)
+                except sqlite3.Error:
+                    pass
+            metrics.observe("takoyaki_sync_lag_seconds", time.monotonic() - first_at)
+            metrics.inc_gauge("takoyaki_sync_pending_commits", -pending)
+            with self._cond:
+                self._synced_local_seq = max(self._synced_local_seq, target_local)
+                self._cond.notify_all()
+
+
+def _connect_for_sync():
+    return libsql.connect(
+        REPLICA_FILE,
+        sync_url=os.getenv("TURSO_DATABASE_URL"),
+        auth_token=os.getenv("TURSO_AUTH_TOKEN"),
+    )
+
+
+sync_scheduler = SyncScheduler(_connect_for_sync, _SyncState(SYNC_STATE_FILE))
+_sync_recovered = False
+
+
+_journal_mode_ready: set[str] = set()  # journal_mode を設定済みのファイル
+_shards_ready: set[str] = set()  # 表定義をカタログに合わせ済みの店舗ファイル
+_shards_lock = threading.Lock()
+_store_resolver = None
+shard_logger = logging.getLogger("takoyaki.shards")
+
+
+def _configure_sqlite(conn, path: str) -> None:
+    if path not in _journal_mode_ready:
+        try:
+            conn.execute(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+            _journal_mode_ready.add(path)
+        except sqlite3.OperationalError:
+            pass  # 他の接続が書き込み中なら次の接続でやり直す
+    conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+
+
+def set_store_resolver(resolver) -> None:
+    """リクエスト中の店舗IDを返す関数を登録する（app.current_store_id）。get_db() の振り分けに使う。"""
+    global _store_resolver
+    _store_resolver = resolver
+
+
+def _routed_store_id() -> int:
+    if "store_id" in g:
+        return g.store_id
+    if _store_resolver is not None and has_request_context():
+        return _store_resolver()
+    return DEFAULT_STORE_ID  # CLI など。別の店舗は get_store_db(store_id) で開く
 
 
 def get_db():
-    if "db" in g:
-        return g.db
+    """
+    今の店舗の接続（リクエスト内で使い回す）。
+    SHARD_DIR がなければ全店舗共通の1ファイルで、get_catalog_db() と同じ接続を返す。
+    """
+    if not SHARD_DIR or g.get("db_catalog_scope"):
+        return get_catalog_db()
+    return get_store_db(_routed_store_id())
+
+
+def get_catalog_db():
+    """材料・仕入れ先・レシピ・店舗（カタログ）を書き換えるときの接続。"""
+    if "db_catalog" not in g:
+        g.db_catalog = _connect()
+    return g.db_catalog
+
+
+def get_store_db(store_id: int):
+    """指定した店舗の接続（リクエスト内で使い回す）。店舗をまたぐ CLI・集計用。"""
+    if not SHARD_DIR:
+        return get_catalog_db()
+    shards = g.setdefault("db_shards", {})
+    if store_id not in shards:
+        shards[store_id] = _connect(shard_path(store_id))
+    return shards[store_id]
+
+
+def connect_store_db(store_id: int):
+    """
+    g を使わずに店舗の接続を新しく開く（スレッドプールから店舗ごとに並べて読む fan_out 用）。
+    閉じるのは呼び出し側。
+    """
+    return _connect(shard_path(store_id)) if SHARD_DIR else _connect()
 
+
+@contextmanager
+def catalog_scope():
+    """この中の get_db() はカタログの接続を返す（スキーマ補正など、店舗を決める前の処理）。"""
+    prev = g.get("db_catalog_scope", False)
+    g.db_catalog_scope = True
+    try:
+        yield
+    finally:
+        g.db_catalog_scope = prev
+
+
+def _ensure_shard_ready(db) -> None:
+    """プロセスで最初に開いたときだけ、店舗ファイルの表定義をカタログに合わせる。"""
+    with _shards_lock:
+        if db.path in _shards_ready:
+            return
+        db.execute("PRAGMA foreign_keys = OFF")  # 作り直しの DROP で明細を消さない
+        try:
+            with transaction(db, serialize=True):
+                changed = ensure_shard_schema(db)
+                caught_up = bring_up_to_date(db)
+        finally:
+            db.execute("PRAGMA foreign_keys = ON")
+        if changed:
+            shard_logger.warning("店舗ファイルの表を合わせました: %s %s", db.path, changed)
+        if caught_up:
+            shard_logger.warning("店舗ファイルの射影に台帳を反映しました: %s %s", db.path, caught_up)
+        _shards_ready.add(db.path)
+
+
+def _connect(shard_file: str | None = None):
+    """shard_file を渡すと店舗ファイルを開き、カタログを catalog として読み取り専用で ATTACH する。"""
     turso_url = os.getenv("TURSO_DATABASE_URL")
     turso_token = os.getenv("TURSO_AUTH_TOKEN")
-    use_libsql = bool(turso_url and turso_token)
+    use_libsql = bool(turso_url and turso_token) and shard_file is None
 
     if use_libsql:
         conn = libsql.connect(
             REPLICA_FILE, sync_url=turso_url, auth_token=turso_token
         )
-        conn.sync()
+        _timed_sync(conn, "connect")
+        global _sync_recovered
+        if not _sync_recovered and TURSO_SYNC_MODE != "immediate":
+            _sync_recovered = True
+            sync_scheduler.recover()
     else:
-        conn = sqlite3.connect(DB_FILE)
+        path = shard_file or DB_FILE
+        if shard_file is not None:
+            os.makedirs(os.path.dirname(shard_file), exist_ok=True)
+        # uri=True は ATTACH の file:...?mode=ro のため（普通のパスはそのままファイル名として扱われる）
+        conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000, uri=shard_file is not None)
         conn.row_factory = sqlite3.Row
+        _configure_sqlite(conn, path)
+        if shard_file is not None:
+            conn.execute(
+                "ATTACH DATABASE ? AS catalog", (f"file:{quote(os.path.abspath(DB_FILE))}?mode=ro",)
+            )
 
     conn.execute("PRAGMA foreign_keys = ON;")
+    backend = "libsql" if use_libsql else ("shard" if shard_file else "sqlite")
+    metrics.inc("takoyaki_db_connections_opened_total", {"backend": backend})
+    metrics.inc_gauge("takoyaki_db_connections_open", 1)
 
-    g.db = _DBProxy(conn, is_libsql=use_libsql)
-    return g.db
+    db = _DBProxy(conn, is_libsql=use_libsql, path=shard_file)
+    if shard_file is not None:
+        _ensure_shard_ready(db)
+    return db
 
 
 def close_db(_exc=None):
-    db = g.pop("db", None)
-    if db is not None:
+    dbs = list(g.pop("db_shards", {}).values())
+    catalog = g.pop("db_catalog", None)
+    if catalog is not None:
+        dbs.append(catalog)
+    for db in dbs:
         db.close()
+        metrics.inc_gauge("takoyaki_db_connections_open", -1)
+
+
+def flush_sync(timeout: float | None = None) -> bool:
+    """未同期のコミットを今すぐ sync し、終わるまで待つ。sqlite 直結や immediate では何もしない。"""
+    if TURSO_SYNC_MODE == "immediate" or not (
+        os.getenv("TURSO_DATABASE_URL") and os.getenv("TURSO_AUTH_TOKEN")
+    ):
+        return True
+    return sync_scheduler.flush(timeout)
+
+
+# -----------------------------
+# Transaction（書き込みの単位）
+# -----------------------------
+class Rollback(Exception):
+    """transaction() の中で raise すると、そのブロックだけロールバックして静かに抜ける（dry-run 用）。"""
 
 
-def commit_and_sync():
-    db = get_db()
-    db.commit()
+def _is_busy(exc: Exception) -> bool:
+    msg = str(exc).lower()
+    return "database is locked" in msg or "busy" in msg
+
+
+def _retry_busy(fn, stage: str):
+    delay = TX_BUSY_BACKOFF_SEC
+    for attempt in range(TX_BUSY_RETRIES + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt == TX_BUSY_RETRIES or not _is_busy(e):
+                raise
+            metrics.inc("takoyaki_db_busy_retries_total", {"stage": stage})
+            time.sleep(delay)
+            delay *= 2
+
+
+class WriteQueue:
+    """
+    長い台帳書き込みを1本ずつ順番に通す。プロセス内は Lock、ワーカー間はロックファイルの flock。
+    SQLite の busy ハンドラ（ポーリング）で取り合うより、待ち順が安定し再試行も起きない。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self):
+        started = time.perf_counter()
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                metrics.observe(
+                    "takoyaki_db_lock_wait_seconds", time.perf_counter() - started, {"stage": "queue"}
+                )
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+
+write_queue = WriteQueue(DB_WRITE_LOCK_FILE)
+_shard_write_queues: dict[str, WriteQueue] = {}
+_shard_write_queues_lock = threading.Lock()
+
+
+def _write_queue_for(db) -> WriteQueue:
+    """店舗ファイルは店舗ごとに並ぶ（他店舗の長い書き込みを待たない）。"""
+    if db.path == DB_FILE:
+        return write_queue
+    with _shard_write_queues_lock:
+        queue = _shard_write_queues.get(db.path)
+        if queue is None:
+            queue = _shard_write_queues[db.path] = WriteQueue(db.path + ".writelock")
+        return queue
+
+
+@contextmanager
+def transaction(db=None, sync: str = "deferred", serialize: bool = False):
+    """
+    書き込みの1単位。外側は BEGIN IMMEDIATE ～ COMMIT、入れ子は SAVEPOINT になる。
+
+    - 例外ならロールバックして投げ直す（Rollback だけは投げ直さない）。
+    - 書き込みがあったときだけ外側の COMMIT で1回 sync する。中で db.commit() は呼べない。
+      sync="deferred" は裏でまとめて、"wait" は sync の完了まで待つ。
+    - 書き込みロックの取得と COMMIT は、SQLITE_BUSY なら間隔を倍々にして再試行する。
+    - serialize=True（棚卸・日報など長い台帳書き込み）は write_queue に並んでから BEGIN する。
+    """
+    if sync not in ("deferred", "wait"):
+        raise ValueError(f"unknown sync mode: {sync}")
+    db = db or get_db()
+    conn = db._conn
+
+    if db._tx_depth:
+        name = f"sp_{db._tx_depth}"
+        conn.execute(f"SAVEPOINT {name}")
+        db._tx_depth += 1
+        db._tx_wait_sync = db._tx_wait_sync or sync == "wait"
+        try:
+            yield db
+        except Rollback:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+        except BaseException:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+            raise
+        else:
+            conn.execute(f"RELEASE {name}")
+        finally:
+            db._tx_depth -= 1
+        return
+
+    # libsql の埋め込みレプリカは書き込みをリモートに委譲するので、ローカルのロックは先取りしない
+    begin_sql = "BEGIN" if db._is_libsql else "BEGIN IMMEDIATE"
+    queued = _write_queue_for(db).hold() if serialize and DB_WRITE_QUEUE else nullcontext()
+    with queued:
+        started = time.perf_counter()
+        _retry_busy(lambda: conn.execute(begin_sql), "begin")
+        metrics.observe(
+            "takoyaki_db_lock_wait_seconds", time.perf_counter() - started, {"stage": "begin"}
+        )
+        db._tx_depth = 1
+        db._tx_dirty = False
+        db._tx_tables = set()
+        db._tx_wait_sync = sync == "wait"
+        started = time.perf_counter()
+        outcome = "rollback"
+        try:
+            yield db
+            if db._tx_dirty:
+                _retry_busy(conn.commit, "commit")
+                outcome = "commit"
+            else:
+                conn.rollback()
+                outcome = "empty"
+        except Rollback:
+            conn.rollback()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            db._tx_depth = 0
+            duration = time.perf_counter() - started
+            metrics.observe("takoyaki_db_transaction_seconds", duration, {"outcome": outcome})
+            trace = get_query_trace()
+            if trace is not None:
+                trace.add_transaction(duration, outcome)
+
+    if outcome == "commit":
+        data_versions.bump(db._tx_tables)
+        db._after_commit()
+        if db._tx_wait_sync:
+            flush_sync()
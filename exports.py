@@ -0,0 +1,210 @@
+"""
+CSVエクスポート（Excelでそのまま開けるUTF-8 BOM付き）。
+Webの /exports と CLI（flask --app app export ...）の両方から使う。
+行は EXPORT_CHUNK_SIZE 件ずつ fetchmany するので、何年分でもメモリは一定。
+在庫明細はアーカイブ済みの分も含めた inventory_tx_history から出す（期首繰越行は含めない）。
+どの種類も店舗（store_id）ごとに出す。
+"""
+from __future__ import annotations
+
+import csv
+import io
+from datetime import date, timedelta
+
+EXPORT_CHUNK_SIZE = 1000
+CSV_BOM = "\ufeff"
+
+EXPORT_KINDS = ("inventory_tx", "purchases", "stocktakes", "daily_reports")
+
+
+def parse_export_date(raw: str | None) -> date | None:
+    """'YYYY-MM-DD' を date に。空なら None、不正なら ValueError。"""
+    raw = (raw or "").strip()
+    if not raw:
+        return None
+    return date.fromisoformat(raw)
+
+
+def _range_params(date_from: date | None, date_to: date | None) -> tuple[str, str]:
+    # 終了日はその日を含めたいので翌日未満で比較する（インデックスが効くよう文字列比較）
+    start = date_from.isoformat() if date_from else "0000-01-01"
+    end = (date_to + timedelta(days=1)).isoformat() if date_to else "9999-12-31"
+    return start, end
+
+
+def build_export_query(
+    kind: str,
+    store_id: int,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    location: str | None = None,
+) -> tuple[str, list[object]]:
+    start, end = _range_params(date_from, date_to)
+
+    if kind == "inventory_tx":
+        sql = """
+            SELECT
+              tx.tx_id,
+              tx.happened_at,
+              tx.item_id,
+              i.name AS item_name,
+              i.unit_base,
+              tx.qty_delta,
+              tx.tx_type,
+              tx.location,
+              tx.ref_type,
+              tx.ref_id,
+              tx.note
+            FROM inventory_tx_history tx
+            JOIN items i ON i.item_id = tx.item_id
+            WHERE tx.store_id = ?
+              AND tx.happened_at >= ?
+              AND tx.happened_at < ?
+        """
+        params: list[object] = [store_id, start, end]
+        if location:
+            sql += " AND UPPER(tx.location) = ?"
+            params.append(location)
+        sql += " ORDER BY tx.happened_at ASC, tx.tx_id ASC"
+        return sql, params
+
+    if kind == "purchases":
+        # 入庫先は inventory_tx(PURCHASE) から推定（一覧画面と同じ）
+        sql = """
+            SELECT
+              p.purchase_id,
+              p.purchased_at,
+              p.supplier_id,
+              s.name AS supplier_name,
+              COALESCE(loc.location, 'STORE') AS location,
+              p.total_amount,
+              p.note,
+              pl.purchase_line_id,
+              pl.item_id,
+              i.name AS item_name,
+              i.unit_base,
+              pl.qty,
+              pl.unit_price,
+              pl.line_amount
+            FROM purchases p
+            LEFT JOIN suppliers s ON s.supplier_id = p.supplier_id
+            LEFT JOIN (
+              SELECT ref_id, MIN(location) AS location
+              FROM inventory_tx_history
+              WHERE ref_type = 'PURCHASE'
+                AND store_id = ?
+              GROUP BY ref_id
+            ) loc ON loc.ref_id = p.purchase_id
+            LEFT JOIN purchase_lines pl ON pl.purchase_id = p.purchase_id
+            LEFT JOIN items i ON i.item_id = pl.item_id
+            WHERE p.store_id = ?
+              AND p.purchased_at >= ?
+              AND p.purchased_at < ?
+        """
+        params = [store_id, store_id, start, end]
+        if location:
+            sql += " AND UPPER(COALESCE(loc.location, 'STORE')) = ?"
+            params.append(location)
+        sql += " ORDER BY p.purchased_at ASC, p.purchase_id ASC, pl.purchase_line_id ASC"
+        return sql, params
+
+    if kind == "stocktakes":
+        sql = """
+            SELECT
+              st.stocktake_id,
+              st.taken_at,
+              st.scope,
+              st.location,
+              st.note,
+              sl.stocktake_line_id,
+              sl.item_id,
+              i.name AS item_name,
+              i.unit_base,
+              sl.counted_qty,
+              sl.unit_cost,
+              sl.line_amount
+            FROM stocktakes st
+            LEFT JOIN stocktake_lines sl ON sl.stocktake_id = st.stocktake_id
+            LEFT JOIN items i ON i.item_id = sl.item_id
+            WHERE st.store_id = ?
+              AND st.taken_at >= ?
+              AND st.taken_at < ?
+        """
+        params = [store_id, start, end]
+        if location:
+            sql += " AND UPPER(st.location) = ?"
+            params.append(location)
+        sql += " ORDER BY st.taken_at ASC, st.stocktake_id ASC, sl.stocktake_line_id ASC"
+        return sql, params
+
+    if kind == "daily_reports":
+        # 日報は店舗（STORE）固定なので location は絞り込みに使わない
+        sql = """
+            SELECT
+              daily_report_id,
+              report_date,
+              sold_batches,
+              waste_pieces,
+              production_minutes,
+              sales_amount,
+              impression,
+              created_at
+            FROM daily_reports
+            WHERE store_id = ?
+              AND report_date >= ?
+              AND report_date < ?
+            ORDER BY report_date ASC, daily_report_id ASC
+        """
+        return sql, [store_id, start, end]
+
+    raise ValueError(f"unknown export kind: {kind}")
+
+
+def iter_export_csv(
+    db,
+    kind: str,
+    store_id: int,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    location: str | None = None,
+    with_bom: bool = True,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+):
+    """
+    CSVを文字列チャンクで順に返すジェネレータ。
+    BOM → ヘッダ行 → chunk_size 行ずつ、の順に yield する。
+    """
+    sql, params = build_export_query(kind, store_id, date_from, date_to, location)
+    cur = db.execute(sql, params)
+    columns = [col[0] for col in cur.description]
+
+    buf = io.StringIO()
+    writer = csv.writer(buf)  # 改行は CRLF（Excel互換）
+
+    if with_bom:
+        buf.write(CSV_BOM)
+    writer.writerow(columns)
+    yield buf.getvalue()
+
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            break
+        buf.seek(0)
+        buf.truncate()
+        for row in rows:
+            writer.writerow([row[c] for c in columns])
+        yield buf.getvalue()
+
+
+def export_filename(
+    kind: str, date_from: date | None, date_to: date | None, location: str | None
+) -> str:
+    parts = [kind]
+    if date_from or date_to:
+        parts.append(
+            f"{date_from.isoformat() if date_from else 'start'}_{date_to.isoformat() if date_to else 'end'}"
+        )
+    if location:
+        parts.append(location.lower())
+    return "_".join(parts) + ".csv"
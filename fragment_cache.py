@@ -0,0 +1,68 @@
+"""
+描画済み HTML 断片のキャッシュ（プロセス内 LRU、合計サイズで上限）。
+
+- キーは (テンプレート名, パラメータ)。値にはデータ版数（data_version_etag）を一緒に持ち、
+  版数が変わっていれば外れとして捨てる。同じキーの古い版が残り続けることはない。
+- 合計が max_bytes を超えたら古く使われたものから捨てる（eviction）。
+- ヒット・ミス・追い出しは metrics（takoyaki_cache_requests_total / takoyaki_cache_evictions_total）、
+  使用量は takoyaki_fragment_cache_bytes に出す。
+"""
+from __future__ import annotations
+
+import sys
+import threading
+from collections import OrderedDict
+
+from metrics import cache_hit, cache_miss
+from metrics import registry as metrics
+
+
+class FragmentCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[tuple, tuple[str, str, int]] = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: tuple, version: str) -> str | None:
+        label = f"fragment:{key[0]}"
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                cache_hit(label)
+                return entry[1]
+            if entry is not None:
+                self._drop(key)
+                metrics.inc_gauge("takoyaki_fragment_cache_bytes", -entry[2])
+        cache_miss(label)
+        return None
+
+    def put(self, key: tuple, version: str, html: str) -> None:
+        size = sys.getsizeof(html)
+        if size > self.max_bytes:
+            return
+        evicted = 0
+        with self._lock:
+            before = self._bytes
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (version, html, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                evicted += 1
+            delta = self._bytes - before
+        metrics.inc_gauge("takoyaki_fragment_cache_bytes", delta)
+        if evicted:
+            metrics.inc("takoyaki_cache_evictions_total", {"cache": "fragment"}, evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            freed, self._bytes = self._bytes, 0
+            self._entries.clear()
+        metrics.inc_gauge("takoyaki_fragment_cache_bytes", -freed)
+
+    def _drop(self, key: tuple) -> None:
+        _version, _html, size = self._entries.pop(key)
+        self._bytes -= size
@@ -0,0 +1,16 @@
+"""
+gunicorn の設定。  gunicorn -c gunicorn.conf.py
+
+- preload_app: マスターで app を import して create_app() のウォームアップ（テンプレートのコンパイル・
+  スキーマ補正・DB接続）を1回だけ行い、ワーカーはそれを fork で引き継ぐ。
+  ワーカーの入れ替え（max_requests）や増減のたびに初回リクエストが遅くなるのを防ぐ。
+- DB 接続はリクエストごとに開くので fork をまたがない（Turso の sync スレッドも fork 後に作り直す）。
+"""
+import os
+
+wsgi_app = "app:create_app()"
+bind = os.getenv("GUNICORN_BIND", "127.0.0.1:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+preload_app = True
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = 100
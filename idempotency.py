@@ -0,0 +1,82 @@
+"""
+フォーム送信の冪等キー（二度押し・回線が不安定なときの再送で入庫・棚卸・移動を二重に登録しない）。
+
+- 登録フォームは開くたびに新しいキー（idempotency_key）を hidden で持つ。
+- 書き込みのトランザクションの最後に (store_id, キー) と結果（リダイレクト先）を idempotency_keys に残す。
+  書き込みと同じ COMMIT なので、キーだけ残って書き込みが無い（またはその逆）ことはない。
+- 同じキーの2回目は、書き込みも sync も行わずに最初の結果へリダイレクトする。
+  2つが同時に届いたときは後の方が COMMIT 前に DuplicateSubmission で戻される。
+- 行は IDEMPOTENCY_TTL_SEC（既定 1日）で期限切れ。記録のたびに期限切れの行を消す（created_at の索引で範囲削除）。
+"""
+from __future__ import annotations
+
+import os
+import time
+
+IDEMPOTENCY_TTL_SEC = float(os.getenv("IDEMPOTENCY_TTL_SEC", str(24 * 3600)))
+IDEMPOTENCY_KEY_MAX_LEN = 64
+
+
+class DuplicateSubmission(Exception):
+    """同じキーの送信がすでに COMMIT 済み。location は最初の送信の結果。"""
+
+    def __init__(self, location: str):
+        super().__init__(location)
+        self.location = location
+
+
+def ensure_idempotency_schema(db) -> None:
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+          store_id    INTEGER NOT NULL,
+          idem_key    TEXT    NOT NULL,
+          endpoint    TEXT    NOT NULL,
+          location    TEXT    NOT NULL,  -- 最初の送信のリダイレクト先
+          created_at  REAL    NOT NULL,  -- epoch 秒（期限切れの判定）
+          PRIMARY KEY (store_id, idem_key)
+        ) WITHOUT ROWID
+        """
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON idempotency_keys(created_at)"
+    )
+
+
+def normalize_key(raw: str | None) -> str | None:
+    key = (raw or "").strip()
+    if not key or len(key) > IDEMPOTENCY_KEY_MAX_LEN:
+        return None
+    return key
+
+
+def find_submission(db, store_id: int, key: str, now: float | None = None) -> str | None:
+    """期限内に COMMIT 済みの送信があればそのリダイレクト先。"""
+    now = time.time() if now is None else now
+    row = db.execute(
+        """
+        SELECT location FROM idempotency_keys
+        WHERE store_id = ? AND idem_key = ? AND created_at >= ?
+        """,
+        (store_id, key, now - IDEMPOTENCY_TTL_SEC),
+    ).fetchone()
+    return row["location"] if row else None
+
+
+def remember_submission(db, store_id: int, key: str, endpoint: str, location: str) -> None:
+    """
+    書き込みのトランザクションの中（COMMIT の直前）で呼ぶ。
+    同じキーが先に COMMIT されていたら DuplicateSubmission（呼び出し側でロールバックされる）。
+    """
+    now = time.time()
+    db.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (now - IDEMPOTENCY_TTL_SEC,))
+    cur = db.execute(
+        """
+        INSERT INTO idempotency_keys (store_id, idem_key, endpoint, location, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (store_id, idem_key) DO NOTHING
+        """,
+        (store_id, key, endpoint, location, now),
+    )
+    if cur.rowcount == 0:
+        raise DuplicateSubmission(find_submission(db, store_id, key, now) or location)
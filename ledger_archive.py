@@ -0,0 +1,267 @@
+"""
+inventory_tx のアーカイブ（締め済み月の圧縮）。
+
+締め済み＝最新の月次棚卸（MONTHLY）の月より前。その期間の明細行を inventory_tx_archive へ移し、
+inventory_tx には (item_id, location) ごとの「期首繰越」行を1行だけ残す。締めは店舗ごとに行う。
+在庫残量は inventory_tx の合計なので、日々の集計は直近の明細＋繰越行だけを読めばよくなる。
+
+移動前後で (item_id, location) ごとの残量が一致することを同じトランザクション内で検証し、
+ズレたら LedgerArchiveError を投げる（呼び出し側で rollback する）。
+"""
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+
+LEDGER_OPENING_NOTE = "期首繰越（アーカイブ）"
+BALANCE_TOLERANCE = 1e-6
+
+
+class LedgerArchiveError(Exception):
+    pass
+
+
+def ensure_archive_schema(db) -> None:
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS inventory_tx_archive (
+          tx_id        INTEGER PRIMARY KEY,
+          store_id     INTEGER NOT NULL DEFAULT 1,
+          happened_at  TEXT    NOT NULL,
+          item_id      INTEGER NOT NULL,
+          qty_delta    REAL    NOT NULL,
+          tx_type      TEXT    NOT NULL,
+          location     TEXT    NOT NULL,
+          ref_type     TEXT,
+          ref_id       INTEGER,
+          note         TEXT,
+          archive_run_id INTEGER
+        )
+        """
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_inventory_tx_archive_ref ON inventory_tx_archive(ref_type, ref_id)"
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_inventory_tx_archive_item_id ON inventory_tx_archive(item_id)"
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS ledger_archive_runs (
+          archive_run_id  INTEGER PRIMARY KEY AUTOINCREMENT,
+          store_id        INTEGER NOT NULL DEFAULT 1,
+          cutoff          TEXT    NOT NULL,
+          archived_rows   INTEGER NOT NULL,
+          opening_rows    INTEGER NOT NULL,
+          created_at      TEXT    NOT NULL DEFAULT (datetime('now'))
+        )
+        """
+    )
+    # 明細の全履歴（アーカイブ＋現行、繰越行は除く）。詳細画面やエクスポート用
+    db.execute(
+        f"""
+        CREATE VIEW IF NOT EXISTS inventory_tx_history AS
+        SELECT tx_id, store_id, happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note
+        FROM inventory_tx_archive
+        UNION ALL
+        SELECT tx_id, store_id, happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note
+        FROM inventory_tx
+        WHERE NOT (ref_type IS NULL AND note = '{LEDGER_OPENING_NOTE}')
+        """
+    )
+
+
+def get_archive_cutoff(db, store_id: int) -> str | None:
+    """店舗のアーカイブ済みの境界（この時刻より前は inventory_tx_archive にある）。"""
+    row = db.execute(
+        "SELECT MAX(cutoff) AS cutoff FROM ledger_archive_runs WHERE store_id = ?", (store_id,)
+    ).fetchone()
+    return row["cutoff"] if row else None
+
+
+def has_archived_tx(db, ref_type: str, ref_id: int) -> bool:
+    """伝票の在庫明細がアーカイブ済みか（締め済みなので編集・削除させない）。"""
+    row = db.execute(
+        """
+        SELECT 1
+        FROM inventory_tx_archive
+        WHERE ref_type = ? AND ref_id = ?
+        LIMIT 1
+        """,
+        (ref_type, ref_id),
+    ).fetchone()
+    return row is not None
+
+
+def latest_closable_cutoff(db, store_id: int) -> str | None:
+    """店舗の最新の MONTHLY 棚卸の月初。これより前の月が締め済み。"""
+    row = db.execute(
+        """
+        SELECT taken_at
+        FROM stocktakes
+        WHERE store_id = ? AND scope = 'MONTHLY'
+        ORDER BY datetime(taken_at) DESC, stocktake_id DESC
+        LIMIT 1
+        """,
+        (store_id,),
+    ).fetchone()
+    if row is None or not row["taken_at"]:
+        return None
+    taken_at = str(row["taken_at"]).replace("T", " ")
+    return f"{taken_at[:7]}-01 00:00:00"
+
+
+def _columns(db, table: str) -> list[str]:
+    return [r["name"] for r in db.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def _sync_archive_columns(db) -> list[str]:
+    """inventory_tx に後から足された列を archive にも足し、共通列を返す。"""
+    live_cols = _columns(db, "inventory_tx")
+    archive_cols = set(_columns(db, "inventory_tx_archive"))
+    for col in live_cols:
+        if col not in archive_cols:
+            db.execute(f"ALTER TABLE inventory_tx_archive ADD COLUMN {col}")
+    return live_cols
+
+
+def _balances(db, table_sql: str, store_id: int) -> dict[tuple[int, str], float]:
+    rows = db.execute(
+        f"""
+        SELECT item_id, location, COALESCE(SUM(qty_delta), 0) AS qty
+        FROM {table_sql}
+        WHERE store_id = ?
+        GROUP BY item_id, location
+        """,
+        (store_id,),
+    ).fetchall()
+    return {(int(r["item_id"]), r["location"]): float(r["qty"] or 0) for r in rows}
+
+
+def _diff_balances(
+    before: dict[tuple[int, str], float], after: dict[tuple[int, str], float]
+) -> list[tuple[int, str, float, float]]:
+    diffs = []
+    for key in set(before) | set(after):
+        b = before.get(key, 0.0)
+        a = after.get(key, 0.0)
+        if abs(a - b) > BALANCE_TOLERANCE:
+            diffs.append((key[0], key[1], b, a))
+    return diffs
+
+
+def archive_ledger(db, cutoff: str, store_id: int, dry_run: bool = False) -> dict[str, object]:
+    """
+    店舗の happened_at < cutoff の inventory_tx を退避し、(item_id, location) ごとの繰越行に置き換える。
+    既存の繰越行は新しい繰越に畳み込む（アーカイブには入れない）。
+    トランザクションは呼び出し側で張ること。
+    """
+    ensure_archive_schema(db)
+
+    current = get_archive_cutoff(db, store_id)
+    if current is not None and cutoff <= current:
+        raise LedgerArchiveError(f"{cutoff} より前は既にアーカイブ済みです（境界: {current}）")
+
+    target = db.execute(
+        """
+        SELECT COUNT(*) AS n
+        FROM inventory_tx
+        WHERE store_id = ?
+          AND happened_at < ?
+          AND NOT (ref_type IS NULL AND note = ?)
+        """,
+        (store_id, cutoff, LEDGER_OPENING_NOTE),
+    ).fetchone()["n"]
+    if not target:
+        return {
+            "store_id": store_id,
+            "cutoff": cutoff,
+            "archived_rows": 0,
+            "opening_rows": 0,
+            "dry_run": dry_run,
+        }
+
+    # 繰越行は dry-run でも同じ集計で数える（プレビューと実行の件数をそろえる）
+    opening_at = (
+        datetime.strptime(cutoff, "%Y-%m-%d %H:%M:%S") - timedelta(seconds=1)
+    ).strftime("%Y-%m-%d %H:%M:%S")
+    opening_rows = db.execute(
+        """
+        SELECT item_id, location, SUM(qty_delta) AS qty
+        FROM inventory_tx
+        WHERE store_id = ? AND happened_at < ?
+        GROUP BY item_id, location
+        """,
+        (store_id, cutoff),
+    ).fetchall()
+    opening_params = [
+        (store_id, opening_at, int(r["item_id"]), float(r["qty"] or 0), r["location"], LEDGER_OPENING_NOTE)
+        for r in opening_rows
+        if abs(float(r["qty"] or 0)) > BALANCE_TOLERANCE
+    ]
+    if dry_run:
+        return {
+            "store_id": store_id,
+            "cutoff": cutoff,
+            "archived_rows": int(target),
+            "opening_rows": len(opening_params),
+            "dry_run": True,
+        }
+
+    live_before = _balances(db, "inventory_tx", store_id)
+    history_before = _balances(db, "inventory_tx_history", store_id)
+
+    cols = _sync_archive_columns(db)
+    col_sql = ", ".join(cols)
+
+    cur = db.execute(
+        "INSERT INTO ledger_archive_runs (store_id, cutoff, archived_rows, opening_rows) VALUES (?, ?, 0, 0)",
+        (store_id, cutoff),
+    )
+    run_id = cur.lastrowid
+
+    db.execute(
+        f"""
+        INSERT INTO inventory_tx_archive ({col_sql}, archive_run_id)
+        SELECT {col_sql}, ?
+        FROM inventory_tx
+        WHERE store_id = ?
+          AND happened_at < ?
+          AND NOT (ref_type IS NULL AND note = ?)
+        """,
+        (run_id, store_id, cutoff, LEDGER_OPENING_NOTE),
+    )
+    db.execute("DELETE FROM inventory_tx WHERE store_id = ? AND happened_at < ?", (store_id, cutoff))
+
+    if opening_params:
+        db.executemany(
+            """
+            INSERT INTO inventory_tx
+              (store_id, happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note)
+            VALUES
+              (?, ?, ?, ?, 'ADJUST', ?, NULL, NULL, ?)
+            """,
+            opening_params,
+        )
+
+    diffs = _diff_balances(live_before, _balances(db, "inventory_tx", store_id))
+    if diffs:
+        raise LedgerArchiveError(f"アーカイブ後の残量が一致しません: {diffs[:5]}")
+    diffs = _diff_balances(history_before, _balances(db, "inventory_tx_history", store_id))
+    if diffs:
+        raise LedgerArchiveError(f"明細履歴の合計が一致しません: {diffs[:5]}")
+
+    db.execute(
+        """
+        UPDATE ledger_archive_runs
+        SET archived_rows = ?, opening_rows = ?
+        WHERE archive_run_id = ?
+        """,
+        (int(target), len(opening_params), run_id),
+    )
+    return {
+        "store_id": store_id,
+        "cutoff": cutoff,
+        "archived_rows": int(target),
+        "opening_rows": len(opening_params),
+        "dry_run": False,
+    }
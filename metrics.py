@@ -0,0 +1,250 @@
+"""
+Prometheus テキスト形式のメトリクス（外部ライブラリなし）。
+
+- counter / histogram はプロセス内の差分を METRICS_FLUSH_SEC ごとに METRICS_FILE（SQLite）へ足し込む。
+  gunicorn のワーカーが何個でも、/metrics はファイル側の合算を返す。
+- gauge はワーカー(pid)ごとの現在値を書き、読むときに METRICS_GAUGE_STALE_SEC 以内のものだけ合計する
+  （落ちたワーカーの値を残さないため）。
+- ヒストグラムのバケットは定義時に固定なので、ワーカー間でそのまま足し算できる。
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+
+APP_DIR = os.path.abspath(os.path.dirname(__file__))
+METRICS_FILE = os.getenv("METRICS_FILE", os.path.join(APP_DIR, "metrics.db"))
+METRICS_FLUSH_SEC = float(os.getenv("METRICS_FLUSH_SEC", "10"))
+METRICS_GAUGE_STALE_SEC = 300
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _label_key(labels: dict | None) -> str:
+    return json.dumps(sorted((labels or {}).items()), ensure_ascii=False)
+
+
+def _format_labels(pairs: list, extra: tuple | None = None) -> str:
+    items = list(pairs) + ([extra] if extra else [])
+    if not items:
+        return ""
+
+    def esc(v) -> str:
+        return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}"
+
+
+def _format_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class Registry:
+    def __init__(self, path: str = METRICS_FILE):
+        self.path = path
+        self._defs: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._pending: dict[tuple[str, str, str], float] = {}
+        self._gauges: dict[tuple[str, str], float] = {}
+        self._last_flush = time.monotonic()
+
+    # --- 定義 ---
+    def counter(self, name: str, help_text: str) -> None:
+        self._defs[name] = {"kind": "counter", "help": help_text}
+
+    def gauge(self, name: str, help_text: str) -> None:
+        self._defs[name] = {"kind": "gauge", "help": help_text}
+
+    def histogram(self, name: str, help_text: str, buckets=SECONDS_BUCKETS) -> None:
+        self._defs[name] = {"kind": "histogram", "help": help_text, "buckets": tuple(buckets)}
+
+    # --- 記録 ---
+    def inc(self, name: str, labels: dict | None = None, value: float = 1) -> None:
+        key = (name, _label_key(labels), "")
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + value
+
+    def observe(self, name: str, value: float, labels: dict | None = None) -> None:
+        buckets = self._defs[name]["buckets"]
+        lk = _label_key(labels)
+        le = next((b for b in buckets if value <= b), float("inf"))
+        with self._lock:
+            for series, v in ((f"bucket:{le!r}", 1), ("sum", value), ("count", 1)):
+                key = (name, lk, series)
+                self._pending[key] = self._pending.get(key, 0) + v
+
+    def inc_gauge(self, name: str, delta: float = 1, labels: dict | None = None) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    # --- 共有ファイル ---
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS metric_samples (
+              metric  TEXT NOT NULL,
+              labels  TEXT NOT NULL,
+              series  TEXT NOT NULL,
+              value   REAL NOT NULL,
+              PRIMARY KEY (metric, labels, series)
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS metric_gauges (
+              metric      TEXT    NOT NULL,
+              labels      TEXT    NOT NULL,
+              pid         INTEGER NOT NULL,
+              value       REAL    NOT NULL,
+              updated_at  REAL    NOT NULL,
+              PRIMARY KEY (metric, labels, pid)
+            )
+            """
+        )
+        return conn
+
+    def flush(self, force: bool = False) -> None:
+        if not force and time.monotonic() - self._last_flush < METRICS_FLUSH_SEC:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            gauges = dict(self._gauges)
+            self._last_flush = time.monotonic()
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.executemany(
+                    """
+                    INSERT INTO metric_samples (metric, labels, series, value)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (metric, labels, series) DO UPDATE SET value = value + excluded.value
+                    """,
+                    [(m, lk, s, v) for (m, lk, s), v in pending.items()],
+                )
+                now = time.time()
+                pid = os.getpid()
+                conn.executemany(
+                    "INSERT OR REPLACE INTO metric_gauges (metric, labels, pid, value, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    [(m, lk, pid, v, now) for (m, lk), v in gauges.items()],
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            # 書けなかった差分は戻して次回に回す
+            with self._lock:
+                for key, v in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + v
+            raise
+
+    # --- 出力 ---
+    def render(self) -> str:
+        self.flush(force=True)
+        conn = self._connect()
+        try:
+            samples = conn.execute("SELECT metric, labels, series, value FROM metric_samples").fetchall()
+            gauges = conn.execute(
+                "SELECT metric, labels, SUM(value) FROM metric_gauges WHERE updated_at >= ? GROUP BY metric, labels",
+                (time.time() - METRICS_GAUGE_STALE_SEC,),
+            ).fetchall()
+        finally:
+            conn.close()
+
+        by_metric: dict[str, dict[str, dict[str, float]]] = {}
+        for metric, lk, series, value in samples:
+            by_metric.setdefault(metric, {}).setdefault(lk, {})[series] = value
+        for metric, lk, value in gauges:
+            by_metric.setdefault(metric, {}).setdefault(lk, {})[""] = value
+
+        lines: list[str] = []
+        for name, d in self._defs.items():
+            lines.append(f"# HELP {name} {d['help']}")
+            lines.append(f"# TYPE {name} {d['kind']}")
+            for lk, series in sorted(by_metric.get(name, {}).items()):
+                pairs = [tuple(p) for p in json.loads(lk)]
+                if d["kind"] != "histogram":
+                    lines.append(f"{name}{_format_labels(pairs)} {_format_value(series.get('', 0))}")
+                    continue
+                cumulative = 0.0
+                for b in d["buckets"] + (float("inf"),):
+                    cumulative += series.get(f"bucket:{b!r}", 0)
+                    lines.append(
+                        f"{name}_bucket{_format_labels(pairs, ('le', _format_value(b)))} {_format_value(cumulative)}"
+                    )
+                lines.append(f"{name}_sum{_format_labels(pairs)} {_format_value(series.get('sum', 0))}")
+                lines.append(f"{name}_count{_format_labels(pairs)} {_format_value(series.get('count', 0))}")
+        lines.extend(self._render_cache_ratios(by_metric))
+        return "\n".join(lines) + "\n"
+
+    def _render_cache_ratios(self, by_metric) -> list[str]:
+        hits: dict[str, float] = {}
+        totals: dict[str, float] = {}
+        for lk, series in by_metric.get("takoyaki_cache_requests_total", {}).items():
+            labels = dict(tuple(p) for p in json.loads(lk))
+            cache = labels.get("cache", "")
+            v = series.get("", 0)
+            totals[cache] = totals.get(cache, 0) + v
+            if labels.get("result") == "hit":
+                hits[cache] = hits.get(cache, 0) + v
+        name = "takoyaki_cache_hit_ratio"
+        lines = [f"# HELP {name} キャッシュのヒット率（起動以来の累計）", f"# TYPE {name} gauge"]
+        for cache, total in sorted(totals.items()):
+            ratio = hits.get(cache, 0) / total if total else 0.0
+            lines.append(f"{name}{_format_labels([('cache', cache)])} {_format_value(round(ratio, 6))}")
+        return lines
+
+
+registry = Registry()
+
+
+@atexit.register
+def _flush_at_exit() -> None:
+    # ワーカー終了時に残りの差分を書く（書けなければ諦める）
+    try:
+        registry.flush(force=True)
+    except sqlite3.Error:
+        pass
+
+
+registry.histogram("takoyaki_http_request_duration_seconds", "リクエスト処理時間（ルート別）")
+registry.counter("takoyaki_http_requests_total", "リクエスト数（ルート・ステータス別）")
+registry.histogram("takoyaki_db_time_seconds", "1リクエストあたりのDB時間（ルート別）")
+registry.counter("takoyaki_db_statements_total", "実行したSQL文の数（ルート別）")
+registry.counter("takoyaki_libsql_sync_total", "libsql conn.sync() の回数（connect=接続時 / commit=コミット時 / deferred=裏スレッド）")
+registry.histogram("takoyaki_libsql_sync_duration_seconds", "libsql conn.sync() の所要時間")
+registry.counter("takoyaki_db_connections_opened_total", "DB接続を開いた回数")
+registry.gauge("takoyaki_db_connections_open", "開いているDB接続数")
+registry.histogram("takoyaki_db_transaction_seconds", "transaction() の BEGIN から COMMIT/ROLLBACK まで（書き込みロックの保持時間）")
+registry.histogram("takoyaki_db_lock_wait_seconds", "書き込みロックの待ち時間（stage=queue: 書き込みキュー / begin: BEGIN IMMEDIATE）")
+registry.counter("takoyaki_db_busy_retries_total", "SQLITE_BUSY で再試行した回数（stage=begin/commit）")
+registry.counter("takoyaki_cache_requests_total", "キャッシュの参照数（result=hit/miss）")
+registry.counter("takoyaki_cache_evictions_total", "サイズ上限でキャッシュから追い出した件数")
+registry.gauge("takoyaki_fragment_cache_bytes", "HTML断片キャッシュの使用量（バイト）")
+registry.counter("takoyaki_sync_coalesced_commits_total", "先行コミットの sync にまとめられたコミット数")
+registry.histogram("takoyaki_sync_lag_seconds", "最初の未同期コミットから sync 完了までの時間")
+registry.gauge("takoyaki_sync_pending_commits", "まだ sync されていないコミット数")
+registry.counter("takoyaki_sync_errors_total", "裏スレッドの sync 失敗回数（再試行する）")
+
+
+def cache_hit(cache: str) -> None:
+    registry.inc("takoyaki_cache_requests_total", {"cache": cache, "result": "hit"})
+
+
+def cache_miss(cache: str) -> None:
+    registry.inc("takoyaki_cache_requests_total", {"cache": cache, "result": "miss"})
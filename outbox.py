@@ -0,0 +1,159 @@
+"""
+台帳・伝票の変更フィード（change data capture）。集計シートやダッシュボードが表を読み直さずに差分だけ取る。
+
+- 台帳・入庫・棚卸・移動（それぞれ明細も）・日報・台帳のアーカイブ（OUTBOX_TABLES）の
+  INSERT / UPDATE / DELETE を、トリガーで outbox に1行ずつ積む。書き込みと同じ文の中で積むので、
+  COMMIT された変更だけが必ず載る。backup.py の時点復元もこれを書いた順に再適用する。
+- seq は AUTOINCREMENT（消しても再利用しない）。書き込みは BEGIN IMMEDIATE で1本ずつなので、
+  seq の順 = COMMIT の順。読む側は「最後に読んだ seq」をカーソルに持ち、それより後だけを読む。
+- payload は書いた後の行（DELETE は消した行）の JSON。列はトリガーを作ったときの表の列で、
+  列が増えたら ensure_outbox_schema() がトリガーを作り直す。
+- 店舗ファイルに分けているときは outbox も店舗ごと（seq も店舗ごと）。1ファイルのときは全店舗で1本の seq。
+- 古い行は `flask outbox-prune` で消す。消した範囲より前のカーソルで読むと truncated になる
+  （読み直しは CSV エクスポートから）。
+- 読む口: asgi.py の /api/read/changes（ロングポーリング）・/api/read/changes/stream（SSE）、
+  `flask outbox-tail`。
+"""
+from __future__ import annotations
+
+import json
+import os
+
+OUTBOX_BATCH_ROWS = int(os.getenv("OUTBOX_BATCH_ROWS", "500"))
+OUTBOX_POLL_INTERVAL_SEC = float(os.getenv("OUTBOX_POLL_INTERVAL_SEC", "0.5"))
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "30"))
+
+# 表 -> (主キー, store_id を持たない明細なら (親のキー, 親の表))
+OUTBOX_TABLES = {
+    "inventory_tx": ("tx_id", None),
+    "purchases": ("purchase_id", None),
+    "purchase_lines": ("purchase_line_id", ("purchase_id", "purchases")),
+    "stocktakes": ("stocktake_id", None),
+    "stocktake_lines": ("stocktake_line_id", ("stocktake_id", "stocktakes")),
+    "transfers": ("transfer_id", None),
+    "transfer_lines": ("transfer_line_id", ("transfer_id", "transfers")),
+    "daily_reports": ("daily_report_id", None),
+    "ledger_archive_runs": ("archive_run_id", None),
+    "inventory_tx_archive": ("tx_id", None),
+}
+_OPS = ("INSERT", "UPDATE", "DELETE")
+
+
+def _store_expr(table: str, row: str) -> str:
+    _pk, parent = OUTBOX_TABLES[table]
+    if parent is None:
+        return f"{row}.store_id"
+    key, parent_table = parent
+    # 親ごと消したとき（ON DELETE CASCADE）は親がもう無いので NULL になる。明細は先に消すこと
+    return f"(SELECT store_id FROM {parent_table} WHERE {key} = {row}.{key})"
+
+
+def trigger_sqls(db) -> dict[str, str]:
+    """表ごと・操作ごとに outbox へ積むトリガー。列は今の表の定義から取る。"""
+    sqls = {}
+    for table, (pk, _parent) in OUTBOX_TABLES.items():
+        columns = [r["name"] for r in db.execute(f"PRAGMA table_info({table})").fetchall()]
+        if not columns:
+            continue
+        for op in _OPS:
+            row = "OLD" if op == "DELETE" else "NEW"
+            payload = ", ".join(f"'{c}', {row}.{c}" for c in columns)
+            name = f"trg_outbox_{table}_{op.lower()}"
+            sqls[name] = (
+                f"CREATE TRIGGER {name} AFTER {op} ON {table} BEGIN "
+                f"INSERT INTO outbox (store_id, table_name, op, row_id, payload) "
+                f"VALUES ({_store_expr(table, row)}, '{table}', '{op}', {row}.{pk}, json_object({payload})); END"
+            )
+    return sqls
+
+
+def ensure_outbox_schema(db) -> None:
+    """outbox とトリガーを作る（定義が変わったトリガーは作り直す）。トランザクションの中で呼ぶこと。"""
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+          seq         INTEGER PRIMARY KEY AUTOINCREMENT,  -- 単調増加。消しても再利用しない
+          store_id    INTEGER,
+          table_name  TEXT    NOT NULL,
+          op          TEXT    NOT NULL CHECK (op IN ('INSERT','UPDATE','DELETE')),
+          row_id      INTEGER NOT NULL,                   -- その表の主キー
+          payload     TEXT    NOT NULL,                   -- 書いた後の行（DELETE は消した行）の JSON
+          created_at  TEXT    NOT NULL DEFAULT (datetime('now'))
+        )
+        """
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_outbox_store_seq ON outbox(store_id, seq)")
+    for name, sql in trigger_sqls(db).items():
+        row = db.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,)
+        ).fetchone()
+        if row is not None and row["sql"] == sql:
+            continue
+        db.execute(f"DROP TRIGGER IF EXISTS {name}")
+        db.execute(sql)
+
+
+def latest_seq(db) -> int:
+    row = db.execute("SELECT MAX(seq) AS seq FROM outbox").fetchone()
+    return int(row["seq"] or 0)
+
+
+def pruned_through(db) -> int:
+    """ここまでの seq は消してある（これより前のカーソルでは取りこぼしがありうる）。"""
+    row = db.execute("SELECT MIN(seq) AS seq FROM outbox").fetchone()
+    if row["seq"] is not None:
+        return int(row["seq"]) - 1
+    row = db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'outbox'").fetchone()
+    return int(row["seq"]) if row else 0
+
+
+def fetch_changes(db, store_id: int, since: int, limit: int = OUTBOX_BATCH_ROWS) -> dict[str, object]:
+    """
+    since より後の変更を seq の順に最大 limit 件。
+    next は次に渡すカーソル、more は続きがあるか、truncated は since より後がすでに消えているか。
+    """
+    rows = db.execute(
+        """
+        SELECT seq, table_name, op, row_id, payload, created_at
+        FROM outbox
+        WHERE store_id = ? AND seq > ?
+        ORDER BY seq
+        LIMIT ?
+        """,
+        (store_id, since, limit),
+    ).fetchall()
+    changes = [
+        {
+            "seq": r["seq"],
+            "table": r["table_name"],
+            "op": r["op"],
+            "row_id": r["row_id"],
+            "row": json.loads(r["payload"]),
+            "created_at": r["created_at"],
+        }
+        for r in rows
+    ]
+    return {
+        "changes": changes,
+        "next": changes[-1]["seq"] if changes else since,
+        "more": len(changes) == limit,
+        "truncated": since < pruned_through(db),
+    }
+
+
+def prune_outbox(db, days: int = OUTBOX_RETENTION_DAYS) -> int:
+    """
+    days 日より前の行を消す。消した行数を返す。トランザクションの中で呼ぶこと。
+    seq と created_at はどちらも積んだ順なので、残す最初の行より前を seq の範囲で消す（全件は読まない）。
+    """
+    cur = db.execute(
+        """
+        DELETE FROM outbox
+        WHERE seq < COALESCE(
+          (SELECT seq FROM outbox WHERE created_at >= datetime('now', ?) ORDER BY seq LIMIT 1),
+          (SELECT MAX(seq) + 1 FROM outbox)
+        )
+        """,
+        (f"-{int(days)} days",),
+    )
+    return cur.rowcount
@@ -0,0 +1,142 @@
+"""
+リクエスト単位の cProfile（本番でも必要なときだけ）。
+
+- 管理トークン付きで X-Profile: 1 ヘッダか ?_profile=1 を付けたリクエスト、
+  または PROFILE_SAMPLE_RATE の確率で選ばれたリクエストを計測する。
+- ビュー関数とテンプレート描画を含めて after_request までを計測し、
+  PROFILE_DIR に <id>.prof（pstats 形式）と <id>.json（ルート・所要時間・SQL数）を保存する。
+  古いものは PROFILE_KEEP 件を残して消す。
+- 一覧・ダウンロード・2件の差分は /admin/profiles から。
+"""
+from __future__ import annotations
+
+import cProfile
+import glob
+import json
+import os
+import pstats
+import random
+import re
+from datetime import datetime, timezone
+
+APP_DIR = os.path.abspath(os.path.dirname(__file__))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(APP_DIR, "profiles"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_KEEP = 200
+PROFILE_TOP = 40
+
+_PROFILE_ID_RE = re.compile(r"^\d{8}T\d{12}-\d+$")
+
+
+def should_sample() -> bool:
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def start_profile() -> cProfile.Profile | None:
+    prof = cProfile.Profile()
+    try:
+        prof.enable()
+    except ValueError:
+        # 他のプロファイラが動いている（デバッガ等）
+        return None
+    return prof
+
+
+def is_valid_id(profile_id: str) -> bool:
+    return bool(_PROFILE_ID_RE.match(profile_id or ""))
+
+
+def profile_path(profile_id: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+
+
+def _meta_path(profile_id: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{profile_id}.json")
+
+
+def save_profile(prof: cProfile.Profile, meta: dict) -> str:
+    prof.disable()
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    profile_id = f"{now.strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}"
+    prof.dump_stats(profile_path(profile_id))
+    meta = dict(meta, profile_id=profile_id, created_at=now.strftime("%Y-%m-%d %H:%M:%S"))
+    with open(_meta_path(profile_id), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    _rotate()
+    return profile_id
+
+
+def _rotate() -> None:
+    metas = sorted(glob.glob(os.path.join(PROFILE_DIR, "*.json")), reverse=True)
+    for path in metas[PROFILE_KEEP:]:
+        profile_id = os.path.basename(path)[: -len(".json")]
+        for p in (path, profile_path(profile_id)):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles() -> list[dict]:
+    out = []
+    for path in sorted(glob.glob(os.path.join(PROFILE_DIR, "*.json")), reverse=True):
+        try:
+            with open(path, encoding="utf-8") as f:
+                out.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return out
+
+
+def load_meta(profile_id: str) -> dict | None:
+    if not is_valid_id(profile_id):
+        return None
+    try:
+        with open(_meta_path(profile_id), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _func_label(key: tuple) -> str:
+    filename, line, func = key
+    if filename == "~":
+        return func  # 組み込み関数
+    rel = os.path.relpath(filename, APP_DIR) if filename.startswith(APP_DIR) else filename
+    return f"{rel}:{line}({func})"
+
+
+def _stats_table(profile_id: str) -> dict[str, dict]:
+    stats = pstats.Stats(profile_path(profile_id))
+    table = {}
+    for key, (cc, nc, tt, ct, _callers) in stats.stats.items():
+        table[_func_label(key)] = {"calls": nc, "tottime_ms": tt * 1000, "cumtime_ms": ct * 1000}
+    return table
+
+
+def top_functions(profile_id: str, sort: str = "cumtime_ms", limit: int = PROFILE_TOP) -> list[dict]:
+    rows = [dict(v, func=k) for k, v in _stats_table(profile_id).items()]
+    return sorted(rows, key=lambda r: r[sort], reverse=True)[:limit]
+
+
+def diff_profiles(a_id: str, b_id: str, limit: int = PROFILE_TOP) -> list[dict]:
+    """関数ごとの累積時間の差（b - a）。差の絶対値が大きい順。"""
+    a = _stats_table(a_id)
+    b = _stats_table(b_id)
+    rows = []
+    for func in set(a) | set(b):
+        ra = a.get(func, {"calls": 0, "cumtime_ms": 0.0, "tottime_ms": 0.0})
+        rb = b.get(func, {"calls": 0, "cumtime_ms": 0.0, "tottime_ms": 0.0})
+        rows.append(
+            {
+                "func": func,
+                "a_calls": ra["calls"],
+                "b_calls": rb["calls"],
+                "a_cumtime_ms": ra["cumtime_ms"],
+                "b_cumtime_ms": rb["cumtime_ms"],
+                "delta_ms": rb["cumtime_ms"] - ra["cumtime_ms"],
+                "delta_tottime_ms": rb["tottime_ms"] - ra["tottime_ms"],
+            }
+        )
+    return sorted(rows, key=lambda r: abs(r["delta_tottime_ms"]), reverse=True)[:limit]
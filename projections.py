@@ -0,0 +1,264 @@
+"""
+台帳（inventory_tx）からの射影（projection）。台帳の行をイベントとして畳み込んだ派生テーブル。
+
+- 射影は Projection として PROJECTIONS に登録する。fold_sql は inventory_tx の1行（名前付き引数
+  :store_id / :item_id / :location / :qty_delta … と、足すなら 1・取り消すなら -1 の :sign）を
+  派生テーブルに反映する UPSERT。
+- 差分更新: projection_cursors に射影ごとの last_applied_tx_id を持つ（それ以下の行は反映済み）。
+  台帳に行を書いたら、同じトランザクションの中で AFTER INSERT トリガーが畳み込んでカーソルを進める。
+  読む側は派生テーブルを引くだけで、書き込みロックは取らない。
+- トリガーが畳み込むのは、カーソルがその行の直前の行まで進んでいるときだけ（遅れている射影を
+  飛ばして進めない）。遅れ（トリガーを作る前の行など）は起動時・店舗ファイルを開いたときに
+  bring_up_to_date() が catch_up で取り戻す（カーソルより後の tx_id だけをチャンクで読む）。
+- 台帳の行は消える・書き換わることがある（伝票の編集・削除、締めのアーカイブ、材料や保管場所の
+  ON UPDATE CASCADE）。反映済みの行（tx_id <= カーソル）が消えたら取り消し、書き換わったら取り消して
+  反映し直すトリガーを fold_sql から作る。未反映の行は次の catch_up で読むだけなので何もしない。
+- 全再構築: 派生テーブルを空にしてカーソルを 0 に戻し、台帳を先頭からチャンクで流して畳み込む（rebuild）。
+- 整合チェック: 同じ畳み込みを一時テーブルに作り、差分更新してきた派生テーブルと突き合わせる（check）。
+"""
+from __future__ import annotations
+
+import os
+import re
+from dataclasses import dataclass
+
+PROJECTION_CHUNK_ROWS = int(os.getenv("PROJECTION_CHUNK_ROWS", "5000"))
+PROJECTION_TOLERANCE = 1e-6
+
+_TX_COLUMNS = "tx_id, store_id, happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note"
+_RE_PARAM = re.compile(r":(\w+)")
+
+
+@dataclass(frozen=True)
+class Projection:
+    name: str
+    table: str
+    create_sql: str  # {table} に表名が入る
+    key_columns: tuple[str, ...]
+    value_columns: tuple[str, ...]
+    fold_sql: str  # {table} に表名が入る。:sign と inventory_tx の列名を名前付き引数で受ける
+    # 畳み込んだ結果、件数が 0 になった行（すべて取り消された）は比較しない。その判定に使う列
+    count_column: str
+
+    def fold_into(self, table: str) -> str:
+        return self.fold_sql.format(table=table)
+
+    def trigger_sqls(self) -> dict[str, str]:
+        """
+        台帳に書いた行の畳み込みと、反映済みの行が消えた・書き換わったときの取り消し（と反映し直し）のトリガー。
+        カーソルが無い（まだ作っていない）射影では何もしない。
+        """
+        applied = (
+            f"(SELECT last_applied_tx_id FROM projection_cursors WHERE name = '{self.name}')"
+        )
+
+        def fold(row: str, sign: int) -> str:
+            sql = _RE_PARAM.sub(
+                lambda m: str(sign) if m.group(1) == "sign" else f"{row}.{m.group(1)}",
+                self.fold_into(self.table),
+            )
+            return " ".join(sql.split()) + ";"
+
+        # 直前の行まで反映済みのときだけ（tx_id の索引を1回引くだけ）
+        caught_up = (
+            f"{applied} >= COALESCE((SELECT MAX(tx_id) FROM inventory_tx WHERE tx_id < NEW.tx_id), 0)"
+        )
+        advance = (
+            f"UPDATE projection_cursors SET last_applied_tx_id = NEW.tx_id, updated_at = datetime('now') "
+            f"WHERE name = '{self.name}';"
+        )
+        return {
+            f"trg_{self.table}_tx_insert": (
+                f"CREATE TRIGGER trg_{self.table}_tx_insert AFTER INSERT ON inventory_tx "
+                f"WHEN NEW.tx_id > {applied} AND {caught_up} BEGIN {fold('NEW', 1)} {advance} END"
+            ),
+            f"trg_{self.table}_tx_delete": (
+                f"CREATE TRIGGER trg_{self.table}_tx_delete AFTER DELETE ON inventory_tx "
+                f"WHEN OLD.tx_id <= {applied} BEGIN {fold('OLD', -1)} END"
+            ),
+            f"trg_{self.table}_tx_update": (
+                f"CREATE TRIGGER trg_{self.table}_tx_update AFTER UPDATE ON inventory_tx "
+                f"WHEN OLD.tx_id <= {applied} BEGIN {fold('OLD', -1)} {fold('NEW', 1)} END"
+            ),
+        }
+
+
+INVENTORY_BALANCES = Projection(
+    name="inventory_balances",
+    table="inventory_balances",
+    create_sql="""
+        CREATE TABLE IF NOT EXISTS {table} (
+          store_id  INTEGER NOT NULL,
+          item_id   INTEGER NOT NULL,
+          location  TEXT    NOT NULL,
+          qty       REAL    NOT NULL,  -- 保管場所ごとの残量（qty_delta の合計）
+          tx_count  INTEGER NOT NULL,  -- 畳み込んだ台帳行の数（取り消しで減る）
+          PRIMARY KEY (store_id, item_id, location)
+        ) WITHOUT ROWID
+    """,
+    key_columns=("store_id", "item_id", "location"),
+    value_columns=("qty", "tx_count"),
+    fold_sql="""
+        INSERT INTO {table} (store_id, item_id, location, qty, tx_count)
+        VALUES (:store_id, :item_id, :location, :sign * :qty_delta, :sign)
+        ON CONFLICT (store_id, item_id, location) DO UPDATE
+          SET qty = qty + excluded.qty, tx_count = tx_count + excluded.tx_count
+    """,
+    count_column="tx_count",
+)
+
+PROJECTIONS = {p.name: p for p in (INVENTORY_BALANCES,)}
+PROJECTION_TABLES = ("projection_cursors",) + tuple(p.table for p in PROJECTIONS.values())
+
+
+def ensure_projection_schema(db) -> None:
+    """
+    射影の表・カーソル・トリガーを作る。中身は bring_up_to_date() で台帳から作る・追いつかせること。
+    トランザクションの中で呼ぶこと。
+    """
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS projection_cursors (
+          name                TEXT    PRIMARY KEY,
+          last_applied_tx_id  INTEGER NOT NULL,
+          rebuilt_at          TEXT,
+          updated_at          TEXT    NOT NULL DEFAULT (datetime('now'))
+        )
+        """
+    )
+    for p in PROJECTIONS.values():
+        db.execute(p.create_sql.format(table=p.table))
+        for name, sql in p.trigger_sqls().items():
+            row = db.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,)
+            ).fetchone()
+            if row is not None and row["sql"] == sql:
+                continue
+            db.execute(f"DROP TRIGGER IF EXISTS {name}")
+            db.execute(sql)
+
+
+def get_cursor(db, name: str) -> int:
+    row = db.execute(
+        "SELECT last_applied_tx_id FROM projection_cursors WHERE name = ?", (name,)
+    ).fetchone()
+    return int(row["last_applied_tx_id"]) if row else 0
+
+
+def _set_cursor(db, name: str, tx_id: int, rebuilt: bool = False) -> None:
+    db.execute(
+        """
+        INSERT INTO projection_cursors (name, last_applied_tx_id, rebuilt_at, updated_at)
+        VALUES (?, ?, CASE WHEN ? THEN datetime('now') END, datetime('now'))
+        ON CONFLICT (name) DO UPDATE SET
+          last_applied_tx_id = excluded.last_applied_tx_id,
+          rebuilt_at = COALESCE(excluded.rebuilt_at, rebuilt_at),
+          updated_at = excluded.updated_at
+        """,
+        (name, tx_id, rebuilt),
+    )
+
+
+def latest_tx_id(db) -> int:
+    row = db.execute("SELECT MAX(tx_id) AS tx_id FROM inventory_tx").fetchone()
+    return int(row["tx_id"] or 0)
+
+
+def _iter_chunks(db, after_tx_id: int, chunk_rows: int):
+    """tx_id の昇順に chunk_rows 行ずつ（全件をメモリに載せない）。"""
+    while True:
+        rows = db.execute(
+            f"SELECT {_TX_COLUMNS} FROM inventory_tx WHERE tx_id > ? ORDER BY tx_id LIMIT ?",
+            (after_tx_id, chunk_rows),
+        ).fetchall()
+        if not rows:
+            return
+        yield rows
+        after_tx_id = int(rows[-1]["tx_id"])
+
+
+def _fold_chunk(db, sql: str, rows) -> None:
+    db.executemany(sql, [dict(r, sign=1) for r in rows])
+
+
+def catch_up(db, projection: Projection, chunk_rows: int = PROJECTION_CHUNK_ROWS) -> int:
+    """カーソルより後の台帳行を畳み込む。反映した行数を返す。トランザクションの中で呼ぶこと。"""
+    cursor = get_cursor(db, projection.name)
+    sql = projection.fold_into(projection.table)
+    applied = 0
+    for rows in _iter_chunks(db, cursor, chunk_rows):
+        _fold_chunk(db, sql, rows)
+        cursor = int(rows[-1]["tx_id"])
+        applied += len(rows)
+    if applied:
+        _set_cursor(db, projection.name, cursor)
+    return applied
+
+
+def rebuild(db, projection: Projection, chunk_rows: int = PROJECTION_CHUNK_ROWS) -> int:
+    """派生テーブルを台帳から作り直す。畳み込んだ行数を返す。トランザクションの中で呼ぶこと。"""
+    db.execute(f"DELETE FROM {projection.table}")
+    _set_cursor(db, projection.name, 0, rebuilt=True)
+    return catch_up(db, projection, chunk_rows)
+
+
+def bring_up_to_date(db) -> dict[str, int]:
+    """
+    カーソルの無い射影は台帳から作り、遅れている射影は追いつかせる。反映した行数を射影ごとに返す
+    （何もしなければ空）。ensure_projection_schema() の後に、トランザクションの中で呼ぶこと。
+    """
+    latest = latest_tx_id(db)
+    applied: dict[str, int] = {}
+    for projection in PROJECTIONS.values():
+        has_cursor = db.execute(
+            "SELECT 1 FROM projection_cursors WHERE name = ?", (projection.name,)
+        ).fetchone() is not None
+        if not has_cursor:
+            applied[projection.name] = rebuild(db, projection)
+        elif get_cursor(db, projection.name) < latest:
+            applied[projection.name] = catch_up(db, projection)
+    return applied
+
+
+def check(db, projection: Projection, chunk_rows: int = PROJECTION_CHUNK_ROWS) -> list[dict]:
+    """
+    差分更新の結果と、台帳から作り直した結果（一時テーブル）を突き合わせる。食い違った行を返す。
+    先に catch_up() してから、同じトランザクションの中で呼ぶこと（途中で台帳が動かないように）。
+    """
+    shadow = f"{projection.table}__check"
+    db.execute(f"DROP TABLE IF EXISTS temp.{shadow}")
+    db.execute(
+        projection.create_sql.format(table=shadow).replace("CREATE TABLE IF NOT EXISTS", "CREATE TEMP TABLE", 1)
+    )
+    sql = projection.fold_into(f"temp.{shadow}")
+    last = get_cursor(db, projection.name)
+    for rows in _iter_chunks(db, 0, chunk_rows):
+        rows = [r for r in rows if int(r["tx_id"]) <= last]
+        if rows:
+            _fold_chunk(db, sql, rows)
+
+    keys = ", ".join(projection.key_columns)
+    join = " AND ".join(f"a.{c} = b.{c}" for c in projection.key_columns)
+    values = ", ".join(
+        f"a.{c} AS incremental_{c}, b.{c} AS rebuilt_{c}" for c in projection.value_columns
+    )
+    differs = " OR ".join(
+        f"ABS(COALESCE(a.{c}, 0) - COALESCE(b.{c}, 0)) > {PROJECTION_TOLERANCE}"
+        for c in projection.value_columns
+    )
+    live = f"{projection.count_column} != 0"
+    mismatches = db.execute(
+        f"""
+        WITH a AS (SELECT * FROM main.{projection.table} WHERE {live}),
+             b AS (SELECT * FROM temp.{shadow} WHERE {live}),
+             k AS (SELECT {keys} FROM a UNION SELECT {keys} FROM b)
+        SELECT {", ".join(f"k.{c}" for c in projection.key_columns)}, {values}
+        FROM k
+        LEFT JOIN a ON {join.replace("b.", "k.")}
+        LEFT JOIN b ON {join.replace("a.", "k.")}
+        WHERE {differs}
+        ORDER BY {", ".join(f"k.{c}" for c in projection.key_columns)}
+        """
+    ).fetchall()
+    db.execute(f"DROP TABLE temp.{shadow}")
+    return [dict(r) for r in mismatches]
@@ -0,0 +1,412 @@
+"""
+負荷検証用の合成データを作る（seed 固定で毎回同じ内容）。
+
+  python seed_data.py -o /tmp/scale.db [--years 5] [--items 40] [--suppliers 8] [--seed 42]
+  SQLITE_FILE=/tmp/scale.db flask --app app run
+
+- スキーマは --schema のDB（既定: takoyaki_inventory.db）から CREATE 文だけ写す。データは写さない。
+- 1日ごとに 日報(CONSUME) → 週1の入庫(PURCHASE) → 倉庫→店舗の移動 → 週次/月次棚卸(ADJUST) を
+  材料ごとの理論在庫を追いながら作るので、残量がマイナスに張り付いたりはしない。
+- 行はメモリに溜めて SEED_FLUSH_ROWS 件ごとに executemany、トランザクションは1年単位。
+  journal_mode=OFF / synchronous=OFF の一時ファイルに書いてから -o に rename する。
+- daily_reports は (store_id, report_date) が UNIQUE で本店1店舗分だけ作るので、規模は --years と --items で調整する。
+  例: --years 5 --items 10000 で inventory_tx 約1,000万行（数分）。
+- transfers の inventory_tx(TRANSFER) はスキーマの CHECK が許す場合だけ作る。
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from db import DB_FILE
+
+SEED_FLUSH_ROWS = 50_000
+
+UNITS = ("g", "ml", "pcs")
+FOOD_NAMES = ("たこ", "小麦粉", "天かす", "紅しょうが", "青のり", "かつお節", "ソース", "マヨネーズ", "卵", "だし", "ねぎ", "キャベツ")
+SUPPLY_NAMES = ("舟皿", "つまようじ", "ガスボンベ", "キッチンペーパー", "レジ袋", "ゴム手袋", "洗剤", "ラップ")
+CLOSED_WEEKDAY = 1  # 火曜定休
+
+INSERT_SQL = {
+    "suppliers": "INSERT INTO suppliers (supplier_id, name, phone, note, created_at) VALUES (?, ?, ?, ?, ?)",
+    "items": """
+        INSERT INTO items (
+          item_id, supplier_id, name, category, unit_base, reorder_point, ref_unit_price,
+          is_active, created_at, is_fixed, cost_group, note
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?, 0, ?, NULL)
+    """,
+    "batch_config": """
+        INSERT INTO batch_config (batch_config_id, name, pieces_per_batch, is_active, created_at)
+        VALUES (?, ?, ?, 1, ?)
+    """,
+    "recipe_batch": """
+        INSERT INTO recipe_batch (batch_config_id, item_id, qty_per_batch, auto_consume)
+        VALUES (?, ?, ?, ?)
+    """,
+    "daily_reports": """
+        INSERT INTO daily_reports (
+          daily_report_id, report_date, sold_batches, waste_pieces, production_minutes,
+          sales_amount, impression, created_at
+        ) VALUES (?, ?, ?, 0, ?, ?, NULL, ?)
+    """,
+    "purchases": """
+        INSERT INTO purchases (purchase_id, supplier_id, purchased_at, note, total_amount)
+        VALUES (?, ?, ?, NULL, ?)
+    """,
+    "purchase_lines": """
+        INSERT INTO purchase_lines (purchase_id, item_id, qty, unit_price, line_amount)
+        VALUES (?, ?, ?, ?, ?)
+    """,
+    "transfers": """
+        INSERT INTO transfers (transfer_id, moved_at, from_location, to_location, note)
+        VALUES (?, ?, 'WAREHOUSE', 'STORE', NULL)
+    """,
+    "transfer_lines": "INSERT INTO transfer_lines (transfer_id, item_id, qty) VALUES (?, ?, ?)",
+    "stocktakes": """
+        INSERT INTO stocktakes (stocktake_id, taken_at, scope, location, note)
+        VALUES (?, ?, ?, 'WAREHOUSE', NULL)
+    """,
+    "stocktake_lines": """
+        INSERT INTO stocktake_lines (stocktake_id, item_id, counted_qty, unit_cost, line_amount)
+        VALUES (?, ?, ?, ?, ?)
+    """,
+    "inventory_tx": """
+        INSERT INTO inventory_tx (
+          happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+}
+# 親→子の順に flush する（外部キーのため）
+FLUSH_ORDER = tuple(INSERT_SQL)
+
+
+class _Loader:
+    """テーブルごとに行を溜めて、まとめて executemany する。"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.pending: dict[str, list[tuple]] = {t: [] for t in INSERT_SQL}
+        self.counts: dict[str, int] = {t: 0 for t in INSERT_SQL}
+        self._buffered = 0
+
+    def add(self, table: str, row: tuple) -> None:
+        self.pending[table].append(row)
+        self._buffered += 1
+        if self._buffered >= SEED_FLUSH_ROWS:
+            self.flush()
+
+    def flush(self) -> None:
+        for table in FLUSH_ORDER:
+            rows = self.pending[table]
+            if rows:
+                self.conn.executemany(INSERT_SQL[table], rows)
+                self.counts[table] += len(rows)
+                rows.clear()
+        self._buffered = 0
+
+
+def copy_schema(schema_db: str, conn: sqlite3.Connection) -> bool:
+    """スキーマだけ写す。inventory_tx が TRANSFER を受け付けるかを返す。"""
+    src = sqlite3.connect(f"file:{schema_db}?mode=ro", uri=True)
+    try:
+        rows = src.execute(
+            """
+            SELECT type, name, sql
+            FROM sqlite_master
+            WHERE sql IS NOT NULL
+              AND name NOT LIKE 'sqlite_%'
+            ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 WHEN 'view' THEN 2 ELSE 3 END
+            """
+        ).fetchall()
+    finally:
+        src.close()
+    allows_transfer = False
+    for kind, name, sql in rows:
+        conn.execute(sql)
+        if kind == "table" and name == "inventory_tx" and "'TRANSFER'" in sql:
+            allows_transfer = True
+    return allows_transfer
+
+
+def _stamp(d: date, hms: str = "09:00:00") -> str:
+    return f"{d.isoformat()} {hms}"
+
+
+def build_master(rng: random.Random, loader: _Loader, n_suppliers: int, n_items: int, created_at: str):
+    for sid in range(1, n_suppliers + 1):
+        loader.add("suppliers", (sid, f"仕入れ先{sid:02d}", f"03-0000-{sid:04d}", None, created_at))
+
+    items = []
+    for item_id in range(1, n_items + 1):
+        is_food = rng.random() < 0.4
+        base = FOOD_NAMES if is_food else SUPPLY_NAMES
+        name = f"{rng.choice(base)}{item_id:04d}"
+        unit = rng.choice(UNITS) if is_food else "pcs"
+        if unit == "pcs":
+            price = round(rng.uniform(5, 400), 1)
+        else:
+            price = round(rng.uniform(0.2, 3.0), 3)
+        supplier_id = rng.randint(1, n_suppliers)
+        # 1バッチ（80個）あたりの使用量。g/ml は数百、pcs は数個
+        per_batch = round(rng.uniform(50, 800), 1) if unit != "pcs" else round(rng.uniform(0.5, 10), 1)
+        auto_consume = 1 if is_food and rng.random() < 0.85 else 0
+        items.append(
+            {
+                "item_id": item_id,
+                "supplier_id": supplier_id,
+                "unit": unit,
+                "price": price,
+                "food": is_food,
+                "per_batch": per_batch if is_food else round(rng.uniform(0.05, 2.0), 2),
+                "auto_consume": auto_consume,
+            }
+        )
+        reorder = round(per_batch * 8, 1)
+        loader.add(
+            "items",
+            (
+                item_id,
+                supplier_id,
+                name,
+                "食材" if is_food else "消耗品",
+                unit,
+                reorder,
+                price,
+                created_at,
+                "FOOD" if is_food else "SUPPLIES",
+            ),
+        )
+
+    loader.add("batch_config", (1, "標準", 80, created_at))
+    for it in items:
+        if it["food"]:
+            loader.add("recipe_batch", (1, it["item_id"], it["per_batch"], it["auto_consume"]))
+    return items
+
+
+def generate(
+    out_conn: sqlite3.Connection,
+    allows_transfer: bool,
+    seed: int,
+    start: date,
+    years: int,
+    n_items: int,
+    n_suppliers: int,
+) -> dict[str, int]:
+    rng = random.Random(seed)
+    loader = _Loader(out_conn)
+    created_at = _stamp(start, "00:00:00")
+
+    out_conn.execute("BEGIN")
+    items = build_master(rng, loader, n_suppliers, n_items, created_at)
+    loader.flush()
+    out_conn.execute("COMMIT")
+
+    by_supplier: dict[int, list[dict]] = {}
+    for it in items:
+        by_supplier.setdefault(it["supplier_id"], []).append(it)
+
+    stock = {it["item_id"]: {"STORE": 0.0, "WAREHOUSE": 0.0} for it in items}
+    used_week = {it["item_id"]: 0.0 for it in items}
+    unrecorded = {it["item_id"]: 0.0 for it in items}
+    warehouse = {it["item_id"]: 0.0 for it in items}  # 実際に倉庫にある量（移動の台帳行がなくても追う）  # 自動消費しない材料の使用量（棚卸で台帳に出る）
+    drift = {it["item_id"]: 1.0 for it in items}
+
+    end = date(start.year + years, start.month, start.day)
+    ids = {"daily_reports": 0, "purchases": 0, "transfers": 0, "stocktakes": 0}
+
+    def next_id(table: str) -> int:
+        ids[table] += 1
+        return ids[table]
+
+    def add_tx(happened_at, item_id, qty, tx_type, location, ref_type, ref_id, note=None):
+        stock[item_id][location] += qty
+        loader.add("inventory_tx", (happened_at, item_id, qty, tx_type, location, ref_type, ref_id, note))
+
+    def stocktake(d: date, scope: str, targets: list[dict]):
+        # 23:59:59 JST = 14:59:59 UTC（アプリと同じく taken_at は UTC）
+        taken_at = _stamp(d, "14:59:59")
+        stocktake_id = next_id("stocktakes")
+        loader.add("stocktakes", (stocktake_id, taken_at, scope))
+        label = f"{scope}棚卸差分（ADJUST）"
+        for it in targets:
+            item_id = it["item_id"]
+            current = stock[item_id]["STORE"] + stock[item_id]["WAREHOUSE"]
+            # 実数＝台帳に出ていない使用分を引いた量。さらに ±3% くらいズレる
+            counted = max(0.0, round((current - unrecorded[item_id]) * rng.uniform(0.97, 1.02), 2))
+            unrecorded[item_id] = 0.0
+            unit_cost = round(it["price"] * drift[item_id], 3) if scope == "MONTHLY" else None
+            line_amount = round(counted * unit_cost, 2) if unit_cost is not None else None
+            loader.add("stocktake_lines", (stocktake_id, item_id, counted, unit_cost, line_amount))
+            delta = round(counted - current, 6)
+            if abs(delta) >= 1e-9:
+                add_tx(taken_at, item_id, delta, "ADJUST", "WAREHOUSE", "STOCKTAKE", stocktake_id, label)
+
+    food_items = [it for it in items if it["food"]]
+    consume_items = [it for it in food_items if it["auto_consume"]]
+    manual_items = [it for it in items if not it["auto_consume"]]
+
+    d = start
+    year = d.year
+    out_conn.execute("BEGIN")
+    while d < end:
+        if d.year != year:
+            loader.flush()
+            out_conn.execute("COMMIT")
+            out_conn.execute("BEGIN")
+            year = d.year
+
+        weekday = d.weekday()
+
+        # 週初（月曜）：仕入れ先ごとに入庫 → 倉庫から店舗へ移動
+        if weekday == 0:
+            for supplier_id, sup_items in by_supplier.items():
+                purchase_id = next_id("purchases")
+                purchased_at = _stamp(d)
+                total = 0.0
+                location = "WAREHOUSE" if rng.random() < 0.7 else "STORE"
+                for it in sup_items:
+                    item_id = it["item_id"]
+                    on_hand = stock[item_id]["STORE"] + stock[item_id]["WAREHOUSE"]
+                    need = max(used_week[item_id], it["per_batch"] * 30) * rng.uniform(1.0, 1.3) - on_hand
+                    if need <= 0 and rng.random() < 0.8:
+                        continue
+                    qty = round(max(need, it["per_batch"] * 10), 1)
+                    drift[item_id] *= rng.uniform(0.995, 1.008)  # 緩やかな値上がり
+                    unit_price = round(it["price"] * drift[item_id], 3)
+                    line_amount = round(qty * unit_price, 2)
+                    total += line_amount
+                    loader.add("purchase_lines", (purchase_id, item_id, qty, unit_price, line_amount))
+                    add_tx(purchased_at, item_id, qty, "PURCHASE", location, "PURCHASE", purchase_id)
+                    if location == "WAREHOUSE":
+                        warehouse[item_id] += qty
+                loader.add("purchases", (purchase_id, supplier_id, purchased_at, round(total, 2)))
+
+            moves = [
+                (it["item_id"], round(warehouse[it["item_id"]] * rng.uniform(0.6, 0.9), 2))
+                for it in items
+                if warehouse[it["item_id"]] > 0
+            ]
+            moves = [(item_id, qty) for item_id, qty in moves if qty > 0]
+            if moves:
+                transfer_id = next_id("transfers")
+                moved_at = _stamp(d, "10:00:00")
+                loader.add("transfers", (transfer_id, moved_at))
+                for item_id, qty in moves:
+                    loader.add("transfer_lines", (transfer_id, item_id, qty))
+                    warehouse[item_id] -= qty
+                    if allows_transfer:
+                        add_tx(moved_at, item_id, -qty, "TRANSFER", "WAREHOUSE", "TRANSFER", transfer_id)
+                        add_tx(moved_at, item_id, qty, "TRANSFER", "STORE", "TRANSFER", transfer_id)
+
+            for item_id in used_week:
+                used_week[item_id] = 0.0
+
+        # 営業日：日報と自動消費
+        if weekday != CLOSED_WEEKDAY:
+            daily_report_id = next_id("daily_reports")
+            # 週末は多め
+            base = 9.0 if weekday >= 5 else 5.5
+            sold_batches = round(max(0.5, rng.gauss(base, 1.5)), 1)
+            loader.add(
+                "daily_reports",
+                (
+                    daily_report_id,
+                    d.isoformat(),
+                    sold_batches,
+                    int(sold_batches * rng.uniform(40, 60)),
+                    round(sold_batches * 80 / 8 * 500 * rng.uniform(0.95, 1.05), 0),
+                    _stamp(d, "21:00:00"),
+                ),
+            )
+            happened_at = _stamp(d)
+            note = f"日報自動消費：sold_batches={sold_batches}"
+            for it in consume_items:
+                qty = round(it["per_batch"] * sold_batches, 4)
+                used_week[it["item_id"]] += qty
+                add_tx(happened_at, it["item_id"], -qty, "CONSUME", "STORE", "DAILY_REPORT", daily_report_id, note)
+            # 消耗品・手動カウントの材料は棚卸の差分で減る（ここでは使用量だけ覚えておく）
+            for it in manual_items:
+                used = it["per_batch"] * sold_batches
+                used_week[it["item_id"]] += used
+                unrecorded[it["item_id"]] += used
+
+        # 週末（日曜）：手動カウント材料の週次棚卸
+        if weekday == 6 and manual_items:
+            stocktake(d, "WEEKLY", manual_items)
+
+        # 月末：FOOD 全件の月次棚卸
+        if (d + timedelta(days=1)).month != d.month:
+            stocktake(d, "MONTHLY", food_items)
+
+        d += timedelta(days=1)
+
+    loader.flush()
+    out_conn.execute("COMMIT")
+    return loader.counts
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="負荷検証用の合成データを作る")
+    parser.add_argument("-o", "--output", required=True, help="出力先DBファイル")
+    parser.add_argument("--schema", default=DB_FILE, help="スキーマを写すDB（既定: takoyaki_inventory.db）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--start", default="2021-01-01", help="開始日 YYYY-MM-DD")
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--items", type=int, default=40)
+    parser.add_argument("--suppliers", type=int, default=8)
+    parser.add_argument("--force", action="store_true", help="既存の出力先を上書きする")
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.output) and not args.force:
+        print(f"{args.output} は既にあります（上書きは --force）", file=sys.stderr)
+        return 1
+    if args.items < 1 or args.suppliers < 1 or args.years < 1:
+        print("--items / --suppliers / --years は1以上にしてください。", file=sys.stderr)
+        return 1
+
+    out_dir = os.path.dirname(os.path.abspath(args.output))
+    fd, tmp_path = tempfile.mkstemp(prefix=".seed-", suffix=".db", dir=out_dir)
+    os.close(fd)
+    started = time.perf_counter()
+    try:
+        conn = sqlite3.connect(tmp_path, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode = OFF")
+            conn.execute("PRAGMA synchronous = OFF")
+            allows_transfer = copy_schema(args.schema, conn)
+            counts = generate(
+                conn,
+                allows_transfer,
+                seed=args.seed,
+                start=date.fromisoformat(args.start),
+                years=args.years,
+                n_items=args.items,
+                n_suppliers=args.suppliers,
+            )
+            conn.execute("ANALYZE")
+        finally:
+            conn.close()
+        os.replace(tmp_path, args.output)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    elapsed = time.perf_counter() - started
+    for table in FLUSH_ORDER:
+        print(f"{table:16s} {counts[table]:>12,d}")
+    if not allows_transfer:
+        print("※ inventory_tx が TRANSFER を受け付けないため、移動の台帳行は作っていません。")
+    print(f"{args.output}: {elapsed:.1f}秒")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
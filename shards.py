@@ -0,0 +1,245 @@
+"""
+店舗ごとのDBファイル（シャーディング）。SHARD_DIR を設定したときだけ有効。
+
+- カタログ（材料・仕入れ先・レシピ・店舗・保管場所）は従来の DB_FILE に置き、全店舗で共有する。
+- 台帳・入庫・棚卸・移動・日報・発注案・実績単価・変更フィード（SHARD_TABLES）は SHARD_DIR/store_<id>.db に店舗ごとに置く。
+  書き込みロック・WAL・書き込みキューがファイルごとなので、ある店舗の長い書き込みが他店舗を待たせない。
+- 店舗ファイルの接続にはカタログを読み取り専用で ATTACH する（db.get_db）。SQL は従来どおり
+  items などを修飾なしで JOIN できる。読み書きで ATTACH すると BEGIN IMMEDIATE がカタログの
+  ロックも取ってしまい、全店舗の書き込みが1本に並ぶため。
+- 店舗ファイルの表定義（索引・ビュー・トリガーも）はカタログ側の同名の表（ensure_* が補正したもの）を写す。ファイルをまたぐ
+  外部キーは SQLite では張れないので、カタログの表への参照だけ外す（整合はアプリ側で確認する）。
+- 既存の1ファイル運用から移すときは `flask shards-split` で店舗ごとの行を各ファイルへ写す。
+"""
+from __future__ import annotations
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from projections import PROJECTION_TABLES, PROJECTIONS, rebuild
+from stores import rebuild_table
+
+SHARD_DIR = os.getenv("SHARD_DIR", "")
+SHARD_FAN_OUT_THREADS = int(os.getenv("SHARD_FAN_OUT_THREADS", "8"))
+
+CATALOG_TABLES = ("items", "suppliers", "batch_config", "recipe_batch", "stores", "locations")
+# 親の表を先に（shards-split の写す順）。outbox は最初（下の split_store_rows を参照）
+SHARD_TABLES = (
+    "outbox",
+    "purchases",
+    "purchase_lines",
+    "purchase_orders",
+    "purchase_order_lines",
+    "stocktakes",
+    "stocktake_lines",
+    "transfers",
+    "transfer_lines",
+    "daily_reports",
+    "inventory_tx",
+    "ledger_archive_runs",
+    "inventory_tx_archive",
+    "item_price_index",
+    "idempotency_keys",
+    "projection_cursors",
+    "inventory_balances",
+)
+SHARD_VIEWS = ("inventory_tx_history",)
+
+# store_id を持たない明細は親の伝票で店舗を決める
+_SPLIT_BY_PARENT = {
+    "purchase_lines": ("purchase_id", "purchases"),
+    "purchase_order_lines": ("purchase_order_id", "purchase_orders"),
+    "stocktake_lines": ("stocktake_id", "stocktakes"),
+    "transfer_lines": ("transfer_id", "transfers"),
+}
+
+_CATALOG_NAMES = "|".join(CATALOG_TABLES)
+_FK_ACTIONS = r"(?:\s+ON\s+(?:UPDATE|DELETE)\s+(?:SET\s+NULL|SET\s+DEFAULT|CASCADE|RESTRICT|NO\s+ACTION))*"
+_RE_TABLE_FK = re.compile(
+    rf",\s*FOREIGN\s+KEY\s*\([^)]*\)\s*REFERENCES\s+[\"`\[]?(?:{_CATALOG_NAMES})[\"`\]]?\s*\([^)]*\){_FK_ACTIONS}",
+    re.IGNORECASE,
+)
+_RE_COLUMN_FK = re.compile(
+    rf"\s+REFERENCES\s+[\"`\[]?(?:{_CATALOG_NAMES})[\"`\]]?\s*(?:\([^)]*\))?{_FK_ACTIONS}",
+    re.IGNORECASE,
+)
+_RE_COMMENT = re.compile(r"--[^\n]*")
+_RE_CREATE_TABLE = re.compile(r"^\s*CREATE\s+TABLE\s+[\"`\[]?(\w+)[\"`\]]?\s*\(", re.IGNORECASE)
+_RE_SPACE = re.compile(r"\s+")
+
+
+class ShardError(Exception):
+    pass
+
+
+def shard_path(store_id: int) -> str:
+    return os.path.join(os.path.abspath(SHARD_DIR), f"store_{int(store_id)}.db")
+
+
+def shard_table_sql(sql: str) -> str:
+    """カタログの CREATE TABLE を店舗ファイル用に（カタログの表への外部キーを外し、表名の引用符を取る）。"""
+    sql = _RE_COMMENT.sub("", sql)
+    sql = _RE_TABLE_FK.sub("", sql)
+    sql = _RE_COLUMN_FK.sub("", sql)
+    sql = _RE_CREATE_TABLE.sub(lambda m: f"CREATE TABLE {m.group(1)} (", sql, count=1)
+    return _RE_SPACE.sub(" ", sql).strip()
+
+
+def _catalog_objects(db) -> list:
+    placeholders = ",".join("?" for _ in SHARD_TABLES + SHARD_VIEWS)
+    return db.execute(
+        f"""
+        SELECT type, name, tbl_name, sql
+        FROM catalog.sqlite_master
+        WHERE sql IS NOT NULL
+          AND tbl_name IN ({placeholders})
+        ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END
+        """,
+        SHARD_TABLES + SHARD_VIEWS,
+    ).fetchall()
+
+
+def ensure_shard_schema(db) -> list[str]:
+    """
+    店舗ファイルの表・索引・ビューをカタログ側の定義に合わせる。作った・作り直した表の名前を返す。
+    db は店舗ファイルの接続（カタログを catalog として ATTACH 済み）。
+    foreign_keys = OFF にしてから、トランザクションの中で呼ぶこと（作り直しの DROP で明細を消さない）。
+    """
+    want_tables: dict[str, str] = {}
+    want_indexes: dict[str, str] = {}
+    want_views: dict[str, str] = {}
+    want_triggers: dict[str, str] = {}
+    for r in _catalog_objects(db):
+        if r["type"] == "table" and r["name"] in SHARD_TABLES:
+            want_tables[r["name"]] = shard_table_sql(r["sql"])
+        elif r["type"] == "index":
+            want_indexes[r["name"]] = r["sql"]
+        elif r["type"] == "view":
+            want_views[r["name"]] = r["sql"]
+        elif r["type"] == "trigger":
+            want_triggers[r["name"]] = r["sql"]
+
+    have = {
+        (r["type"], r["name"]): r["sql"]
+        for r in db.execute("SELECT type, name, sql FROM main.sqlite_master WHERE sql IS NOT NULL").fetchall()
+    }
+    changed = [
+        table
+        for table, sql in want_tables.items()
+        if ("table", table) not in have or shard_table_sql(have[("table", table)]) != sql
+    ]
+    views_stale = changed or any(have.get(("view", name)) != sql for name, sql in want_views.items())
+    if views_stale:
+        for name in SHARD_VIEWS:
+            db.execute(f"DROP VIEW IF EXISTS main.{name}")
+
+    for table in changed:
+        if ("table", table) in have:
+            rebuild_table(db, table, want_tables[table])
+        else:
+            db.execute(want_tables[table])
+
+    # カタログで消した索引は店舗ファイルからも消し、定義が変わったものは張り直す
+    for (kind, name), sql in have.items():
+        if kind == "index" and name not in want_indexes:
+            tbl = db.execute("SELECT tbl_name FROM main.sqlite_master WHERE name = ?", (name,)).fetchone()
+            if tbl is not None and tbl["tbl_name"] in SHARD_TABLES:
+                db.execute(f"DROP INDEX main.{name}")
+    for name, sql in want_indexes.items():
+        current = db.execute(
+            "SELECT sql FROM main.sqlite_master WHERE type = 'index' AND name = ?", (name,)
+        ).fetchone()
+        if current is not None and current["sql"] == sql:
+            continue
+        if current is not None:
+            db.execute(f"DROP INDEX main.{name}")
+        db.execute(sql)
+
+    if views_stale:
+        for sql in want_views.values():
+            db.execute(sql)
+
+    # トリガー（projections.py の取り消し・outbox.py の変更フィード）。表を作り直したときは rebuild_table が張り直している
+    for (kind, name), sql in have.items():
+        if kind == "trigger" and name not in want_triggers:
+            db.execute(f"DROP TRIGGER IF EXISTS main.{name}")
+    for name, sql in want_triggers.items():
+        current = db.execute(
+            "SELECT sql FROM main.sqlite_master WHERE type = 'trigger' AND name = ?", (name,)
+        ).fetchone()
+        if current is not None and current["sql"] == sql:
+            continue
+        if current is not None:
+            db.execute(f"DROP TRIGGER main.{name}")
+        db.execute(sql)
+    return changed
+
+
+def split_store_rows(db, store_id: int) -> dict[str, int]:
+    """
+    カタログ（旧1ファイル運用のDB）から、この店舗の行を店舗ファイルへ写す。写した表と行数を返す。
+    カタログ側の行は消さない（戻すときは SHARD_DIR を外す。ただし分割後の書き込みは戻らない）。
+    実績単価は店舗を持たないので全行を写す（以降は店舗ごとの入庫から更新される）。
+    射影（projections.py）は写さず、写した台帳から作り直す。
+    """
+    tables = [t for t in SHARD_TABLES if t not in PROJECTION_TABLES]
+    for table in tables:
+        if db.execute(f"SELECT 1 FROM main.{table} LIMIT 1").fetchone() is not None:
+            raise ShardError(f"店舗 {store_id} のファイルの {table} にすでに行があります")
+
+    copied: dict[str, int] = {}
+    for table in tables:
+        columns = [r["name"] for r in db.execute(f"PRAGMA main.table_info({table})").fetchall()]
+        catalog_columns = {r["name"] for r in db.execute(f"PRAGMA catalog.table_info({table})").fetchall()}
+        cols = ", ".join(c for c in columns if c in catalog_columns)
+        if table in _SPLIT_BY_PARENT:
+            key, parent = _SPLIT_BY_PARENT[table]
+            where, params = (
+                f"WHERE {key} IN (SELECT {key} FROM catalog.{parent} WHERE store_id = ?)",
+                (store_id,),
+            )
+        elif "store_id" in catalog_columns:
+            where, params = "WHERE store_id = ?", (store_id,)
+        else:
+            where, params = "", ()
+        cur = db.execute(
+            f"INSERT INTO main.{table} ({cols}) SELECT {cols} FROM catalog.{table} {where}", params
+        )
+        copied[table] = cur.rowcount
+        if table == "outbox":
+            outbox_seq = db.execute("SELECT COALESCE(MAX(seq), 0) FROM main.outbox").fetchone()[0]
+
+    # 写した伝票・台帳の INSERT で店舗ファイルの outbox トリガーが積んだ行は、写した変更の重複なので消す。
+    # seq はカタログの続きから振る（1ファイル運用のときのカーソルをそのまま使える）
+    db.execute("DELETE FROM main.outbox WHERE seq > ?", (outbox_seq,))
+    row = db.execute("SELECT seq FROM catalog.sqlite_sequence WHERE name = 'outbox'").fetchone()
+    next_from = max(outbox_seq, int(row[0]) if row else 0)
+    if db.execute("UPDATE main.sqlite_sequence SET seq = ? WHERE name = 'outbox'", (next_from,)).rowcount == 0:
+        db.execute("INSERT INTO main.sqlite_sequence (name, seq) VALUES ('outbox', ?)", (next_from,))
+
+    # 射影は写さず、写した台帳から作り直す
+    for projection in PROJECTIONS.values():
+        rebuild(db, projection)
+    return copied
+
+
+def fan_out(store_ids, fn, connect, max_workers: int = SHARD_FAN_OUT_THREADS) -> dict[int, object]:
+    """
+    店舗ごとに fn(db, store_id) をスレッドプールで並べて実行し、{store_id: 結果} を返す。
+    connect(store_id) は店舗の接続を新しく開く関数（スレッドごとに別接続。終わったら閉じる）。
+    """
+    store_ids = list(store_ids)
+
+    def run(store_id: int):
+        db = connect(store_id)
+        try:
+            return fn(db, store_id)
+        finally:
+            db.close()
+
+    if len(store_ids) <= 1:
+        return {store_id: run(store_id) for store_id in store_ids}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(store_ids)), thread_name_prefix="shard") as pool:
+        results = list(pool.map(run, store_ids))
+    return dict(zip(store_ids, results))
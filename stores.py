@@ -0,0 +1,333 @@
+"""
+店舗（stores）と保管場所（locations）。1つのDBで複数店舗を扱う。
+
+- 台帳（inventory_tx）・入庫・棚卸・日報・移動・発注案は store_id を持ち、画面・API の集計は
+  すべて「今の店舗」で絞る。索引は store_id を先頭にしてあるので、他店舗の行は読まない。
+- 保管場所は店舗ごとに locations に登録する（新しい店舗には STORE＝店舗、WAREHOUSE＝倉庫を作る）。
+  inventory_tx・stocktakes・transfers の location は (store_id, location) で locations を参照する。
+- 旧スキーマ（location を CHECK で2つに固定、日報は日付だけで UNIQUE）は migrate_store_schema() で
+  作り直す。既存の行はすべて既定店舗（store_id = 1）になる。
+"""
+from __future__ import annotations
+
+import threading
+
+from data_version import data_versions
+from ledger_archive import ensure_archive_schema
+
+DEFAULT_STORE_ID = 1
+DEFAULT_LOCATIONS = (("STORE", "店舗"), ("WAREHOUSE", "倉庫"))
+STORE_TABLES = ("stores", "locations")
+
+
+class StoreMigrationError(Exception):
+    pass
+
+
+def ensure_store_schema(db) -> None:
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stores (
+          store_id    INTEGER PRIMARY KEY AUTOINCREMENT,
+          code        TEXT    NOT NULL UNIQUE,
+          name        TEXT    NOT NULL,
+          is_active   INTEGER NOT NULL DEFAULT 1,
+          created_at  TEXT    NOT NULL DEFAULT (datetime('now'))
+        )
+        """
+    )
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS locations (
+          location_id  INTEGER PRIMARY KEY AUTOINCREMENT,
+          store_id     INTEGER NOT NULL,
+          code         TEXT    NOT NULL,
+          name         TEXT    NOT NULL,
+          is_active    INTEGER NOT NULL DEFAULT 1,
+          UNIQUE (store_id, code),
+          FOREIGN KEY (store_id) REFERENCES stores(store_id)
+            ON UPDATE CASCADE
+            ON DELETE RESTRICT
+        )
+        """
+    )
+    if db.execute("SELECT 1 FROM stores WHERE store_id = ?", (DEFAULT_STORE_ID,)).fetchone() is None:
+        db.execute(
+            "INSERT INTO stores (store_id, code, name) VALUES (?, 'MAIN', '本店')",
+            (DEFAULT_STORE_ID,),
+        )
+        add_default_locations(db, DEFAULT_STORE_ID)
+
+
+def add_default_locations(db, store_id: int) -> None:
+    db.executemany(
+        "INSERT OR IGNORE INTO locations (store_id, code, name) VALUES (?, ?, ?)",
+        [(store_id, code, name) for code, name in DEFAULT_LOCATIONS],
+    )
+
+
+def create_store(db, code: str, name: str) -> int:
+    """店舗を作り、既定の保管場所（STORE / WAREHOUSE）も登録する。トランザクションは呼び出し側で張ること。"""
+    cur = db.execute("INSERT INTO stores (code, name) VALUES (?, ?)", (code, name))
+    store_id = int(cur.lastrowid)
+    add_default_locations(db, store_id)
+    return store_id
+
+
+# -----------------------------
+# 旧スキーマからの移行
+# -----------------------------
+# 台帳の定義（transfers.py が 'TRANSFER' を足したときの作り直しにも使う）
+INVENTORY_TX_SQL = """
+        CREATE TABLE inventory_tx (
+          tx_id        INTEGER PRIMARY KEY AUTOINCREMENT,
+          store_id     INTEGER NOT NULL DEFAULT 1,
+          happened_at  TEXT    NOT NULL DEFAULT (datetime('now')),
+          item_id      INTEGER NOT NULL,
+          qty_delta    REAL    NOT NULL,  -- +入庫 / -出庫
+          tx_type      TEXT    NOT NULL CHECK (tx_type IN ('PURCHASE','CONSUME','WASTE','ADJUST','STOCKTAKE','TRANSFER')),
+          location     TEXT    NOT NULL,
+          ref_type     TEXT    CHECK (ref_type IN ('DAILY_REPORT','PURCHASE','STOCKTAKE','TRANSFER')),
+          ref_id       INTEGER,
+          note         TEXT,
+          FOREIGN KEY (item_id) REFERENCES items(item_id)
+            ON UPDATE CASCADE
+            ON DELETE RESTRICT,
+          FOREIGN KEY (store_id, location) REFERENCES locations(store_id, code)
+            ON UPDATE CASCADE
+            ON DELETE RESTRICT
+        )
+"""
+
+# 作り直す表。location の CHECK をやめて locations を参照し、store_id を先頭寄りに持つ
+_REBUILT_TABLES = {
+    "inventory_tx": INVENTORY_TX_SQL,
+    "stocktakes": """
+        CREATE TABLE stocktakes (
+          stocktake_id  INTEGER PRIMARY KEY AUTOINCREMENT,
+          store_id      INTEGER NOT NULL DEFAULT 1,
+          taken_at      TEXT    NOT NULL DEFAULT (datetime('now')),
+          scope         TEXT    NOT NULL CHECK (scope IN ('WEEKLY','MONTHLY')),
+          location      TEXT    NOT NULL,
+          note          TEXT,
+          FOREIGN KEY (store_id, location) REFERENCES locations(store_id, code)
+            ON UPDATE CASCADE
+            ON DELETE RESTRICT
+        )
+    """,
+    "transfers": """
+        CREATE TABLE transfers (
+          transfer_id    INTEGER PRIMARY KEY AUTOINCREMENT,
+          store_id       INTEGER NOT NULL DEFAULT 1,
+          moved_at       TEXT NOT NULL DEFAULT (datetime('now')),
+          from_location  TEXT NOT NULL,
+          to_location    TEXT NOT NULL,
+          note           TEXT,
+          FOREIGN KEY (store_id, from_location) REFERENCES locations(store_id, code)
+            ON UPDATE CASCADE
+            ON DELETE RESTRICT,
+          FOREIGN KEY (store_id, to_location) REFERENCES locations(store_id, code)
+            ON UPDATE CASCADE
+            ON DELETE RESTRICT
+        )
+    """,
+    "daily_reports": """
+        CREATE TABLE daily_reports (
+          daily_report_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+          store_id             INTEGER NOT NULL DEFAULT 1,
+          report_date          TEXT    NOT NULL,            -- YYYY-MM-DD
+          sold_batches         REAL    NOT NULL DEFAULT 0,  -- 0.1刻みOK
+          waste_pieces         INTEGER NOT NULL DEFAULT 0,
+          production_minutes   INTEGER NOT NULL DEFAULT 0,
+          sales_amount         REAL    NOT NULL DEFAULT 0,
+          impression           TEXT,
+          created_at           TEXT    NOT NULL DEFAULT (datetime('now')),
+          UNIQUE (store_id, report_date),
+          FOREIGN KEY (store_id) REFERENCES stores(store_id)
+            ON UPDATE CASCADE
+            ON DELETE RESTRICT
+        )
+    """,
+}
+
+# 列を足すだけの表（親を参照する FK は foreign_keys = OFF の間なら既定値つきで足せる）
+_ADDED_COLUMNS = {
+    "purchases": "store_id INTEGER NOT NULL DEFAULT 1 REFERENCES stores(store_id)",
+    "purchase_orders": "store_id INTEGER NOT NULL DEFAULT 1 REFERENCES stores(store_id)",
+    "inventory_tx_archive": "store_id INTEGER NOT NULL DEFAULT 1",
+    "ledger_archive_runs": "store_id INTEGER NOT NULL DEFAULT 1",
+}
+
+# 旧 location の表記ゆれ（'Warehouse'）は大文字にそろえて移す
+_LOCATION_COLUMNS = {"location", "from_location", "to_location"}
+
+STORE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_inventory_tx_store_item ON inventory_tx(store_id, item_id, location, qty_delta)",
+    "CREATE INDEX IF NOT EXISTS idx_inventory_tx_store_happened ON inventory_tx(store_id, happened_at)",
+    "CREATE INDEX IF NOT EXISTS idx_purchases_store_purchased_at ON purchases(store_id, purchased_at)",
+    "CREATE INDEX IF NOT EXISTS idx_stocktakes_store_scope ON stocktakes(store_id, scope, taken_at)",
+    "CREATE INDEX IF NOT EXISTS idx_transfers_store_moved_at ON transfers(store_id, moved_at)",
+    "CREATE INDEX IF NOT EXISTS idx_purchase_orders_store_status ON purchase_orders(store_id, status)",
+    "CREATE INDEX IF NOT EXISTS idx_inventory_tx_archive_store ON inventory_tx_archive(store_id, happened_at)",
+)
+# store_id 先頭の索引で置き換わるもの（item_id・ref の索引は FK と伝票引きで使うので残す）
+_SUPERSEDED_INDEXES = (
+    "idx_inventory_tx_happened_at",
+    "idx_inventory_tx_type",
+    "idx_purchases_purchased_at",
+    "idx_stocktakes_taken_at",
+    "idx_daily_reports_report_date",
+    "idx_purchase_orders_status",
+)
+
+
+def _columns(db, table: str) -> list[str]:
+    return [r["name"] for r in db.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def _table_exists(db, table: str) -> bool:
+    row = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    return row is not None
+
+
+def needs_store_migration(db) -> bool:
+    for table in list(_REBUILT_TABLES) + list(_ADDED_COLUMNS):
+        if _table_exists(db, table) and "store_id" not in _columns(db, table):
+            return True
+    return False
+
+
+def rebuild_table(db, table: str, create_sql: str, select_exprs: dict[str, str] | None = None) -> int:
+    """
+    表を作り直す（CHECK や UNIQUE は ALTER では変えられないため）。
+    新しい表に同名の列をそのまま移し、select_exprs の列は式で埋める。AUTOINCREMENT の採番は引き継ぐ。
+    元の表の索引・トリガーは同じ定義で張り直す（DROP TABLE で一緒に消えるため）。
+    foreign_keys = OFF にしてから、トランザクションの中で呼ぶこと（DROP で子の行が消えないように）。
+    """
+    select_exprs = select_exprs or {}
+    tmp = f"{table}__rebuild"
+    old_cols = set(_columns(db, table))
+    db.execute(f"DROP TABLE IF EXISTS {tmp}")
+    db.execute(create_sql.replace(f"CREATE TABLE {table} (", f"CREATE TABLE {tmp} (", 1))
+    new_cols = _columns(db, tmp)
+    targets = [c for c in new_cols if c in old_cols or c in select_exprs]
+    exprs = [select_exprs.get(c, c) for c in targets]
+    db.execute(
+        f"INSERT INTO {tmp} ({', '.join(targets)}) SELECT {', '.join(exprs)} FROM {table}"
+    )
+    seq = db.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    index_sqls = [
+        r["sql"]
+        for r in db.execute(
+            "SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+            (table,),
+        ).fetchall()
+    ]
+    db.execute(f"DROP TABLE {table}")
+    db.execute(f"ALTER TABLE {tmp} RENAME TO {table}")
+    for sql in index_sqls:
+        db.execute(sql)
+    if seq is not None:
+        db.execute(
+            "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (int(seq["seq"]), table)
+        )
+    return db.execute(f"SELECT COUNT(*) AS n FROM {table}").fetchone()["n"]
+
+
+def migrate_store_schema(db) -> dict[str, int]:
+    """
+    旧スキーマを店舗対応に移す。移した表と行数を返す（移行済みなら索引を張るだけで空）。
+    foreign_keys = OFF にしてから、トランザクションの中で呼ぶこと。
+    """
+    ensure_store_schema(db)
+    migrated: dict[str, int] = {}
+    if needs_store_migration(db):
+        # inventory_tx を作り直す間はビューが壊れるので外し、あとで store_id つきで作り直す
+        db.execute("DROP VIEW IF EXISTS inventory_tx_history")
+        for table, create_sql in _REBUILT_TABLES.items():
+            if not _table_exists(db, table) or "store_id" in _columns(db, table):
+                continue
+            exprs = {c: f"UPPER({c})" for c in _LOCATION_COLUMNS}
+            migrated[table] = rebuild_table(db, table, create_sql, exprs)
+        for table, column_sql in _ADDED_COLUMNS.items():
+            if _table_exists(db, table) and "store_id" not in _columns(db, table):
+                db.execute(f"ALTER TABLE {table} ADD COLUMN {column_sql}")
+                migrated[table] = db.execute(f"SELECT COUNT(*) AS n FROM {table}").fetchone()["n"]
+        ensure_archive_schema(db)
+
+        # 旧データの location がすべて既定店舗の保管場所に載っているか（FK をこの場で検証する）
+        broken = db.execute("PRAGMA foreign_key_check").fetchall()
+        if broken:
+            sample = [tuple(r) for r in broken[:5]]
+            raise StoreMigrationError(f"店舗対応への移行で参照切れがあります: {sample}")
+
+    for sql in STORE_INDEXES:
+        db.execute(sql)
+    for name in _SUPERSEDED_INDEXES:
+        db.execute(f"DROP INDEX IF EXISTS {name}")
+    return migrated
+
+
+# -----------------------------
+# 店舗・保管場所の一覧（プロセス内キャッシュ）
+# -----------------------------
+class StoreCatalog:
+    """
+    stores / locations をプロセス内に持つ。データ版数（stores・locations）が変わったときだけ読み直すので、
+    304 を返すだけのリクエストでは本体DBに接続しない。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._stores: dict[int, dict] = {}
+        self._locations: dict[int, list[dict]] = {}
+
+    def _load(self, connect) -> None:
+        versions, _updated_at = data_versions.read(STORE_TABLES)
+        version = tuple(sorted(versions.items()))
+        with self._lock:
+            if version == self._version:
+                return
+        db = connect()
+        stores = {
+            int(r["store_id"]): dict(r)
+            for r in db.execute(
+                "SELECT store_id, code, name, is_active FROM stores ORDER BY store_id ASC"
+            ).fetchall()
+        }
+        locations: dict[int, list[dict]] = {store_id: [] for store_id in stores}
+        for r in db.execute(
+            """
+            SELECT location_id, store_id, code, name, is_active
+            FROM locations
+            ORDER BY store_id ASC, location_id ASC
+            """
+        ).fetchall():
+            locations.setdefault(int(r["store_id"]), []).append(dict(r))
+        with self._lock:
+            self._stores, self._locations, self._version = stores, locations, version
+
+    def stores(self, connect) -> dict[int, dict]:
+        """connect は本体DBの接続を返す関数（読み直すときだけ呼ぶ）。"""
+        self._load(connect)
+        return self._stores
+
+    def active_stores(self, connect) -> list[dict]:
+        return [s for s in self.stores(connect).values() if s["is_active"]]
+
+    def locations(self, connect, store_id: int) -> list[dict]:
+        self._load(connect)
+        return self._locations.get(store_id, [])
+
+    def location_codes(self, connect, store_id: int) -> list[str]:
+        return [loc["code"] for loc in self.locations(connect, store_id) if loc["is_active"]]
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version = None
+
+
+store_catalog = StoreCatalog()
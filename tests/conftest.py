@@ -0,0 +1,106 @@
+"""
+テストの共通部品。
+
+アプリの設定（DBのパス・SHARD_DIR など）は import 時に環境変数から読み、スキーマ補正や店舗の一覧も
+プロセスの中で覚えるので、アプリを動かす手順（シナリオ）は一時ディレクトリのDBを指す子プロセスで
+1本ずつ実行する（backup.py verify・bench.py と同じやり方）。テストは子プロセスが返した JSON と、
+書き終わったDBファイルを確かめる。元の takoyaki_inventory.db は写しを作るだけで書き換えない。
+
+実行: pip install pytest && python -m pytest -q（リポジトリの直下で）
+"""
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TESTS_DIR = os.path.join(REPO_DIR, "tests")
+SEED_DB = os.path.join(REPO_DIR, "takoyaki_inventory.db")  # 読むだけ（写しを作る）
+SCENARIO_TIMEOUT_SEC = 120
+
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)  # pytest だけで実行したときも shards などを import できるように
+
+
+class AppEnv:
+    """1テスト分の一時DB一式。run() は同じDBに何回でも呼べる（SHARD_DIR の有無は呼ぶごとに選ぶ）。"""
+
+    def __init__(self, tmp_dir: str):
+        self.tmp_dir = tmp_dir
+        self.db_path = os.path.join(tmp_dir, "takoyaki_inventory.db")
+        self.shard_dir = os.path.join(tmp_dir, "shards")
+        self.backup_dir = os.path.join(tmp_dir, "backups")
+        src = sqlite3.connect(f"file:{SEED_DB}?mode=ro", uri=True)
+        dst = sqlite3.connect(self.db_path)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+
+    def env(self, shards: bool = False) -> dict[str, str]:
+        env = dict(
+            os.environ,
+            SQLITE_FILE=self.db_path,
+            SHARD_DIR=self.shard_dir if shards else "",
+            METRICS_FILE=os.path.join(self.tmp_dir, "metrics.db"),
+            QUERY_STATS_FILE=os.path.join(self.tmp_dir, "query_stats.db"),
+            DATA_VERSION_FILE=os.path.join(self.tmp_dir, "data_version.db"),
+            SYNC_STATE_FILE=os.path.join(self.tmp_dir, "sync_state.db"),
+            SLOW_SQL_LOG=os.path.join(self.tmp_dir, "slow_sql.log"),
+            PROFILE_DIR=os.path.join(self.tmp_dir, "profiles"),
+            BACKUP_DIR=self.backup_dir,
+            JINJA_BYTECODE_CACHE_DIR="",
+            WARMUP_ON_START="0",
+            PYTHONPATH=os.pathsep.join((REPO_DIR, TESTS_DIR)),
+        )
+        env.pop("TURSO_DATABASE_URL", None)
+        env.pop("TURSO_AUTH_TOKEN", None)
+        return env
+
+    def run(self, scenario, *args, shards: bool = False):
+        """テストモジュールの関数 scenario(*args) を子プロセスで実行し、戻り値（JSON にできるもの）を返す。"""
+        module, name = scenario.__module__, scenario.__name__
+        code = f"import json, sys, {module}; print(json.dumps({module}.{name}(*json.loads(sys.argv[1]))))"
+        proc = subprocess.run(
+            [sys.executable, "-c", code, json.dumps(args)],
+            env=self.env(shards),
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            timeout=SCENARIO_TIMEOUT_SEC,
+        )
+        if proc.returncode != 0:
+            pytest.fail(f"{name} が失敗しました:\n{proc.stderr}", pytrace=False)
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+
+    def cli(self, *args: str, shards: bool = False) -> subprocess.CompletedProcess:
+        """python <args>（backup.py など）を同じ環境変数で実行する。"""
+        return subprocess.run(
+            [sys.executable, *args],
+            env=self.env(shards),
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            timeout=SCENARIO_TIMEOUT_SEC,
+        )
+
+    def query(self, sql: str, params=(), path: str | None = None) -> list[tuple]:
+        conn = sqlite3.connect(f"file:{path or self.db_path}?mode=ro", uri=True)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def shard_path(self, store_id: int) -> str:
+        return os.path.join(self.shard_dir, f"store_{int(store_id)}.db")
+
+
+@pytest.fixture
+def app_env(tmp_path) -> AppEnv:
+    return AppEnv(str(tmp_path))
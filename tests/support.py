@@ -0,0 +1,42 @@
+"""
+子プロセス（conftest.AppEnv.run）の中でシナリオが使う部品。app はここで初めて import する。
+"""
+from __future__ import annotations
+
+import sqlite3
+from urllib.parse import parse_qs, urlsplit
+
+
+def client():
+    """一時DBを指すアプリのテストクライアント。最初の GET でスキーマ補正を済ませる。"""
+    from app import create_app
+
+    c = create_app(warm=False).test_client()
+    c.get("/")
+    return c
+
+
+def catalog_ids(sql: str, params=()) -> list[int]:
+    """カタログ（DB_FILE）から id の列を読む。"""
+    from db import DB_FILE
+
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        return [r[0] for r in conn.execute(sql, params).fetchall()]
+    finally:
+        conn.close()
+
+
+def active_item_ids(n: int = 2) -> list[int]:
+    return catalog_ids("SELECT item_id FROM items WHERE is_active = 1 ORDER BY item_id LIMIT ?", (n,))
+
+
+def purchase_form(item_id: int, qty: str, **extra) -> dict[str, object]:
+    return {"item_id": [str(item_id)], "qty": [qty], "unit_price": ["100"], "location": "STORE", **extra}
+
+
+def redirect_id(response) -> int:
+    """登録後のリダイレクト先の id（/transfers/<id>・/purchases?created=<id>）。"""
+    url = urlsplit(response.headers["Location"])
+    created = parse_qs(url.query).get("created")
+    return int(created[0] if created else url.path.rstrip("/").rsplit("/", 1)[-1])
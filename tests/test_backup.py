@@ -0,0 +1,119 @@
+"""
+時点復元（backup.py restore --until）。スナップショットの後の変更を変更フィード（outbox）から再適用する。
+入庫の削除・編集も再適用されること、--until より後の変更は入らないこと、射影が台帳と合うこと。
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+import support
+
+
+def _ledger(path: str) -> dict[str, float]:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT store_id, item_id, location, ROUND(SUM(qty_delta), 6) FROM inventory_tx GROUP BY 1, 2, 3"
+        ).fetchall()
+    finally:
+        conn.close()
+    return {f"{r[0]}/{r[1]}/{r[2]}": r[3] for r in rows if r[3]}
+
+
+def _write_around_snapshot(snap_dir: str) -> dict[str, object]:
+    from backup import create_snapshot
+    from db import DB_FILE
+
+    c = support.client()
+    item_a, item_b = support.active_item_ids(2)
+    deleted = support.redirect_id(c.post("/purchases", data=support.purchase_form(item_a, "7")))
+    edited = support.redirect_id(c.post("/purchases", data=support.purchase_form(item_b, "3")))
+    create_snapshot(DB_FILE, snap_dir, keep=1)
+
+    c.post(f"/purchases/{deleted}/delete")
+    c.post(f"/purchases/{edited}/update", data=support.purchase_form(item_b, "5"))
+    added = support.redirect_id(c.post("/purchases", data=support.purchase_form(item_a, "2")))
+    transfer = support.redirect_id(
+        c.post(
+            "/transfers",
+            data={"from_location": "STORE", "to_location": "WAREHOUSE", "item_id": [str(item_b)], "qty": ["1"]},
+        )
+    )
+    ledger_until = _ledger(DB_FILE)
+    until = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    time.sleep(1.1)  # outbox.created_at は秒単位
+    late = support.redirect_id(c.post("/purchases", data=support.purchase_form(item_b, "9")))
+    return {
+        "deleted": deleted,
+        "edited": edited,
+        "added": added,
+        "transfer": transfer,
+        "late": late,
+        "until": until,
+        "ledger_until": ledger_until,
+    }
+
+
+def _restore(app_env, until: str, name: str) -> str:
+    out = os.path.join(app_env.tmp_dir, f"{name}.db")
+    proc = app_env.cli(
+        "backup.py", "restore", "--dir", app_env.backup_dir, "--until", until, "--source", app_env.db_path, "-o", out
+    )
+    assert proc.returncode == 0, proc.stderr
+    return out
+
+
+def _projection(app_env, path: str) -> dict[str, float]:
+    rows = app_env.query("SELECT store_id, item_id, location, ROUND(qty, 6) FROM inventory_balances", path=path)
+    return {f"{r[0]}/{r[1]}/{r[2]}": r[3] for r in rows if r[3]}
+
+
+def _purchase_ids(app_env, path: str) -> set[int]:
+    return {r[0] for r in app_env.query("SELECT purchase_id FROM purchases", path=path)}
+
+
+def test_restore_until_replays_changes_after_snapshot(app_env):
+    written = app_env.run(_write_around_snapshot, app_env.backup_dir)
+
+    out = _restore(app_env, written["until"], "until")
+
+    purchases = _purchase_ids(app_env, out)
+    assert written["deleted"] not in purchases
+    assert written["added"] in purchases
+    assert written["late"] not in purchases
+    assert app_env.query(
+        "SELECT COUNT(*) FROM inventory_tx WHERE ref_type = 'PURCHASE' AND ref_id = ?", (written["deleted"],), path=out
+    ) == [(0,)]
+    assert app_env.query(
+        "SELECT qty FROM purchase_lines WHERE purchase_id = ?", (written["edited"],), path=out
+    ) == [(5.0,)]
+    assert app_env.query(
+        "SELECT COUNT(*) FROM inventory_tx WHERE ref_type = 'TRANSFER' AND ref_id = ?", (written["transfer"],), path=out
+    ) == [(2,)]
+    assert _ledger(out) == written["ledger_until"]
+    assert _projection(app_env, out) == written["ledger_until"]
+
+
+def test_restore_to_latest_matches_source(app_env):
+    written = app_env.run(_write_around_snapshot, app_env.backup_dir)
+
+    out = _restore(app_env, "9999-12-31 23:59:59", "latest")
+
+    assert written["late"] in _purchase_ids(app_env, out)
+    assert _purchase_ids(app_env, out) == _purchase_ids(app_env, app_env.db_path)
+    assert _ledger(out) == _ledger(app_env.db_path)
+    assert _projection(app_env, out) == _ledger(out)
+    # 再適用した範囲の変更フィードは現行DBと同じ seq で続く
+    assert app_env.query("SELECT MAX(seq) FROM outbox", path=out) == app_env.query("SELECT MAX(seq) FROM outbox")
+
+
+def test_restore_refuses_to_overwrite_source(app_env):
+    app_env.run(_write_around_snapshot, app_env.backup_dir)
+
+    proc = app_env.cli("backup.py", "restore", "--dir", app_env.backup_dir, "-o", app_env.db_path)
+
+    assert proc.returncode == 1
+    assert "現行DB" in proc.stderr
@@ -0,0 +1,99 @@
+"""
+登録フォームの二度押し・再送（idempotent_submission）。同じ idempotency_key の2回目は書き込まず、
+1回目と同じ画面へリダイレクトする。
+"""
+from __future__ import annotations
+
+import sqlite3
+
+import pytest
+
+import support
+
+
+def _forms(item_id: int) -> dict[str, dict[str, object]]:
+    return {
+        "purchases": support.purchase_form(item_id, "2"),
+        "transfers": {
+            "from_location": "WAREHOUSE",
+            "to_location": "STORE",
+            "item_id": [str(item_id)],
+            "qty": ["1"],
+        },
+        "stocktakes": {
+            "mode": "weekly",
+            "group": "ALL",
+            "taken_at": "2026-04-10T20:00",
+            f"counted_{item_id}": "3",
+        },
+    }
+
+
+_PATHS = {"purchases": "/purchases", "transfers": "/transfers", "stocktakes": "/stocktakes/create"}
+
+
+def _submit_twice(kind: str, key: str | None) -> dict[str, object]:
+    c = support.client()
+    (item_id,) = support.active_item_ids(1)
+    form = _forms(item_id)[kind]
+    if key is not None:
+        form["idempotency_key"] = key
+    responses = [c.post(_PATHS[kind], data=form) for _ in range(2)]
+    return {
+        "statuses": [r.status_code for r in responses],
+        "locations": [r.headers.get("Location") for r in responses],
+    }
+
+
+def _submit_transfer_after_key_expired(key: str) -> dict[str, object]:
+    """idempotency_keys の行が期限切れで消えた後の再送。transfers の UNIQUE で止まる。"""
+    from db import DB_FILE
+
+    c = support.client()
+    (item_id,) = support.active_item_ids(1)
+    form = {**_forms(item_id)["transfers"], "idempotency_key": key}
+    first = c.post("/transfers", data=form)
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        with conn:
+            conn.execute("DELETE FROM idempotency_keys")
+    finally:
+        conn.close()
+    second = c.post("/transfers", data=form)
+    return {"locations": [first.headers.get("Location"), second.headers.get("Location")]}
+
+
+@pytest.mark.parametrize("kind", ["purchases", "transfers", "stocktakes"])
+def test_same_key_writes_once(app_env, kind):
+    before = app_env.query(f"SELECT COUNT(*) FROM {kind}")[0][0]
+    result = app_env.run(_submit_twice, kind, "double-submit-1")
+
+    assert result["statuses"] == [302, 302]
+    assert result["locations"][0] == result["locations"][1]
+    assert app_env.query(f"SELECT COUNT(*) FROM {kind}")[0][0] == before + 1
+
+
+def test_duplicate_purchase_posts_ledger_once(app_env):
+    app_env.run(_submit_twice, "purchases", "double-submit-2")
+
+    rows = app_env.query(
+        """
+        SELECT COUNT(*) FROM inventory_tx
+        WHERE ref_type = 'PURCHASE' AND ref_id = (SELECT MAX(purchase_id) FROM purchases)
+        """
+    )
+    assert rows[0][0] == 1
+
+
+def test_without_key_each_post_writes(app_env):
+    before = app_env.query("SELECT COUNT(*) FROM purchases")[0][0]
+    app_env.run(_submit_twice, "purchases", None)
+
+    assert app_env.query("SELECT COUNT(*) FROM purchases")[0][0] == before + 2
+
+
+def test_transfer_key_outlives_submission_record(app_env):
+    result = app_env.run(_submit_transfer_after_key_expired, "double-submit-3")
+
+    assert result["locations"][0] == result["locations"][1]
+    assert app_env.query("SELECT COUNT(*) FROM transfers")[0][0] == 1
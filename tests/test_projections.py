@@ -0,0 +1,103 @@
+"""
+射影 inventory_balances（projections.py）。台帳への書き込み・伝票の編集と削除・締めのアーカイブの後も、
+トリガーだけで（catch_up なしで）台帳の合計と一致していること。
+"""
+from __future__ import annotations
+
+import support
+
+ARCHIVE_CUTOFF = "2026-04-01 00:00:00"  # 元のDBの台帳は 2026-01〜2026-04
+
+
+def _write_through_app() -> dict[str, object]:
+    c = support.client()
+    item_a, item_b = support.active_item_ids(2)
+    deleted = support.redirect_id(c.post("/purchases", data=support.purchase_form(item_a, "7")))
+    edited = support.redirect_id(c.post("/purchases", data=support.purchase_form(item_b, "3")))
+    c.post(f"/purchases/{edited}/update", data=support.purchase_form(item_b, "5"))
+    c.post(f"/purchases/{deleted}/delete")
+    c.post(
+        "/transfers",
+        data={"from_location": "STORE", "to_location": "WAREHOUSE", "item_id": [str(item_b)], "qty": ["1"]},
+    )
+    c.post(
+        "/stocktakes/create",
+        data={"mode": "weekly", "group": "ALL", "taken_at": "2026-04-10T20:00", f"counted_{item_a}": "2"},
+    )
+    return {"mismatches": _check(c.application)}
+
+
+def _archive(cutoff: str) -> dict[str, object]:
+    from db import get_db, transaction
+    from ledger_archive import archive_ledger
+    from stores import DEFAULT_STORE_ID
+
+    c = support.client()
+    with c.application.app_context():
+        db = get_db()
+        with transaction(db, serialize=True):
+            result = archive_ledger(db, cutoff, DEFAULT_STORE_ID)
+    return {"archive": result, "mismatches": _check(c.application)}
+
+
+def _check(app) -> list[dict]:
+    from db import get_db, transaction
+    from projections import INVENTORY_BALANCES, check
+
+    with app.app_context():
+        db = get_db()
+        with transaction(db, serialize=True):
+            return [dict(r) for r in check(db, INVENTORY_BALANCES)]
+
+
+def _ledger_balances(app_env) -> dict[tuple, float]:
+    rows = app_env.query(
+        "SELECT store_id, item_id, location, ROUND(SUM(qty_delta), 6) FROM inventory_tx GROUP BY 1, 2, 3"
+    )
+    return {r[:3]: r[3] for r in rows if r[3]}
+
+
+def _projected_balances(app_env) -> dict[tuple, float]:
+    rows = app_env.query("SELECT store_id, item_id, location, ROUND(qty, 6) FROM inventory_balances")
+    return {r[:3]: r[3] for r in rows if r[3]}
+
+
+def _cursor_and_latest(app_env) -> tuple[int, int]:
+    return app_env.query(
+        """
+        SELECT
+          (SELECT last_applied_tx_id FROM projection_cursors WHERE name = 'inventory_balances'),
+          (SELECT COALESCE(MAX(tx_id), 0) FROM inventory_tx)
+        """
+    )[0]
+
+
+def test_writes_keep_projection_in_step(app_env):
+    purchases = app_env.query("SELECT COUNT(*) FROM purchases")[0][0]
+    result = app_env.run(_write_through_app)
+
+    assert app_env.query("SELECT COUNT(*) FROM purchases")[0][0] == purchases + 1
+    assert app_env.query("SELECT COUNT(*) FROM transfers")[0][0] == 1
+    assert app_env.query("SELECT COUNT(*) FROM stocktakes")[0][0] == 1
+    assert result["mismatches"] == []
+    cursor, latest = _cursor_and_latest(app_env)
+    assert cursor == latest
+    assert _projected_balances(app_env) == _ledger_balances(app_env)
+
+
+def test_archive_keeps_projection_in_step(app_env):
+    app_env.run(_write_through_app)
+    before = _ledger_balances(app_env)
+
+    result = app_env.run(_archive, ARCHIVE_CUTOFF)
+
+    assert result["archive"]["archived_rows"] > 0
+    assert result["mismatches"] == []
+    remaining = app_env.query(
+        "SELECT COUNT(*) FROM inventory_tx WHERE happened_at < ? AND ref_type IS NOT NULL", (ARCHIVE_CUTOFF,)
+    )
+    assert remaining[0][0] == 0
+    assert _ledger_balances(app_env) == before
+    assert _projected_balances(app_env) == before
+    cursor, latest = _cursor_and_latest(app_env)
+    assert cursor == latest
@@ -0,0 +1,186 @@
+"""
+店舗ごとのDBファイル（shards.py）。1ファイル運用からの shards-split、分割後の振り分けとカタログの ATTACH、
+店舗をまたぐ集計の fan_out。
+"""
+from __future__ import annotations
+
+import threading
+
+import pytest
+
+from shards import fan_out
+
+import support
+
+YM = "2026-04"
+
+
+def _rollup(app) -> dict[str, object]:
+    from views.reports import build_store_rollup
+
+    with app.test_request_context():
+        rollup = build_store_rollup(YM)
+    return {
+        "stores": {str(row["store"]["store_id"]): row["purchases_cost"] for row in rollup["rows"]},
+        "total": rollup["totals"]["purchases_cost"],
+    }
+
+
+def _write_two_stores() -> dict[str, object]:
+    """1ファイル運用で2店舗目を作り、両方の店舗に入庫を書く。"""
+    c = support.client()
+    c.post("/stores", data={"code": "SECOND", "name": "2号店"})
+    stores = support.catalog_ids("SELECT store_id FROM stores ORDER BY store_id")
+    (item_id,) = support.active_item_ids(1)
+    for store_id, qty in zip(stores, ("4", "6")):
+        c.post(
+            f"/purchases?store={store_id}",
+            data=support.purchase_form(item_id, qty, purchased_date=f"{YM}-15"),
+        )
+    return {"stores": stores, "rollup": _rollup(c.application)}
+
+
+def _split(extra_store_id: int) -> dict[str, object]:
+    """SHARD_DIR を設定して shards-split し、分割後の集計と、分割後の書き込みの行き先を見る。"""
+    from db import get_store_db
+
+    c = support.client()
+    runner = c.application.test_cli_runner()
+    first = runner.invoke(args=["shards-split"])
+    again = runner.invoke(args=["shards-split"])
+    rollup = _rollup(c.application)
+    (item_id,) = support.active_item_ids(1)
+    created = support.redirect_id(
+        c.post(
+            f"/purchases?store={extra_store_id}",
+            data=support.purchase_form(item_id, "1", purchased_date=f"{YM}-20"),
+        )
+    )
+    with c.application.app_context():
+        db = get_store_db(extra_store_id)
+        attached = [r["name"] for r in db.execute("PRAGMA database_list").fetchall()]
+    return {
+        "first": [first.exit_code, first.output],
+        "again": [again.exit_code, again.output],
+        "rollup": rollup,
+        "created": created,
+        "attached": attached,
+    }
+
+
+def test_split_moves_each_store_to_its_file(app_env):
+    before = app_env.run(_write_two_stores)
+    main_store, extra_store = before["stores"]
+
+    after = app_env.run(_split, extra_store, shards=True)
+
+    assert after["first"][0] == 0, after["first"][1]
+    for store_id in (main_store, extra_store):
+        shard = app_env.shard_path(store_id)
+        assert app_env.query("SELECT DISTINCT store_id FROM purchases", path=shard) == [(store_id,)]
+        catalog_tx = app_env.query(
+            "SELECT tx_id, item_id, qty_delta, location FROM inventory_tx WHERE store_id = ? ORDER BY tx_id",
+            (store_id,),
+        )
+        shard_tx = app_env.query(
+            "SELECT tx_id, item_id, qty_delta, location FROM inventory_tx WHERE store_id = ? ORDER BY tx_id",
+            (store_id,),
+            path=shard,
+        )
+        # 分割後に書いた入庫は店舗ファイルにだけある
+        if store_id == extra_store:
+            shard_tx = shard_tx[:-1]
+        assert shard_tx == catalog_tx
+        assert app_env.query("SELECT COUNT(*) FROM inventory_balances", path=shard)[0][0] > 0
+
+
+def test_split_refuses_to_run_twice(app_env):
+    _main_store, extra_store = app_env.run(_write_two_stores)["stores"]
+
+    after = app_env.run(_split, extra_store, shards=True)
+
+    assert after["again"][0] != 0
+    assert "すでに行があります" in after["again"][1]
+
+
+def test_writes_after_split_go_to_the_store_file(app_env):
+    _main_store, extra_store = app_env.run(_write_two_stores)["stores"]
+
+    after = app_env.run(_split, extra_store, shards=True)
+
+    created = after["created"]
+    query = "SELECT COUNT(*) FROM purchases WHERE purchase_id = ? AND store_id = ?"
+    assert app_env.query(query, (created, extra_store), path=app_env.shard_path(extra_store))[0][0] == 1
+    assert app_env.query(query, (created, extra_store))[0][0] == 0
+    # カタログ（材料など）は店舗ファイルの接続に ATTACH して読む
+    assert after["attached"] == ["main", "catalog"]
+
+
+def test_rollup_matches_before_and_after_split(app_env):
+    before = app_env.run(_write_two_stores)
+    main_store, extra_store = before["stores"]
+
+    after = app_env.run(_split, extra_store, shards=True)
+
+    assert after["rollup"] == before["rollup"]
+    costs = before["rollup"]["stores"]
+    assert costs[str(extra_store)] == 600
+    assert before["rollup"]["total"] == costs[str(main_store)] + costs[str(extra_store)]
+
+
+class _Conn:
+    def __init__(self, store_id: int):
+        self.store_id = store_id
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_fan_out_runs_each_store_on_its_own_connection():
+    opened: list[_Conn] = []
+    threads: set[str] = set()
+
+    def connect(store_id):
+        conn = _Conn(store_id)
+        opened.append(conn)
+        return conn
+
+    def read(db, store_id):
+        threads.add(threading.current_thread().name)
+        assert db.store_id == store_id
+        return store_id * 10
+
+    assert fan_out([1, 2, 3], read, connect) == {1: 10, 2: 20, 3: 30}
+    assert sorted(c.store_id for c in opened) == [1, 2, 3]
+    assert all(c.closed for c in opened)
+    assert all(name.startswith("shard") for name in threads)
+
+
+def test_fan_out_single_store_stays_on_caller_thread():
+    threads: list[str] = []
+
+    def read(db, store_id):
+        threads.append(threading.current_thread().name)
+        return store_id
+
+    assert fan_out([5], read, _Conn) == {5: 5}
+    assert threads == [threading.current_thread().name]
+
+
+def test_fan_out_closes_connections_and_raises_on_error():
+    opened: list[_Conn] = []
+
+    def connect(store_id):
+        conn = _Conn(store_id)
+        opened.append(conn)
+        return conn
+
+    def read(db, store_id):
+        if store_id == 2:
+            raise RuntimeError("boom")
+        return store_id
+
+    with pytest.raises(RuntimeError, match="boom"):
+        fan_out([1, 2], read, connect)
+    assert opened and all(c.closed for c in opened)
@@ -0,0 +1,95 @@
+"""
+移動の複式の記帳（transfers.py）と、旧スキーマの台帳からの移行（migrate_transfer_ledger）。
+"""
+from __future__ import annotations
+
+import sqlite3
+
+from transfers import transfer_postings
+
+import support
+
+
+def _create_transfer() -> dict[str, object]:
+    c = support.client()
+    item_a, item_b = support.active_item_ids(2)
+    r = c.post(
+        "/transfers",
+        data={
+            "from_location": "WAREHOUSE",
+            "to_location": "STORE",
+            "item_id": [str(item_a), str(item_b)],
+            "qty": ["2", "0.5"],
+        },
+    )
+    return {"transfer_id": support.redirect_id(r), "items": [item_a, item_b]}
+
+
+def _start_app() -> dict[str, object]:
+    support.client()
+    return {}
+
+
+def test_transfer_postings_pair_each_line():
+    rows = transfer_postings(1, 7, "2026-04-01 09:00:00", "WAREHOUSE", "STORE", [(3, 2.0)], None)
+
+    assert rows == [
+        (1, "2026-04-01 09:00:00", 3, -2.0, "WAREHOUSE", 7, None),
+        (1, "2026-04-01 09:00:00", 3, 2.0, "STORE", 7, None),
+    ]
+
+
+def test_transfer_moves_stock_between_locations(app_env):
+    result = app_env.run(_create_transfer)
+
+    rows = app_env.query(
+        """
+        SELECT item_id, location, qty_delta, tx_type FROM inventory_tx
+        WHERE ref_type = 'TRANSFER' AND ref_id = ?
+        ORDER BY item_id, qty_delta
+        """,
+        (result["transfer_id"],),
+    )
+    item_a, item_b = result["items"]
+    assert rows == [
+        (item_a, "WAREHOUSE", -2.0, "TRANSFER"),
+        (item_a, "STORE", 2.0, "TRANSFER"),
+        (item_b, "WAREHOUSE", -0.5, "TRANSFER"),
+        (item_b, "STORE", 0.5, "TRANSFER"),
+    ]
+
+
+def test_migration_posts_legacy_transfers(app_env):
+    # 旧スキーマ（inventory_tx の CHECK が 'TRANSFER' を受け付けない）のまま手で入れた移動
+    assert "'TRANSFER'" not in app_env.query("SELECT sql FROM sqlite_master WHERE name = 'inventory_tx'")[0][0]
+    conn = sqlite3.connect(app_env.db_path)
+    try:
+        with conn:
+            cur = conn.execute(
+                "INSERT INTO transfers (moved_at, from_location, to_location) VALUES (?, 'STORE', 'WAREHOUSE')",
+                ("2026-02-01 09:00:00",),
+            )
+            transfer_id = cur.lastrowid
+            conn.execute(
+                "INSERT INTO transfer_lines (transfer_id, item_id, qty) VALUES (?, 1, 4)", (transfer_id,)
+            )
+    finally:
+        conn.close()
+    ledger_rows = app_env.query("SELECT COUNT(*) FROM inventory_tx")[0][0]
+
+    app_env.run(_start_app)
+    app_env.run(_start_app)  # 2回目は書き足さない
+
+    assert "'TRANSFER'" in app_env.query("SELECT sql FROM sqlite_master WHERE name = 'inventory_tx'")[0][0]
+    assert app_env.query("SELECT COUNT(*) FROM inventory_tx")[0][0] == ledger_rows + 2
+    postings = app_env.query(
+        """
+        SELECT happened_at, location, qty_delta FROM inventory_tx
+        WHERE ref_type = 'TRANSFER' AND ref_id = ?
+        ORDER BY qty_delta
+        """,
+        (transfer_id,),
+    )
+    assert postings == [("2026-02-01 09:00:00", "STORE", -4.0), ("2026-02-01 09:00:00", "WAREHOUSE", 4.0)]
+    columns = {r[1] for r in app_env.query("PRAGMA table_info(transfers)")}
+    assert "idempotency_key" in columns
@@ -0,0 +1,144 @@
+"""
+保管場所間の移動（transfers）を台帳（inventory_tx）に複式で載せる。
+
+- 移動の明細1行ごとに、移動元へ -qty・移動先へ +qty の2行（tx_type / ref_type = 'TRANSFER'）を
+  同じトランザクションで書く。店舗全体の残量は変わらず、保管場所ごとの残量だけが動く。
+- 旧スキーマの inventory_tx は CHECK が 'TRANSFER' を受け付けず、移動の登録はすべてロールバックされていた。
+  migrate_transfer_ledger() で CHECK を広げて表を作り直し、台帳に載っていない移動があれば書き足す。
+- 二度押し・再送で同じ移動が2件できないよう、フォームごとの idempotency_key を transfers に持つ
+  （店舗内で UNIQUE）。
+"""
+from __future__ import annotations
+
+from ledger_archive import ensure_archive_schema
+from stores import INVENTORY_TX_SQL, rebuild_table
+
+TRANSFER_INDEXES = (
+    # 伝票から台帳の行を引く（詳細・削除・アーカイブ済みの判定）。古いDBには無いことがある
+    "CREATE INDEX IF NOT EXISTS idx_inventory_tx_ref ON inventory_tx(ref_type, ref_id)",
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_transfers_idempotency_key
+    ON transfers(store_id, idempotency_key) WHERE idempotency_key IS NOT NULL
+    """,
+)
+
+_INSERT_POSTING = """
+    INSERT INTO inventory_tx
+      (store_id, happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note)
+    VALUES
+      (?, ?, ?, ?, 'TRANSFER', ?, 'TRANSFER', ?, ?)
+"""
+
+
+def needs_transfer_ledger_migration(db) -> bool:
+    row = db.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'inventory_tx'"
+    ).fetchone()
+    return row is not None and "'TRANSFER'" not in row["sql"]
+
+
+def migrate_transfer_ledger(db) -> dict[str, int]:
+    """
+    inventory_tx が移動を受け付けるようにし、台帳に載っていない移動を書き足す。
+    作り直した表・書き足した移動の件数を返す（済んでいれば空）。
+    foreign_keys = OFF にしてから、トランザクションの中で呼ぶこと。
+    """
+    migrated: dict[str, int] = {}
+    if needs_transfer_ledger_migration(db):
+        db.execute("DROP VIEW IF EXISTS inventory_tx_history")
+        migrated["inventory_tx"] = rebuild_table(db, "inventory_tx", INVENTORY_TX_SQL)
+        ensure_archive_schema(db)  # ビューを作り直す
+
+    columns = {r["name"] for r in db.execute("PRAGMA table_info(transfers)").fetchall()}
+    if "idempotency_key" not in columns:
+        db.execute("ALTER TABLE transfers ADD COLUMN idempotency_key TEXT")
+    for sql in TRANSFER_INDEXES:
+        db.execute(sql)
+
+    posted = post_unposted_transfers(db)
+    if posted:
+        migrated["transfers"] = posted
+    return migrated
+
+
+def transfer_postings(
+    store_id: int,
+    transfer_id: int,
+    happened_at: str,
+    from_location: str,
+    to_location: str,
+    lines: list[tuple[int, float]],
+    note: str | None,
+) -> list[tuple]:
+    """明細 (item_id, qty) ごとに 移動元 -qty / 移動先 +qty の2行。"""
+    rows = []
+    for item_id, qty in lines:
+        rows.append((store_id, happened_at, item_id, -qty, from_location, transfer_id, note))
+        rows.append((store_id, happened_at, item_id, qty, to_location, transfer_id, note))
+    return rows
+
+
+def post_transfer(db, transfer_id: int) -> int:
+    """
+    登録済みの移動（ヘッダ＋明細）を台帳に載せる。書いた行数を返す。
+    すでに載っていれば（アーカイブ済みも含めて）何もしない（再実行しても二重に載らない）。
+    """
+    if db.execute(
+        "SELECT 1 FROM inventory_tx_history WHERE ref_type = 'TRANSFER' AND ref_id = ? LIMIT 1",
+        (transfer_id,),
+    ).fetchone() is not None:
+        return 0
+    header = db.execute(
+        "SELECT store_id, moved_at, from_location, to_location, note FROM transfers WHERE transfer_id = ?",
+        (transfer_id,),
+    ).fetchone()
+    if header is None:
+        return 0
+    lines = [
+        (r["item_id"], float(r["qty"]))
+        for r in db.execute(
+            "SELECT item_id, qty FROM transfer_lines WHERE transfer_id = ? ORDER BY transfer_line_id",
+            (transfer_id,),
+        ).fetchall()
+    ]
+    rows = transfer_postings(
+        header["store_id"],
+        transfer_id,
+        header["moved_at"],
+        header["from_location"],
+        header["to_location"],
+        lines,
+        header["note"],
+    )
+    db.executemany(_INSERT_POSTING, rows)
+    return len(rows)
+
+
+def post_unposted_transfers(db) -> int:
+    """台帳に1行も無い移動（旧スキーマの手入力など）を載せる。載せた移動の件数を返す。"""
+    transfer_ids = [
+        r["transfer_id"]
+        for r in db.execute(
+            """
+            SELECT t.transfer_id
+            FROM transfers t
+            WHERE NOT EXISTS (
+              SELECT 1 FROM inventory_tx_history tx
+              WHERE tx.ref_type = 'TRANSFER' AND tx.ref_id = t.transfer_id
+            )
+              AND EXISTS (SELECT 1 FROM transfer_lines tl WHERE tl.transfer_id = t.transfer_id)
+            ORDER BY t.transfer_id
+            """
+        ).fetchall()
+    ]
+    for transfer_id in transfer_ids:
+        post_transfer(db, transfer_id)
+    return len(transfer_ids)
+
+
+def find_transfer_by_key(db, store_id: int, idempotency_key: str) -> int | None:
+    row = db.execute(
+        "SELECT transfer_id FROM transfers WHERE store_id = ? AND idempotency_key = ?",
+        (store_id, idempotency_key),
+    ).fetchone()
+    return int(row["transfer_id"]) if row else None
@@ -0,0 +1,18 @@
+"""
+画面・API・CLI の Blueprint（サブシステムごとに1モジュール）。app.create_app() が BLUEPRINTS の順に登録する。
+core はアプリ全体のフック（before/after_request）を持つので最初に登録する（after_request の実行順がこれで決まる）。
+共通の処理（DB・キャッシュ・伝票の登録など）は app.py にあり、各モジュールはそこから import する。
+"""
+from views import admin, api_v1, cli, core, items, purchases, reports, stocktakes, transfers
+
+BLUEPRINTS = (
+    core.bp,
+    items.bp,
+    purchases.bp,
+    stocktakes.bp,
+    transfers.bp,
+    reports.bp,
+    api_v1.bp,
+    admin.bp,
+    cli.bp,
+)
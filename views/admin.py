@@ -0,0 +1,173 @@
+"""
+管理画面（SQL統計・プロファイル・管理ログイン）。ADMIN_TOKEN が未設定なら 404。
+"""
+from __future__ import annotations
+
+import hmac
+
+from flask import (
+    Blueprint,
+    abort,
+    flash,
+    redirect,
+    render_template,
+    request,
+    send_file,
+    session,
+    url_for,
+)
+
+from db import get_db, query_stats
+from profiler import (
+    diff_profiles,
+    list_profiles,
+    load_meta,
+    profile_path,
+    top_functions,
+)
+
+from app import (
+    ADMIN_TOKEN,
+    SECRET_KEY,
+    _admin_session_digest,
+    is_admin_request,
+)
+
+bp = Blueprint("admin", __name__)
+
+QUERY_STATS_EXPLAIN_TOP = 10
+
+
+def require_admin() -> None:
+    if not is_admin_request():
+        abort(404)
+
+
+# -----------------------------
+# Admin（SQL集計）
+# -----------------------------
+def explain_query_plan(db, fingerprint: str) -> list[str]:
+    """指紋のままの SQL を、? をすべて NULL にして EXPLAIN QUERY PLAN にかける。"""
+    sql = fingerprint.replace("IN (?...)", "IN (?)")
+    rows = db.execute(f"EXPLAIN QUERY PLAN {sql}", (None,) * sql.count("?")).fetchall()
+    return [r["detail"] for r in rows]
+
+
+@bp.get("/admin/query-stats")
+def admin_query_stats():
+    """全ワーカー合算の指紋別統計。?explain=1 で上位の実行計画も付ける。"""
+    require_admin()
+    try:
+        top = max(1, int(request.args.get("top") or 50))
+    except ValueError:
+        top = 50
+    sort = request.args.get("sort") or "total_ms"
+    if sort not in ("total_ms", "p95_ms", "max_ms", "count"):
+        sort = "total_ms"
+
+    stats = sorted(query_stats.snapshot(), key=lambda r: r[sort], reverse=True)[:top]
+
+    if request.args.get("explain") == "1":
+        db = get_db()
+        for row in stats[:QUERY_STATS_EXPLAIN_TOP]:
+            head = row["fingerprint"].lstrip().split(" ", 1)[0].upper()
+            if head not in ("SELECT", "WITH"):
+                continue
+            try:
+                row["plan"] = explain_query_plan(db, row["fingerprint"])
+            except Exception as e:
+                row["plan_error"] = str(e)
+
+    return {"sort": sort, "statements": stats}
+
+
+@bp.post("/admin/query-stats/reset")
+def admin_query_stats_reset():
+    require_admin()
+    query_stats.reset()
+    return {"ok": True}
+
+
+# -----------------------------
+# Admin（ログイン）
+# -----------------------------
+@bp.route("/admin/login", methods=["GET", "POST"])
+def admin_login():
+    """ブラウザで管理画面を見るとき用。トークンはフォームの本文で受け取り、セッションに印を付ける。"""
+    if not ADMIN_TOKEN:
+        abort(404)
+    if request.method == "GET":
+        return render_template("admin_login.html", enabled=bool(SECRET_KEY))
+    if not SECRET_KEY:
+        flash("SECRET_KEY が未設定のため、管理ログインは使えません（X-Admin-Token ヘッダを使ってください）。", "error")
+        return redirect(url_for("admin.admin_login"))
+    token = (request.form.get("token") or "").encode("utf-8")
+    if not hmac.compare_digest(token, ADMIN_TOKEN.encode("utf-8")):
+        flash("管理トークンが違います。", "error")
+        return redirect(url_for("admin.admin_login"))
+    session["admin"] = _admin_session_digest()
+    flash("管理者としてログインしました。", "success")
+    return redirect(url_for("admin.admin_profiles"))
+
+
+@bp.post("/admin/logout")
+def admin_logout():
+    session.pop("admin", None)
+    flash("管理者ログインを解除しました。", "success")
+    return redirect(url_for("core.home"))
+
+
+# -----------------------------
+# Admin（プロファイル）
+# -----------------------------
+@bp.get("/admin/profiles")
+def admin_profiles():
+    require_admin()
+    return render_template("admin_profiles.html", profiles=list_profiles())
+
+
+@bp.get("/admin/profiles/diff")
+def admin_profile_diff():
+    require_admin()
+    a_id = (request.args.get("a") or "").strip()
+    b_id = (request.args.get("b") or "").strip()
+    a_meta = load_meta(a_id)
+    b_meta = load_meta(b_id)
+    if a_meta is None or b_meta is None:
+        abort(404)
+    return render_template(
+        "admin_profile_diff.html",
+        a=a_meta,
+        b=b_meta,
+        rows=diff_profiles(a_id, b_id),
+    )
+
+
+@bp.get("/admin/profiles/<profile_id>.prof")
+def admin_profile_download(profile_id: str):
+    require_admin()
+    if load_meta(profile_id) is None:
+        abort(404)
+    return send_file(
+        profile_path(profile_id),
+        mimetype="application/octet-stream",
+        as_attachment=True,
+        download_name=f"{profile_id}.prof",
+    )
+
+
+@bp.get("/admin/profiles/<profile_id>")
+def admin_profile_detail(profile_id: str):
+    require_admin()
+    meta = load_meta(profile_id)
+    if meta is None:
+        abort(404)
+    sort = request.args.get("sort") or "cumtime_ms"
+    if sort not in ("cumtime_ms", "tottime_ms", "calls"):
+        sort = "cumtime_ms"
+    return render_template(
+        "admin_profile_detail.html",
+        meta=meta,
+        rows=top_functions(profile_id, sort=sort),
+        sort=sort,
+    )
@@ -0,0 +1,434 @@
+"""
+/api/v1（端末・外部連携からのまとめ登録と在庫の読み取り）。Authorization: Bearer API_TOKEN。
+"""
+from __future__ import annotations
+
+import hmac
+import math
+import os
+from datetime import date, datetime, timezone
+
+from flask import Blueprint, jsonify, request
+
+from db import get_catalog_db, get_db, transaction
+from ledger_archive import get_archive_cutoff, has_archived_tx
+from stores import store_catalog
+
+from app import (
+    INVENTORY_TABLES,
+    _iter_chunks,
+    _to_datetime_seconds,
+    conditional_by_data_version,
+    current_store_id,
+    fetch_inventory_rows,
+    insert_purchase,
+    insert_stocktake,
+    parse_stocktake_location,
+    refresh_item_price_index,
+    regenerate_inventory_tx_for_daily_report,
+)
+
+bp = Blueprint("api_v1", __name__)
+
+API_TOKEN = os.getenv("API_TOKEN", "")  # 設定したら Authorization: Bearer <token> が必須
+API_BATCH_MAX = 500  # 1リクエストあたりの件数の上限
+
+
+# -----------------------------
+# API v1（JSON。POS・ハンディ端末からの一括登録）
+# -----------------------------
+def api_error(status: int, message: str, errors: list[dict] | None = None):
+    body: dict[str, object] = {"ok": False, "error": message}
+    if errors:
+        body["errors"] = errors
+    return jsonify(body), status
+
+
+@bp.before_request
+def _check_api_token():
+    if not API_TOKEN:
+        return None
+    supplied = request.headers.get("Authorization", "").encode("utf-8")
+    if not hmac.compare_digest(supplied, f"Bearer {API_TOKEN}".encode("utf-8")):
+        return api_error(401, "unauthorized")
+    return None
+
+
+@bp.before_request
+def _check_api_store():
+    """API は X-Store-Id（または ?store=）で店舗を選ぶ。無い・休止中の店舗は JSON の 404。"""
+    explicit = request.args.get("store") or request.headers.get("X-Store-Id")
+    if not explicit:
+        return None
+    active = {s["store_id"] for s in store_catalog.active_stores(get_catalog_db)}
+    try:
+        if int(explicit) in active:
+            return None
+    except ValueError:
+        pass
+    return api_error(404, f"store not found: {explicit}")
+
+
+class _ApiErrors(list):
+    """検証エラーを全件ためて 422 でまとめて返す（1件でもあれば何も書かない）。"""
+
+    def add(self, path: str, message: str) -> None:
+        self.append({"path": path, "message": message})
+
+    def number(self, value, path: str, required: bool = True, positive: bool = False) -> float | None:
+        if value is None or value == "":
+            if required:
+                self.add(path, "必須です")
+            return None
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            self.add(path, "数値ではありません")
+            return None
+        try:
+            x = float(value)
+        except ValueError:
+            self.add(path, "数値ではありません")
+            return None
+        if not math.isfinite(x):
+            self.add(path, "数値ではありません")
+            return None
+        if positive and x <= 0:
+            self.add(path, "0より大きくしてください")
+        elif x < 0:
+            self.add(path, "0以上にしてください")
+        return x
+
+    def integer(self, value, path: str, required: bool = True) -> int | None:
+        if value is None or value == "":
+            if required:
+                self.add(path, "必須です")
+            return None
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            self.add(path, "整数ではありません")
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            self.add(path, "整数ではありません")
+            return None
+
+    def location(self, value, path: str, store_id: int, default: str = "STORE") -> str:
+        """保管場所コード（省略時は default）。文字列でない・店舗の locations に無いものはエラー。"""
+        if value is None or value == "":
+            return default
+        code = value.strip().upper() if isinstance(value, str) else None
+        if code not in store_catalog.location_codes(get_catalog_db, store_id):
+            self.add(path, "店舗の保管場所コードではありません")
+            return default
+        return code
+
+
+def _api_batch(key: str) -> tuple[list | None, object]:
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get(key), list):
+        return None, api_error(400, f"JSON オブジェクトの {key} 配列が必要です")
+    rows = data[key]
+    if not rows:
+        return None, api_error(400, f"{key} が空です")
+    if len(rows) > API_BATCH_MAX:
+        return None, api_error(413, f"{key} は {API_BATCH_MAX} 件までです")
+    return rows, data
+
+
+def _existing_ids(db, table: str, column: str, ids: set[int]) -> set[int]:
+    found: set[int] = set()
+    for chunk in _iter_chunks(sorted(ids)):
+        placeholders = ",".join("?" for _ in chunk)
+        rows = db.execute(
+            f"SELECT {column} AS id FROM {table} WHERE {column} IN ({placeholders})", chunk
+        ).fetchall()
+        found.update(int(r["id"]) for r in rows)
+    return found
+
+
+def _check_not_archived(
+    db, store_id: int, errors: _ApiErrors, path: str, happened_at: str | None
+) -> None:
+    cutoff = get_archive_cutoff(db, store_id)
+    if cutoff and happened_at and happened_at < cutoff:
+        errors.add(path, f"締め済み（{cutoff[:10]} より前）の期間には登録できません")
+
+
+@bp.get("/api/v1/inventory")
+@conditional_by_data_version(*INVENTORY_TABLES)
+def api_inventory():
+    rows = fetch_inventory_rows(get_db(), current_store_id())
+    return jsonify(
+        {
+            "ok": True,
+            "items": [
+                {
+                    "item_id": r["item_id"],
+                    "name": r["name"],
+                    "unit_base": r["unit_base"],
+                    "qty": float(r["qty_total"] or 0),
+                    "reorder_point": float(r["reorder_point"] or 0),
+                }
+                for r in rows
+            ],
+        }
+    )
+
+
+@bp.post("/api/v1/purchases/batch")
+def api_purchases_batch():
+    """
+    {"purchases": [{"supplier_id", "purchased_date": "YYYY-MM-DD", "location", "note",
+                    "lines": [{"item_id", "qty", "unit_price"}, ...]}, ...]}
+    """
+    purchases, resp = _api_batch("purchases")
+    if purchases is None:
+        return resp
+    db = get_db()
+    store_id = current_store_id()
+    errors = _ApiErrors()
+    parsed = []
+    item_refs: dict[int, list[str]] = {}
+    supplier_refs: dict[int, list[str]] = {}
+    for i, p in enumerate(purchases):
+        base = f"purchases[{i}]"
+        if not isinstance(p, dict):
+            errors.add(base, "オブジェクトではありません")
+            continue
+        supplier_id = errors.integer(p.get("supplier_id"), f"{base}.supplier_id", required=False)
+        if supplier_id is not None:
+            supplier_refs.setdefault(supplier_id, []).append(f"{base}.supplier_id")
+        purchased_at = None
+        purchased_date = (str(p.get("purchased_date") or "")).strip()
+        if purchased_date:
+            try:
+                purchased_at = f"{date.fromisoformat(purchased_date).isoformat()} 09:00:00"
+            except ValueError:
+                errors.add(f"{base}.purchased_date", "YYYY-MM-DD で指定してください")
+        _check_not_archived(db, store_id, errors, f"{base}.purchased_date", purchased_at)
+        lines_raw = p.get("lines")
+        if not isinstance(lines_raw, list) or not lines_raw:
+            errors.add(f"{base}.lines", "明細が1行もありません")
+            continue
+        lines = []
+        for j, line in enumerate(lines_raw):
+            lp = f"{base}.lines[{j}]"
+            if not isinstance(line, dict):
+                errors.add(lp, "オブジェクトではありません")
+                continue
+            item_id = errors.integer(line.get("item_id"), f"{lp}.item_id")
+            qty = errors.number(line.get("qty"), f"{lp}.qty", positive=True)
+            unit_price = errors.number(line.get("unit_price"), f"{lp}.unit_price", required=False)
+            if item_id is not None:
+                item_refs.setdefault(item_id, []).append(f"{lp}.item_id")
+            lines.append((item_id, qty, unit_price))
+        parsed.append(
+            (
+                supplier_id,
+                purchased_at,
+                errors.location(p.get("location"), f"{base}.location", store_id),
+                (str(p.get("note") or "")).strip() or None,
+                lines,
+            )
+        )
+
+    for ids, refs, table, column in (
+        (set(item_refs), item_refs, "items", "item_id"),
+        (set(supplier_refs), supplier_refs, "suppliers", "supplier_id"),
+    ):
+        for missing in ids - _existing_ids(db, table, column, ids):
+            for path in refs[missing]:
+                errors.add(path, "存在しません")
+    if errors:
+        return api_error(422, "validation failed", errors)
+
+    try:
+        with transaction(db):
+            purchase_ids = [insert_purchase(db, store_id, *row) for row in parsed]
+            refresh_item_price_index(db, sorted(item_refs))
+    except Exception as e:
+        return api_error(500, f"登録に失敗しました: {e}")
+    return (
+        jsonify(
+            {
+                "ok": True,
+                "purchase_ids": purchase_ids,
+                "lines": sum(len(row[4]) for row in parsed),
+            }
+        ),
+        201,
+    )
+
+
+@bp.post("/api/v1/stocktakes/batch")
+def api_stocktakes_batch():
+    """
+    {"scope": "WEEKLY"|"MONTHLY", "taken_at": "YYYY-MM-DDTHH:MM"（JST）, "location", "note",
+     "counts": [{"item_id", "counted_qty"}, ...]}
+    数えた材料だけの棚卸を1件作り、理論在庫との差分を ADJUST にする。
+    location は数えた保管場所（省略・"ALL" は店舗全体で、全保管場所の合計と比べる）。
+    """
+    counts, data = _api_batch("counts")
+    if counts is None:
+        return data
+    db = get_db()
+    store_id = current_store_id()
+    errors = _ApiErrors()
+    scope = str(data.get("scope") or "WEEKLY").upper()
+    if scope not in ("WEEKLY", "MONTHLY"):
+        errors.add("scope", "WEEKLY か MONTHLY を指定してください")
+    try:
+        taken_at = _to_datetime_seconds(str(data.get("taken_at") or ""))
+    except ValueError:
+        errors.add("taken_at", "YYYY-MM-DDTHH:MM（JST）で指定してください")
+        taken_at = None
+    taken_at = taken_at or datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    _check_not_archived(db, store_id, errors, "taken_at", taken_at)
+    try:
+        location = parse_stocktake_location(data.get("location"), store_id)
+    except ValueError:
+        errors.add("location", "店舗の保管場所コード（または ALL）を指定してください")
+        location = None
+
+    counted_map: dict[int, float] = {}
+    item_refs: dict[int, str] = {}
+    for i, c in enumerate(counts):
+        base = f"counts[{i}]"
+        if not isinstance(c, dict):
+            errors.add(base, "オブジェクトではありません")
+            continue
+        item_id = errors.integer(c.get("item_id"), f"{base}.item_id")
+        counted = errors.number(c.get("counted_qty"), f"{base}.counted_qty")
+        if item_id is None or counted is None:
+            continue
+        if item_id in counted_map:
+            errors.add(f"{base}.item_id", "同じ材料が重複しています")
+            continue
+        counted_map[item_id] = counted
+        item_refs[item_id] = f"{base}.item_id"
+
+    items = []
+    for chunk in _iter_chunks(sorted(counted_map)):
+        placeholders = ",".join("?" for _ in chunk)
+        items += db.execute(
+            f"""
+            SELECT item_id, name, unit_base, ref_unit_price
+            FROM items
+            WHERE item_id IN ({placeholders})
+            ORDER BY name ASC
+            """,
+            chunk,
+        ).fetchall()
+    for missing in set(counted_map) - {int(it["item_id"]) for it in items}:
+        errors.add(item_refs[missing], "存在しません")
+    if errors:
+        return api_error(422, "validation failed", errors)
+
+    note = (str(data.get("note") or "")).strip()
+    try:
+        with transaction(db, serialize=True):
+            stocktake_id, adjust_count = insert_stocktake(
+                db, store_id, taken_at, scope, location, note, items, counted_map
+            )
+    except Exception as e:
+        return api_error(500, f"登録に失敗しました: {e}")
+    return (
+        jsonify(
+            {"ok": True, "stocktake_id": stocktake_id, "lines": len(items), "adjustments": adjust_count}
+        ),
+        201,
+    )
+
+
+@bp.post("/api/v1/daily-reports/batch")
+def api_daily_reports_batch():
+    """
+    {"reports": [{"report_date": "YYYY-MM-DD", "sold_batches", "production_minutes",
+                  "sales_amount", "impression"}, ...]}
+    同じ日付の日報があれば上書きし、在庫の自動消費（inventory_tx）を作り直す。
+    """
+    reports, resp = _api_batch("reports")
+    if reports is None:
+        return resp
+    db = get_db()
+    store_id = current_store_id()
+    errors = _ApiErrors()
+    parsed = []
+    seen_dates: set[str] = set()
+    for i, r in enumerate(reports):
+        base = f"reports[{i}]"
+        if not isinstance(r, dict):
+            errors.add(base, "オブジェクトではありません")
+            continue
+        try:
+            report_date = date.fromisoformat(str(r.get("report_date") or "")).isoformat()
+        except ValueError:
+            errors.add(f"{base}.report_date", "YYYY-MM-DD で指定してください")
+            continue
+        if report_date in seen_dates:
+            errors.add(f"{base}.report_date", "同じ日付が重複しています")
+            continue
+        seen_dates.add(report_date)
+        parsed.append(
+            (
+                report_date,
+                errors.number(r.get("sold_batches"), f"{base}.sold_batches", required=False) or 0.0,
+                errors.number(r.get("production_minutes"), f"{base}.production_minutes", required=False)
+                or 0.0,
+                errors.number(r.get("sales_amount"), f"{base}.sales_amount", required=False) or 0.0,
+                (str(r.get("impression") or "")).strip(),
+            )
+        )
+
+    existing: dict[str, int] = {}
+    for chunk in _iter_chunks(sorted(seen_dates)):
+        placeholders = ",".join("?" for _ in chunk)
+        for row in db.execute(
+            f"""
+            SELECT daily_report_id, report_date
+            FROM daily_reports
+            WHERE store_id = ? AND report_date IN ({placeholders})
+            """,
+            [store_id, *chunk],
+        ).fetchall():
+            existing[row["report_date"]] = int(row["daily_report_id"])
+    for i, row in enumerate(parsed):
+        report_id = existing.get(row[0])
+        if report_id is not None and has_archived_tx(db, "DAILY_REPORT", report_id):
+            errors.add(f"reports[{i}].report_date", "締め済み（アーカイブ済み）の日報は上書きできません")
+        _check_not_archived(db, store_id, errors, f"reports[{i}].report_date", row[0])
+    if errors:
+        return api_error(422, "validation failed", errors)
+
+    created: list[int] = []
+    updated: list[int] = []
+    tx_rows = 0
+    try:
+        with transaction(db, serialize=True):
+            for report_date, sold_batches, production_minutes, sales_amount, impression in parsed:
+                report_id = existing.get(report_date)
+                if report_id is None:
+                    cur = db.execute(
+                        """
+                        INSERT INTO daily_reports
+                          (store_id, report_date, sold_batches, waste_pieces, production_minutes, sales_amount, impression, created_at)
+                        VALUES
+                          (?, ?, ?, 0, ?, ?, ?, datetime('now'))
+                        """,
+                        (store_id, report_date, sold_batches, production_minutes, sales_amount, impression),
+                    )
+                    report_id = cur.lastrowid
+                    created.append(report_id)
+                else:
+                    db.execute(
+                        """
+                        UPDATE daily_reports
+                        SET sold_batches = ?, production_minutes = ?, sales_amount = ?, impression = ?
+                        WHERE daily_report_id = ?
+                        """,
+                        (sold_batches, production_minutes, sales_amount, impression, report_id),
+                    )
+                    updated.append(report_id)
+                tx_rows += regenerate_inventory_tx_for_daily_report(db, report_id)
+    except Exception as e:
+        return api_error(500, f"登録に失敗しました: {e}")
+    return jsonify({"ok": True, "created": created, "updated": updated, "tx_rows": tx_rows}), 201
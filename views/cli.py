@@ -0,0 +1,267 @@
+"""
+flask --app app の CLI。グループなしで登録する（flask --app app export など）。
+"""
+from __future__ import annotations
+
+import json
+import time
+from datetime import datetime
+
+import click
+from flask import Blueprint
+
+from data_version import ALL_TABLES, data_versions
+from db import (
+    Rollback,
+    get_catalog_db,
+    get_db,
+    get_store_db,
+    transaction,
+)
+from exports import EXPORT_KINDS, iter_export_csv, parse_export_date
+from ledger_archive import (
+    LedgerArchiveError,
+    archive_ledger,
+    get_archive_cutoff,
+    latest_closable_cutoff,
+)
+from outbox import (
+    OUTBOX_BATCH_ROWS,
+    OUTBOX_POLL_INTERVAL_SEC,
+    OUTBOX_RETENTION_DAYS,
+    fetch_changes,
+    prune_outbox,
+)
+from projections import (
+    PROJECTIONS,
+    catch_up,
+    check,
+    get_cursor,
+    latest_tx_id,
+    rebuild,
+)
+from shards import (
+    SHARD_DIR,
+    ShardError,
+    shard_path,
+    split_store_rows,
+)
+from stores import DEFAULT_STORE_ID, store_catalog
+
+from app import ensure_schema
+
+bp = Blueprint("cli", __name__, cli_group=None)
+
+
+# -----------------------------
+# CLI（エクスポート・台帳の締め・店舗ファイル・射影・outbox）
+# -----------------------------
+@bp.cli.command("export")
+@click.argument("kind", type=click.Choice(EXPORT_KINDS))
+@click.option("--from", "date_from", default=None, help="開始日 YYYY-MM-DD（含む）")
+@click.option("--to", "date_to", default=None, help="終了日 YYYY-MM-DD（含む）")
+@click.option("--store", "store_id", type=int, default=DEFAULT_STORE_ID, show_default=True, help="店舗ID")
+@click.option("--location", default=None, help="保管場所コード（例: STORE, WAREHOUSE）")
+@click.option("--no-bom", is_flag=True, help="BOMを付けない（Excel以外で読む場合）")
+@click.option("-o", "--output", default="-", help="出力先ファイル（既定: 標準出力）")
+def export_command(kind, date_from, date_to, store_id, location, no_bom, output):
+    """CSVをストリーミング出力する。例: flask --app app export inventory_tx --from 2026-01-01 -o tx.csv"""
+    try:
+        start = parse_export_date(date_from)
+        end = parse_export_date(date_to)
+    except ValueError:
+        raise click.BadParameter("日付は YYYY-MM-DD で指定してください。")
+
+    ensure_schema()
+    if store_id not in store_catalog.stores(get_catalog_db):
+        raise click.BadParameter(f"店舗 {store_id} はありません。", param_hint="--store")
+    db = get_store_db(store_id)
+    if location:
+        location = location.strip().upper()
+        if location not in store_catalog.location_codes(get_catalog_db, store_id):
+            raise click.BadParameter(f"店舗 {store_id} に保管場所 {location} はありません。", param_hint="--location")
+    chunks = iter_export_csv(db, kind, store_id, start, end, location, with_bom=not no_bom)
+    if output == "-":
+        out = click.get_text_stream("stdout", encoding="utf-8")
+        for chunk in chunks:
+            out.write(chunk)
+        return
+    with open(output, "w", encoding="utf-8", newline="") as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+
+@bp.cli.command("ledger-archive")
+@click.option("--before", "before_month", default=None, help="この月（YYYY-MM）より前を退避。既定: 最新の月次棚卸の月")
+@click.option("--store", "store_id", type=int, default=None, help="店舗ID（既定: 稼働中の全店舗）")
+@click.option("--dry-run", is_flag=True, help="件数だけ表示して何もしない")
+def ledger_archive_command(before_month, store_id, dry_run):
+    """締め済み月の inventory_tx を店舗ごとにアーカイブし、期首繰越行に置き換える。"""
+    ensure_schema()
+
+    before_cutoff = None
+    if before_month:
+        try:
+            before_cutoff = f"{datetime.strptime(before_month, '%Y-%m').strftime('%Y-%m')}-01 00:00:00"
+        except ValueError:
+            raise click.BadParameter("月は YYYY-MM で指定してください。")
+
+    if store_id is None:
+        targets = store_catalog.active_stores(get_catalog_db)
+    elif store_id in store_catalog.stores(get_catalog_db):
+        targets = [store_catalog.stores(get_catalog_db)[store_id]]
+    else:
+        raise click.BadParameter(f"店舗 {store_id} はありません。", param_hint="--store")
+
+    for store in targets:
+        sid = store["store_id"]
+        prefix = f"[{store['code']}] "
+        db = get_store_db(sid)
+        limit = latest_closable_cutoff(db, sid)
+        if limit is None:
+            click.echo(prefix + "月次棚卸がないため締め済みの月がありません。")
+            continue
+        cutoff = before_cutoff or limit
+        if cutoff > limit:
+            click.echo(prefix + f"{before_month} はまだ締められていません（最新の月次棚卸: {limit[:7]}）")
+            continue
+
+        try:
+            with transaction(db, sync="wait", serialize=True):
+                result = archive_ledger(db, cutoff, sid, dry_run=dry_run)
+                if dry_run:
+                    raise Rollback
+        except LedgerArchiveError as e:
+            raise click.ClickException(prefix + str(e))
+
+        label = "対象" if dry_run else "退避"
+        click.echo(
+            prefix
+            + f"{cutoff} より前: {label} {result['archived_rows']}件 / 繰越行 {result['opening_rows']}件"
+            f"（現在の境界: {get_archive_cutoff(db, sid) or 'なし'}）"
+        )
+
+
+@bp.cli.command("shards-split")
+@click.option("--store", "store_id", type=int, default=None, help="店舗ID（既定: 全店舗）")
+def shards_split_command(store_id):
+    """1ファイル運用のDBから、店舗ごとの台帳・伝票を SHARD_DIR の店舗ファイルへ写す（移行時に1回）。"""
+    if not SHARD_DIR:
+        raise click.ClickException("SHARD_DIR を設定してから実行してください。")
+    ensure_schema()
+
+    stores = store_catalog.stores(get_catalog_db)
+    if store_id is None:
+        targets = list(stores.values())
+    elif store_id in stores:
+        targets = [stores[store_id]]
+    else:
+        raise click.BadParameter(f"店舗 {store_id} はありません。", param_hint="--store")
+
+    for store in targets:
+        db = get_store_db(store["store_id"])
+        prefix = f"[{store['code']}] "
+        try:
+            with transaction(db, serialize=True):
+                copied = split_store_rows(db, store["store_id"])
+        except ShardError as e:
+            raise click.ClickException(prefix + str(e))
+        total = sum(copied.values())
+        detail = ", ".join(f"{table} {n}" for table, n in copied.items() if n)
+        click.echo(prefix + f"{shard_path(store['store_id'])} へ {total}行を写しました（{detail or 'なし'}）")
+    data_versions.bump([ALL_TABLES])
+
+
+@bp.cli.command("projections")
+@click.argument("action", type=click.Choice(["status", "catch-up", "rebuild", "check"]))
+@click.option("--name", type=click.Choice(list(PROJECTIONS)), default=None, help="射影（既定: すべて）")
+def projections_command(action, name):
+    """
+    台帳からの射影を操作する。status: カーソルの位置 / catch-up: 差分を反映 /
+    rebuild: 台帳から作り直す / check: 差分更新と作り直しの結果を突き合わせる（食い違いがあれば終了コード 1）。
+    """
+    ensure_schema()
+    targets = [PROJECTIONS[name]] if name else list(PROJECTIONS.values())
+    if SHARD_DIR:
+        dbs = [(f"[{s['code']}] ", get_store_db(s["store_id"])) for s in store_catalog.stores(get_catalog_db).values()]
+    else:
+        dbs = [("", get_db())]
+
+    mismatched = 0
+    for prefix, db in dbs:
+        latest = latest_tx_id(db)
+        for projection in targets:
+            label = f"{prefix}{projection.name}: "
+            if action == "status":
+                cursor = get_cursor(db, projection.name)
+                click.echo(label + f"反映済み tx_id {cursor} / 最新 {latest}（遅れ {max(latest - cursor, 0)}）")
+                continue
+            with transaction(db, serialize=True):
+                if action == "rebuild":
+                    click.echo(label + f"{rebuild(db, projection)}行から作り直しました")
+                    continue
+                applied = catch_up(db, projection)
+                if action == "catch-up":
+                    click.echo(label + f"{applied}行を反映しました")
+                    continue
+                diffs = check(db, projection)
+            if not diffs:
+                click.echo(label + "一致")
+                continue
+            mismatched += len(diffs)
+            click.echo(label + f"{len(diffs)}件の食い違い")
+            for d in diffs[:20]:
+                click.echo(f"  {d}")
+    if mismatched:
+        raise click.ClickException(f"射影の食い違いが {mismatched}件あります（rebuild で作り直せます）。")
+
+
+@bp.cli.command("outbox-tail")
+@click.option("--store", "store_id", type=int, default=DEFAULT_STORE_ID, show_default=True, help="店舗ID")
+@click.option("--since", type=int, default=0, show_default=True, help="この seq より後から（前回の最後の seq）")
+@click.option("--follow", "-f", is_flag=True, help="書き込みを待って流し続ける（Ctrl-C で終了）")
+@click.option("--limit", type=int, default=OUTBOX_BATCH_ROWS, show_default=True, help="1回に読む件数")
+def outbox_tail_command(store_id, since, follow, limit):
+    """台帳・伝票の変更を1行1件の JSON で出力する。例: flask --app app outbox-tail --since 120 -f"""
+    ensure_schema()
+    if store_id not in store_catalog.stores(get_catalog_db):
+        raise click.BadParameter(f"店舗 {store_id} はありません。", param_hint="--store")
+    db = get_store_db(store_id)
+    cursor = since
+    try:
+        while True:
+            batch = fetch_changes(db, store_id, cursor, limit)
+            if batch["truncated"]:
+                click.echo(f"seq {cursor} より後の一部はすでに消えています（outbox-prune 済み）。", err=True)
+            for change in batch["changes"]:
+                click.echo(json.dumps(change, ensure_ascii=False))
+            cursor = batch["next"]
+            if batch["more"]:
+                continue
+            if not follow:
+                return
+            time.sleep(OUTBOX_POLL_INTERVAL_SEC)
+    except KeyboardInterrupt:
+        click.echo(f"最後の seq: {cursor}", err=True)
+
+
+@bp.cli.command("outbox-prune")
+@click.option("--days", type=int, default=OUTBOX_RETENTION_DAYS, show_default=True, help="これより古い変更を消す（日）")
+def outbox_prune_command(days):
+    """変更フィード（outbox）の古い行を消す。"""
+    ensure_schema()
+    if SHARD_DIR:
+        dbs = [(f"[{s['code']}] ", get_store_db(s["store_id"])) for s in store_catalog.stores(get_catalog_db).values()]
+    else:
+        dbs = [("", get_db())]
+    for prefix, db in dbs:
+        with transaction(db, serialize=True):
+            deleted = prune_outbox(db, days)
+        click.echo(prefix + f"{days}日より前の変更を {deleted}行消しました")
+
+
+@bp.cli.command("data-version-bump")
+def data_version_bump_command():
+    """全画面の ETag を無効にする（DBをバックアップから戻したとき・手で直したとき）。"""
+    data_versions.bump([ALL_TABLES])
+    click.echo("data version を進めました。")
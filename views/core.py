@@ -0,0 +1,466 @@
+"""
+リクエスト共通のフック（プロファイル・SQL計測・メトリクス・スキーマ補正・店舗）と、トップ・店舗・バッチ設定・/metrics。
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+import uuid
+
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    current_app,
+    flash,
+    g,
+    has_request_context,
+    redirect,
+    render_template,
+    request,
+    session,
+    url_for,
+)
+
+from db import (
+    finish_query_trace,
+    get_catalog_db,
+    get_db,
+    get_query_trace,
+    start_query_trace,
+    transaction,
+)
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from metrics import registry as metrics
+from profiler import save_profile, should_sample, start_profile
+from stores import STORE_TABLES, create_store, store_catalog
+
+from app import (
+    SQL_TRACE_PANEL,
+    conditional_by_data_version,
+    current_store_id,
+    ensure_schema,
+    is_admin_request,
+)
+
+bp = Blueprint("core", __name__)
+
+# SQL計測の出力先（db.py の QueryTrace）
+SQL_TRACE_SERVER_TIMING = os.getenv("SQL_TRACE_SERVER_TIMING", "0") == "1"
+SQL_TRACE_LOG_TOP = 3
+sql_logger = logging.getLogger("takoyaki.sql")
+_RE_STORE_CODE = re.compile(r"^[A-Z0-9_]{1,20}$")
+
+
+@bp.before_app_request
+def _start_request_profile():
+    requested = request.headers.get("X-Profile") == "1" or request.args.get("_profile") == "1"
+    if requested and is_admin_request():
+        trigger = "manual"
+    elif should_sample():
+        trigger = "sample"
+    else:
+        return
+    prof = start_profile()
+    if prof is not None:
+        g.profile = (prof, trigger, time.perf_counter())
+
+
+@bp.after_app_request
+def _save_request_profile(response):
+    """ほかの after_request より後に走るよう先に登録している。"""
+    entry = g.pop("profile", None)
+    if entry is None:
+        return response
+    prof, trigger, started = entry
+    trace = get_query_trace()
+    profile_id = save_profile(
+        prof,
+        {
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "route": request.url_rule.rule if request.url_rule else None,
+            "status": response.status_code,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            "sql_count": trace.count if trace else None,
+            "sql_ms": round(trace.total_ms, 2) if trace else None,
+            "trigger": trigger,
+        },
+    )
+    response.headers["X-Profile-Id"] = profile_id
+    return response
+
+
+@bp.before_app_request
+def _start_sql_trace():
+    g.request_started = time.perf_counter()
+    start_query_trace()
+
+
+@bp.after_app_request
+def _record_request_metrics(response):
+    started = g.get("request_started")
+    if started is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    metrics.observe(
+        "takoyaki_http_request_duration_seconds",
+        time.perf_counter() - started,
+        {"route": route, "method": request.method},
+    )
+    metrics.inc(
+        "takoyaki_http_requests_total",
+        {"route": route, "method": request.method, "status": str(response.status_code)},
+    )
+    trace = get_query_trace()
+    if trace is not None:
+        metrics.observe("takoyaki_db_time_seconds", trace.total_ms / 1000, {"route": route})
+        metrics.inc("takoyaki_db_statements_total", {"route": route}, trace.count)
+    try:
+        metrics.flush()
+    except sqlite3.Error:
+        pass
+    return response
+
+
+@bp.get("/metrics")
+def metrics_endpoint():
+    """Prometheus テキスト形式（全ワーカー合算）。"""
+    return Response(metrics.render(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
+
+
+@bp.after_app_request
+def _report_sql_trace(response):
+    """1リクエスト1行の構造化ログ。必要なら Server-Timing とデバッグパネルも付ける。"""
+    trace = get_query_trace()
+    if trace is None:
+        return response
+
+    request_ms = (time.perf_counter() - trace.started) * 1000
+    top = trace.top(SQL_TRACE_LOG_TOP)
+    sql_logger.info(
+        json.dumps(
+            {
+                "method": request.method,
+                "path": request.path,
+                "endpoint": request.endpoint,
+                "status": response.status_code,
+                "request_ms": round(request_ms, 2),
+                "sql_count": trace.count,
+                "sql_ms": round(trace.total_ms, 2),
+                "tx_count": len(trace.transactions),
+                "tx_ms": round(trace.tx_ms, 2),
+                "top": [
+                    {"sql": t["sql"][:200], "count": t["count"], "ms": round(t["ms"], 2)}
+                    for t in top
+                ],
+            },
+            ensure_ascii=False,
+        )
+    )
+
+    finish_query_trace(trace, request.endpoint or request.path)
+
+    if SQL_TRACE_SERVER_TIMING:
+        response.headers.add(
+            "Server-Timing", f'db;dur={trace.total_ms:.1f};desc="{trace.count} queries"'
+        )
+        response.headers.add("Server-Timing", f"app;dur={request_ms:.1f}")
+
+    if (
+        (SQL_TRACE_PANEL or current_app.debug)
+        and response.mimetype == "text/html"
+        and not response.is_streamed
+    ):
+        html = response.get_data(as_text=True)
+        idx = html.rfind("</body>")
+        if idx != -1:
+            panel = render_template(
+                "_sql_trace_panel.html",
+                trace=trace,
+                top=trace.top(15),
+                request_ms=request_ms,
+            )
+            response.set_data(html[:idx] + panel + html[idx:])
+    return response
+
+
+# -----------------------------
+# スキーマ補正・テンプレートの共通値
+# -----------------------------
+bp.before_app_request(ensure_schema)
+
+
+@bp.app_context_processor
+def inject_current_store():
+    """ナビの店舗切替と、保管場所の選択肢（今の店舗の locations）。"""
+    if not has_request_context():
+        return {}
+    stores = store_catalog.active_stores(get_catalog_db)
+    store_id = current_store_id()
+    current = next((s for s in stores if s["store_id"] == store_id), None)
+    store_locations = [
+        loc for loc in store_catalog.locations(get_catalog_db, store_id) if loc["is_active"]
+    ]
+    return {"stores": stores, "current_store": current, "store_locations": store_locations}
+
+
+@bp.app_template_global()
+def new_idempotency_key() -> str:
+    """登録フォームの hidden に入れる送信ごとのキー（idempotent_submission）。"""
+    return uuid.uuid4().hex
+
+
+# -----------------------------
+# Routes
+# -----------------------------
+@bp.get("/")
+def home():
+    return render_template("home.html")
+
+
+# -----------------------------
+# Recipe batch（仕込み設定）
+# -----------------------------
+def get_active_batch_config(db):
+    row = db.execute(
+        """
+        SELECT batch_config_id, name, pieces_per_batch
+        FROM batch_config
+        WHERE is_active = 1
+        ORDER BY batch_config_id DESC
+        LIMIT 1
+        """
+    ).fetchone()
+    return row
+
+
+@bp.get("/recipe-batch")
+@conditional_by_data_version("batch_config", "recipe_batch", "items")
+def recipe_batch_edit():
+    db = get_db()
+
+    bc = get_active_batch_config(db)
+    if bc is None:
+        flash("アクティブなBATCH_CONFIGがありません。先に batch_config を作成してください。", "error")
+        return redirect(url_for("items.items_list"))
+
+    batch_config_id = bc["batch_config_id"]
+
+    # items と recipe_batch を紐付けて表示
+    rows = db.execute(
+        """
+        SELECT
+          i.item_id,
+          i.name,
+          i.unit_base,
+          COALESCE(i.cost_group, 'SUPPLIES') AS cost_group,
+          COALESCE(rb.qty_per_batch, 0) AS qty_per_batch,
+          COALESCE(rb.auto_consume, 0) AS auto_consume
+        FROM items i
+        LEFT JOIN recipe_batch rb
+          ON rb.item_id = i.item_id
+         AND rb.batch_config_id = ?
+        WHERE i.is_active = 1
+        ORDER BY
+          CASE COALESCE(i.cost_group,'SUPPLIES') WHEN 'FOOD' THEN 0 ELSE 1 END,
+          i.name ASC
+        """,
+        (batch_config_id,),
+    ).fetchall()
+
+    return render_template(
+        "recipe_batch_edit.html",
+        bc=bc,
+        rows=rows,
+    )
+
+
+@bp.post("/recipe-batch")
+def recipe_batch_update():
+    db = get_catalog_db()
+
+    batch_config_id = request.form.get("batch_config_id")
+    if not batch_config_id:
+        abort(400)
+    batch_config_id = int(batch_config_id)
+
+    # 対象items（アクティブ）
+    items = db.execute(
+        """
+        SELECT item_id, unit_base
+        FROM items
+        WHERE is_active = 1
+        ORDER BY item_id
+        """
+    ).fetchall()
+
+    # 既存レシピ（qtyを保持するため qty_per_batch も取る）
+    existing = db.execute(
+        """
+        SELECT recipe_id, item_id, qty_per_batch, auto_consume
+        FROM recipe_batch
+        WHERE batch_config_id = ?
+        """,
+        (batch_config_id,),
+    ).fetchall()
+
+    existing_by_item = {
+        r["item_id"]: {
+            "recipe_id": r["recipe_id"],
+            "qty_per_batch": float(r["qty_per_batch"] or 0),
+            "auto_consume": int(r["auto_consume"] or 0),
+        }
+        for r in existing
+    }
+
+    updated = 0
+    inserted = 0
+
+    try:
+        with transaction(db):
+            for it in items:
+                item_id = it["item_id"]
+                unit_base = it["unit_base"]
+
+                # ✅ auto_consume はチェックのON/OFFだけで設定できる
+                auto_consume = 1 if request.form.get(f"auto_{item_id}") == "1" else 0
+
+                # qty_per_batch：空欄なら「既存値を保持」する
+                raw_qty = (request.form.get(f"qty_{item_id}") or "").strip()
+
+                if item_id in existing_by_item:
+                    # 既存がある場合：空欄なら保持、入力があれば更新
+                    qty = existing_by_item[item_id]["qty_per_batch"]
+                    if raw_qty != "":
+                        try:
+                            qty = float(raw_qty)
+                        except ValueError:
+                            pass  # 変な入力は無視して保持
+                else:
+                    # 既存がない場合：空欄なら0（ただしauto_consume=1なら「設定行」を作る）
+                    if raw_qty == "":
+                        qty = 0.0
+                    else:
+                        try:
+                            qty = float(raw_qty)
+                        except ValueError:
+                            qty = 0.0
+
+                # pcsも小数を許可（小数第3位まで想定）
+
+                if item_id in existing_by_item:
+                    # 既存行：auto_consume だけの変更もOK、qtyは空欄なら保持
+                    recipe_id = existing_by_item[item_id]["recipe_id"]
+                    db.execute(
+                        """
+                        UPDATE recipe_batch
+                        SET qty_per_batch = ?, auto_consume = ?
+                        WHERE recipe_id = ?
+                        """,
+                        (qty, auto_consume, recipe_id),
+                    )
+                    updated += 1
+                else:
+                    # 新規：qty>0 もしくは auto_consume=1 のときだけ行を作る
+                    # （auto_consume=1 で qty=0 の「設定だけ」もOK）
+                    if qty > 0 or auto_consume == 1:
+                        db.execute(
+                            """
+                            INSERT INTO recipe_batch (batch_config_id, item_id, qty_per_batch, auto_consume)
+                            VALUES (?, ?, ?, ?)
+                            """,
+                            (batch_config_id, item_id, qty, auto_consume),
+                        )
+                        inserted += 1
+
+        flash(f"保存しました（追加:{inserted} 更新:{updated}）", "success")
+        return redirect(url_for("core.recipe_batch_edit"))
+
+    except Exception as e:
+        flash(f"保存に失敗しました: {e}", "error")
+        return redirect(url_for("core.recipe_batch_edit"))
+
+
+# -----------------------------
+# Stores（店舗・保管場所）
+# -----------------------------
+@bp.get("/stores")
+@conditional_by_data_version(*STORE_TABLES)
+def stores_list():
+    db = get_catalog_db()
+    stores = db.execute(
+        "SELECT store_id, code, name, is_active, created_at FROM stores ORDER BY store_id ASC"
+    ).fetchall()
+    locations: dict[int, list[sqlite3.Row]] = {}
+    for loc in db.execute(
+        "SELECT store_id, code, name, is_active FROM locations ORDER BY store_id ASC, location_id ASC"
+    ).fetchall():
+        locations.setdefault(int(loc["store_id"]), []).append(loc)
+    return render_template("stores_list.html", all_stores=stores, locations_by_store=locations)
+
+
+@bp.post("/stores")
+def store_create():
+    code = (request.form.get("code") or "").strip().upper()
+    name = (request.form.get("name") or "").strip()
+    if not _RE_STORE_CODE.match(code) or not name:
+        flash("店舗コード（英大文字・数字・_）と店舗名は必須です。", "error")
+        return redirect(url_for("core.stores_list"))
+
+    db = get_catalog_db()
+    try:
+        with transaction(db):
+            store_id = create_store(db, code, name)
+    except sqlite3.IntegrityError:
+        flash(f"店舗コード {code} はすでにあります。", "error")
+        return redirect(url_for("core.stores_list"))
+    store_catalog.invalidate()
+    flash(f"店舗「{name}」を登録しました（ID: {store_id}）。", "success")
+    return redirect(url_for("core.stores_list"))
+
+
+@bp.post("/stores/<int:store_id>/locations")
+def store_location_create(store_id: int):
+    code = (request.form.get("code") or "").strip().upper()
+    name = (request.form.get("name") or "").strip()
+    if not _RE_STORE_CODE.match(code) or not name:
+        flash("保管場所コード（英大文字・数字・_）と名前は必須です。", "error")
+        return redirect(url_for("core.stores_list"))
+
+    db = get_catalog_db()
+    if db.execute("SELECT 1 FROM stores WHERE store_id = ?", (store_id,)).fetchone() is None:
+        abort(404)
+    try:
+        with transaction(db):
+            db.execute(
+                "INSERT INTO locations (store_id, code, name) VALUES (?, ?, ?)",
+                (store_id, code, name),
+            )
+    except sqlite3.IntegrityError:
+        flash(f"保管場所 {code} はすでにあります。", "error")
+        return redirect(url_for("core.stores_list"))
+    store_catalog.invalidate()
+    flash(f"保管場所「{name}」を追加しました。", "success")
+    return redirect(url_for("core.stores_list"))
+
+
+@bp.post("/stores/switch")
+def store_switch():
+    """ナビの店舗切替。以降の画面はセッションの店舗で絞り込む。"""
+    try:
+        store_id = int(request.form.get("store_id") or 0)
+    except ValueError:
+        store_id = 0
+    if store_id not in {s["store_id"] for s in store_catalog.active_stores(get_catalog_db)}:
+        abort(404)
+    session["store_id"] = store_id
+    next_url = request.form.get("next") or ""
+    # 自サイト内のパスだけ（//evil.example などへは飛ばさない）
+    if not next_url.startswith("/") or next_url.startswith("//"):
+        next_url = url_for("core.home")
+    return redirect(next_url)
@@ -0,0 +1,577 @@
+"""
+材料・仕入れ先・実績単価・在庫一覧の画面。
+"""
+from __future__ import annotations
+
+import sqlite3
+
+from flask import (
+    Blueprint,
+    abort,
+    flash,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+
+from db import (
+    connect_store_db,
+    get_catalog_db,
+    get_db,
+    transaction,
+)
+from shards import SHARD_DIR, fan_out
+from stores import store_catalog
+
+from app import (
+    INVENTORY_TABLES,
+    PRICE_ALERT_RATIO,
+    conditional_by_data_version,
+    current_store_id,
+    fetch_inventory_rows,
+    fetch_suppliers,
+    render_cached_fragment,
+)
+
+bp = Blueprint("items", __name__)
+
+# 材料を参照する店舗側の表（店舗ごとのファイルに分けると外部キーで削除を止められないので調べる）
+_ITEM_REFERENCES = (
+    "inventory_tx_history",
+    "purchase_lines",
+    "purchase_order_lines",
+    "stocktake_lines",
+    "transfer_lines",
+)
+
+
+# -----------------------------
+# Items（材料）
+# -----------------------------
+def _to_float(value: str, default: float = 0.0) -> float:
+    value = (value or "").strip()
+    if value == "":
+        return default
+    return float(value)
+
+
+def fetch_item(item_id: int) -> sqlite3.Row | None:
+    db = get_db()
+    return db.execute(
+        """
+        SELECT
+          i.item_id,
+          i.cost_group,
+          i.supplier_id,
+          i.name,
+          i.unit_base,
+          i.reorder_point,
+          i.ref_unit_price,
+          i.pack_qty,
+          i.min_order_qty,
+          i.note,
+          i.is_fixed,
+          i.is_active,
+          s.name AS supplier_name
+        FROM items i
+        LEFT JOIN suppliers s ON s.supplier_id = i.supplier_id
+        WHERE i.item_id = ?
+        """,
+        (item_id,),
+    ).fetchone()
+
+
+@bp.get("/items")
+@conditional_by_data_version("items", "suppliers")
+def items_list():
+    db = get_db()
+    rows = db.execute(
+        """
+        SELECT
+          i.item_id,
+          i.name,
+          i.unit_base,
+          i.reorder_point,
+          i.ref_unit_price,
+          i.note,
+          i.is_fixed,
+          i.cost_group,
+          i.is_active,
+          s.name AS supplier_name
+        FROM items i
+        LEFT JOIN suppliers s ON s.supplier_id = i.supplier_id
+        ORDER BY i.item_id DESC
+        """
+    ).fetchall()
+    return render_template("items_list.html", items=rows)
+
+
+@bp.get("/items/new")
+def item_new_form():
+    suppliers = fetch_suppliers()
+    return render_template("item_new.html", suppliers=suppliers)
+
+
+@bp.post("/items")
+def item_create():
+    supplier_id_raw = request.form.get("supplier_id", "").strip()
+    supplier_id = int(supplier_id_raw) if supplier_id_raw else None
+
+    name = (request.form.get("name") or "").strip()
+    unit_base = (request.form.get("unit_base") or "").strip()
+    reorder_point = _to_float(request.form.get("reorder_point", ""), 0.0)
+    ref_unit_price = _to_float(request.form.get("ref_unit_price", ""), 0.0)
+    pack_qty = _to_float(request.form.get("pack_qty", ""), 0.0)
+    min_order_qty = _to_float(request.form.get("min_order_qty", ""), 0.0)
+    note = (request.form.get("note") or "").strip() or None
+    is_fixed = 1 if request.form.get("is_fixed") == "1" else 0
+    cost_group = (request.form.get("cost_group") or "SUPPLIES").strip()
+    if cost_group not in ("FOOD", "SUPPLIES"):
+        cost_group = "SUPPLIES"
+    is_active = 1 if request.form.get("is_active") == "1" else 0
+
+    # バリデーション（最低限）
+    errors: list[str] = []
+    if not name:
+        errors.append("材料名（name）は必須です。")
+    if not unit_base:
+        errors.append("単位（unit_base）は必須です。（例: g / ml / pcs）")
+    if reorder_point < 0:
+        errors.append("発注目安（reorder_point）は0以上にしてください。")
+    if ref_unit_price < 0:
+        errors.append("参考価格（ref_unit_price）は0以上にしてください。")
+    if pack_qty < 0:
+        errors.append("入数（pack_qty）は0以上にしてください。")
+    if min_order_qty < 0:
+        errors.append("最小発注数（min_order_qty）は0以上にしてください。")
+
+    if errors:
+        for e in errors:
+            flash(e, "error")
+        return redirect(url_for("items.item_new_form"))
+
+    db = get_catalog_db()
+    try:
+        with transaction(db):
+            # category は使わないので NULL で入れる（列が存在してもOK）
+            db.execute(
+                """
+                INSERT INTO items (
+                  supplier_id, name, category, unit_base,
+                  reorder_point, ref_unit_price, pack_qty, min_order_qty,
+                  note, is_fixed, cost_group, is_active
+                )
+                VALUES (?, ?, NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    supplier_id, name, unit_base, reorder_point, ref_unit_price,
+                    pack_qty, min_order_qty, note, is_fixed, cost_group, is_active,
+                ),
+            )
+    except sqlite3.IntegrityError as e:
+        flash(f"登録に失敗しました（整合性エラー）: {e}", "error")
+        return redirect(url_for("items.item_new_form"))
+    except Exception as e:
+        flash(f"登録に失敗しました: {e}", "error")
+        return redirect(url_for("items.item_new_form"))
+
+    flash("材料を登録しました。", "success")
+    return redirect(url_for("items.items_list"))
+
+
+# =============================
+# Suppliers（登録・編集）
+# =============================
+def fetch_supplier(supplier_id: int) -> sqlite3.Row | None:
+    db = get_db()
+    return db.execute(
+        """
+        SELECT supplier_id, name, phone, note, created_at
+        FROM suppliers
+        WHERE supplier_id = ?
+        """,
+        (supplier_id,),
+    ).fetchone()
+
+
+@bp.get("/suppliers")
+@conditional_by_data_version("suppliers")
+def suppliers_list():
+    db = get_db()
+    rows = db.execute(
+        """
+        SELECT supplier_id, name, phone, note, created_at
+        FROM suppliers
+        ORDER BY supplier_id DESC
+        """
+    ).fetchall()
+    return render_template("suppliers_list.html", suppliers=rows)
+
+
+@bp.get("/suppliers/new")
+def supplier_new_form():
+    return render_template("supplier_new.html")
+
+
+@bp.post("/suppliers")
+def supplier_create():
+    name = (request.form.get("name") or "").strip()
+    phone = (request.form.get("phone") or "").strip() or None
+    location = "WAREHOUSE"
+
+    note = (request.form.get("note") or "").strip() or None
+
+    errors: list[str] = []
+    if not name:
+        errors.append("仕入れ先名（name）は必須です。")
+
+    if errors:
+        for e in errors:
+            flash(e, "error")
+        return redirect(url_for("items.supplier_new_form"))
+
+    db = get_catalog_db()
+    try:
+        with transaction(db):
+            db.execute(
+                """
+                INSERT INTO suppliers (name, phone, note)
+                VALUES (?, ?, ?)
+                """,
+                (name, phone, note),
+            )
+    except sqlite3.IntegrityError as e:
+        flash(f"登録に失敗しました（整合性エラー）: {e}", "error")
+        return redirect(url_for("items.supplier_new_form"))
+    except Exception as e:
+        flash(f"登録に失敗しました: {e}", "error")
+        return redirect(url_for("items.supplier_new_form"))
+
+    flash("仕入れ先を登録しました。", "success")
+    return redirect(url_for("items.suppliers_list"))
+
+
+@bp.get("/suppliers/<int:supplier_id>/edit")
+def supplier_edit_form(supplier_id: int):
+    supplier = fetch_supplier(supplier_id)
+    if supplier is None:
+        abort(404)
+    return render_template("supplier_edit.html", supplier=supplier)
+
+
+@bp.post("/suppliers/<int:supplier_id>/update")
+def supplier_update(supplier_id: int):
+    supplier = fetch_supplier(supplier_id)
+    if supplier is None:
+        abort(404)
+
+    name = (request.form.get("name") or "").strip()
+    phone = (request.form.get("phone") or "").strip() or None
+    note = (request.form.get("note") or "").strip() or None
+
+    errors: list[str] = []
+    if not name:
+        errors.append("仕入れ先名（name）は必須です。")
+
+    if errors:
+        for e in errors:
+            flash(e, "error")
+        return redirect(url_for("items.supplier_edit_form", supplier_id=supplier_id))
+
+    db = get_catalog_db()
+    try:
+        with transaction(db):
+            db.execute(
+                """
+                UPDATE suppliers
+                SET name = ?, phone = ?, note = ?
+                WHERE supplier_id = ?
+                """,
+                (name, phone, note, supplier_id),
+            )
+    except sqlite3.IntegrityError as e:
+        flash(f"更新に失敗しました（整合性エラー）: {e}", "error")
+        return redirect(url_for("items.supplier_edit_form", supplier_id=supplier_id))
+    except Exception as e:
+        flash(f"更新に失敗しました: {e}", "error")
+        return redirect(url_for("items.supplier_edit_form", supplier_id=supplier_id))
+
+    flash("仕入れ先を更新しました。", "success")
+    return redirect(url_for("items.suppliers_list"))
+
+
+@bp.post("/suppliers/<int:supplier_id>/delete")
+def supplier_delete(supplier_id: int):
+    db = get_catalog_db()
+
+    supplier = db.execute(
+        "SELECT supplier_id, name FROM suppliers WHERE supplier_id = ?",
+        (supplier_id,),
+    ).fetchone()
+    if supplier is None:
+        abort(404)
+
+    try:
+        with transaction(db):
+            db.execute("DELETE FROM suppliers WHERE supplier_id = ?", (supplier_id,))
+        flash(f"仕入れ先を削除しました: {supplier['name']}", "success")
+    except sqlite3.IntegrityError as e:
+        flash(f"削除できませんでした（関連データあり）: {e}", "error")
+    except Exception as e:
+        flash(f"削除に失敗しました: {e}", "error")
+
+    return redirect(url_for("items.suppliers_list"))
+
+
+# -----------------------------
+# Item price index（実績単価インデックス）
+# -----------------------------
+@bp.get("/prices")
+@conditional_by_data_version("item_price_index", "items", "suppliers")
+def price_index_list():
+    db = get_db()
+    rows = db.execute(
+        """
+        SELECT
+          ipx.item_id,
+          i.name AS item_name,
+          i.unit_base,
+          i.ref_unit_price,
+          ipx.supplier_id,
+          COALESCE(s.name, '（未設定）') AS supplier_name,
+          ipx.last_unit_price,
+          ipx.last_purchased_at,
+          ipx.prev_unit_price,
+          ipx.rolling_avg_30d
+        FROM item_price_index ipx
+        JOIN items i ON i.item_id = ipx.item_id
+        LEFT JOIN suppliers s ON s.supplier_id = ipx.supplier_id
+        WHERE i.is_active = 1
+        ORDER BY i.name ASC, ipx.last_unit_price ASC
+        """
+    ).fetchall()
+
+    price_rows = []
+    for r in rows:
+        change = None
+        prev = r["prev_unit_price"]
+        if prev is not None and float(prev) > 0:
+            change = (float(r["last_unit_price"]) - float(prev)) / float(prev)
+        price_rows.append(
+            {
+                "row": r,
+                "change": change,
+                "is_alert": change is not None and abs(change) >= PRICE_ALERT_RATIO,
+            }
+        )
+    return render_template(
+        "price_index.html",
+        price_rows=price_rows,
+        alert_ratio=PRICE_ALERT_RATIO,
+    )
+
+
+@bp.get("/items/<int:item_id>/prices")
+def item_price_history(item_id: int):
+    item = fetch_item(item_id)
+    if item is None:
+        abort(404)
+
+    db = get_db()
+    summary = db.execute(
+        """
+        SELECT
+          COALESCE(s.name, '（未設定）') AS supplier_name,
+          ipx.last_unit_price,
+          ipx.last_purchased_at,
+          ipx.prev_unit_price,
+          ipx.rolling_avg_30d
+        FROM item_price_index ipx
+        LEFT JOIN suppliers s ON s.supplier_id = ipx.supplier_id
+        WHERE ipx.item_id = ?
+        ORDER BY ipx.last_purchased_at DESC
+        """,
+        (item_id,),
+    ).fetchall()
+
+    history = db.execute(
+        """
+        SELECT
+          p.purchase_id,
+          p.purchased_at,
+          COALESCE(s.name, '（未設定）') AS supplier_name,
+          pl.qty,
+          pl.unit_price,
+          pl.line_amount
+        FROM purchase_lines pl
+        JOIN purchases p ON p.purchase_id = pl.purchase_id
+        LEFT JOIN suppliers s ON s.supplier_id = p.supplier_id
+        WHERE pl.item_id = ?
+        ORDER BY p.purchased_at DESC, pl.purchase_line_id DESC
+        LIMIT 100
+        """,
+        (item_id,),
+    ).fetchall()
+
+    return render_template(
+        "item_price_history.html",
+        item=item,
+        summary=summary,
+        history=history,
+    )
+
+
+# -----------------------------
+# Inventory (在庫一覧)
+# -----------------------------
+@bp.get("/inventory")
+@conditional_by_data_version(*INVENTORY_TABLES)
+def inventory_list():
+    rows_html = render_cached_fragment(
+        "_inventory_rows.html",
+        INVENTORY_TABLES,
+        {},
+        lambda: {"rows": fetch_inventory_rows(get_db(), current_store_id())},
+    )
+    return render_template("inventory_list.html", rows_html=rows_html)
+
+
+# -----------------------------
+# Edit (更新)
+# -----------------------------
+@bp.get("/items/<int:item_id>/edit")
+def item_edit_form(item_id: int):
+    item = fetch_item(item_id)
+    if item is None:
+        abort(404)
+    suppliers = fetch_suppliers()
+    return render_template("item_edit.html", item=item, suppliers=suppliers)
+
+
+@bp.post("/items/<int:item_id>/update")
+def item_update(item_id: int):
+    item = fetch_item(item_id)
+    if item is None:
+        abort(404)
+
+    supplier_id_raw = request.form.get("supplier_id", "").strip()
+    supplier_id = int(supplier_id_raw) if supplier_id_raw else None
+
+    name = (request.form.get("name") or "").strip()
+    unit_base = (request.form.get("unit_base") or "").strip()
+    reorder_point = _to_float(request.form.get("reorder_point", ""), 0.0)
+    ref_unit_price = _to_float(request.form.get("ref_unit_price", ""), 0.0)
+    pack_qty = _to_float(request.form.get("pack_qty", ""), 0.0)
+    min_order_qty = _to_float(request.form.get("min_order_qty", ""), 0.0)
+    note = (request.form.get("note") or "").strip() or None
+    is_fixed = 1 if request.form.get("is_fixed") == "1" else 0
+    cost_group = (request.form.get("cost_group") or "SUPPLIES").strip()
+    if cost_group not in ("FOOD", "SUPPLIES"):
+        cost_group = "SUPPLIES"
+    is_active = 1 if request.form.get("is_active") == "1" else 0
+
+    errors: list[str] = []
+    if not name:
+        errors.append("材料名（name）は必須です。")
+    if not unit_base:
+        errors.append("単位（unit_base）は必須です。（例: g / ml / pcs）")
+    if reorder_point < 0:
+        errors.append("発注目安（reorder_point）は0以上にしてください。")
+    if ref_unit_price < 0:
+        errors.append("参考価格（ref_unit_price）は0以上にしてください。")
+    if pack_qty < 0:
+        errors.append("入数（pack_qty）は0以上にしてください。")
+    if min_order_qty < 0:
+        errors.append("最小発注数（min_order_qty）は0以上にしてください。")
+
+    if errors:
+        for e in errors:
+            flash(e, "error")
+        return redirect(url_for("items.item_edit_form", item_id=item_id))
+
+    db = get_catalog_db()
+    try:
+        with transaction(db):
+            # category は使わないので NULL で上書きしてOK
+            db.execute(
+                """
+                UPDATE items
+                SET
+                  supplier_id = ?,
+                  name = ?,
+                  category = NULL,
+                  unit_base = ?,
+                  reorder_point = ?,
+                  ref_unit_price = ?,
+                  pack_qty = ?,
+                  min_order_qty = ?,
+                  note = ?,
+                  is_fixed = ?,
+                  cost_group = ?,
+                  is_active = ?
+                WHERE item_id = ?
+                """,
+                (
+                    supplier_id, name, unit_base, reorder_point, ref_unit_price,
+                    pack_qty, min_order_qty, note, is_fixed, cost_group, is_active, item_id,
+                ),
+            )
+    except sqlite3.IntegrityError as e:
+        flash(f"更新に失敗しました（整合性エラー）: {e}", "error")
+        return redirect(url_for("items.item_edit_form", item_id=item_id))
+    except Exception as e:
+        flash(f"更新に失敗しました: {e}", "error")
+        return redirect(url_for("items.item_edit_form", item_id=item_id))
+
+    flash("材料を更新しました。", "success")
+    return redirect(url_for("items.items_list"))
+
+
+def _item_used_in_store_files(item_id: int) -> bool:
+    sql = " UNION ALL ".join(f"SELECT 1 FROM {t} WHERE item_id = ?" for t in _ITEM_REFERENCES)
+    found = fan_out(
+        store_catalog.stores(get_catalog_db),
+        lambda db, _store_id: db.execute(f"{sql} LIMIT 1", (item_id,) * len(_ITEM_REFERENCES)).fetchone()
+        is not None,
+        connect_store_db,
+    )
+    return any(found.values())
+
+
+@bp.post("/items/<int:item_id>/delete")
+def item_delete(item_id: int):
+    db = get_catalog_db()
+
+    # 存在確認
+    item = db.execute(
+        "SELECT item_id, name FROM items WHERE item_id = ?", (item_id,)
+    ).fetchone()
+    if item is None:
+        abort(404)
+    used_in_store_files = bool(SHARD_DIR) and _item_used_in_store_files(item_id)
+
+    try:
+        with transaction(db):
+            try:
+                # まず物理削除を試す（失敗したらセーブポイントまで戻す）
+                with transaction(db):
+                    if used_in_store_files:
+                        raise sqlite3.IntegrityError("店舗のDBファイルで使われています")
+                    db.execute("DELETE FROM items WHERE item_id = ?", (item_id,))
+                deleted = True
+            except sqlite3.IntegrityError:
+                # 関連データがあると削除できないので、無効化へ
+                db.execute("UPDATE items SET is_active = 0 WHERE item_id = ?", (item_id,))
+                deleted = False
+        if deleted:
+            flash(f"材料を削除しました: {item['name']}", "success")
+        else:
+            flash(
+                f"関連データがあるため物理削除できませんでした。無効化（is_active=0）しました: {item['name']}",
+                "error",
+            )
+    except Exception as e:
+        flash(f"削除に失敗しました: {e}", "error")
+
+    return redirect(url_for("items.items_list"))
@@ -0,0 +1,1064 @@
+"""
+入庫・買い物リスト・発注案の画面。
+"""
+from __future__ import annotations
+
+import sqlite3
+from itertools import groupby
+
+from flask import (
+    Blueprint,
+    abort,
+    flash,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+
+from db import get_db, transaction
+from idempotency import DuplicateSubmission
+from ledger_archive import has_archived_tx
+
+from app import (
+    PRICE_ALERT_RATIO,
+    SHOPPING_LIST_TABLES,
+    _iter_chunks,
+    build_shopping_list,
+    ceil_to_step,
+    conditional_by_data_version,
+    current_store_id,
+    duplicate_submission_response,
+    fetch_active_items,
+    fetch_suppliers,
+    idempotent_submission,
+    insert_purchase,
+    normalize_inventory_location,
+    refresh_item_price_index,
+    remember_submission_result,
+)
+
+bp = Blueprint("purchases", __name__)
+
+
+# -----------------------------
+# Purchases（入庫）
+# -----------------------------
+def collect_price_change_alerts(db, item_ids: list[int], supplier_id: int | None) -> list[str]:
+    """直近の入庫で前回単価から PRICE_ALERT_RATIO 以上動いた材料のメッセージを返す。"""
+    if not item_ids:
+        return []
+    alerts: list[str] = []
+    for chunk in _iter_chunks(sorted(set(item_ids))):
+        placeholders = ",".join("?" for _ in chunk)
+        rows = db.execute(
+            f"""
+            SELECT i.name, ipx.last_unit_price, ipx.prev_unit_price
+            FROM item_price_index ipx
+            JOIN items i ON i.item_id = ipx.item_id
+            WHERE ipx.supplier_id = ?
+              AND ipx.item_id IN ({placeholders})
+              AND ipx.prev_unit_price IS NOT NULL
+              AND ipx.prev_unit_price > 0
+            """,
+            (supplier_id or 0, *chunk),
+        ).fetchall()
+        for r in rows:
+            last = float(r["last_unit_price"])
+            prev = float(r["prev_unit_price"])
+            change = (last - prev) / prev
+            if abs(change) >= PRICE_ALERT_RATIO:
+                alerts.append(
+                    f"単価変動：{r['name']} {prev:,.2f} → {last:,.2f}（{change * 100:+.1f}%）"
+                )
+    return alerts
+
+
+@bp.get("/purchases")
+def purchases_list():
+    db = get_db()
+    store_id = current_store_id()
+    rows = db.execute(
+        """
+        SELECT
+          p.purchase_id,
+          p.purchased_at,
+          COALESCE(s.name,'（未設定）') AS supplier_name,
+          p.note,
+          p.total_amount,
+          COALESCE(itx.location, 'STORE') AS location
+        FROM purchases p
+        LEFT JOIN suppliers s ON s.supplier_id = p.supplier_id
+        LEFT JOIN (
+          SELECT ref_id, MIN(location) AS location
+          FROM inventory_tx_history
+          WHERE store_id = ? AND ref_type = 'PURCHASE'
+          GROUP BY ref_id
+        ) itx ON itx.ref_id = p.purchase_id
+        WHERE p.store_id = ?
+        ORDER BY p.purchased_at DESC, p.purchase_id DESC
+        """,
+        (store_id, store_id),
+    ).fetchall()
+    created = request.args.get("created")
+    try:
+        created_purchase_id = int(created) if created else None
+    except ValueError:
+        created_purchase_id = None
+    return render_template(
+        "purchases_list.html",
+        purchases=rows,
+        created_purchase_id=created_purchase_id,
+    )
+
+
+@bp.get("/purchases/new")
+def purchase_new_form():
+    suppliers = fetch_suppliers()
+    items = fetch_active_items()
+    return render_template(
+        "purchase_new.html",
+        suppliers=suppliers,
+        items=items,
+        default_location="STORE",
+    )
+
+
+@bp.post("/purchases")
+@idempotent_submission
+def purchase_create():
+    db = get_db()
+    store_id = current_store_id()
+
+    supplier_id_raw = (request.form.get("supplier_id") or "").strip()
+    supplier_id = int(supplier_id_raw) if supplier_id_raw else None
+
+    purchased_date = (request.form.get("purchased_date") or "").strip()
+    if purchased_date:
+        purchased_at = f"{purchased_date} 09:00:00"
+    else:
+        # 空ならDB側のDEFAULTに任せる
+        purchased_at = None
+
+    location = normalize_inventory_location(request.form.get("location"), "STORE")
+
+    note = (request.form.get("note") or "").strip() or None
+
+    # 発注案から来た場合は確定時に RECEIVED にする
+    purchase_order_id_raw = (request.form.get("purchase_order_id") or "").strip()
+    purchase_order_id = None
+
+    # 明細（最大10行想定）
+    item_ids = request.form.getlist("item_id")
+    qty_list = request.form.getlist("qty")
+    unit_price_list = request.form.getlist("unit_price")
+
+    lines: list[tuple[int, float, float | None]] = []
+    errors: list[str] = []
+
+    if purchase_order_id_raw:
+        try:
+            purchase_order_id = int(purchase_order_id_raw)
+        except ValueError:
+            errors.append("発注案IDが不正です。")
+        else:
+            if db.execute(
+                "SELECT 1 FROM purchase_orders WHERE purchase_order_id = ? AND store_id = ?",
+                (purchase_order_id, store_id),
+            ).fetchone() is None:
+                errors.append("発注案が存在しません。")
+
+    for idx, (item_id_raw, qty_raw, unit_price_raw) in enumerate(
+        zip(item_ids, qty_list, unit_price_list), start=1
+    ):
+        item_id_raw = (item_id_raw or "").strip()
+        qty_raw = (qty_raw or "").strip()
+        unit_price_raw = (unit_price_raw or "").strip()
+
+        if item_id_raw == "" and qty_raw == "" and unit_price_raw == "":
+            continue  # 完全空行はスキップ
+
+        if item_id_raw == "":
+            errors.append(f"{idx}行目：材料を選択してください。")
+            continue
+
+        if qty_raw == "":
+            errors.append(f"{idx}行目：数量(qty)を入力してください。")
+            continue
+
+        try:
+            item_id = int(item_id_raw)
+        except ValueError:
+            errors.append(f"{idx}行目：材料IDが不正です。")
+            continue
+
+        try:
+            qty = float(qty_raw)
+        except ValueError:
+            errors.append(f"{idx}行目：数量(qty)が数値ではありません。")
+            continue
+
+        if qty <= 0:
+            errors.append(f"{idx}行目：数量(qty)は0より大きくしてください。")
+            continue
+        item_row = db.execute(
+            "SELECT name, unit_base FROM items WHERE item_id = ?",
+            (item_id,),
+        ).fetchone()
+        if item_row is None:
+            errors.append(f"{idx}行目：材料IDが存在しません。")
+            continue
+
+        if unit_price_raw == "":
+            errors.append(f"{idx}行目：単価(unit_price)を入力してください。")
+            continue
+
+        try:
+            unit_price = float(unit_price_raw)
+            if unit_price < 0:
+                errors.append(f"{idx}行目：単価(unit_price)は0以上にしてください。")
+                continue
+        except ValueError:
+            errors.append(f"{idx}行目：単価(unit_price)が数値ではありません。")
+            continue
+
+        lines.append((item_id, qty, unit_price))
+
+    if not lines:
+        errors.append("明細が1行もありません。材料と数量を入力してください。")
+
+    if errors:
+        for e in errors:
+            flash(e, "error")
+        return redirect(url_for("purchases.purchase_new_form"))
+
+    try:
+        with transaction(db):
+            purchase_id = insert_purchase(
+                db, store_id, supplier_id, purchased_at, location, note, lines
+            )
+            refresh_item_price_index(db, [item_id for (item_id, _qty, _price) in lines])
+
+            if purchase_order_id is not None:
+                db.execute(
+                    """
+                    UPDATE purchase_orders
+                    SET status = 'RECEIVED', purchase_id = ?
+                    WHERE purchase_order_id = ? AND store_id = ? AND status = 'DRAFT'
+                    """,
+                    (purchase_id, purchase_order_id, store_id),
+                )
+            remember_submission_result(db, url_for("purchases.purchases_list", created=purchase_id))
+    except DuplicateSubmission as e:
+        return duplicate_submission_response(e.location)
+    except Exception as e:
+        flash(f"入庫登録に失敗しました: {e}", "error")
+        return redirect(url_for("purchases.purchase_new_form"))
+
+    flash("入庫（仕入れ）を登録しました。", "success")
+    for alert in collect_price_change_alerts(
+        db, [item_id for (item_id, _qty, _price) in lines], supplier_id
+    ):
+        flash(alert, "warning")
+    return redirect(url_for("purchases.purchases_list", created=purchase_id))
+
+
+@bp.post("/purchases/new-from-list")
+def purchase_new_from_list():
+    db = get_db()
+
+    supplier_id_raw = (request.form.get("supplier_id") or "").strip()
+    supplier_id = int(supplier_id_raw) if supplier_id_raw else None
+
+    # チェックされた材料
+    selected_item_ids_raw = request.form.getlist("selected_item_ids")
+    selected_item_ids = []
+    for x in selected_item_ids_raw:
+        try:
+            selected_item_ids.append(int(x))
+        except ValueError:
+            pass
+
+    if not selected_item_ids:
+        flash("チェックされた材料がありません。", "error")
+        return redirect(url_for("purchases.shopping_list"))
+
+    prefill_lines = []
+    for item_id in selected_item_ids[:10]:  # purchase_new.html が10行固定なので最大10件
+        qty_raw = (request.form.get(f"qty_{item_id}") or "").strip()
+        unit_price_raw = (request.form.get(f"unit_price_{item_id}") or "").strip()
+
+        try:
+            qty = float(qty_raw) if qty_raw else 0.0
+        except ValueError:
+            qty = 0.0
+
+        # 単価は任意
+        unit_price = None
+        if unit_price_raw != "":
+            try:
+                unit_price = float(unit_price_raw)
+            except ValueError:
+                unit_price = None
+
+        prefill_lines.append(
+            {
+                "item_id": item_id,
+                "qty": qty,
+                "unit_price": unit_price,
+            }
+        )
+
+    suppliers = fetch_suppliers()
+    items = fetch_active_items()
+
+    # ちょい親切：メモに「買い物リストから」入れとく
+    default_note = "買い物リストから作成"
+
+    return render_template(
+        "purchase_new.html",
+        suppliers=suppliers,
+        items=items,
+        prefill_lines=prefill_lines,
+        default_supplier_id=supplier_id,
+        default_location="STORE",
+        default_note=default_note,
+    )
+
+
+@bp.get("/purchases/<int:purchase_id>")
+def purchase_detail(purchase_id: int):
+    db = get_db()
+    store_id = current_store_id()
+
+    header = db.execute(
+        """
+        SELECT
+          p.purchase_id,
+          p.purchased_at,
+          p.total_amount,
+          p.note,
+          s.name AS supplier_name
+        FROM purchases p
+        LEFT JOIN suppliers s ON s.supplier_id = p.supplier_id
+        WHERE p.purchase_id = ? AND p.store_id = ?
+        """,
+        (purchase_id, store_id),
+    ).fetchone()
+
+    if header is None:
+        abort(404)
+
+    lines = db.execute(
+        """
+        SELECT
+          pl.purchase_line_id,
+          pl.qty,
+          pl.unit_price,
+          pl.line_amount,
+          i.name AS item_name,
+          i.unit_base
+        FROM purchase_lines pl
+        JOIN items i ON i.item_id = pl.item_id
+        WHERE pl.purchase_id = ?
+        ORDER BY pl.purchase_line_id ASC
+        """,
+        (purchase_id,),
+    ).fetchall()
+
+    return render_template("purchase_detail.html", header=header, lines=lines)
+
+
+@bp.get("/purchases/<int:purchase_id>/edit")
+def purchase_edit_form(purchase_id: int):
+    db = get_db()
+    store_id = current_store_id()
+
+    header = db.execute(
+        """
+        SELECT
+          p.purchase_id,
+          p.purchased_at,
+          p.note,
+          p.supplier_id,
+          s.name AS supplier_name,
+          COALESCE((
+            SELECT MIN(tx.location)
+            FROM inventory_tx tx
+            WHERE tx.ref_type = 'PURCHASE' AND tx.ref_id = p.purchase_id
+          ), 'STORE') AS location
+        FROM purchases p
+        LEFT JOIN suppliers s ON s.supplier_id = p.supplier_id
+        WHERE p.purchase_id = ? AND p.store_id = ?
+        """,
+        (purchase_id, store_id),
+    ).fetchone()
+    if header is None:
+        abort(404)
+
+    lines = db.execute(
+        """
+        SELECT item_id, qty, unit_price
+        FROM purchase_lines
+        WHERE purchase_id = ?
+        ORDER BY purchase_line_id ASC
+        """,
+        (purchase_id,),
+    ).fetchall()
+
+    line_rows: list[dict[str, object]] = []
+    for l in lines:
+        line_rows.append(
+            {
+                "item_id": l["item_id"],
+                "qty": l["qty"],
+                "unit_price": l["unit_price"],
+            }
+        )
+    while len(line_rows) < 10:
+        line_rows.append({"item_id": "", "qty": "", "unit_price": ""})
+    line_rows = line_rows[:10]
+
+    default_purchased_date = ""
+    if header["purchased_at"]:
+        default_purchased_date = str(header["purchased_at"])[:10]
+
+    suppliers = fetch_suppliers()
+    items = fetch_active_items()
+    return render_template(
+        "purchase_edit.html",
+        header=header,
+        line_rows=line_rows,
+        suppliers=suppliers,
+        items=items,
+        default_purchased_date=default_purchased_date,
+        default_location=normalize_inventory_location(header["location"], "STORE", store_id),
+    )
+
+
+@bp.post("/purchases/<int:purchase_id>/update")
+def purchase_update(purchase_id: int):
+    db = get_db()
+    store_id = current_store_id()
+
+    header = db.execute(
+        """
+        SELECT
+          p.purchase_id,
+          p.purchased_at,
+          COALESCE((
+            SELECT MIN(tx.location)
+            FROM inventory_tx tx
+            WHERE tx.ref_type = 'PURCHASE' AND tx.ref_id = p.purchase_id
+          ), 'STORE') AS location
+        FROM purchases p
+        WHERE p.purchase_id = ? AND p.store_id = ?
+        """,
+        (purchase_id, store_id),
+    ).fetchone()
+    if header is None:
+        abort(404)
+    if has_archived_tx(db, "PURCHASE", purchase_id):
+        flash("締め済み（アーカイブ済み）の期間の入庫は編集できません。", "error")
+        return redirect(url_for("purchases.purchase_detail", purchase_id=purchase_id))
+
+    supplier_id_raw = (request.form.get("supplier_id") or "").strip()
+    supplier_id = int(supplier_id_raw) if supplier_id_raw else None
+
+    purchased_date = (request.form.get("purchased_date") or "").strip()
+    if purchased_date:
+        purchased_at_db = f"{purchased_date} 09:00:00"
+    else:
+        purchased_at_db = header["purchased_at"]
+
+    location = normalize_inventory_location(
+        request.form.get("location"), header["location"] or "STORE"
+    )
+
+    note = (request.form.get("note") or "").strip() or None
+
+    item_ids = request.form.getlist("item_id")
+    qty_list = request.form.getlist("qty")
+    unit_price_list = request.form.getlist("unit_price")
+
+    lines: list[tuple[int, float, float | None]] = []
+    errors: list[str] = []
+
+    for idx, (item_id_raw, qty_raw, unit_price_raw) in enumerate(
+        zip(item_ids, qty_list, unit_price_list), start=1
+    ):
+        item_id_raw = (item_id_raw or "").strip()
+        qty_raw = (qty_raw or "").strip()
+        unit_price_raw = (unit_price_raw or "").strip()
+
+        if item_id_raw == "" and qty_raw == "" and unit_price_raw == "":
+            continue
+
+        if item_id_raw == "":
+            errors.append(f"{idx}行目：材料を選択してください。")
+            continue
+
+        if qty_raw == "":
+            errors.append(f"{idx}行目：数量(qty)を入力してください。")
+            continue
+
+        try:
+            item_id = int(item_id_raw)
+        except ValueError:
+            errors.append(f"{idx}行目：材料IDが不正です。")
+            continue
+
+        try:
+            qty = float(qty_raw)
+        except ValueError:
+            errors.append(f"{idx}行目：数量(qty)が数値ではありません。")
+            continue
+
+        if qty <= 0:
+            errors.append(f"{idx}行目：数量(qty)は0より大きくしてください。")
+            continue
+        item_row = db.execute(
+            "SELECT name, unit_base FROM items WHERE item_id = ?",
+            (item_id,),
+        ).fetchone()
+        if item_row is None:
+            errors.append(f"{idx}行目：材料IDが存在しません。")
+            continue
+
+        if unit_price_raw == "":
+            errors.append(f"{idx}行目：単価(unit_price)を入力してください。")
+            continue
+
+        try:
+            unit_price = float(unit_price_raw)
+            if unit_price < 0:
+                errors.append(f"{idx}行目：単価(unit_price)は0以上にしてください。")
+                continue
+        except ValueError:
+            errors.append(f"{idx}行目：単価(unit_price)が数値ではありません。")
+            continue
+
+        lines.append((item_id, qty, unit_price))
+
+    if not lines:
+        errors.append("明細が1行もありません。材料と数量を入力してください。")
+
+    if errors:
+        for e in errors:
+            flash(e, "error")
+        return redirect(url_for("purchases.purchase_edit_form", purchase_id=purchase_id))
+
+    try:
+        with transaction(db):
+            db.execute(
+                """
+                UPDATE purchases
+                SET supplier_id = ?, purchased_at = ?, note = ?, total_amount = NULL
+                WHERE purchase_id = ?
+                """,
+                (supplier_id, purchased_at_db, note, purchase_id),
+            )
+
+            old_item_ids = [
+                int(r["item_id"])
+                for r in db.execute(
+                    "SELECT item_id FROM purchase_lines WHERE purchase_id = ?",
+                    (purchase_id,),
+                ).fetchall()
+            ]
+
+            db.execute(
+                "DELETE FROM inventory_tx WHERE ref_type = 'PURCHASE' AND ref_id = ?",
+                (purchase_id,),
+            )
+            db.execute("DELETE FROM purchase_lines WHERE purchase_id = ?", (purchase_id,))
+
+            total = 0.0
+            for (item_id, qty, unit_price) in lines:
+                line_amount = None
+                if unit_price is not None:
+                    line_amount = qty * unit_price
+                    total += line_amount
+
+                db.execute(
+                    """
+                    INSERT INTO purchase_lines (purchase_id, item_id, qty, unit_price, line_amount)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (purchase_id, item_id, qty, unit_price, line_amount),
+                )
+
+                db.execute(
+                    """
+                    INSERT INTO inventory_tx (
+                      store_id, happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note
+                    )
+                    VALUES (
+                      ?, COALESCE(?, datetime('now')),
+                      ?, ?, 'PURCHASE', ?, 'PURCHASE', ?, ?
+                    )
+                    """,
+                    (
+                        store_id,
+                        purchased_at_db,
+                        item_id,
+                        qty,
+                        location,
+                        purchase_id,
+                        note,
+                    ),
+                )
+
+            db.execute(
+                "UPDATE purchases SET total_amount = ? WHERE purchase_id = ?",
+                (total, purchase_id),
+            )
+
+            refresh_item_price_index(
+                db, old_item_ids + [item_id for (item_id, _qty, _price) in lines]
+            )
+
+    except Exception as e:
+        flash(f"更新に失敗しました: {e}", "error")
+        return redirect(url_for("purchases.purchase_edit_form", purchase_id=purchase_id))
+
+    flash("入庫を更新しました。", "success")
+    for alert in collect_price_change_alerts(
+        db, [item_id for (item_id, _qty, _price) in lines], supplier_id
+    ):
+        flash(alert, "warning")
+    return redirect(url_for("purchases.purchase_detail", purchase_id=purchase_id))
+
+
+@bp.post("/purchases/<int:purchase_id>/delete")
+def purchase_delete(purchase_id: int):
+    db = get_db()
+
+    header = db.execute(
+        "SELECT purchase_id FROM purchases WHERE purchase_id = ? AND store_id = ?",
+        (purchase_id, current_store_id()),
+    ).fetchone()
+    if header is None:
+        abort(404)
+    if has_archived_tx(db, "PURCHASE", purchase_id):
+        flash("締め済み（アーカイブ済み）の期間の入庫は削除できません。", "error")
+        return redirect(url_for("purchases.purchase_detail", purchase_id=purchase_id))
+
+    try:
+        with transaction(db):
+            item_ids = [
+                int(r["item_id"])
+                for r in db.execute(
+                    "SELECT item_id FROM purchase_lines WHERE purchase_id = ?",
+                    (purchase_id,),
+                ).fetchall()
+            ]
+            db.execute(
+                "DELETE FROM inventory_tx WHERE ref_type = 'PURCHASE' AND ref_id = ?",
+                (purchase_id,),
+            )
+            # 明細は親より先に消す（CASCADE に任せると変更フィードに店舗が載らない）
+            db.execute("DELETE FROM purchase_lines WHERE purchase_id = ?", (purchase_id,))
+            db.execute("DELETE FROM purchases WHERE purchase_id = ?", (purchase_id,))
+            refresh_item_price_index(db, item_ids)
+    except Exception as e:
+        flash(f"削除に失敗しました: {e}", "error")
+        return redirect(url_for("purchases.purchase_detail", purchase_id=purchase_id))
+
+    flash("入庫を削除しました。", "success")
+    return redirect(url_for("purchases.purchases_list"))
+
+
+# -----------------------------
+# Shopping list (買い物リスト)
+# -----------------------------
+@bp.get("/shopping-list")
+@conditional_by_data_version(*SHOPPING_LIST_TABLES)
+def shopping_list():
+    return render_template(
+        "shopping_list.html",
+        grouped=build_shopping_list(get_db(), current_store_id()),
+    )
+
+
+# -----------------------------
+# Purchase orders (発注案)
+# -----------------------------
+ORDER_PRICE_LOOKBACK_DAYS = 180
+
+
+def calc_order_qty(
+    shortage: float, unit_base: str | None, pack_qty: float, min_order_qty: float
+) -> float:
+    """不足数を最小発注数・入数（発注の刻み）で丸めた発注数量を返す。"""
+    if shortage <= 1e-9:
+        return 0.0
+    qty = max(shortage, min_order_qty)
+    if pack_qty > 0:
+        return ceil_to_step(qty, pack_qty)
+    step = 1.0 if unit_base == "pcs" else 0.01
+    return ceil_to_step(qty, step)
+
+
+def fetch_recent_supplier_prices(
+    db, lookback_days: int = ORDER_PRICE_LOOKBACK_DAYS
+) -> dict[int, list[dict[str, object]]]:
+    """
+    仕入れ先×材料ごとの直近の実績単価を item_price_index からまとめて取得する。
+    return: {item_id: [{"supplier_id", "unit_price", "purchased_at"}, ...]}
+    """
+    rows = db.execute(
+        """
+        SELECT ipx.item_id, ipx.supplier_id, ipx.last_unit_price, ipx.last_purchased_at
+        FROM item_price_index ipx
+        JOIN items i ON i.item_id = ipx.item_id
+        WHERE i.is_active = 1
+          AND ipx.supplier_id != 0
+          AND datetime(ipx.last_purchased_at) >= datetime('now', ?)
+        """,
+        (f"-{int(lookback_days)} days",),
+    ).fetchall()
+
+    price_map: dict[int, list[dict[str, object]]] = {}
+    for r in rows:
+        price_map.setdefault(int(r["item_id"]), []).append(
+            {
+                "supplier_id": int(r["supplier_id"]),
+                "unit_price": float(r["last_unit_price"] or 0),
+                "purchased_at": r["last_purchased_at"],
+            }
+        )
+    return price_map
+
+
+def _known_unit_price(value) -> float | None:
+    """単価。0 以下・未設定は不明（None）。"""
+    price = float(value or 0)
+    return price if price > 0 else None
+
+
+def build_purchase_order_plan(db, store_id: int) -> list[dict[str, object]]:
+    """
+    店舗の在庫が発注目安を下回った全アクティブ材料について、最安の仕入れ先を選んで発注案を作る。
+    在庫・材料・実績単価はそれぞれ1クエリで取得し、材料ごとの個別クエリは発行しない。
+    実績単価が無い材料は items の仕入れ先と ref_unit_price を使う。
+    0 以下・未設定の単価は「単価不明」（unit_price / est_amount が None）で、最安の比較では単価のわかる候補より後にする。
+    """
+    rows = db.execute(
+        """
+        WITH inv AS (
+          SELECT item_id, SUM(qty_delta) AS qty
+          FROM inventory_tx
+          WHERE store_id = ?
+          GROUP BY item_id
+        )
+        SELECT
+          i.item_id,
+          i.name,
+          i.unit_base,
+          i.reorder_point,
+          i.ref_unit_price,
+          i.pack_qty,
+          i.min_order_qty,
+          i.cost_group,
+          i.supplier_id,
+          COALESCE(inv.qty, 0) AS qty
+        FROM items i
+        LEFT JOIN inv ON inv.item_id = i.item_id
+        WHERE i.is_active = 1
+          AND COALESCE(i.reorder_point, 0) > 0
+          AND COALESCE(inv.qty, 0) < COALESCE(i.reorder_point, 0)
+        ORDER BY i.name ASC
+        """,
+        (store_id,),
+    ).fetchall()
+    if not rows:
+        return []
+
+    price_map = fetch_recent_supplier_prices(db)
+    supplier_names = {int(s["supplier_id"]): s["name"] for s in fetch_suppliers()}
+
+    groups: dict[int | None, dict[str, object]] = {}
+    for r in rows:
+        qty = float(r["qty"] or 0)
+        reorder_point = float(r["reorder_point"] or 0)
+        order_qty = calc_order_qty(
+            reorder_point - qty,
+            r["unit_base"],
+            float(r["pack_qty"] or 0),
+            float(r["min_order_qty"] or 0),
+        )
+        if order_qty <= 1e-9:
+            continue
+
+        default_supplier_id = r["supplier_id"]
+        ref_price = _known_unit_price(r["ref_unit_price"])
+        candidates = [
+            dict(c, unit_price=_known_unit_price(c["unit_price"]), price_source="LAST")
+            for c in price_map.get(int(r["item_id"]), [])
+        ]
+        if default_supplier_id is not None and all(
+            c["supplier_id"] != default_supplier_id for c in candidates
+        ):
+            candidates.append(
+                {
+                    "supplier_id": int(default_supplier_id),
+                    "unit_price": ref_price,
+                    "purchased_at": None,
+                    "price_source": "REF",
+                }
+            )
+
+        if candidates:
+            # 最安を選ぶ。単価不明は単価のわかる候補より後、同額なら材料マスターの仕入れ先を優先
+            best = min(
+                candidates,
+                key=lambda c: (
+                    c["unit_price"] is None,
+                    c["unit_price"] or 0.0,
+                    c["supplier_id"] != default_supplier_id,
+                ),
+            )
+        else:
+            best = {
+                "supplier_id": None,
+                "unit_price": ref_price,
+                "purchased_at": None,
+                "price_source": "REF",
+            }
+
+        supplier_id = best["supplier_id"]
+        unit_price = best["unit_price"]
+        est_amount = None if unit_price is None else order_qty * unit_price
+
+        group = groups.get(supplier_id)
+        if group is None:
+            group = {
+                "supplier_id": supplier_id,
+                "supplier_name": supplier_names.get(supplier_id, "（未設定）"),
+                "lines": [],
+                "est_sum": 0.0,
+            }
+            groups[supplier_id] = group
+        group["lines"].append(
+            {
+                "item_id": r["item_id"],
+                "name": r["name"],
+                "unit_base": r["unit_base"],
+                "cost_group": r["cost_group"],
+                "qty": qty,
+                "reorder_point": reorder_point,
+                "order_qty": order_qty,
+                "unit_price": unit_price,
+                "price_source": best["price_source"],
+                "last_purchased_at": best["purchased_at"],
+                "candidate_count": len(candidates),
+                "est_amount": est_amount,
+            }
+        )
+        group["est_sum"] += est_amount or 0.0
+        if est_amount is None:
+            group["unknown_price_count"] = group.get("unknown_price_count", 0) + 1
+
+    return sorted(groups.values(), key=lambda g: str(g["supplier_name"]))
+
+
+@bp.get("/purchase-orders/plan")
+def purchase_order_plan():
+    db = get_db()
+    plan = build_purchase_order_plan(db, current_store_id())
+    return render_template(
+        "purchase_order_plan.html",
+        plan=plan,
+        lookback_days=ORDER_PRICE_LOOKBACK_DAYS,
+    )
+
+
+@bp.post("/purchase-orders")
+def purchase_orders_create():
+    db = get_db()
+    store_id = current_store_id()
+
+    selected_item_ids = set()
+    for x in request.form.getlist("selected_item_ids"):
+        try:
+            selected_item_ids.add(int(x))
+        except ValueError:
+            pass
+
+    if not selected_item_ids:
+        flash("チェックされた材料がありません。", "error")
+        return redirect(url_for("purchases.purchase_order_plan"))
+
+    plan = build_purchase_order_plan(db, store_id)
+
+    created = 0
+    try:
+        with transaction(db):
+            line_params = []
+            for group in plan:
+                lines = [l for l in group["lines"] if int(l["item_id"]) in selected_item_ids]
+                if not lines:
+                    continue
+                est_sum = sum(float(l["est_amount"] or 0) for l in lines)
+                cur = db.execute(
+                    """
+                    INSERT INTO purchase_orders (store_id, supplier_id, status, est_amount, note)
+                    VALUES (?, ?, 'DRAFT', ?, ?)
+                    """,
+                    (store_id, group["supplier_id"], est_sum, "発注案から自動作成"),
+                )
+                purchase_order_id = cur.lastrowid
+                created += 1
+                for l in lines:
+                    line_params.append(
+                        (
+                            purchase_order_id,
+                            l["item_id"],
+                            l["order_qty"],
+                            l["unit_price"],
+                            l["price_source"],
+                            l["est_amount"],
+                        )
+                    )
+
+            if line_params:
+                db.executemany(
+                    """
+                    INSERT INTO purchase_order_lines (
+                      purchase_order_id, item_id, qty, unit_price, price_source, line_amount
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    """,
+                    line_params,
+                )
+
+    except Exception as e:
+        flash(f"発注案の作成に失敗しました: {e}", "error")
+        return redirect(url_for("purchases.purchase_order_plan"))
+
+    flash(f"発注案（下書き）を{created}件作成しました。", "success")
+    return redirect(url_for("purchases.purchase_orders_list"))
+
+
+@bp.get("/purchase-orders")
+def purchase_orders_list():
+    db = get_db()
+    headers = db.execute(
+        """
+        SELECT
+          po.purchase_order_id,
+          po.created_at,
+          po.status,
+          po.est_amount,
+          po.note,
+          po.purchase_id,
+          po.supplier_id,
+          COALESCE(s.name, '（未設定）') AS supplier_name
+        FROM purchase_orders po
+        LEFT JOIN suppliers s ON s.supplier_id = po.supplier_id
+        WHERE po.store_id = ?
+        ORDER BY CASE po.status WHEN 'DRAFT' THEN 0 ELSE 1 END,
+                 po.created_at DESC, po.purchase_order_id DESC
+        LIMIT 100
+        """,
+        (current_store_id(),),
+    ).fetchall()
+
+    lines_by_order: dict[int, list[sqlite3.Row]] = {}
+    order_ids = [int(h["purchase_order_id"]) for h in headers]
+    for chunk in _iter_chunks(order_ids):
+        placeholders = ",".join("?" for _ in chunk)
+        rows = db.execute(
+            f"""
+            SELECT
+              pol.purchase_order_id,
+              pol.qty,
+              pol.unit_price,
+              pol.price_source,
+              pol.line_amount,
+              i.name AS item_name,
+              i.unit_base
+            FROM purchase_order_lines pol
+            JOIN items i ON i.item_id = pol.item_id
+            WHERE pol.purchase_order_id IN ({placeholders})
+            ORDER BY pol.purchase_order_id, i.name ASC
+            """,
+            chunk,
+        ).fetchall()
+        for order_id, group in groupby(rows, key=lambda r: r["purchase_order_id"]):
+            lines_by_order[int(order_id)] = list(group)
+
+    orders = [
+        {"header": h, "lines": lines_by_order.get(int(h["purchase_order_id"]), [])}
+        for h in headers
+    ]
+    return render_template("purchase_orders_list.html", orders=orders)
+
+
+@bp.get("/purchase-orders/<int:purchase_order_id>/receive")
+def purchase_order_receive(purchase_order_id: int):
+    db = get_db()
+
+    header = db.execute(
+        """
+        SELECT purchase_order_id, supplier_id, status
+        FROM purchase_orders
+        WHERE purchase_order_id = ? AND store_id = ?
+        """,
+        (purchase_order_id, current_store_id()),
+    ).fetchone()
+    if header is None:
+        abort(404)
+    if header["status"] != "DRAFT":
+        flash("この発注案は既に処理済みです。", "error")
+        return redirect(url_for("purchases.purchase_orders_list"))
+
+    lines = db.execute(
+        """
+        SELECT item_id, qty, unit_price
+        FROM purchase_order_lines
+        WHERE purchase_order_id = ?
+        ORDER BY purchase_order_line_id ASC
+        """,
+        (purchase_order_id,),
+    ).fetchall()
+
+    prefill_lines = [
+        {
+            "item_id": l["item_id"],
+            "qty": float(l["qty"] or 0),
+            "unit_price": l["unit_price"],
+        }
+        for l in lines
+    ]
+
+    return render_template(
+        "purchase_new.html",
+        suppliers=fetch_suppliers(),
+        items=fetch_active_items(),
+        prefill_lines=prefill_lines,
+        default_supplier_id=header["supplier_id"],
+        default_location="STORE",
+        default_note=f"発注案ID {purchase_order_id} から入庫",
+        purchase_order_id=purchase_order_id,
+    )
+
+
+@bp.post("/purchase-orders/<int:purchase_order_id>/cancel")
+def purchase_order_cancel(purchase_order_id: int):
+    db = get_db()
+    try:
+        with transaction(db):
+            db.execute(
+                """
+                UPDATE purchase_orders
+                SET status = 'CANCELLED'
+                WHERE purchase_order_id = ? AND store_id = ? AND status = 'DRAFT'
+                """,
+                (purchase_order_id, current_store_id()),
+            )
+        flash("発注案を取り消しました。", "success")
+    except Exception as e:
+        flash(f"取り消しに失敗しました: {e}", "error")
+    return redirect(url_for("purchases.purchase_orders_list"))
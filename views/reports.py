@@ -0,0 +1,354 @@
+"""
+日報・月次原価・店舗別集計・CSVエクスポートの画面。
+"""
+from __future__ import annotations
+
+from datetime import date, datetime
+
+from flask import (
+    Blueprint,
+    Response,
+    abort,
+    flash,
+    redirect,
+    render_template,
+    request,
+    stream_with_context,
+    url_for,
+)
+
+from db import (
+    connect_store_db,
+    get_catalog_db,
+    get_db,
+    transaction,
+)
+from exports import (
+    EXPORT_KINDS,
+    export_filename,
+    iter_export_csv,
+    parse_export_date,
+)
+from ledger_archive import has_archived_tx
+from shards import fan_out
+from stores import store_catalog
+
+from app import (
+    IDEAL_FOOD_COST_RATIO,
+    MONTHLY_FOOD_COST_TABLES,
+    build_monthly_food_cost,
+    conditional_by_data_version,
+    current_store_id,
+    regenerate_inventory_tx_for_daily_report,
+    render_cached_fragment,
+)
+
+bp = Blueprint("reports", __name__)
+
+
+# -----------------------------
+# Daily reports（日報）
+# -----------------------------
+def format_daily_report_for_line(rep) -> str:
+    """
+    LINEへコピペする用の本文を作る
+    形式:
+    【日報】
+    売れたバッチ
+    生産時間(入力値・時間)
+
+    売上(カンマ区切り)
+
+    所感
+    """
+    sold = rep["sold_batches"]
+    sold_str = str(sold if sold is not None else 0)
+
+    prod = rep["production_minutes"]
+    prod_str = f"{float(prod or 0):.1f}"
+
+    sales = rep["sales_amount"]
+    sales_int = int(round(float(sales or 0)))
+    sales_str = f"{sales_int:,}"
+
+    impression = (rep["impression"] or "").strip()
+
+    return (
+        "【日報】\n"
+        f"{sold_str}\n"
+        f"{prod_str}\n\n"
+        f"{sales_str}\n\n"
+        f"{impression}"
+    )
+
+
+@bp.get("/daily-reports")
+def daily_reports_list():
+    db = get_db()
+    rows = db.execute(
+        """
+        SELECT daily_report_id, report_date, sold_batches, production_minutes, sales_amount
+        FROM daily_reports
+        WHERE store_id = ?
+        ORDER BY report_date DESC, daily_report_id DESC
+        """,
+        (current_store_id(),),
+    ).fetchall()
+    return render_template("daily_reports_list.html", reports=rows)
+
+
+@bp.get("/daily-reports/new")
+def daily_report_new():
+    today = date.today().isoformat()
+    return render_template("daily_report_new.html", default_date=today)
+
+
+@bp.post("/daily-reports")
+def daily_report_create():
+    db = get_db()
+    store_id = current_store_id()
+
+    report_date = (request.form.get("report_date") or "").strip()
+    if not report_date:
+        flash("日付（report_date）は必須です", "error")
+        return redirect(url_for("reports.daily_report_new"))
+
+    sold_batches = float((request.form.get("sold_batches") or "0").strip() or 0)
+    waste_pieces = 0
+    production_minutes = float(
+        (request.form.get("production_minutes") or "0").strip() or 0
+    )
+    sales_amount = float((request.form.get("sales_amount") or "0").strip() or 0)
+    impression = (request.form.get("impression") or "").strip()
+
+    # 1日1回運用：同じ日付があるなら編集へ誘導（好みで）
+    exists = db.execute(
+        """
+        SELECT daily_report_id FROM daily_reports WHERE store_id = ? AND report_date = ?
+        LIMIT 1
+        """,
+        (store_id, report_date),
+    ).fetchone()
+    if exists:
+        flash("この日付の日報は既にあります。編集してください。", "error")
+        return redirect(
+            url_for("reports.daily_report_edit", daily_report_id=exists["daily_report_id"])
+        )
+
+    try:
+        with transaction(db, serialize=True):
+            db.execute(
+                """
+                INSERT INTO daily_reports
+                  (store_id, report_date, sold_batches, waste_pieces, production_minutes, sales_amount, impression, created_at)
+                VALUES
+                  (?, ?, ?, ?, ?, ?, ?, datetime('now'))
+                """,
+                (
+                    store_id,
+                    report_date,
+                    sold_batches,
+                    waste_pieces,
+                    production_minutes,
+                    sales_amount,
+                    impression,
+                ),
+            )
+
+            daily_report_id = db.execute("SELECT last_insert_rowid() AS id").fetchone()[
+                "id"
+            ]
+
+            created_tx = regenerate_inventory_tx_for_daily_report(db, daily_report_id)
+
+        flash(f"日報を登録しました（inventory_tx自動生成: {created_tx}件）", "success")
+        return redirect(url_for("reports.daily_report_detail", daily_report_id=daily_report_id))
+
+    except Exception as e:
+        flash(f"日報登録に失敗しました: {e}", "error")
+        return redirect(url_for("reports.daily_report_new"))
+
+
+@bp.get("/daily-reports/<int:daily_report_id>/edit")
+def daily_report_edit(daily_report_id: int):
+    db = get_db()
+    rep = db.execute(
+        """
+        SELECT * FROM daily_reports WHERE daily_report_id = ? AND store_id = ?
+        """,
+        (daily_report_id, current_store_id()),
+    ).fetchone()
+    if rep is None:
+        abort(404)
+    return render_template("daily_report_edit.html", rep=rep)
+
+
+@bp.post("/daily-reports/<int:daily_report_id>/edit")
+def daily_report_update(daily_report_id: int):
+    db = get_db()
+
+    report_date = (request.form.get("report_date") or "").strip()
+    sold_batches = float((request.form.get("sold_batches") or "0").strip() or 0)
+    waste_pieces = 0
+    production_minutes = float(
+        (request.form.get("production_minutes") or "0").strip() or 0
+    )
+    sales_amount = float((request.form.get("sales_amount") or "0").strip() or 0)
+    impression = (request.form.get("impression") or "").strip()
+
+    exists = db.execute(
+        "SELECT 1 FROM daily_reports WHERE daily_report_id = ? AND store_id = ?",
+        (daily_report_id, current_store_id()),
+    ).fetchone()
+    if exists is None:
+        abort(404)
+    if has_archived_tx(db, "DAILY_REPORT", daily_report_id):
+        flash("締め済み（アーカイブ済み）の期間の日報は編集できません。", "error")
+        return redirect(url_for("reports.daily_report_detail", daily_report_id=daily_report_id))
+
+    try:
+        with transaction(db, serialize=True):
+            db.execute(
+                """
+                UPDATE daily_reports
+                SET report_date = ?,
+                    sold_batches = ?,
+                    waste_pieces = ?,
+                    production_minutes = ?,
+                    sales_amount = ?,
+                    impression = ?
+                WHERE daily_report_id = ?
+                """,
+                (
+                    report_date,
+                    sold_batches,
+                    waste_pieces,
+                    production_minutes,
+                    sales_amount,
+                    impression,
+                    daily_report_id,
+                ),
+            )
+
+            created_tx = regenerate_inventory_tx_for_daily_report(db, daily_report_id)
+
+        flash(f"日報を更新しました（inventory_tx再生成: {created_tx}件）", "success")
+        return redirect(url_for("reports.daily_report_detail", daily_report_id=daily_report_id))
+
+    except Exception as e:
+        flash(f"日報更新に失敗しました: {e}", "error")
+        return redirect(url_for("reports.daily_report_edit", daily_report_id=daily_report_id))
+
+
+@bp.get("/daily-reports/<int:daily_report_id>")
+def daily_report_detail(daily_report_id: int):
+    db = get_db()
+    rep = db.execute(
+        """
+        SELECT *
+        FROM daily_reports
+        WHERE daily_report_id = ? AND store_id = ?
+        """,
+        (daily_report_id, current_store_id()),
+    ).fetchone()
+
+    if rep is None:
+        abort(404)
+
+    line_text = format_daily_report_for_line(rep)
+    return render_template("daily_report_detail.html", rep=rep, line_text=line_text)
+
+
+# -----------------------------
+# Reports (月次原価)
+# -----------------------------
+@bp.get("/reports/monthly-food-cost")
+@conditional_by_data_version(*MONTHLY_FOOD_COST_TABLES)
+def monthly_food_cost():
+    # 月選択：?ym=2026-01（なければ今月）
+    ym = (request.args.get("ym") or date.today().strftime("%Y-%m")).strip()
+    body_html = render_cached_fragment(
+        "_monthly_food_cost_body.html",
+        MONTHLY_FOOD_COST_TABLES,
+        {"ym": ym},
+        lambda: build_monthly_food_cost(get_db(), current_store_id(), ym),
+    )
+    return render_template(
+        "monthly_food_cost.html", ym=ym, ideal_ratio=IDEAL_FOOD_COST_RATIO, body_html=body_html
+    )
+
+
+def build_store_rollup(ym: str) -> dict[str, object]:
+    """
+    店舗横断の月次原価。店舗ごとに集計した値（各店舗の行だけを読む）を足し合わせる。
+    店舗ごとの集計はスレッドプールで並べて、店舗ごとの接続で読む（店舗ファイルに分けていれば別ファイル）。
+    """
+    stores = store_catalog.active_stores(get_catalog_db)
+    reports = fan_out(
+        [store["store_id"] for store in stores],
+        lambda db, store_id: build_monthly_food_cost(db, store_id, ym),
+        connect_store_db,
+    )
+    rows = []
+    totals = {"sales": 0.0, "begin_value": 0.0, "purchases_cost": 0.0, "end_value": 0.0, "cogs": 0.0}
+    for store in stores:
+        report = reports[store["store_id"]]
+        row = {k: report[k] for k in (*totals, "ratio", "begin_missing", "end_missing")}
+        rows.append({"store": store, **row})
+        for k in totals:
+            totals[k] += report[k]
+    ratio = totals["cogs"] / totals["sales"] if totals["sales"] > 0 else None
+    return {"ym": ym, "rows": rows, "totals": totals, "ratio": ratio}
+
+
+@bp.get("/reports/stores")
+@conditional_by_data_version(*MONTHLY_FOOD_COST_TABLES)
+def stores_rollup():
+    ym = (request.args.get("ym") or date.today().strftime("%Y-%m")).strip()
+    try:
+        datetime.strptime(ym, "%Y-%m")
+    except ValueError:
+        ym = date.today().strftime("%Y-%m")
+    return render_template(
+        "stores_rollup.html", ideal_ratio=IDEAL_FOOD_COST_RATIO, **build_store_rollup(ym)
+    )
+
+
+# -----------------------------
+# Exports (CSVエクスポート)
+# -----------------------------
+@bp.get("/exports")
+def exports_index():
+    return render_template("exports.html", kinds=EXPORT_KINDS)
+
+
+@bp.get("/exports/<kind>.csv")
+def export_csv(kind: str):
+    if kind not in EXPORT_KINDS:
+        abort(404)
+
+    try:
+        date_from = parse_export_date(request.args.get("from"))
+        date_to = parse_export_date(request.args.get("to"))
+    except ValueError:
+        flash("日付は YYYY-MM-DD で指定してください。", "error")
+        return redirect(url_for("reports.exports_index"))
+
+    store_id = current_store_id()
+    location = (request.args.get("location") or "").strip().upper() or None
+    if location is not None and location not in store_catalog.location_codes(get_catalog_db, store_id):
+        location = None
+
+    def generate():
+        # ビューを抜けた時点で teardown が接続を閉じるので、接続はストリーム側で取り直す
+        yield from iter_export_csv(get_db(), kind, store_id, date_from, date_to, location)
+
+    filename = export_filename(kind, date_from, date_to, location)
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/csv",
+        headers={
+            "Content-Type": "text/csv; charset=utf-8",
+            "Content-Disposition": f'attachment; filename="{filename}"',
+        },
+    )
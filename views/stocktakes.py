@@ -0,0 +1,894 @@
+"""
+棚卸（週次・月次）の画面。
+"""
+from __future__ import annotations
+
+import sqlite3
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from flask import (
+    Blueprint,
+    abort,
+    flash,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+from markupsafe import Markup
+
+from db import get_catalog_db, get_db, transaction
+from idempotency import DuplicateSubmission
+from ledger_archive import has_archived_tx
+
+from app import (
+    STOCKTAKE_ADJUST_LOCATION,
+    _iter_chunks,
+    _to_datetime_seconds,
+    build_estimate_price_map,
+    build_monthly_weighted_unit_cost_map,
+    current_store_id,
+    duplicate_submission_response,
+    get_inventory_qty_map_for_items,
+    idempotent_submission,
+    insert_stocktake,
+    month_range_for_datetime,
+    parse_stocktake_location,
+    remember_submission_result,
+    render_cached_fragment,
+)
+
+bp = Blueprint("stocktakes", __name__)
+
+STOCKTAKE_FORM_TABLES = ("items", "inventory_tx", "recipe_batch", "batch_config")
+
+
+# -----------------------------
+# Stocktakes (棚卸)
+# -----------------------------
+def normalize_stocktake_mode(raw: str | None, default: str) -> str:
+    mode = (raw or "").strip().lower()
+    if mode not in ("weekly", "monthly"):
+        return default
+    return mode
+
+
+def normalize_stocktake_group(raw: str | None) -> str:
+    group = (raw or "").strip().upper()
+    if group not in ("ALL", "FOOD", "SUPPLIES"):
+        return "ALL"
+    return group
+
+
+def fetch_items_for_stocktake_group(group: str) -> list[sqlite3.Row]:
+    db = get_db()
+    if group == "FOOD":
+        return db.execute(
+            """
+            SELECT item_id, supplier_id, name, unit_base, reorder_point, ref_unit_price, cost_group
+            FROM items
+            WHERE is_active = 1 AND cost_group = 'FOOD'
+            ORDER BY name ASC
+            """
+        ).fetchall()
+    if group == "SUPPLIES":
+        return db.execute(
+            """
+            SELECT item_id, supplier_id, name, unit_base, reorder_point, ref_unit_price, cost_group
+            FROM items
+            WHERE is_active = 1 AND cost_group = 'SUPPLIES'
+            ORDER BY name ASC
+            """
+        ).fetchall()
+    return db.execute(
+        """
+        SELECT item_id, supplier_id, name, unit_base, reorder_point, ref_unit_price, cost_group
+        FROM items
+        WHERE is_active = 1
+        ORDER BY name ASC
+        """
+    ).fetchall()
+
+
+def build_initial_stocktake_unit_cost_map(
+    db, store_id: int, items: list[sqlite3.Row], taken_at: str
+) -> dict[int, float]:
+    """
+    初回棚卸用: 棚卸日時までの実績平均単価を品目ごとに一括計算する。
+    実績数量が0の品目・単価未入力の明細は見積り単価（実績単価インデックス → ref_unit_price）を使用。
+    """
+    if not items:
+        return {}
+
+    item_ids = [int(it["item_id"]) for it in items]
+    ref_map = build_estimate_price_map(db, items)
+
+    unit_cost_map: dict[int, float] = {}
+    for chunk in _iter_chunks(item_ids):
+        placeholders = ",".join(["?"] * len(chunk))
+        rows = db.execute(
+            f"""
+            SELECT
+              pl.item_id AS item_id,
+              COALESCE(SUM(
+                CASE
+                  WHEN pl.line_amount IS NOT NULL THEN pl.line_amount
+                  WHEN pl.unit_price IS NOT NULL THEN pl.qty * pl.unit_price
+                  ELSE pl.qty * COALESCE(
+                    (
+                      SELECT ipx.last_unit_price
+                      FROM item_price_index ipx
+                      WHERE ipx.item_id = pl.item_id
+                      ORDER BY ipx.last_purchased_at DESC
+                      LIMIT 1
+                    ),
+                    i.ref_unit_price,
+                    0
+                  )
+                END
+              ), 0) AS amount_sum,
+              COALESCE(SUM(pl.qty), 0) AS qty_sum
+            FROM purchase_lines pl
+            JOIN purchases p ON p.purchase_id = pl.purchase_id
+            JOIN items i ON i.item_id = pl.item_id
+            WHERE pl.item_id IN ({placeholders})
+              AND p.store_id = ?
+              AND datetime(p.purchased_at) <= datetime(?)
+            GROUP BY pl.item_id
+            """,
+            (*chunk, store_id, taken_at),
+        ).fetchall()
+
+        for r in rows:
+            item_id = int(r["item_id"])
+            qty_sum = float(r["qty_sum"] or 0)
+            if qty_sum <= 0:
+                unit_cost_map[item_id] = ref_map.get(item_id, 0.0)
+                continue
+            amount_sum = float(r["amount_sum"] or 0)
+            unit_cost_map[item_id] = amount_sum / qty_sum
+
+    for item_id in item_ids:
+        if item_id not in unit_cost_map:
+            unit_cost_map[item_id] = ref_map.get(item_id, 0.0)
+
+    return unit_cost_map
+
+
+@bp.get("/stocktakes")
+def stocktakes_list():
+    db = get_db()
+    rows = db.execute(
+        """
+        SELECT
+          st.stocktake_id,
+          st.taken_at,
+          datetime(substr(replace(st.taken_at, 'T', ' '), 1, 19), '+9 hours') AS taken_at_display,
+          st.scope,
+          st.location,
+          st.note,
+          COUNT(sl.stocktake_line_id) AS line_count
+        FROM stocktakes st
+        LEFT JOIN stocktake_lines sl ON sl.stocktake_id = st.stocktake_id
+        WHERE st.store_id = ?
+        GROUP BY st.stocktake_id
+        ORDER BY st.taken_at DESC, st.stocktake_id DESC
+        """,
+        (current_store_id(),),
+    ).fetchall()
+    return render_template("stocktakes_list.html", stocktakes=rows)
+
+
+@bp.get("/stocktakes/new")
+def stocktake_new_form():
+    # デフォルトはFOODのみ
+    only_food = request.args.get("only_food", "1") != "0"
+    group = "FOOD" if only_food else "ALL"
+    return redirect(url_for("stocktakes.stocktake_weekly_new", group=group))
+
+
+@bp.post("/stocktakes")
+def stocktake_create():
+    db = get_db()
+    store_id = current_store_id()
+
+    taken_at_local = (request.form.get("taken_at") or "").strip()
+    taken_at = _to_datetime_seconds(taken_at_local)  # UTC 'YYYY-MM-DD HH:MM:00' or None
+    if not taken_at:
+        taken_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    scope = "MONTHLY"  # 今回は月次固定（必要ならフォーム化できます）
+    # 月次棚卸は倉庫での実測を前提
+    location = "WAREHOUSE"
+    note = (request.form.get("note") or "").strip() or None
+
+    only_food = (request.form.get("only_food") or "1") != "0"
+
+    # 明細
+    item_ids = request.form.getlist("item_id")
+    counted_list = request.form.getlist("counted_qty")
+
+    lines: list[tuple[int, float]] = []
+    errors: list[str] = []
+
+    for idx, (item_id_raw, counted_raw) in enumerate(
+        zip(item_ids, counted_list), start=1
+    ):
+        item_id_raw = (item_id_raw or "").strip()
+        counted_raw = (counted_raw or "").strip()
+
+        if counted_raw == "":
+            continue  # 未入力は「今回は数えてない」とみなしてスキップ
+
+        try:
+            item_id = int(item_id_raw)
+        except ValueError:
+            errors.append(f"{idx}行目：材料IDが不正です。")
+            continue
+
+        try:
+            counted = float(counted_raw)
+        except ValueError:
+            errors.append(f"{idx}行目：棚卸数量が数値ではありません。")
+            continue
+
+        if counted < 0:
+            errors.append(f"{idx}行目：棚卸数量は0以上にしてください。")
+            continue
+
+        lines.append((item_id, counted))
+
+    if not lines:
+        errors.append("棚卸数量が1つも入力されていません。少なくとも1つ入力してください。")
+
+    if errors:
+        for e in errors:
+            flash(e, "error")
+        return redirect(url_for("stocktakes.stocktake_new_form", only_food=("1" if only_food else "0")))
+
+    # ここ重要：棚卸時点の「理論在庫」を計算（taken_atがあればその時点まで）
+    if taken_at:
+        inv_rows = db.execute(
+            """
+            SELECT item_id, SUM(qty_delta) AS qty
+            FROM inventory_tx
+            WHERE store_id = ? AND location = ? AND happened_at <= ?
+            GROUP BY item_id
+            """,
+            (store_id, location, taken_at),
+        ).fetchall()
+    else:
+        inv_rows = db.execute(
+            """
+            SELECT item_id, SUM(qty_delta) AS qty
+            FROM inventory_tx
+            WHERE store_id = ? AND location = ?
+            GROUP BY item_id
+            """,
+            (store_id, location),
+        ).fetchall()
+
+    theoretical_map = {row["item_id"]: float(row["qty"] or 0) for row in inv_rows}
+
+    try:
+        with transaction(db, serialize=True):
+            # stocktakes（ヘッダ）
+            cur = db.execute(
+                """
+                INSERT INTO stocktakes (store_id, taken_at, scope, location, note)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (store_id, taken_at, scope, location, note),
+            )
+
+            stocktake_id = cur.lastrowid
+
+            # lines と adjust tx
+            for (item_id, counted) in lines:
+                # 保存（棚卸の実測）
+                db.execute(
+                    """
+                    INSERT INTO stocktake_lines (stocktake_id, item_id, counted_qty)
+                    VALUES (?, ?, ?)
+                    """,
+                    (stocktake_id, item_id, counted),
+                )
+
+                theoretical = theoretical_map.get(item_id, 0.0)
+                delta = counted - theoretical
+
+                # 差分が0なら tx を作らない（履歴が汚れない）
+                if abs(delta) < 1e-9:
+                    continue
+
+                # inventory_tx（差分調整）
+                db.execute(
+                    """
+                    INSERT INTO inventory_tx (
+                      store_id, happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note
+                    )
+                    VALUES (
+                      ?, COALESCE(?, datetime('now')),
+                      ?, ?, 'ADJUST', ?, 'STOCKTAKE', ?, ?
+                    )
+                    """,
+                    (store_id, taken_at, item_id, delta, location, stocktake_id, note),
+                )
+
+    except Exception as e:
+        flash(f"月次棚卸の登録に失敗しました: {e}", "error")
+        return redirect(url_for("stocktakes.stocktake_new_form", only_food=("1" if only_food else "0")))
+
+    flash("月次棚卸を登録し、差分を ADJUST で反映しました。", "success")
+    return redirect(url_for("stocktakes.stocktake_detail", stocktake_id=stocktake_id))
+
+
+@bp.get("/stocktakes/<int:stocktake_id>")
+def stocktake_detail(stocktake_id: int):
+    db = get_db()
+
+    header = db.execute(
+        """
+        SELECT
+          stocktake_id,
+          taken_at,
+          datetime(substr(replace(taken_at, 'T', ' '), 1, 19), '+9 hours') AS taken_at_display,
+          scope,
+          location,
+          all_locations,
+          note
+        FROM stocktakes
+        WHERE stocktake_id = ? AND store_id = ?
+        """,
+        (stocktake_id, current_store_id()),
+    ).fetchone()
+    if header is None:
+        abort(404)
+
+    lines = db.execute(
+        """
+        SELECT
+          sl.stocktake_line_id,
+          i.name AS item_name,
+          i.unit_base,
+          i.cost_group,
+          sl.counted_qty
+        FROM stocktake_lines sl
+        JOIN items i ON i.item_id = sl.item_id
+        WHERE sl.stocktake_id = ?
+        ORDER BY i.name ASC
+        """,
+        (stocktake_id,),
+    ).fetchall()
+
+    adjusts = db.execute(
+        """
+        SELECT
+          itx.tx_id,
+          i.name AS item_name,
+          i.unit_base,
+          itx.qty_delta
+        FROM inventory_tx_history itx
+        JOIN items i ON i.item_id = itx.item_id
+        WHERE itx.ref_type = 'STOCKTAKE'
+          AND itx.ref_id = ?
+          AND itx.tx_type = 'ADJUST'
+        ORDER BY i.name ASC
+        """,
+        (stocktake_id,),
+    ).fetchall()
+
+    return render_template(
+        "stocktake_detail.html",
+        header=header,
+        st=header,
+        lines=lines,
+        adjusts=adjusts,
+    )
+
+
+def _get_active_batch_config_id(db):
+    row = db.execute(
+        """
+        SELECT batch_config_id
+        FROM batch_config
+        WHERE is_active = 1
+        ORDER BY batch_config_id DESC
+        LIMIT 1
+        """
+    ).fetchone()
+    if not row:
+        return None
+    return row["batch_config_id"]
+
+
+def _get_qty_per_batch_map_for_items(db, item_ids: list[int]) -> dict[int, float]:
+    batch_config_id = _get_active_batch_config_id(db)
+    if not batch_config_id or not item_ids:
+        return {}
+
+    qty_per_batch_map: dict[int, float] = {}
+    for chunk in _iter_chunks(item_ids):
+        placeholders = ",".join("?" for _ in chunk)
+        params = [batch_config_id, *chunk]
+        rows = db.execute(
+            f"""
+            SELECT item_id, COALESCE(qty_per_batch, 0) AS qty_per_batch
+            FROM recipe_batch
+            WHERE batch_config_id = ?
+              AND item_id IN ({placeholders})
+            """,
+            params,
+        ).fetchall()
+        for r in rows:
+            qty_per_batch_map[int(r["item_id"])] = float(r["qty_per_batch"] or 0)
+    return qty_per_batch_map
+
+
+def _apply_weekly_batches_to_reorder_point(
+    db, items: list[sqlite3.Row], weekly_batches: float
+) -> int:
+    if weekly_batches < 0:
+        return 0
+    item_ids = [int(it["item_id"]) for it in items]
+    qty_per_batch_map = _get_qty_per_batch_map_for_items(db, item_ids)
+    if not qty_per_batch_map:
+        return 0
+
+    update_params = []
+    for it in items:
+        item_id = int(it["item_id"])
+        qty_per_batch = qty_per_batch_map.get(item_id)
+        if qty_per_batch is None:
+            continue
+        reorder_point = max(qty_per_batch * weekly_batches, 0.0)
+        update_params.append((reorder_point, item_id))
+    if not update_params:
+        return 0
+
+    # 発注目安はカタログの材料にある（店舗ファイルに分けているときは別の接続で書く）
+    catalog = get_catalog_db()
+    with transaction(catalog):
+        catalog.executemany(
+            """
+            UPDATE items
+            SET reorder_point = ?
+            WHERE item_id = ?
+            """,
+            update_params,
+        )
+    return len(update_params)
+
+
+def build_stocktake_form_rows(
+    db, store_id: int, group: str, location: str | None, counted_map: dict[int, float] | None = None
+) -> list[dict[str, object]]:
+    """棚卸入力の行。counted_map がない材料は、棚卸する保管場所（None は店舗全体）の現在残量を初期値にする。"""
+    items = fetch_items_for_stocktake_group(group)
+    item_ids = [int(it["item_id"]) for it in items]
+    current_map = get_inventory_qty_map_for_items(db, store_id, item_ids, location)
+    qty_per_batch_map = _get_qty_per_batch_map_for_items(db, item_ids)
+    counted_map = counted_map or {}
+
+    rows = []
+    for it in items:
+        cur = current_map.get(it["item_id"], 0.0)
+        rows.append(
+            {
+                "item_id": it["item_id"],
+                "name": it["name"],
+                "unit_base": it["unit_base"],
+                "ref_unit_price": float(it["ref_unit_price"] or 0),
+                "cost_group": it["cost_group"],
+                "reorder_point": float(it["reorder_point"] or 0),
+                "qty_per_batch": float(qty_per_batch_map.get(int(it["item_id"]), 0)),
+                "current_qty": cur,
+                "counted_default": counted_map.get(it["item_id"], cur),
+            }
+        )
+    return rows
+
+
+def render_stocktake_new_form(mode: str, group: str):
+    db = get_db()
+    try:
+        location = parse_stocktake_location(request.args.get("location"))
+    except ValueError:
+        location = None
+    rows_html = render_cached_fragment(
+        "_stocktake_rows.html",
+        STOCKTAKE_FORM_TABLES,
+        {"group": group, "location": location or "ALL"},
+        lambda: {"rows": build_stocktake_form_rows(db, current_store_id(), group, location)},
+    )
+    default_taken_at = datetime.now(ZoneInfo("Asia/Tokyo")).strftime(
+        "%Y-%m-%d %H:%M:%S"
+    )
+    return render_template(
+        "stocktake_new.html",
+        mode=mode,
+        group=group,
+        rows_html=rows_html,
+        stocktake_location=location or "ALL",
+        default_taken_at=default_taken_at,
+        has_active_batch_config=_get_active_batch_config_id(db) is not None,
+        default_weekly_batches=1.0,
+    )
+
+
+@bp.route("/stocktakes/weekly/new", methods=["GET", "POST"])
+def stocktake_weekly_new():
+    if request.method == "POST":
+        return stocktake_create_unified()
+
+    mode = normalize_stocktake_mode(request.args.get("mode"), "weekly")
+    return render_stocktake_new_form(mode, "ALL")
+
+
+# -----------------------------
+# Stocktakes (月次: 新フォーム)
+# -----------------------------
+@bp.get("/stocktakes/monthly/new")
+def stocktake_monthly_new():
+    mode = normalize_stocktake_mode(request.args.get("mode"), "weekly")
+    group = normalize_stocktake_group(request.args.get("group"))
+    return render_stocktake_new_form(mode, group)
+
+
+@bp.post("/stocktakes/monthly")
+def stocktake_monthly_create():
+    return stocktake_create_unified()
+
+
+@bp.get("/stocktakes/<int:stocktake_id>/edit")
+def stocktake_edit_form(stocktake_id: int):
+    db = get_db()
+
+    header = db.execute(
+        """
+        SELECT
+          stocktake_id,
+          taken_at,
+          datetime(substr(replace(taken_at, 'T', ' '), 1, 19), '+9 hours') AS taken_at_display,
+          scope,
+          location,
+          all_locations,
+          note
+        FROM stocktakes
+        WHERE stocktake_id = ? AND store_id = ?
+        """,
+        (stocktake_id, current_store_id()),
+    ).fetchone()
+    if header is None:
+        abort(404)
+
+    mode = normalize_stocktake_mode((header["scope"] or "").lower(), "monthly")
+    group = normalize_stocktake_group(request.args.get("group"))
+
+    line_rows = db.execute(
+        """
+        SELECT item_id, counted_qty
+        FROM stocktake_lines
+        WHERE stocktake_id = ?
+        """,
+        (stocktake_id,),
+    ).fetchall()
+    line_map = {r["item_id"]: float(r["counted_qty"] or 0) for r in line_rows}
+    location = None if header["all_locations"] else header["location"]
+    if "location" in request.args:
+        try:
+            location = parse_stocktake_location(request.args.get("location"))
+        except ValueError:
+            pass
+    rows = build_stocktake_form_rows(db, current_store_id(), group, location, line_map)
+    has_active_batch_config = _get_active_batch_config_id(db) is not None
+
+    return render_template(
+        "stocktake_new.html",
+        mode=mode,
+        group=group,
+        rows_html=Markup(render_template("_stocktake_rows.html", rows=rows)),
+        stocktake_location=location or "ALL",
+        default_taken_at=header["taken_at_display"] or header["taken_at"],
+        form_action=url_for("stocktakes.stocktake_update", stocktake_id=stocktake_id),
+        is_edit=True,
+        stocktake_id=stocktake_id,
+        has_active_batch_config=has_active_batch_config,
+        default_weekly_batches=1.0,
+    )
+
+
+@bp.post("/stocktakes/create")
+@idempotent_submission
+def stocktake_create_unified():
+    db = get_db()
+    store_id = current_store_id()
+
+    mode = normalize_stocktake_mode(request.form.get("mode"), "monthly")
+    group = normalize_stocktake_group(request.form.get("group"))
+    try:
+        location = parse_stocktake_location(request.form.get("location"), store_id)
+    except ValueError:
+        flash("棚卸する保管場所が不正です。", "error")
+        return redirect(url_for("stocktakes.stocktake_weekly_new", group=group, mode=mode))
+
+    taken_at = _to_datetime_seconds(request.form.get("taken_at"))
+    if not taken_at:
+        taken_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    note = (request.form.get("note") or "").strip()
+    apply_weekly_batches = "1" in request.form.getlist("apply_weekly_batches")
+    weekly_batches_raw = (request.form.get("weekly_batches") or "").strip()
+    weekly_batches = None
+    if mode == "weekly" and apply_weekly_batches and weekly_batches_raw:
+        try:
+            weekly_batches = float(weekly_batches_raw)
+        except ValueError:
+            flash("1週間のバッチ数は数値で入力してください。", "error")
+            return redirect(url_for("stocktakes.stocktake_weekly_new", group=group, mode=mode))
+        if weekly_batches < 0:
+            flash("1週間のバッチ数は0以上にしてください。", "error")
+            return redirect(url_for("stocktakes.stocktake_weekly_new", group=group, mode=mode))
+
+    items = fetch_items_for_stocktake_group(group)
+    counted_map: dict[int, float] = {}
+    for it in items:
+        raw = (request.form.get(f"counted_{it['item_id']}") or "").strip()
+        try:
+            counted_map[it["item_id"]] = float(raw)
+        except ValueError:
+            pass  # 空欄・不正値は理論在庫のまま
+
+    if mode == "weekly":
+        try:
+            with transaction(db, serialize=True):
+                stocktake_id, adjust_count = insert_stocktake(
+                    db, store_id, taken_at, "WEEKLY", location, note, items, counted_map
+                )
+                updated_reorder_count = 0
+                if weekly_batches is not None:
+                    updated_reorder_count = _apply_weekly_batches_to_reorder_point(
+                        db, items, weekly_batches
+                    )
+                remember_submission_result(db, url_for("stocktakes.stocktake_detail", stocktake_id=stocktake_id))
+
+            if weekly_batches is not None:
+                flash(
+                    f"週次棚卸を登録しました（ADJUST反映: {adjust_count}件 / 発注目安更新: {updated_reorder_count}件）",
+                    "success",
+                )
+            else:
+                flash(f"週次棚卸を登録しました（ADJUST反映: {adjust_count}件）", "success")
+            return redirect(url_for("stocktakes.stocktake_detail", stocktake_id=stocktake_id))
+
+        except DuplicateSubmission as e:
+            return duplicate_submission_response(e.location)
+        except Exception as e:
+            flash(f"週次棚卸の保存に失敗しました: {e}", "error")
+            return redirect(url_for("stocktakes.stocktake_weekly_new", group=group, mode=mode))
+
+    # monthly
+    try:
+        with transaction(db, serialize=True):
+            stocktake_id, adjust_count = insert_stocktake(
+                db, store_id, taken_at, "MONTHLY", location, note, items, counted_map
+            )
+            remember_submission_result(db, url_for("stocktakes.stocktake_detail", stocktake_id=stocktake_id))
+
+        flash(f"月次棚卸を登録しました（ADJUST反映: {adjust_count}件）", "success")
+        return redirect(url_for("stocktakes.stocktake_detail", stocktake_id=stocktake_id))
+
+    except DuplicateSubmission as e:
+        return duplicate_submission_response(e.location)
+    except Exception as e:
+        flash(f"棚卸登録に失敗しました: {e}", "error")
+        return redirect(url_for("stocktakes.stocktake_monthly_new", group=group, mode=mode))
+
+
+@bp.post("/stocktakes/<int:stocktake_id>/update")
+def stocktake_update(stocktake_id: int):
+    db = get_db()
+    store_id = current_store_id()
+
+    header = db.execute(
+        "SELECT stocktake_id FROM stocktakes WHERE stocktake_id = ? AND store_id = ?",
+        (stocktake_id, store_id),
+    ).fetchone()
+    if header is None:
+        abort(404)
+    if has_archived_tx(db, "STOCKTAKE", stocktake_id):
+        flash("締め済み（アーカイブ済み）の期間の棚卸は編集できません。", "error")
+        return redirect(url_for("stocktakes.stocktake_detail", stocktake_id=stocktake_id))
+
+    mode = normalize_stocktake_mode(request.form.get("mode"), "monthly")
+    scope = "WEEKLY" if mode == "weekly" else "MONTHLY"
+    group = normalize_stocktake_group(request.form.get("group"))
+    try:
+        counted_location = parse_stocktake_location(request.form.get("location"), store_id)
+    except ValueError:
+        flash("棚卸する保管場所が不正です。", "error")
+        return redirect(
+            url_for("stocktakes.stocktake_edit_form", stocktake_id=stocktake_id, group=group)
+        )
+    location = counted_location or STOCKTAKE_ADJUST_LOCATION
+
+    taken_at = _to_datetime_seconds(request.form.get("taken_at"))
+    if not taken_at:
+        taken_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+    if not taken_at:
+        taken_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    note = (request.form.get("note") or "").strip()
+    apply_weekly_batches = "1" in request.form.getlist("apply_weekly_batches")
+    weekly_batches_raw = (request.form.get("weekly_batches") or "").strip()
+    weekly_batches = None
+    if scope == "WEEKLY" and apply_weekly_batches and weekly_batches_raw:
+        try:
+            weekly_batches = float(weekly_batches_raw)
+        except ValueError:
+            flash("1週間のバッチ数は数値で入力してください。", "error")
+            return redirect(
+                url_for("stocktakes.stocktake_edit_form", stocktake_id=stocktake_id, group=group)
+            )
+        if weekly_batches < 0:
+            flash("1週間のバッチ数は0以上にしてください。", "error")
+            return redirect(
+                url_for("stocktakes.stocktake_edit_form", stocktake_id=stocktake_id, group=group)
+            )
+
+    items = fetch_items_for_stocktake_group(group)
+    month_start, month_end = month_range_for_datetime(taken_at)
+
+    try:
+        with transaction(db, serialize=True):
+            db.execute(
+                """
+                UPDATE stocktakes
+                SET taken_at = ?, scope = ?, location = ?, all_locations = ?, note = ?
+                WHERE stocktake_id = ?
+                """,
+                (taken_at, scope, location, 1 if counted_location is None else 0, note, stocktake_id),
+            )
+
+            db.execute(
+                "DELETE FROM inventory_tx WHERE ref_type = 'STOCKTAKE' AND ref_id = ?",
+                (stocktake_id,),
+            )
+            db.execute("DELETE FROM stocktake_lines WHERE stocktake_id = ?", (stocktake_id,))
+
+            item_ids = [int(it["item_id"]) for it in items]
+            baseline_map = get_inventory_qty_map_for_items(db, store_id, item_ids, counted_location)
+
+            prev_monthly = db.execute(
+                """
+                SELECT stocktake_id
+                FROM stocktakes
+                WHERE store_id = ?
+                  AND scope = 'MONTHLY'
+                  AND location = ?
+                  AND datetime(taken_at) < datetime(?)
+                  AND stocktake_id != ?
+                ORDER BY datetime(taken_at) DESC, stocktake_id DESC
+                LIMIT 1
+                """,
+                (store_id, location, taken_at, stocktake_id),
+            ).fetchone()
+            is_initial_stocktake = prev_monthly is None
+
+            cost_map = {}
+            if not is_initial_stocktake:
+                cost_map = build_monthly_weighted_unit_cost_map(
+                    db, store_id, items, month_start, month_end, location=location
+                )
+            initial_cost_map = {}
+            if is_initial_stocktake:
+                initial_cost_map = build_initial_stocktake_unit_cost_map(
+                    db, store_id, items, taken_at
+                )
+
+            adjust_count = 0
+            stocktake_line_params = []
+            inventory_tx_params = []
+            for it in items:
+                item_id = it["item_id"]
+                unit_base = it["unit_base"]
+
+                raw = (request.form.get(f"counted_{item_id}") or "").strip()
+                if raw == "":
+                    counted = baseline_map.get(item_id, 0.0)
+                else:
+                    try:
+                        counted = float(raw)
+                    except ValueError:
+                        counted = baseline_map.get(item_id, 0.0)
+
+                if is_initial_stocktake:
+                    unit_cost = initial_cost_map.get(int(item_id), float(it["ref_unit_price"] or 0))
+                else:
+                    unit_cost, _no_qty, _used_ref = cost_map.get(
+                        item_id, (float(it["ref_unit_price"] or 0), True, False)
+                    )
+                line_amount = counted * unit_cost
+                stocktake_line_params.append(
+                    (stocktake_id, item_id, counted, unit_cost, line_amount)
+                )
+
+                baseline = baseline_map.get(item_id, 0.0)
+                delta = counted - baseline
+                if abs(delta) < 1e-9:
+                    continue
+
+                note_label = "WEEKLY棚卸差分（ADJUST）" if scope == "WEEKLY" else "MONTHLY棚卸差分（ADJUST）"
+                inventory_tx_params.append(
+                    (store_id, taken_at, item_id, delta, location, stocktake_id, note_label)
+                )
+                adjust_count += 1
+
+            if stocktake_line_params:
+                db.executemany(
+                    """
+                    INSERT INTO stocktake_lines (
+                      stocktake_id, item_id, counted_qty, unit_cost, line_amount
+                    )
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    stocktake_line_params,
+                )
+            if inventory_tx_params:
+                db.executemany(
+                    """
+                    INSERT INTO inventory_tx
+                      (store_id, happened_at, item_id, qty_delta, tx_type, location, ref_type, ref_id, note)
+                    VALUES
+                      (?, ?, ?, ?, 'ADJUST', ?, 'STOCKTAKE', ?, ?)
+                    """,
+                    inventory_tx_params,
+                )
+
+            updated_reorder_count = 0
+            if scope == "WEEKLY" and weekly_batches is not None:
+                updated_reorder_count = _apply_weekly_batches_to_reorder_point(
+                    db, items, weekly_batches
+                )
+
+        if scope == "WEEKLY" and weekly_batches is not None:
+            flash(
+                f"棚卸を更新しました（ADJUST反映: {adjust_count}件 / 発注目安更新: {updated_reorder_count}件）",
+                "success",
+            )
+        else:
+            flash(f"棚卸を更新しました（ADJUST反映: {adjust_count}件）", "success")
+        return redirect(url_for("stocktakes.stocktake_detail", stocktake_id=stocktake_id))
+
+    except Exception as e:
+        flash(f"棚卸更新に失敗しました: {e}", "error")
+        return redirect(
+            url_for("stocktakes.stocktake_edit_form", stocktake_id=stocktake_id, group=group)
+        )
+
+
+@bp.post("/stocktakes/<int:stocktake_id>/delete")
+def stocktake_delete(stocktake_id: int):
+    db = get_db()
+
+    header = db.execute(
+        "SELECT stocktake_id FROM stocktakes WHERE stocktake_id = ? AND store_id = ?",
+        (stocktake_id, current_store_id()),
+    ).fetchone()
+    if header is None:
+        abort(404)
+    if has_archived_tx(db, "STOCKTAKE", stocktake_id):
+        flash("締め済み（アーカイブ済み）の期間の棚卸は削除できません。", "error")
+        return redirect(url_for("stocktakes.stocktake_detail", stocktake_id=stocktake_id))
+
+    try:
+        with transaction(db, serialize=True):
+            db.execute(
+                "DELETE FROM inventory_tx WHERE ref_type = 'STOCKTAKE' AND ref_id = ?",
+                (stocktake_id,),
+            )
+            db.execute("DELETE FROM stocktake_lines WHERE stocktake_id = ?", (stocktake_id,))
+            db.execute("DELETE FROM stocktakes WHERE stocktake_id = ?", (stocktake_id,))
+        flash("棚卸を削除しました。", "success")
+    except Exception as e:
+        flash(f"棚卸の削除に失敗しました: {e}", "error")
+
+    return redirect(url_for("stocktakes.stocktakes_list"))
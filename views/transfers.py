@@ -0,0 +1,291 @@
+"""
+保管場所間の移動の画面。
+"""
+from __future__ import annotations
+
+import sqlite3
+
+from flask import (
+    Blueprint,
+    abort,
+    flash,
+    g,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+
+from db import get_db, transaction
+from idempotency import DuplicateSubmission
+from transfers import find_transfer_by_key, post_transfer
+
+from app import (
+    current_store_id,
+    duplicate_submission_response,
+    fetch_active_items,
+    fetch_suppliers,
+    idempotent_submission,
+    normalize_inventory_location,
+    remember_submission_result,
+)
+
+bp = Blueprint("transfers", __name__)
+
+
+# -----------------------------
+# Transfers (移動)
+# -----------------------------
+@bp.get("/transfers")
+def transfers_list():
+    db = get_db()
+    rows = db.execute(
+        """
+        SELECT
+          t.transfer_id,
+          t.moved_at,
+          t.from_location,
+          t.to_location,
+          t.note,
+          COUNT(tl.transfer_line_id) AS line_count
+        FROM transfers t
+        LEFT JOIN transfer_lines tl ON tl.transfer_id = t.transfer_id
+        WHERE t.store_id = ?
+        GROUP BY t.transfer_id
+        ORDER BY t.moved_at DESC, t.transfer_id DESC
+        """,
+        (current_store_id(),),
+    ).fetchall()
+    return render_template("transfers_list.html", transfers=rows)
+
+
+@bp.get("/transfers/new")
+def transfer_new_form():
+    items = fetch_active_items()
+    return render_template("transfer_new.html", items=items)
+
+
+@bp.post("/transfers")
+@idempotent_submission
+def transfer_create():
+    db = get_db()
+    store_id = current_store_id()
+
+    moved_date = (request.form.get("moved_date") or "").strip()
+    if moved_date:
+        moved_at = f"{moved_date} 09:00:00"
+    else:
+        moved_at = None
+
+    from_location = normalize_inventory_location(
+        request.form.get("from_location"), "WAREHOUSE", store_id
+    )
+    to_location = normalize_inventory_location(request.form.get("to_location"), "STORE", store_id)
+    note = (request.form.get("note") or "").strip() or None
+    # 冪等キーは移動にも残す（idempotency_keys の期限が切れた後の再送も UNIQUE で止める）
+    idempotency_key = g.idempotency_key
+
+    errors = []
+    if from_location == to_location:
+        errors.append("移動元と移動先が同じです。")
+
+    item_ids = request.form.getlist("item_id")
+    qty_list = request.form.getlist("qty")
+
+    lines = []
+    for idx, (item_id_raw, qty_raw) in enumerate(
+        zip(item_ids, qty_list), start=1
+    ):
+        item_id_raw = (item_id_raw or "").strip()
+        qty_raw = (qty_raw or "").strip()
+
+        if item_id_raw == "" and qty_raw == "":
+            continue
+
+        if item_id_raw == "":
+            errors.append(f"{idx}行目：材料を選択してください。")
+            continue
+
+        if qty_raw == "":
+            errors.append(f"{idx}行目：数量(qty)を入力してください。")
+            continue
+
+        try:
+            item_id = int(item_id_raw)
+        except ValueError:
+            errors.append(f"{idx}行目：材料IDが不正です。")
+            continue
+
+        try:
+            qty = float(qty_raw)
+        except ValueError:
+            errors.append(f"{idx}行目：数量(qty)が数値ではありません。")
+            continue
+
+        if qty <= 0:
+            errors.append(f"{idx}行目：数量(qty)は0より大きくしてください。")
+            continue
+
+        lines.append((item_id, qty))
+
+    if not lines:
+        errors.append("明細が1行もありません。材料と数量を入力してください。")
+
+    if errors:
+        for e in errors:
+            flash(e, "error")
+        return redirect(url_for("transfers.transfer_new_form"))
+
+    try:
+        with transaction(db):
+            # transfers（ヘッダ）。moved_at が空なら列の既定値（今）
+            cur = db.execute(
+                """
+                INSERT INTO transfers (store_id, moved_at, from_location, to_location, note, idempotency_key)
+                VALUES (?, COALESCE(?, datetime('now')), ?, ?, ?, ?)
+                """,
+                (store_id, moved_at, from_location, to_location, note, idempotency_key),
+            )
+            transfer_id = cur.lastrowid
+
+            db.executemany(
+                """
+                INSERT INTO transfer_lines (transfer_id, item_id, qty)
+                VALUES (?, ?, ?)
+                """,
+                [(transfer_id, item_id, qty) for (item_id, qty) in lines],
+            )
+            # inventory_tx：明細ごとに 移動元 -qty / 移動先 +qty（同じトランザクションで両方）
+            post_transfer(db, transfer_id)
+            remember_submission_result(db, url_for("transfers.transfer_detail", transfer_id=transfer_id))
+
+    except DuplicateSubmission as e:
+        return duplicate_submission_response(e.location)
+    except sqlite3.IntegrityError as e:
+        done_id = find_transfer_by_key(db, store_id, idempotency_key) if idempotency_key else None
+        if done_id is not None:
+            # 同じキーの送信が並んで届き、先に登録された
+            return duplicate_submission_response(url_for("transfers.transfer_detail", transfer_id=done_id))
+        flash(f"移動の登録に失敗しました: {e}", "error")
+        return redirect(url_for("transfers.transfer_new_form"))
+    except Exception as e:
+        flash(f"移動の登録に失敗しました: {e}", "error")
+        return redirect(url_for("transfers.transfer_new_form"))
+
+    flash("移動を登録しました（在庫履歴にも反映済み）。", "success")
+    return redirect(url_for("transfers.transfer_detail", transfer_id=transfer_id))
+
+
+@bp.get("/transfers/<int:transfer_id>")
+def transfer_detail(transfer_id: int):
+    db = get_db()
+
+    header = db.execute(
+        """
+        SELECT transfer_id, moved_at, from_location, to_location, note
+        FROM transfers
+        WHERE transfer_id = ? AND store_id = ?
+        """,
+        (transfer_id, current_store_id()),
+    ).fetchone()
+    if header is None:
+        abort(404)
+
+    lines = db.execute(
+        """
+        SELECT
+          tl.transfer_line_id,
+          i.name AS item_name,
+          i.unit_base,
+          tl.qty
+        FROM transfer_lines tl
+        JOIN items i ON i.item_id = tl.item_id
+        WHERE tl.transfer_id = ?
+        ORDER BY i.name ASC
+        """,
+        (transfer_id,),
+    ).fetchall()
+
+    return render_template("transfer_detail.html", header=header, lines=lines)
+
+
+@bp.get("/transfers/new-from-purchase/<int:purchase_id>")
+def transfer_new_from_purchase(purchase_id: int):
+    db = get_db()
+    store_id = current_store_id()
+
+    # 仕入れヘッダ
+    p = db.execute(
+        """
+        SELECT purchase_id, supplier_id, purchased_at, note
+        FROM purchases
+        WHERE purchase_id = ? AND store_id = ?
+        """,
+        (purchase_id, store_id),
+    ).fetchone()
+    if p is None:
+        abort(404)
+
+    # 仕入れ明細
+    lines = db.execute(
+        """
+        SELECT pl.item_id, pl.qty, i.name, i.unit_base
+        FROM purchase_lines pl
+        JOIN items i ON i.item_id = pl.item_id
+        WHERE pl.purchase_id = ?
+        ORDER BY pl.purchase_line_id ASC
+        """,
+        (purchase_id,),
+    ).fetchall()
+
+    if not lines:
+        flash("この仕入れには明細がありません。", "error")
+        return redirect(url_for("purchases.purchases_list"))
+
+    # この仕入れがどこに入庫されたか（inventory_txから推定）
+    tx_loc = db.execute(
+        """
+        SELECT location
+        FROM inventory_tx
+        WHERE ref_type = 'PURCHASE' AND ref_id = ?
+        LIMIT 1
+        """,
+        (purchase_id,),
+    ).fetchone()
+
+    from_location = normalize_inventory_location(
+        tx_loc["location"] if tx_loc else None, "WAREHOUSE", store_id
+    )
+
+    # 移動先（倉庫→店舗が基本）
+    to_location = "STORE" if from_location == "WAREHOUSE" else "WAREHOUSE"
+
+    # transfer_new.html が10行固定なら最大10件まで
+    prefill_lines = []
+    for r in lines[:10]:
+        prefill_lines.append(
+            {
+                "item_id": r["item_id"],
+                "qty": float(r["qty"] or 0),
+            }
+        )
+
+    if len(lines) > 10:
+        flash("明細が10件を超えています。移動フォームには先頭10件のみ反映しました。", "error")
+
+    suppliers = fetch_suppliers()
+    items = fetch_active_items()
+
+    default_note = f"仕入れID {purchase_id} から店舗へ補充"
+    default_moved_date = str(p["purchased_at"])[:10] if p["purchased_at"] else ""
+
+    return render_template(
+        "transfer_new.html",
+        suppliers=suppliers,
+        items=items,
+        prefill_lines=prefill_lines,
+        default_from_location=from_location,
+        default_to_location=to_location,
+        default_moved_date=default_moved_date,
+        default_note=default_note,
+    )